@@ -50,6 +50,7 @@ def runSetup():
     addict = 'addict<=2.2.0'
     sphinx = 'sphinx==1.7.5'
     pathlib2 = 'pathlib2==2.3.2'
+    numpy = 'numpy>=1.11'
 
     core_reqs = [
         dill,
@@ -64,7 +65,8 @@ def runSetup():
         pytest_cov,
         addict,
         sphinx,
-        pathlib2]
+        pathlib2,
+        numpy]
 
     mesos_reqs = [
         pymesos,
@@ -82,6 +82,18 @@ class AbstractBatchSystem(with_metaclass(ABCMeta, object)):
         """
         raise NotImplementedError()
 
+    @classmethod
+    def supportsWorkerZygote(cls):
+        """
+        Whether the workers of this batch system may hand their jobs off to a worker zygote, see
+        :mod:`toil.workerZygote`. The workers forked by a zygote don't belong to the batch system
+        job that handed them off, so batch systems that account for, confine or kill the
+        processes of each job as a unit, e.g. by its process group or cgroup, must return False.
+
+        :rtype: bool
+        """
+        return False
+
     def setUserScript(self, userScript):
         """
         Set the user script for this workflow. This method must be called before the first job is
@@ -130,6 +142,16 @@ class AbstractBatchSystem(with_metaclass(ABCMeta, object)):
         """
         raise NotImplementedError()
 
+    def getNumberOfIssuedBatchJobs(self):
+        """
+        Gets the number of currently issued jobs. The leader compares it to the number of jobs
+        it issued to find out whether any jobs went missing without listing all of them, so
+        implementations that can count their jobs cheaply should override this method.
+
+        :rtype: int
+        """
+        return len(self.getIssuedBatchJobIDs())
+
     @abstractmethod
     def getRunningBatchJobIDs(self):
         """
@@ -289,7 +311,9 @@ class BatchSystemSupport(AbstractBatchSystem):
         """
         assert isinstance(info, WorkerCleanupInfo)
         workflowDir = Toil.getWorkflowDir(info.workflowID, info.workDir)
-        workflowDirContents = os.listdir(workflowDir)
+        # Ignore the workers' node-local copies of the workflow's environment and jobs
+        workflowDirContents = [name for name in os.listdir(workflowDir)
+                               if not name.startswith('environment-') and name != 'jobBodies']
         shutdownFileStore(workflowDir, info.workflowID)
         if (info.cleanWorkDir == 'always'
             or info.cleanWorkDir in ('onSuccess', 'onError')
@@ -331,6 +355,10 @@ class BatchSystemLocalSupport(BatchSystemSupport):
         """To be called by getIssuedBatchJobIDs"""
         return self.localBatch.getIssuedBatchJobIDs()
 
+    def getNumberOfIssuedLocalJobs(self):
+        """To be called by getNumberOfIssuedBatchJobs()"""
+        return self.localBatch.getNumberOfIssuedBatchJobs()
+
     def getRunningLocalJobIDs(self):
         """To be called by getRunningBatchJobIDs()."""
         return self.localBatch.getRunningBatchJobIDs()
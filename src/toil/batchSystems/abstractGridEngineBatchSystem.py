@@ -365,6 +365,9 @@ class AbstractGridEngineBatchSystem(BatchSystemLocalSupport):
         """
         return list(self.getIssuedLocalJobIDs()) + list(self.currentJobs)
 
+    def getNumberOfIssuedBatchJobs(self):
+        return self.getNumberOfIssuedLocalJobs() + len(self.currentJobs)
+
     def getRunningBatchJobIDs(self):
         """
         Retrieve running job IDs from local and batch scheduler.
@@ -12,17 +12,24 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from __future__ import absolute_import
+from __future__ import division
 
 from future import standard_library
 standard_library.install_aliases()
 from builtins import object
-from queue import Queue
 from collections import namedtuple
 from bisect import bisect
+from heapq import heappush, heappop
+from itertools import count, groupby
 from threading import Lock
+import logging
+import time
+
+from six import iteritems
 
 from toil.provisioners.abstractProvisioner import Shape
 
+log = logging.getLogger(__name__)
 
 TaskData = namedtuple('TaskData', (
     # Time when the task was started
@@ -41,28 +48,34 @@ TaskData = namedtuple('TaskData', (
 
 class JobQueue(object):
     def __init__(self):
-        # mapping of jobTypes to queues of jobs of that type
+        # mapping of jobTypes to heaps of (negated priority, sequence number, job) tuples such
+        # that jobs of a type are dequeued in order of decreasing priority and FIFO otherwise
         self.queues = {}
         # list of jobTypes in decreasing resource expense
         self.sortedTypes = []
         self.jobLock = Lock()
+        self.sequenceNumbers = count()
 
-    def insertJob(self, job, jobType):
+    def insertJob(self, job, jobType, priority=0):
         with self.jobLock:
             if jobType not in self.queues:
                 index = bisect(self.sortedTypes, jobType)
                 self.sortedTypes.insert(index, jobType)
-                self.queues[jobType] = Queue()
-            self.queues[jobType].put(job)
+                self.queues[jobType] = []
+            heappush(self.queues[jobType], (-priority, next(self.sequenceNumbers), job))
 
     def jobIDs(self):
         with self.jobLock:
-            return [job.jobID for queue in list(self.queues.values()) for job in list(queue.queue)]
+            return [job.jobID for queue in list(self.queues.values()) for _, _, job in queue]
+
+    def numberOfJobs(self):
+        with self.jobLock:
+            return sum(len(queue) for queue in self.queues.values())
 
     def nextJobOfType(self, jobType):
         with self.jobLock:
-            job = self.queues[jobType].get(block=False)
-            if self.queues[jobType].empty():
+            _, _, job = heappop(self.queues[jobType])
+            if not self.queues[jobType]:
                 del self.queues[jobType]
                 self.sortedTypes.remove(jobType)
             return job
@@ -71,7 +84,159 @@ class JobQueue(object):
         # without a lock we could get a false negative from this method
         # if it were called while nextJobOfType was executing
         with self.jobLock:
-            return self.queues.get(jobType, Queue()).empty()
+            return not self.queues.get(jobType)
+
+    def typesByPriority(self):
+        """
+        Returns a snapshot of the job types with queued jobs, ordered by the priority of the most
+        important job of each type and, among types of equal priority, by decreasing resource
+        expense.
+
+        :rtype: list[MesosShape]
+        """
+        with self.jobLock:
+            # The sort is stable, so ties retain the order of self.sortedTypes
+            return sorted(self.sortedTypes, key=lambda jobType: self.queues[jobType][0][0])
+
+    def typeCountsByPriority(self):
+        """
+        Like :meth:`typesByPriority` but also returns the number of queued jobs of each type and
+        the priority of its most important job, as taken by :func:`packOffers`.
+
+        :rtype: list[(MesosShape, int, int)]
+        """
+        with self.jobLock:
+            return [(jobType, len(self.queues[jobType]), -self.queues[jobType][0][0])
+                    for jobType in sorted(self.sortedTypes,
+                                          key=lambda jobType: self.queues[jobType][0][0])]
+
+
+OfferResources = namedtuple('OfferResources', (
+    # Number of cores offered
+    'cores',
+    # Memory offered in bytes
+    'memory',
+    # Disk offered in bytes
+    'disk',
+    # Whether the offering agent is preemptable
+    'preemptable',
+    # A dictionary mapping the names of custom consumable resources offered to their amounts
+    'consumables'))
+
+
+def _fits(jobType, remaining, preemptable):
+    cores, memory, disk, consumables = remaining
+    # On a non-preemptable node we can run any job, on a preemptable node we can only run
+    # preemptable jobs
+    return ((not preemptable or jobType.preemptable)
+            and cores >= jobType.cores
+            and memory >= jobType.memory
+            and disk >= jobType.disk
+            and all(consumables.get(name, 0) >= amount
+                    for name, amount in iteritems(jobType.consumables)))
+
+
+def _slack(jobType, remaining, offer):
+    # The sum of the fractions of each of the offer's resources that would be left over after
+    # placing a job of the given type in it
+    cores, memory, disk, _ = remaining
+    return sum(((cores - jobType.cores) / offer.cores if offer.cores else 0,
+                (memory - jobType.memory) / offer.memory if offer.memory else 0,
+                (disk - jobType.disk) / offer.disk if offer.disk else 0))
+
+
+def _shareUsed(offers, assignments):
+    # The fractions of the offered cores, memory and disk taken up by the assigned jobs, summed
+    cores = sum(offer.cores for offer in offers)
+    memory = sum(offer.memory for offer in offers)
+    disk = sum(offer.disk for offer in offers)
+    return sum((jobType.cores / cores if cores else 0)
+               + (jobType.memory / memory if memory else 0)
+               + (jobType.disk / disk if disk else 0)
+               for offerJobTypes in assignments for jobType in offerJobTypes)
+
+
+def _placeJobs(offers, jobTypes, bestFit, deadline):
+    remaining = [[offer.cores, offer.memory, offer.disk, dict(offer.consumables)]
+                 for offer in offers]
+    assignments = [[] for _ in offers]
+    for _, level in groupby(jobTypes, key=lambda jobTypeCount: jobTypeCount[2]):
+        # Each entry holds a type and the number of its jobs left to place
+        level = [[jobType, numJobs] for jobType, numJobs, _ in level]
+        while level:
+            for entry in list(level):
+                jobType = entry[0]
+                best, bestSlack = None, None
+                for i, offer in enumerate(offers):
+                    if _fits(jobType, remaining[i], offer.preemptable):
+                        if not bestFit:
+                            best = i
+                            break
+                        slack = _slack(jobType, remaining[i], offer)
+                        if best is None or slack < bestSlack:
+                            best, bestSlack = i, slack
+                if best is None:
+                    # The remaining jobs of this type don't fit anywhere
+                    level.remove(entry)
+                    continue
+                assignments[best].append(jobType)
+                bestRemaining = remaining[best]
+                bestRemaining[0] -= jobType.cores
+                bestRemaining[1] -= jobType.memory
+                bestRemaining[2] -= jobType.disk
+                for name, amount in iteritems(jobType.consumables):
+                    bestRemaining[3][name] -= amount
+                entry[1] -= 1
+                if entry[1] == 0:
+                    level.remove(entry)
+            if deadline is not None and time.time() > deadline:
+                return assignments, False
+    return assignments, True
+
+
+def packOffers(offers, jobTypes, timeBudget=None):
+    """
+    Decides which queued jobs to launch with which of a batch of resource offers.
+
+    Unlike filling one offer after the other, the offers are packed together. Jobs of more
+    important types are placed before those of less important ones. Types of equal priority take
+    turns, one job at a time, so that no type starves the others of the offers. Each job goes to
+    the offer it fits in most tightly, keeping large offers free for large jobs so that a few
+    small, important jobs don't fragment the cluster. Since that occasionally leaves more unused
+    than simply taking the first offer a job fits in, both are tried and the plan that uses the
+    larger share of the offered resources wins.
+
+    >>> small = MesosShape(wallTime=0, memory=1, cores=1, disk=1, preemptable=False)
+    >>> large = MesosShape(wallTime=0, memory=1, cores=4, disk=1, preemptable=False)
+    >>> offers = [OfferResources(4, 10, 10, False, {}), OfferResources(1, 10, 10, False, {})]
+    >>> packOffers(offers, [(small, 1, 1), (large, 1, 0)]) == [[large], [small]]
+    True
+
+    :param list[OfferResources] offers: the resources offered
+
+    :param list[(MesosShape, int, int)] jobTypes: each type of the queued jobs, the number of
+           jobs of that type and the priority of its most important job, ordered as by
+           :meth:`JobQueue.typeCountsByPriority`
+
+    :param float|None timeBudget: the number of seconds after which to stop placing jobs, if
+           any. The jobs not placed by then wait for later offers.
+
+    :return: for each offer, the type of every job to launch with it
+    :rtype: list[list[MesosShape]]
+    """
+    if not offers:
+        return []
+    start = time.time()
+    deadline = None if timeBudget is None else start + timeBudget
+    assignments, finished = _placeJobs(offers, jobTypes, bestFit=True, deadline=deadline)
+    if finished:
+        firstFit, finished = _placeJobs(offers, jobTypes, bestFit=False, deadline=deadline)
+        if finished and _shareUsed(offers, firstFit) > _shareUsed(offers, assignments):
+            assignments = firstFit
+    if not finished:
+        log.debug('Stopped packing offers after %.3f seconds, leaving the remaining jobs for '
+                  'later offers.', time.time() - start)
+    return assignments
 
 
 class MesosShape(Shape):
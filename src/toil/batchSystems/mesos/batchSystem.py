@@ -46,7 +46,8 @@ from toil import resolveEntryPoint
 from toil.batchSystems.abstractBatchSystem import (AbstractScalableBatchSystem,
                                                    BatchSystemLocalSupport,
                                                    NodeInfo)
-from toil.batchSystems.mesos import ToilJob, MesosShape, TaskData, JobQueue
+from toil.batchSystems.mesos import (ToilJob, MesosShape, TaskData, JobQueue, OfferResources,
+                                    packOffers)
 
 log = logging.getLogger(__name__)
 
@@ -122,6 +123,16 @@ class MesosBatchSystem(BatchSystemLocalSupport,
         # Dict of launched jobIDs to TaskData objects
         self.runningJobMap = {}
 
+        # The maximum number of jobs to launch together as one Mesos task
+        self.taskBundleSize = config.mesosTaskBundleSize
+
+        # Map of the Mesos task IDs of bundles to the IDs of their jobs that haven't ended yet
+        self.bundles = {}
+
+        # Map of the IDs of jobs that are part of a bundle to the task ID of the bundle, from the
+        # moment the bundle is built until the job ends
+        self.jobBundles = {}
+
         # Mesos has no easy way of getting a task's resources so we track them here
         self.taskResources = {}
 
@@ -161,8 +172,18 @@ class MesosBatchSystem(BatchSystemLocalSupport,
         self.lastTimeOfferLogged = 0
         self.logPeriod = 30  # seconds
 
+        # The number of seconds resourceOffers may spend deciding which jobs to launch with the
+        # offers it was given, so that large queues don't hold up the driver
+        self.offerPackingTimeBudget = 1.0
+
         self.ignoredNodes = set()
 
+        # The names of the custom consumable resources that any agent has offered so far
+        self.offeredConsumables = set()
+
+        # The names of the consumables we already warned about because no agent offers them
+        self.warnedConsumables = set()
+
         self._startDriver()
 
     def setUserScript(self, userScript):
@@ -187,7 +208,12 @@ class MesosBatchSystem(BatchSystemLocalSupport,
         jobID = self.getNextJobID()
         job = ToilJob(jobID=jobID,
                       name=str(jobNode),
-                      resources=MesosShape(wallTime=0, **jobNode._requirements),
+                      resources=MesosShape(wallTime=0,
+                                           memory=jobNode.memory,
+                                           cores=jobNode.cores,
+                                           disk=jobNode.disk,
+                                           preemptable=jobNode.preemptable,
+                                           consumables=jobNode.consumables),
                       command=jobNode.command,
                       userScript=self.userScript,
                       environment=self.environment.copy(),
@@ -198,7 +224,7 @@ class MesosBatchSystem(BatchSystemLocalSupport,
         # TODO: round all elements of resources
 
         self.taskResources[jobID] = job.resources
-        self.jobQueues.insertJob(job, jobType)
+        self.jobQueues.insertJob(job, jobType, priority=jobNode.priority)
         log.debug("... queued")
         return jobID
 
@@ -224,10 +250,14 @@ class MesosBatchSystem(BatchSystemLocalSupport,
             
             if jobID in self.getIssuedBatchJobIDs():
                 # Since the job has been issued, we have to kill it
-                taskId = addict.Dict()
-                taskId.value = str(jobID)
                 log.debug("Kill issued job %s" % str(jobID))
-                self.driver.killTask(taskId)
+                if jobID in self.jobBundles:
+                    # Killing the task would kill the other jobs of the bundle as well
+                    self._killBundledJob(jobID)
+                else:
+                    taskId = addict.Dict()
+                    taskId.value = str(jobID)
+                    self.driver.killTask(taskId)
             else:
                 # This job was never issued. Maybe it is a local job.
                 # We don't have to kill it.
@@ -249,11 +279,33 @@ class MesosBatchSystem(BatchSystemLocalSupport,
         # longer running, because that update happens before their IDs go into
         # killedJobIds. So we can safely return.
 
+    def _killBundledJob(self, jobID):
+        """
+        Asks the executor running the bundle of the given job to kill just that job. The Mesos
+        task of the bundle, whose ID is not the job's, keeps running the bundle's other jobs.
+        """
+        try:
+            taskData = self.runningJobMap[jobID]
+        except KeyError:
+            # The job has ended in the meantime
+            return
+        executorId = addict.Dict()
+        executorId.value = taskData.executorID
+        agentId = addict.Dict()
+        agentId.value = taskData.agentID
+        message = repr(dict(killJobs=[jobID])).encode('utf-8')
+        self.driver.sendFrameworkMessage(executorId, agentId, encode_data(message))
+
     def getIssuedBatchJobIDs(self):
         jobIds = set(self.jobQueues.jobIDs())
         jobIds.update(list(self.runningJobMap.keys()))
         return list(jobIds) + list(self.getIssuedLocalJobIDs())
 
+    def getNumberOfIssuedBatchJobs(self):
+        # A job is removed from its queue before it is added to runningJobMap
+        return (self.jobQueues.numberOfJobs() + len(self.runningJobMap) +
+                self.getNumberOfIssuedLocalJobs())
+
     def getRunningBatchJobIDs(self):
         currentTime = dict()
         for jobID, data in list(self.runningJobMap.items()):
@@ -391,29 +443,66 @@ class MesosBatchSystem(BatchSystemLocalSupport,
                 disk += resource.scalar.value
         return cores, memory, disk, preemptable
 
-    def _prepareToRun(self, jobType, offer):
-        # Get the first element to insure FIFO
-        job = self.jobQueues.nextJobOfType(jobType)
-        task = self._newMesosTask(job, offer)
-        return task
+    def _parseOfferConsumables(self, offer):
+        """
+        Returns a dictionary mapping the custom scalar resources in the given offer, as
+        advertised by agents started with e.g. ``--resources=ssd:4``, to their amounts. These are
+        matched against the custom consumable resources required by jobs.
+        """
+        consumables = {}
+        for resource in offer.resources:
+            if resource.name not in ('cpus', 'mem', 'disk', 'ports') and resource.type == 'SCALAR':
+                consumables[resource.name] = (consumables.get(resource.name, 0) +
+                                              resource.scalar.value)
+        return consumables
+
+    def _prepareToRun(self, jobTypes, offer):
+        """
+        Dequeues a job of each of the given types and builds the Mesos tasks to run them with the
+        given offer, bundling up to self.taskBundleSize jobs into each task.
+        """
+        jobs = []
+        for jobType in jobTypes:
+            # Jobs may have been killed since the queue was inspected
+            if self.jobQueues.typeEmpty(jobType):
+                continue
+            # Get the most important job of the given type, or the first one to ensure FIFO
+            job = self.jobQueues.nextJobOfType(jobType)
+            # TODO: this used to be a conditional but Hannes wanted it changed to an assert
+            # TODO: ... so we can understand why it exists.
+            assert job.jobID not in self.runningJobMap
+            log.debug("Preparing to launch job %s with %.2f cores, %.2f MiB memory, and %.2f MiB disk using offer %s ...",
+                      job.jobID, jobType.cores, toMiB(jobType.memory), toMiB(jobType.disk), offer.id.value)
+            jobs.append(job)
+        tasks = []
+        for i in range(0, len(jobs), self.taskBundleSize):
+            bundle = jobs[i:i + self.taskBundleSize]
+            if len(bundle) == 1:
+                tasks.append(self._newMesosTask(bundle[0], offer))
+            else:
+                tasks.append(self._newMesosBundleTask(bundle, offer))
+        return tasks
 
     def _updateStateToRunning(self, offer, runnableTasks):
+        agentIP = socket.gethostbyname(offer.hostname)
         for task in runnableTasks:
-            resourceKey = int(task.task_id.value)
-            resources = self.taskResources[resourceKey]
-            agentIP = socket.gethostbyname(offer.hostname)
-            try:
-                self.hostToJobIDs[agentIP].append(resourceKey)
-            except KeyError:
-                self.hostToJobIDs[agentIP] = [resourceKey]
-
-            self.runningJobMap[int(task.task_id.value)] = TaskData(startTime=time.time(),
-                                                                   agentID=offer.agent_id.value,
-                                                                   agentIP=agentIP,
-                                                                   executorID=task.executor.executor_id.value,
-                                                                   cores=resources.cores,
-                                                                   memory=resources.memory)
-            del self.taskResources[resourceKey]
+            taskID = task.task_id.value
+            # The jobs of a bundle are tracked individually
+            resourceKeys = self.bundles.get(taskID) or [int(taskID)]
+            for resourceKey in resourceKeys:
+                resources = self.taskResources[resourceKey]
+                try:
+                    self.hostToJobIDs[agentIP].append(resourceKey)
+                except KeyError:
+                    self.hostToJobIDs[agentIP] = [resourceKey]
+
+                self.runningJobMap[resourceKey] = TaskData(startTime=time.time(),
+                                                           agentID=offer.agent_id.value,
+                                                           agentIP=agentIP,
+                                                           executorID=task.executor.executor_id.value,
+                                                           cores=resources.cores,
+                                                           memory=resources.memory)
+                del self.taskResources[resourceKey]
             log.debug('Launched Mesos task %s.', task.task_id.value)
 
     def resourceOffers(self, driver, offers):
@@ -421,8 +510,11 @@ class MesosBatchSystem(BatchSystemLocalSupport,
         Invoked when resources have been offered to this framework.
         """
         self._trackOfferedNodes(offers)
+        for offer in offers:
+            self.offeredConsumables.update(self._parseOfferConsumables(offer))
 
-        jobTypes = self.jobQueues.sortedTypes
+        jobTypes = self.jobQueues.typeCountsByPriority()
+        self._warnAboutUnofferedConsumables(jobType for jobType, _, _ in jobTypes)
 
         if not jobTypes:
             log.debug('There are no queued tasks. Declining Mesos offers.')
@@ -430,61 +522,34 @@ class MesosBatchSystem(BatchSystemLocalSupport,
             self._declineAllOffers(driver, offers)
             return
 
-        unableToRun = True
-        # Right now, gives priority to largest jobs
+        usableOffers = []
+        offerResources = []
         for offer in offers:
             if offer.hostname in self.ignoredNodes:
                 log.debug("Declining offer %s because node %s is designated for termination" %
                         (offer.id.value, offer.hostname))
                 driver.declineOffer(offer.id)
                 continue
-            runnableTasks = []
             # TODO: In an offer, can there ever be more than one resource with the same name?
             offerCores, offerMemory, offerDisk, offerPreemptable = self._parseOffer(offer)
             log.debug('Got offer %s for a %spreemptable agent with %.2f MiB memory, %.2f core(s) '
                       'and %.2f MiB of disk.', offer.id.value, '' if offerPreemptable else 'non-',
                       offerMemory, offerCores, offerDisk)
-            remainingCores = offerCores
-            remainingMemory = offerMemory
-            remainingDisk = offerDisk
-
-            for jobType in jobTypes:
-                runnableTasksOfType = []
-                # Because we are not removing from the list until outside of the while loop, we
-                # must decrement the number of jobs left to run ourselves to avoid an infinite
-                # loop.
-                nextToLaunchIndex = 0
-                # Toil specifies disk and memory in bytes but Mesos uses MiB
-                while ( not self.jobQueues.typeEmpty(jobType)
-                       # On a non-preemptable node we can run any job, on a preemptable node we
-                       # can only run preemptable jobs:
-                       and (not offerPreemptable or jobType.preemptable)
-                       and remainingCores >= jobType.cores
-                       and remainingDisk >= toMiB(jobType.disk)
-                       and remainingMemory >= toMiB(jobType.memory)):
-                    task = self._prepareToRun(jobType, offer)
-                    # TODO: this used to be a conditional but Hannes wanted it changed to an assert
-                    # TODO: ... so we can understand why it exists.
-                    assert int(task.task_id.value) not in self.runningJobMap
-                    runnableTasksOfType.append(task)
-                    log.debug("Preparing to launch Mesos task %s with %.2f cores, %.2f MiB memory, and %.2f MiB disk using offer %s ...",
-                              task.task_id.value, jobType.cores, toMiB(jobType.memory), toMiB(jobType.disk), offer.id.value)
-                    remainingCores -= jobType.cores
-                    remainingMemory -= toMiB(jobType.memory)
-                    remainingDisk -= toMiB(jobType.disk)
-                    nextToLaunchIndex += 1
-                if not self.jobQueues.typeEmpty(jobType):
-                    # report that remaining jobs cannot be run with the current resourcesq:
-                    log.debug('Offer %(offer)s not suitable to run the tasks with requirements '
-                              '%(requirements)r. Mesos offered %(memory)s memory, %(cores)s cores '
-                              'and %(disk)s of disk on a %(non)spreemptable agent.',
-                              dict(offer=offer.id.value,
-                                   requirements=jobType.__dict__,
-                                   non='' if offerPreemptable else 'non-',
-                                   memory=fromMiB(offerMemory),
-                                   cores=offerCores,
-                                   disk=fromMiB(offerDisk)))
-                runnableTasks.extend(runnableTasksOfType)
+            usableOffers.append(offer)
+            # Toil specifies disk and memory in bytes but Mesos uses MiB
+            offerResources.append(OfferResources(cores=offerCores,
+                                                 memory=fromMiB(offerMemory),
+                                                 disk=fromMiB(offerDisk),
+                                                 preemptable=offerPreemptable,
+                                                 consumables=self._parseOfferConsumables(offer)))
+
+        # Gives priority to the types with the highest priority jobs, then packs the jobs into
+        # all offers of the batch together
+        assignments = packOffers(offerResources, jobTypes, timeBudget=self.offerPackingTimeBudget)
+
+        unableToRun = True
+        for offer, offerJobTypes in zip(usableOffers, assignments):
+            runnableTasks = self._prepareToRun(offerJobTypes, offer)
             # Launch all runnable tasks together so we only call launchTasks once per offer
             if runnableTasks:
                 unableToRun = False
@@ -502,10 +567,24 @@ class MesosBatchSystem(BatchSystemLocalSupport,
                      '%i jobs running. Enable debug level logging to see more details about '
                      'job types and offers received.', len(self.runningJobMap))
 
+    def _warnAboutUnofferedConsumables(self, jobTypes):
+        """
+        Logs a warning, once per consumable, for each custom consumable resource required by the
+        given job types that no agent has offered so far. Such jobs stay queued until an agent
+        advertising the consumable joins the cluster, which may be never.
+        """
+        for jobType in jobTypes:
+            for name in jobType.consumables:
+                if name not in self.offeredConsumables and name not in self.warnedConsumables:
+                    self.warnedConsumables.add(name)
+                    log.warning("Jobs require the consumable '%s' but no Mesos agent has offered "
+                                "it. They will wait until an agent started with e.g. "
+                                "--resources=%s:1 joins the cluster.", name, name)
+
     def _trackOfferedNodes(self, offers):
         for offer in offers:
             # All AgentID messages are required to have a value according to the Mesos Protobuf file.
-            assert(offer.agent_id.has_key('value'))
+            assert('value' in offer.agent_id)
             try:
                 nodeAddress = socket.gethostbyname(offer.hostname)
             except:
@@ -537,11 +616,36 @@ class MesosBatchSystem(BatchSystemLocalSupport,
         """
         Build the Mesos task object for a given the Toil job and Mesos offer
         """
+        return self._newTask(str(job.jobID), job.name, job, job.resources, offer)
+
+    def _newMesosBundleTask(self, jobs, offer):
+        """
+        Build the Mesos task object running the given Toil jobs side by side with a Mesos offer.
+        The task requires the resources of all of its jobs.
+        """
+        consumables = {}
+        for job in jobs:
+            for name, amount in iteritems(job.resources.consumables):
+                consumables[name] = consumables.get(name, 0) + amount
+        resources = MesosShape(wallTime=0,
+                               memory=sum(job.resources.memory for job in jobs),
+                               cores=sum(job.resources.cores for job in jobs),
+                               disk=sum(job.resources.disk for job in jobs),
+                               preemptable=all(job.resources.preemptable for job in jobs),
+                               consumables=consumables)
+        # Job IDs are unique and every job is part of at most one bundle
+        taskID = 'bundle-%s' % jobs[0].jobID
+        self.bundles[taskID] = set(job.jobID for job in jobs)
+        for job in jobs:
+            self.jobBundles[job.jobID] = taskID
+        return self._newTask(taskID, 'Bundle of %i jobs' % len(jobs), jobs, resources, offer)
+
+    def _newTask(self, taskID, name, data, resources, offer):
         task = addict.Dict()
-        task.task_id.value = str(job.jobID)
+        task.task_id.value = taskID
         task.agent_id.value = offer.agent_id.value
-        task.name = job.name
-        task.data = encode_data(pickle.dumps(job))
+        task.name = name
+        task.data = encode_data(pickle.dumps(data))
         task.executor = addict.Dict(self.executor)
 
         task.resources = []
@@ -550,29 +654,37 @@ class MesosBatchSystem(BatchSystemLocalSupport,
         cpus = task.resources[-1]
         cpus.name = 'cpus'
         cpus.type = 'SCALAR'
-        cpus.scalar.value = job.resources.cores
+        cpus.scalar.value = resources.cores
 
         task.resources.append(addict.Dict())
         disk = task.resources[-1]
         disk.name = 'disk'
         disk.type = 'SCALAR'
-        if toMiB(job.resources.disk) > 1:
-            disk.scalar.value = toMiB(job.resources.disk)
+        if toMiB(resources.disk) > 1:
+            disk.scalar.value = toMiB(resources.disk)
         else:
-            log.warning("Job %s uses less disk than Mesos requires. Rounding %s up to 1 MiB.",
-                        job.jobID, job.resources.disk)
+            log.warning("Task %s uses less disk than Mesos requires. Rounding %s up to 1 MiB.",
+                        taskID, resources.disk)
             disk.scalar.value = 1
         
         task.resources.append(addict.Dict())
         mem = task.resources[-1]
         mem.name = 'mem'
         mem.type = 'SCALAR'
-        if toMiB(job.resources.memory) > 1:
-            mem.scalar.value = toMiB(job.resources.memory)
+        if toMiB(resources.memory) > 1:
+            mem.scalar.value = toMiB(resources.memory)
         else:
-            log.warning("Job %s uses less memory than Mesos requires. Rounding %s up to 1 MiB.",
-                        job.jobID, job.resources.memory)
+            log.warning("Task %s uses less memory than Mesos requires. Rounding %s up to 1 MiB.",
+                        taskID, resources.memory)
             mem.scalar.value = 1
+
+        # Reserve the custom consumable resources so Mesos doesn't offer them to other tasks
+        for name, amount in sorted(iteritems(resources.consumables)):
+            task.resources.append(addict.Dict())
+            consumable = task.resources[-1]
+            consumable.name = name
+            consumable.type = 'SCALAR'
+            consumable.scalar.value = amount
         return task
 
     def statusUpdate(self, driver, update):
@@ -584,47 +696,17 @@ class MesosBatchSystem(BatchSystemLocalSupport,
         status update will be delivered (note, however, that this is currently not true if the
         agent sending the status update is lost/fails during that time).
         """
+        if update.task_id.value.startswith('bundle-'):
+            self._bundleStatusUpdate(update)
+            return
+
         jobID = int(update.task_id.value)
         log.debug("Job %i is in state '%s' due to reason '%s'.", jobID, update.state, update.reason)
-        
-        def jobEnded(_exitStatus, wallTime=None):
-            """
-            Notify external observers of the job ending.
-            """
-            self.updatedJobsQueue.put((jobID, _exitStatus, wallTime))
-            agentIP = None
-            try:
-                agentIP = self.runningJobMap[jobID].agentIP
-            except KeyError:
-                log.warning("Job %i returned exit code %i but isn't tracked as running.",
-                            jobID, _exitStatus)
-            else:
-                # Mark the job as no longer running. We MUST do this BEFORE
-                # saying we killed the job, or it will be possible for another
-                # thread to kill a job and then see it as running.
-                del self.runningJobMap[jobID]
-
-            try:
-                self.hostToJobIDs[agentIP].remove(jobID)
-            except KeyError:
-                log.warning("Job %i returned exit code %i from unknown host.",
-                            jobID, _exitStatus)
-                            
-            try:
-                self.killJobIds.remove(jobID)
-            except KeyError:
-                pass
-            else:
-                # We were asked to kill this job, so say that we have done so.
-                # We do this LAST, after all status updates for the job have
-                # been handled, to ensure a consistent view of the scheduler
-                # state from other threads.
-                self.killedJobIds.add(jobID)
 
         if update.state == 'TASK_FINISHED':
             # We get the running time of the job via the timestamp, which is in job-local time in seconds
-            assert(update.has_key('timestamp'))
-            jobEnded(0, wallTime=update.timestamp)
+            assert('timestamp' in update)
+            self._jobEnded(jobID, 0, wallTime=update.timestamp)
         elif update.state == 'TASK_FAILED':
             try:
                 exitStatus = int(update.message)
@@ -639,22 +721,103 @@ class MesosBatchSystem(BatchSystemLocalSupport,
                             update.message, update.reason,
                             update.executor_id, update.agent_id)
             
-            jobEnded(exitStatus)
+            self._jobEnded(jobID, exitStatus)
         elif update.state in ('TASK_LOST', 'TASK_KILLED', 'TASK_ERROR'):
             log.warning("Job %i is in unexpected state %s with message '%s' due to reason '%s'.",
                         jobID, update.state, update.message, update.reason)
-            jobEnded(255)
+            self._jobEnded(jobID, 255)
             
-        if update.has_key('limitation'):
+        if 'limitation' in update:
             log.warning("Job limit info: %s" % update.limitation)
             
+    def _jobEnded(self, jobID, exitStatus, wallTime=None):
+        """
+        Notify external observers of the job ending.
+        """
+        self.updatedJobsQueue.put((jobID, exitStatus, wallTime))
+        agentIP = None
+        try:
+            agentIP = self.runningJobMap[jobID].agentIP
+        except KeyError:
+            log.warning("Job %i returned exit code %i but isn't tracked as running.",
+                        jobID, exitStatus)
+        else:
+            # Mark the job as no longer running. We MUST do this BEFORE
+            # saying we killed the job, or it will be possible for another
+            # thread to kill a job and then see it as running.
+            del self.runningJobMap[jobID]
+
+        try:
+            self.hostToJobIDs[agentIP].remove(jobID)
+        except KeyError:
+            log.warning("Job %i returned exit code %i from unknown host.",
+                        jobID, exitStatus)
+
+        try:
+            self.killJobIds.remove(jobID)
+        except KeyError:
+            pass
+        else:
+            # We were asked to kill this job, so say that we have done so.
+            # We do this LAST, after all status updates for the job have
+            # been handled, to ensure a consistent view of the scheduler
+            # state from other threads.
+            self.killedJobIds.add(jobID)
+
+    def _bundledJobsEnded(self, results):
+        """
+        Handles the results reported by the executor for jobs that ran as part of a bundle.
+        Results of jobs that were already reported are ignored.
+
+        :param list[(int, int, float)] results: the ID, exit status and wall time of each job
+        """
+        for jobID, exitStatus, wallTime in results:
+            try:
+                bundleID = self.jobBundles.pop(jobID)
+            except KeyError:
+                continue
+            self.bundles[bundleID].discard(jobID)
+            if exitStatus < 0:
+                # The job was killed by a signal
+                log.warning("Job %i of bundle %s was killed by signal %i.",
+                            jobID, bundleID, -exitStatus)
+                exitStatus = 255
+            elif exitStatus != 0:
+                log.warning("Job %i of bundle %s failed with exit status %i.",
+                            jobID, bundleID, exitStatus)
+            self._jobEnded(jobID, exitStatus, wallTime)
+
+    def _bundleStatusUpdate(self, update):
+        """
+        Handles a status update of a Mesos task running a bundle of jobs. The results of its jobs
+        are usually reported in framework messages as they end, but those may be lost, so the
+        final update of the bundle carries all of them again.
+        """
+        bundleID = update.task_id.value
+        log.debug("Bundle %s is in state '%s' due to reason '%s'.",
+                  bundleID, update.state, update.reason)
+        if update.state not in ('TASK_FINISHED', 'TASK_FAILED', 'TASK_LOST', 'TASK_KILLED',
+                                'TASK_ERROR'):
+            return
+        if bundleID not in self.bundles:
+            # Mesos may deliver the final update more than once
+            return
+        if update.get('data'):
+            self._bundledJobsEnded(ast.literal_eval(decode_data(update.data).decode('utf-8')))
+        for jobID in self.bundles.pop(bundleID):
+            log.warning("Job %i of bundle %s did not report a result before the bundle ended in "
+                        "state %s with message '%s' due to reason '%s'.", jobID, bundleID,
+                        update.state, update.message, update.reason)
+            self.jobBundles.pop(jobID, None)
+            self._jobEnded(jobID, 255)
+
     def frameworkMessage(self, driver, executorId, agentId, message):
         """
         Invoked when an executor sends a message.
         """
         
         # Take it out of base 64 encoding from Protobuf
-        message = decode_data(message)
+        message = decode_data(message).decode('utf-8')
         
         log.debug('Got framework message from executor %s running on agent %s: %s',
                   executorId.value, agentId.value, message)
@@ -673,6 +836,8 @@ class MesosBatchSystem(BatchSystemLocalSupport,
                 requestedMemory = sum(taskData.memory for taskData in resources)
                 executor.nodeInfo = NodeInfo(requestedCores=requestedCores, requestedMemory=requestedMemory, **v)
                 self.executors[nodeAddress] = executor
+            elif k == 'jobUpdates':
+                self._bundledJobsEnded(v)
             else:
                 raise RuntimeError("Unknown message field '%s'." % k)
 
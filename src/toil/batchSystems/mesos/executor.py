@@ -36,6 +36,7 @@ except ImportError:
     from urllib.request import urlopen
 
 import addict
+import ast
 from pymesos import MesosExecutorDriver, Executor, decode_data, encode_data
 
 from toil import subprocess, pickle
@@ -49,13 +50,23 @@ log = logging.getLogger(__name__)
 class MesosExecutor(Executor):
     """
     Part of Toil's Mesos framework, runs on a Mesos agent. A Toil job is passed to it via the
-    task.data field, and launched via call(toil.command).
+    task.data field, and launched via call(toil.command). The task.data field may also hold a
+    list of jobs, a bundle, which are run side by side.
     """
 
+    # The number of seconds between checks for ended jobs of a bundle. The jobs that ended since
+    # the last check are reported together.
+    bundlePollInterval = 1
+
     def __init__(self):
         super(MesosExecutor, self).__init__()
         self.popenLock = threading.Lock()
         self.runningTasks = {}
+        # Maps the task IDs of running bundles to the IDs of their jobs, as strings. The jobs of
+        # a bundle are tracked in runningTasks by job ID.
+        self.runningBundles = {}
+        # The IDs of bundled jobs that were asked to be killed before they were started
+        self.killedJobs = set()
         self.workerCleanupInfo = None
         log.debug('Preparing system for resource download')
         Resource.prepareSystem()
@@ -97,6 +108,12 @@ class MesosExecutor(Executor):
         """
         Kill parent task process and all its spawned children
         """
+        if taskId in self.runningBundles:
+            # Kill every job of the bundle
+            for jobId in self.runningBundles[taskId]:
+                self.killedJobs.add(jobId)
+                self.killTask(driver, jobId)
+            return
         try:
             pid = self.runningTasks[taskId]
             pgid = os.getpgid(pid)
@@ -136,7 +153,7 @@ class MesosExecutor(Executor):
                                         memoryTotal=psutil.virtual_memory().total,
                                         workers=len(self.runningTasks))
             log.debug("Send framework message: %s", message)
-            driver.sendFrameworkMessage(encode_data(repr(message)))
+            driver.sendFrameworkMessage(encode_data(repr(message).encode('utf-8')))
             # Prevent workers launched together from repeatedly hitting the leader at the same time
             time.sleep(random.randint(45, 75))
 
@@ -164,10 +181,19 @@ class MesosExecutor(Executor):
                 return
 
             # This is where task.data is first invoked. Using this position to setup cleanupInfo
+            workerCleanupInfo = (taskData[0] if isinstance(taskData, list)
+                                 else taskData).workerCleanupInfo
             if self.workerCleanupInfo is not None:
-                assert self.workerCleanupInfo == taskData.workerCleanupInfo
+                assert self.workerCleanupInfo == workerCleanupInfo
             else:
-                self.workerCleanupInfo = taskData.workerCleanupInfo
+                self.workerCleanupInfo = workerCleanupInfo
+
+            if isinstance(taskData, list):
+                results = runBundle(taskData)
+                wallTime = time.time() - startTime
+                sendUpdate(task, 'TASK_FINISHED', wallTime,
+                           data=encode_data(repr(results).encode('utf-8')))
+                return
 
             # try to invoke a run on the unpickled task
             try:
@@ -212,7 +238,58 @@ class MesosExecutor(Executor):
                                         preexec_fn=lambda: os.setpgrp(),
                                         shell=True, env=jobEnv)
 
-        def sendUpdate(task, taskState, wallTime=None, msg=''):
+        def runBundle(jobs):
+            """
+            Runs the jobs of a bundle side by side. Whenever jobs have ended, they are reported
+            to the scheduler together in a framework message.
+
+            :type jobs: list[toil.batchSystems.mesos.ToilJob]
+
+            :return: the ID, exit status and wall time of every job of the bundle
+            :rtype: list[(int, int, float)]
+            """
+            results = []
+            running = {}
+            self.runningBundles[task.task_id.value] = [str(job.jobID) for job in jobs]
+            for job in jobs:
+                if str(job.jobID) in self.killedJobs:
+                    # Report the job like one killed with SIGKILL while running
+                    self.killedJobs.discard(str(job.jobID))
+                    results.append((job.jobID, -signal.SIGKILL, 0.0))
+                    continue
+                try:
+                    process = runJob(job)
+                except:
+                    log.error('Exception while running job %s of bundle %s:', job.jobID,
+                              task.task_id.value, exc_info=True)
+                    results.append((job.jobID, 255, 0.0))
+                else:
+                    running[job.jobID] = process, time.time()
+                    self.runningTasks[str(job.jobID)] = process.pid
+                    if str(job.jobID) in self.killedJobs:
+                        # The job was asked to be killed while it was being started
+                        self.killTask(driver, str(job.jobID))
+            reported = 0
+            while True:
+                for jobID, (process, jobStartTime) in list(running.items()):
+                    exitStatus = process.poll()
+                    if exitStatus is not None:
+                        results.append((jobID, exitStatus, time.time() - jobStartTime))
+                        del running[jobID]
+                        del self.runningTasks[str(jobID)]
+                if len(results) > reported:
+                    message = Expando(address=self.address, jobUpdates=results[reported:])
+                    log.debug("Send framework message: %s", message)
+                    driver.sendFrameworkMessage(encode_data(repr(message).encode('utf-8')))
+                    reported = len(results)
+                if not running:
+                    del self.runningBundles[task.task_id.value]
+                    for job in jobs:
+                        self.killedJobs.discard(str(job.jobID))
+                    return results
+                time.sleep(self.bundlePollInterval)
+
+        def sendUpdate(task, taskState, wallTime=None, msg='', data=None):
             update = addict.Dict()
             update.task_id.value = task.task_id.value
             if self.id is not None:
@@ -221,6 +298,8 @@ class MesosExecutor(Executor):
             update.state = taskState
             update.timestamp = wallTime
             update.message = msg
+            if data is not None:
+                update.data = data
             driver.sendStatusUpdate(update)
 
         thread = threading.Thread(target=runTask)
@@ -231,13 +310,24 @@ class MesosExecutor(Executor):
         Invoked when a framework message has arrived for this executor.
         """
         log.debug("Received message from framework: {}".format(message))
+        message = ast.literal_eval(decode_data(message).decode('utf-8'))
+        assert isinstance(message, dict)
+        for k, v in message.items():
+            if k == 'killJobs':
+                # Jobs that are part of a bundle are killed individually. Remember them in case
+                # they haven't been started yet.
+                for jobID in v:
+                    self.killedJobs.add(str(jobID))
+                    self.killTask(driver, str(jobID))
+            else:
+                raise RuntimeError("Unknown message field '%s'." % k)
 
 
 def main():
     logging.basicConfig(level=logging.DEBUG)
     log.debug("Starting executor")
 
-    if not os.environ.has_key("MESOS_AGENT_ENDPOINT"):
+    if "MESOS_AGENT_ENDPOINT" not in os.environ:
         # Some Mesos setups in our tests somehow lack this variable. Provide a
         # fake one to maybe convince the executor driver to work.
         os.environ["MESOS_AGENT_ENDPOINT"] = os.environ.get("MESOS_SLAVE_ENDPOINT", "127.0.0.1:5051")
@@ -254,7 +344,7 @@ def main():
         
     # Parse the agent state
     agent_state = json.loads(urlopen("http://%s/state" % os.environ["MESOS_AGENT_ENDPOINT"]).read())
-    if agent_state.has_key('completed_frameworks'):
+    if 'completed_frameworks' in agent_state:
         # Drop the completed frameworks which grow over time
         del agent_state['completed_frameworks']
     log.debug("Agent state: %s", str(agent_state))
@@ -78,6 +78,12 @@ def _singleMachineOptions(addOptionFn, config):
 def _mesosOptions(addOptionFn, config=None):
     addOptionFn("--mesosMaster", dest="mesosMasterAddress", default=getPublicIP() + ':5050',
                 help=("The host and port of the Mesos master separated by colon. (default: %(default)s)"))
+    addOptionFn("--mesosTaskBundleSize", dest="mesosTaskBundleSize", default=1,
+                help=("The maximum number of jobs to launch together as a single Mesos task. "
+                      "The jobs of a bundle run side by side and are reported in batches, "
+                      "saving a round trip through Mesos per job when many small jobs are "
+                      "queued. The resources of a bundle are only released once its last job "
+                      "ends. (default: %(default)s)"))
 
 
 # Built in batch systems that have options
@@ -148,6 +154,7 @@ def setDefaultOptions(config):
 
     # mesos
     config.mesosMasterAddress = '%s:5050' % getPublicIP()
+    config.mesosTaskBundleSize = 1
 
     # parasol
     config.parasolCommand = 'parasol'
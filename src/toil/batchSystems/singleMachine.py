@@ -28,11 +28,13 @@ import time
 import math
 from threading import Thread
 from threading import Lock, Condition
-from six.moves.queue import Empty, Queue
+from six import iteritems
+from six.moves.queue import Empty, Queue, PriorityQueue
 
 import toil
 from toil import subprocess
-from toil.batchSystems.abstractBatchSystem import BatchSystemSupport
+from toil.batchSystems.abstractBatchSystem import (BatchSystemSupport,
+                                                   InsufficientSystemResources)
 from toil import worker as toil_worker
 from toil.common import Toil
 
@@ -53,6 +55,10 @@ class SingleMachineBatchSystem(BatchSystemSupport):
     def supportsWorkerCleanup(cls):
         return True
 
+    @classmethod
+    def supportsWorkerZygote(cls):
+        return True
+
     numCores = multiprocessing.cpu_count()
 
     minCores = 0.1
@@ -94,8 +100,9 @@ class SingleMachineBatchSystem(BatchSystemSupport):
         """
         :type: dict[str,toil.job.JobNode]
         """
-        # A queue of jobs waiting to be executed. Consumed by the workers.
-        self.inputQueue = Queue()
+        # A queue of jobs waiting to be executed, ordered by decreasing priority and, among jobs
+        # of equal priority, by issue order. Consumed by the workers.
+        self.inputQueue = PriorityQueue()
         # A queue of finished jobs. Produced by the workers.
         self.outputQueue = Queue()
         # A dictionary mapping IDs of currently running jobs to their Info objects
@@ -121,6 +128,11 @@ class SingleMachineBatchSystem(BatchSystemSupport):
         self.memory = ResourcePool(self.maxMemory, 'memory', self.acquisitionTimeout)
         # A pool representing the available space in bytes
         self.disk = ResourcePool(self.maxDisk, 'disk', self.acquisitionTimeout)
+        # The total amount of each custom consumable resource and pools representing the
+        # available amounts
+        self.maxConsumables = dict(config.consumables)
+        self.consumables = {name: ResourcePool(amount, name, self.acquisitionTimeout)
+                            for name, amount in iteritems(self.maxConsumables)}
 
         if not self.debugWorker:
             log.debug('Setting up the thread pool with %i workers, '
@@ -183,10 +195,10 @@ class SingleMachineBatchSystem(BatchSystemSupport):
         while True:
             if self.debugWorker and inputQueue.empty():
                 return
-            args = inputQueue.get()
+            _, _, _, args = inputQueue.get()
             if args is None:
                 break
-            jobCommand, jobID, jobCores, jobMemory, jobDisk, environment = args
+            jobCommand, jobID, jobCores, jobMemory, jobDisk, jobConsumables, environment = args
             while True:
                 try:
                     coreFractions = int(old_div(jobCores, self.minCores))
@@ -198,7 +210,8 @@ class SingleMachineBatchSystem(BatchSystemSupport):
                                   jobCores)
                         with self.coreFractions.acquisitionOf(coreFractions):
                             with self.disk.acquisitionOf(jobDisk):
-                                self._runWorker(jobCommand, jobID, environment)
+                                with self._acquisitionOfConsumables(jobConsumables):
+                                    self._runWorker(jobCommand, jobID, environment)
 
                 except ResourcePool.AcquisitionTimeoutException as e:
                     log.debug('Could not acquire enough (%s) to run job (%s). Requested: (%s), '
@@ -217,6 +230,22 @@ class SingleMachineBatchSystem(BatchSystemSupport):
                         self.aquisitionCondition.notifyAll()
                     break
 
+    @contextmanager
+    def _acquisitionOfConsumables(self, consumables):
+        """
+        Acquire the given amounts of custom consumable resources for the duration of the context.
+
+        :param list[tuple[str,int]] consumables: pairs of consumable name and amount, in the
+               same order for all jobs
+        """
+        if not consumables:
+            yield
+        else:
+            (name, amount), rest = consumables[0], consumables[1:]
+            with self.consumables[name].acquisitionOf(amount):
+                with self._acquisitionOfConsumables(rest):
+                    yield
+
     def issueBatchJob(self, jobNode):
         """Adds the command and resources to a queue to be run."""
         # Round cores to minCores and apply scale
@@ -230,14 +259,19 @@ class SingleMachineBatchSystem(BatchSystemSupport):
                                           'with.'.format(jobNode.jobName, jobNode.memory, self.maxMemory))
 
         self.checkResourceRequest(jobNode.memory, cores, jobNode.disk)
+        consumables = sorted(iteritems(jobNode.consumables))
+        for name, amount in consumables:
+            if amount > self.maxConsumables.get(name, 0):
+                raise InsufficientSystemResources(name, amount, self.maxConsumables.get(name, 0))
         log.debug("Issuing the command: %s with memory: %i, cores: %i, disk: %i" % (
             jobNode.command, jobNode.memory, cores, jobNode.disk))
         with self.jobIndexLock:
             jobID = self.jobIndex
             self.jobIndex += 1
         self.jobs[jobID] = jobNode.command
-        self.inputQueue.put((jobNode.command, jobID, cores, jobNode.memory,
-                             jobNode.disk, self.environment.copy()))
+        self.inputQueue.put((-jobNode.priority, -jobNode.criticalPath, jobID,
+                             (jobNode.command, jobID, cores, jobNode.memory,
+                              jobNode.disk, consumables, self.environment.copy())))
         if self.debugWorker:  # then run immediately, blocking for return
             self.worker(self.inputQueue)
         return jobID
@@ -262,6 +296,9 @@ class SingleMachineBatchSystem(BatchSystemSupport):
         """Just returns all the jobs that have been run, but not yet returned as updated."""
         return list(self.jobs.keys())
 
+    def getNumberOfIssuedBatchJobs(self):
+        return len(self.jobs)
+
     def getRunningBatchJobIDs(self):
         now = time.time()
         return {jobID: now - info.time for jobID, info in list(self.runningJobs.items())}
@@ -275,7 +312,8 @@ class SingleMachineBatchSystem(BatchSystemSupport):
         inputQueue = self.inputQueue
         self.inputQueue = None
         for i in range(self.numWorkers):
-            inputQueue.put(None)
+            # Sentinels sort after all jobs so that queued jobs are still run
+            inputQueue.put((float('inf'), 0, i, None))
         for thread in self.workerThreads:
             thread.join()
         BatchSystemSupport.workerCleanup(self.workerCleanupInfo)
@@ -20,6 +20,7 @@ standard_library.install_aliases()
 from builtins import str
 from builtins import range
 from builtins import object
+import hashlib
 import logging
 import os
 import re
@@ -64,6 +65,9 @@ class Config(object):
         self.jobStore is the same, e.g. when a job store name is reused after a previous run has
         finished sucessfully and its job store has been clean up."""
         self.workflowAttemptNumber = None
+        self.environmentHash = None
+        """The MD5 of the shared environment.pickle file, allowing workers to validate a copy
+        of that file cached on their node instead of reading it from the job store."""
         self.jobStore = None
         self.logLevel = getLogLevelString()
         self.workDir = None
@@ -92,6 +96,8 @@ class Config(object):
         self.betaInertia = 0.1
         self.scaleInterval = 60
         self.preemptableCompensation = 0.0
+        self.runtimeQuantile = 0.5
+        self.prewarmHorizon = 0
         self.nodeStorage = 50
         self.metrics = False
 
@@ -99,6 +105,10 @@ class Config(object):
         self.maxPreemptableServiceJobs = sys.maxsize
         self.maxServiceJobs = sys.maxsize
         self.deadlockWait = 60  # Number of seconds to wait before declaring a deadlock
+        # Parameters to limit the number of concurrently issued jobs
+        self.maxJobs = sys.maxsize
+        self.jobQuotas = {}  # Maps job names or tags to the maximum number of such jobs issued
+        self.jobRates = {}  # Maps job names or tags to the maximum number of such jobs issued per minute
         self.statePollingWait = 1  # Number of seconds to wait before querying job state
 
         # Resource requirements
@@ -110,6 +120,7 @@ class Config(object):
         self.maxCores = sys.maxsize
         self.maxMemory = sys.maxsize
         self.maxDisk = sys.maxsize
+        self.consumables = {}  # Maps custom consumable resources to the amount on each node
 
         # Retrying/rescuing jobs
         self.retryCount = 1
@@ -119,6 +130,9 @@ class Config(object):
         # Misc
         self.disableCaching = True
         self.disableChaining = False
+        self.maxWorkerSuccessors = 0
+        self.workerZygote = False
+        self.cacheJobBodies = False
         self.maxLogFileSize = 64000
         self.writeLogs = None
         self.writeLogsGzip = None
@@ -212,6 +226,7 @@ class Config(object):
         setOption("disableAutoDeployment")
         setOption("scale", float, fC(0.0))
         setOption("mesosMasterAddress")
+        setOption("mesosTaskBundleSize", int, iC(1))
         setOption("parasolCommand")
         setOption("parasolMaxBatches", int, iC(1))
         setOption("linkImports")
@@ -237,6 +252,13 @@ class Config(object):
         if not 0.0 <= self.preemptableCompensation <= 1.0:
             raise RuntimeError('preemptableCompensation (%f) must be between 0.0 and 1.0!'
                                '' % self.preemptableCompensation)
+        setOption("runtimeQuantile", float)
+        if not 0.0 < self.runtimeQuantile <= 1.0:
+            raise RuntimeError('runtimeQuantile (%f) must be greater than 0.0 and at most 1.0!'
+                               '' % self.runtimeQuantile)
+        setOption("prewarmHorizon", float)
+        if self.prewarmHorizon < 0:
+            raise RuntimeError('prewarmHorizon (%f) must not be negative!' % self.prewarmHorizon)
         setOption("nodeStorage", int)
 
         # Parameters to limit service jobs / detect deadlocks
@@ -245,6 +267,11 @@ class Config(object):
         setOption("deadlockWait", int)
         setOption("statePollingWait", int)
 
+        # Parameters to limit the number of concurrently issued jobs
+        setOption("maxJobs", int, iC(1))
+        setOption("jobQuotas", parseNamedAmounts)
+        setOption("jobRates", parseNamedAmounts)
+
         # Resource requirements
         setOption("defaultMemory", h2b, iC(1))
         setOption("defaultCores", float, fC(1.0))
@@ -254,6 +281,7 @@ class Config(object):
         setOption("maxMemory", h2b, iC(1))
         setOption("maxDisk", h2b, iC(1))
         setOption("defaultPreemptable")
+        setOption("consumables", parseNamedAmounts)
 
         # Retrying/rescuing jobs
         setOption("retryCount", int, iC(1))
@@ -264,6 +292,9 @@ class Config(object):
         setOption("maxLocalJobs", int)
         setOption("disableCaching")
         setOption("disableChaining")
+        setOption("maxWorkerSuccessors", int, iC(0))
+        setOption("workerZygote")
+        setOption("cacheJobBodies")
         setOption("maxLogFileSize", h2b, iC(1))
         setOption("writeLogs")
         setOption("writeLogsGzip")
@@ -426,6 +457,18 @@ def _addOptions(addGroupFn, config):
                       "missing preemptable nodes with a non-preemptable one. A value of 1.0 "
                       "replaces every missing pre-emptable node with a non-preemptable one." %
                       config.preemptableCompensation))
+    addOptionFn("--runtimeQuantile", dest="runtimeQuantile", default=None,
+                help=("The quantile of the recent runtimes of completed jobs that the autoscaler "
+                      "assumes queued jobs of the same name, or failing that, of similar "
+                      "requirements, will take. Larger values provision for the slower jobs of a "
+                      "kind. Must be greater than 0.0 and at most 1.0. default=%s" %
+                      config.runtimeQuantile))
+    addOptionFn("--prewarmHorizon", dest="prewarmHorizon", default=None,
+                help=("The number of seconds ahead of time that the autoscaler provisions nodes "
+                      "for jobs that aren't ready to run yet but will be once an issued job "
+                      "completes, such as the children of a job that is running. Set this to the "
+                      "time it takes a node to come up to hide that time. A value of 0 disables "
+                      "provisioning ahead of demand. default=%s" % config.prewarmHorizon))
     addOptionFn("--nodeStorage", dest="nodeStorage", default=50,
                 help=("Specify the size of the root volume of worker nodes when they are launched "
                       "in gigabytes. You may want to set this if your jobs require a lot of disk "
@@ -458,6 +501,30 @@ def _addOptions(addGroupFn, config):
                     help=("Time, in seconds, to wait before doing a scheduler query for job state. "
                           "Return cached results if within the waiting period."))
 
+    #
+    # Parameters to limit the number of concurrently issued jobs
+    #
+    addOptionFn = addGroupFn(
+        "toil options for throttling jobs",
+        "Allows limiting the number of jobs that are issued to the batch system at once, overall "
+        "or by job name or tag, and the number of jobs with a job name or tag that are issued per "
+        "minute, e.g. to keep a step from saturating a shared database. Jobs that are ready to "
+        "run in excess of a limit are held by the leader until capacity frees up and are not "
+        "provisioned for by the cluster scaler in the meantime.")
+    addOptionFn("--maxJobs", dest="maxJobs", default=None,
+                help=("The maximum number of jobs, including service jobs, that are issued to the "
+                      "batch system at once. default=%s" % config.maxJobs))
+    addOptionFn("--jobQuota", dest="jobQuotas", default=[], action="append",
+                metavar="NAME=LIMIT",
+                help=("The maximum number of jobs with the given job name or tag, e.g. "
+                      "license:gatk=10, that are issued to the batch system at once. Can be "
+                      "specified multiple times."))
+    addOptionFn("--jobRate", dest="jobRates", default=[], action="append",
+                metavar="NAME=LIMIT",
+                help=("The maximum number of jobs with the given job name or tag, e.g. db=60, "
+                      "that are issued to the batch system per minute. Can be specified multiple "
+                      "times."))
+
     #
     # Resource requirements
     #
@@ -494,6 +561,13 @@ def _addOptions(addGroupFn, config):
                 help='The maximum amount of disk space to request from the batch system at any '
                      'one time. Standard suffixes like K, Ki, M, Mi, G or Gi are supported. '
                      'Default is %s' % bytes2human(config.maxDisk, symbols='iec'))
+    addOptionFn('--consumable', dest='consumables', default=[], action='append',
+                metavar='NAME=AMOUNT',
+                help='The amount of a custom consumable resource, e.g. local SSD slots or '
+                     'license seats, that each worker node provides to the jobs requiring it. '
+                     'Enforced by the singleMachine batch system and considered by the cluster '
+                     'scaler. Mesos agents advertise their own amounts, via their --resources '
+                     'option. Can be specified multiple times.')
 
     #
     # Retrying/rescuing jobs
@@ -524,6 +598,21 @@ def _addOptions(addGroupFn, config):
     addOptionFn('--disableChaining', dest='disableChaining', action='store_true', default=False,
                 help="Disables chaining of jobs (chaining uses one job's resource allocation "
                 "for its successor job if possible).")
+    addOptionFn('--maxWorkerSuccessors', dest='maxWorkerSuccessors', default=None,
+                help="Let a worker run up to this many of its job's successors that fit within "
+                "its resource allocation itself, in parallel if they fit, rather than issuing "
+                "them to the batch system. The remaining successors are issued as usual. "
+                "default=%s (disabled)" % config.maxWorkerSuccessors)
+    addOptionFn('--workerZygote', dest='workerZygote', action='store_true', default=False,
+                help="Start a zygote process on each worker node that pre-imports Toil and the "
+                "user module and forks subsequent workers from itself, reducing the start-up "
+                "latency of short jobs. Ignored by batch systems that confine the processes of "
+                "each job, i.e. all but the single machine batch system.")
+    addOptionFn('--cacheJobBodies', dest='cacheJobBodies', action='store_true', default=False,
+                help="Keep a copy of every pickled job read by a worker on the worker's node so "
+                "that jobs chained or retried on the same node are not read from the job store "
+                "again. The copies take up at most 64 MiB per node, which is set aside from the "
+                "space available to the file store cache.")
     addOptionFn("--maxLogFileSize", dest="maxLogFileSize", default=None,
                 help=("The maximum size of a job log file to keep (in bytes), log files "
                       "larger than this will be truncated to the last X bytes. Setting "
@@ -734,7 +823,9 @@ class Toil(object):
         """
         Invoke a Toil workflow with the given job as the root for an initial run. This method
         must be called in the body of a ``with Toil(...) as toil:`` statement. This method should
-        not be called more than once for a workflow that has not finished.
+        not be called more than once for a workflow that has not finished. It may be called with
+        ``--restart`` if the job store was left behind by a run that never started the workflow,
+        e.g. one that died while importing files.
 
         :param toil.job.Job rootJob: The root job of the workflow
         :return: The root job's return value
@@ -742,13 +833,18 @@ class Toil(object):
         self._assertContextManagerUsed()
         self.writePIDFile()
         if self.config.restart:
-            raise ToilRestartException('A Toil workflow can only be started once. Use '
-                                       'Toil.restart() to resume it.')
+            if self._isStarted():
+                raise ToilRestartException('A Toil workflow can only be started once. Use '
+                                           'Toil.restart() to resume it.')
+            # This is the first attempt at running the workflow after all
+            self.config.workflowAttemptNumber = 0
+            self._jobStore.writeConfig()
 
         self._batchSystem = self.createBatchSystem(self.config)
         self._setupAutoDeployment(rootJob.getUserScript())
         try:
             self._setBatchSystemEnvVars()
+            self._setWorkerZygoteEnvVar(rootJob.getUserScript())
             self._serialiseEnv()
             self._cacheAllJobs()
 
@@ -782,6 +878,9 @@ class Toil(object):
             raise ToilRestartException('A Toil workflow must be initiated with Toil.start(), '
                                        'not restart().')
 
+        if not self._isStarted():
+            raise ToilRestartException('The Toil workflow was never started. Use Toil.start() '
+                                       'to start it.')
         from toil.job import JobException
         try:
             self._jobStore.loadRootJob()
@@ -794,6 +893,7 @@ class Toil(object):
         self._setupAutoDeployment()
         try:
             self._setBatchSystemEnvVars()
+            self._setWorkerZygoteEnvVar()
             self._serialiseEnv()
             self._cacheAllJobs()
             self._setProvisioner()
@@ -802,6 +902,19 @@ class Toil(object):
         finally:
             self._shutdownBatchSystem()
 
+    def _isStarted(self):
+        """
+        Whether the workflow was ever started, i.e. whether its root job was set in the job store.
+
+        :rtype: bool
+        """
+        from toil.jobStores.abstractJobStore import NoSuchFileException
+        try:
+            with self._jobStore.readSharedFileStream(self._jobStore.rootJobStoreIDFileName):
+                return True
+        except NoSuchFileException:
+            return False
+
     def _setProvisioner(self):
         if self.config.provisioner is None:
             self._provisioner = None
@@ -962,6 +1075,26 @@ class Toil(object):
         self._assertContextManagerUsed()
         self._jobStore.exportFile(jobStoreFileID, dstUrl)
 
+    def importFiles(self, srcUrls, maxThreads=None, journalPath=None):
+        """
+        Imports the files at the given URLs into the job store, several at a time.
+
+        See :func:`toil.jobStores.abstractJobStore.AbstractJobStore.importFiles` for a
+        full description
+        """
+        self._assertContextManagerUsed()
+        return self._jobStore.importFiles(srcUrls, maxThreads=maxThreads, journalPath=journalPath)
+
+    def exportFiles(self, exports, maxThreads=None, journalPath=None):
+        """
+        Exports files to the destinations pointed at by the given URLs, several at a time.
+
+        See :func:`toil.jobStores.abstractJobStore.AbstractJobStore.exportFiles` for a
+        full description
+        """
+        self._assertContextManagerUsed()
+        self._jobStore.exportFiles(exports, maxThreads=maxThreads, journalPath=journalPath)
+
     def _setBatchSystemEnvVars(self):
         """
         Sets the environment variables required by the job store and those passed on command line.
@@ -970,13 +1103,50 @@ class Toil(object):
             for k, v in iteritems(envDict):
                 self._batchSystem.setEnv(k, v)
 
+    def _setWorkerZygoteEnvVar(self, userScript=None):
+        """
+        Passes the key of the worker zygote to the workers if --workerZygote was given and the
+        batch system supports it. The key depends on the contents of the user script, so that
+        workers of a restarted workflow don't use a zygote that imported an older version of it.
+
+        :param toil.resource.ModuleDescriptor userScript: the module descriptor referencing the
+               user script. If None, it will be looked up in the job store or, failing that,
+               derived from the main module.
+        """
+        if not self.config.workerZygote:
+            return
+        if not self._batchSystem.supportsWorkerZygote():
+            logger.warning('Ignoring --workerZygote since the batch system confines the '
+                           'processes of each job.')
+            return
+        from toil.resource import ModuleDescriptor
+        from toil.workerZygote import zygoteKey, zygoteKeyEnvVar
+        if userScript is None:
+            from toil.jobStores.abstractJobStore import NoSuchFileException
+            try:
+                with self._jobStore.readSharedFileStream('userScript') as f:
+                    userScript = safeUnpickleFromStream(f)
+            except NoSuchFileException:
+                try:
+                    userScript = ModuleDescriptor.forModule('__main__')
+                except Exception:
+                    logger.debug('Failed to determine the user script.', exc_info=True)
+        userScriptPath = None
+        if userScript is not None:
+            userScriptPath = os.path.join(userScript.dirPath, *userScript.name.split('.')) + '.py'
+        self._batchSystem.setEnv(zygoteKeyEnvVar, zygoteKey(self.config.jobStore, userScriptPath))
+
     def _serialiseEnv(self):
         """
         Puts the environment in a globally accessible pickle file.
         """
         # Dump out the environment of this process in the environment pickle file.
+        environment = pickle.dumps(dict(os.environ), pickle.HIGHEST_PROTOCOL)
         with self._jobStore.writeSharedFileStream("environment.pickle") as fileHandle:
-            pickle.dump(dict(os.environ), fileHandle, pickle.HIGHEST_PROTOCOL)
+            fileHandle.write(environment)
+        # Record the hash of the environment so workers can use a node-local copy of it
+        self.config.environmentHash = hashlib.md5(environment).hexdigest()
+        self._jobStore.writeConfig()
         logger.debug("Written the environment for the jobs to the environment file")
 
     def _cacheAllJobs(self):
@@ -1282,6 +1452,57 @@ def parseSetEnv(l):
     return d
 
 
+def parseNamedAmounts(l):
+    """
+    Parses a list of strings of the form "NAME=AMOUNT" into a dictionary mapping each name to a
+    positive integer, e.g. the maximum number of jobs with a given name or tag that may be
+    issued at once or the amount of a custom consumable resource that is available.
+
+    :type l: list[str]
+    :rtype: dict[str,int]
+
+    >>> parseNamedAmounts([])
+    {}
+    >>> parseNamedAmounts(['a=1', 'license:gatk=10'])
+    {'a': 1, 'license:gatk': 10}
+    >>> parseNamedAmounts(['a=b=2'])
+    {'a=b': 2}
+    >>> parseNamedAmounts(['a'])
+    Traceback (most recent call last):
+    ...
+    ValueError: Expected NAME=AMOUNT but got 'a'
+    >>> parseNamedAmounts(['a=0'])
+    Traceback (most recent call last):
+    ...
+    ValueError: The amount for 'a' must be a positive integer
+    """
+    d = dict()
+    for i in l:
+        try:
+            k, v = i.rsplit('=', 1)
+        except ValueError:
+            raise ValueError('Expected NAME=AMOUNT but got %r' % i)
+        if not k:
+            raise ValueError('Empty name')
+        if not v.isdigit() or int(v) < 1:
+            raise ValueError('The amount for %r must be a positive integer' % k)
+        d[k] = int(v)
+    return d
+
+
+def getJobQuotas(jobNode, jobQuotas):
+    """
+    Returns the configured job quotas that apply to the given job, i.e. those for its job name
+    and its tags. Works the same for the configured job rates.
+
+    :param dict[str,int] jobQuotas: The configured job quotas, see parseNamedAmounts.
+    :rtype: frozenset[str]
+    """
+    if not jobQuotas:
+        return frozenset()
+    return frozenset(key for key in (jobNode.jobName,) + tuple(jobNode.tags) if key in jobQuotas)
+
+
 def iC(minValue, maxValue=sys.maxsize):
     # Returns function that checks if a given int is in the given half-open interval
     assert isinstance(minValue, int) and isinstance(maxValue, int)
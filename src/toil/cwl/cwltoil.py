@@ -365,6 +365,35 @@ def uploadFile(uploadfunc, fileindex, existing, uf, skip_broken=False):
         uploadfunc, fileindex, existing, uf["location"])
 
 
+def uploadFiles(toil, fileindex, existing, obj, skip_broken=False):
+    """Update all file objects in obj like uploadFile does, importing the
+    files that aren't in the file store yet several at a time.
+
+    """
+    pending = set()
+
+    def collect(uf):
+        location = uf["location"]
+        if not location and uf["path"]:
+            location = schema_salad.ref_resolver.file_uri(uf["path"])
+        location = existing.get(location, location)
+        if location.startswith("toilfs:") or location.startswith("_:") \
+                or location in fileindex or not os.path.isfile(location[7:]):
+            return
+        pending.add(location)
+
+    adjustFileObjs(obj, collect)
+    pending = sorted(pending)
+    imported = dict(zip(pending, toil.importFiles(pending)))
+
+    def importFile(url):
+        # Files missed by collect() are imported one at a time
+        return imported[url] if url in imported else toil.importFile(url)
+
+    adjustFileObjs(obj, functools.partial(
+        uploadFile, importFile, fileindex, existing, skip_broken=skip_broken))
+
+
 def writeGlobalFileWrapper(file_store, fileuri):
     """Wrap writeGlobalFile to accepts file:// URIs"""
     return file_store.writeGlobalFile(
@@ -407,6 +436,8 @@ def toilStageFiles(file_store, cwljob, outdir, index, existing, export,
     jobfiles = list(_collectDirEntries(cwljob))
     pm = ToilPathMapper(
         jobfiles, "", outdir, separateDirs=False, stage_listing=True)
+    # Maps destination URLs to the IDs of the files to export there
+    exports = {}
     for f, p in pm.items():
         if not p.staged:
             continue
@@ -422,19 +453,20 @@ def toilStageFiles(file_store, cwljob, outdir, index, existing, export,
                 destUrl = '/'.join(s.strip('/')
                                    for s in [destBucket, unstageTargetPath])
 
-                file_store.exportFile(p.resolved[7:], destUrl)
+                exports[destUrl] = p.resolved[7:]
 
             continue
 
         if not os.path.exists(os.path.dirname(p.target)):
             os.makedirs(os.path.dirname(p.target), 0o0755)
         if p.type == "File":
-            file_store.exportFile(p.resolved[7:], "file://" + p.target)
+            exports["file://" + p.target] = p.resolved[7:]
         elif p.type == "Directory" and not os.path.exists(p.target):
             os.makedirs(p.target, 0o0755)
         elif p.type == "CreateFile":
             with open(p.target, "wb") as n:
                 n.write(p.resolved.encode("utf-8"))
+    file_store.exportFiles(exports)
 
     def _check_adjust(f):
         f["location"] = schema_salad.ref_resolver.file_uri(
@@ -1224,9 +1256,7 @@ def main(args=None, stdout=sys.stdout):
                 normalizeFilesDirs(tool)
                 adjustDirObjs(tool, functools.partial(
                     get_listing, fs_access, recursive=True))
-                adjustFileObjs(tool, functools.partial(
-                    uploadFile, toil.importFile, fileindex, existing,
-                    skip_broken=True))
+                uploadFiles(toil, fileindex, existing, tool, skip_broken=True)
 
             tool.visit(import_files)
 
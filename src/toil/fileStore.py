@@ -32,6 +32,7 @@ import base64
 import dill
 import errno
 import logging
+import mmap
 import os
 import shutil
 import stat
@@ -110,6 +111,8 @@ class FileStore(with_metaclass(ABCMeta, object)):
         self.loggingMessages = []
         self.filesToDelete = set()
         self.jobsToDelete = set()
+        # Maps job store file IDs to the read-only mappings handed out by readGlobalFileMapped
+        self._mappedFiles = defaultdict(list)
 
     @staticmethod
     def createFileStore(jobStore, jobGraph, localTempDir, inputBlockFn, caching):
@@ -233,6 +236,59 @@ class FileStore(with_metaclass(ABCMeta, object)):
         """
         raise NotImplementedError()
 
+    def readGlobalFileMapped(self, fileStoreID):
+        """
+        Makes the file associated with fileStoreID available locally as an immutable, cached
+        file and returns a read-only memory map over it. Concurrent jobs on the same node that
+        map the same file share the pages of the single cached copy instead of each holding a
+        private copy in memory.
+
+        The mapping is backed by a hard link to the cached copy in the job's local temp
+        directory, so the cache treats it as being in use and will not evict it while it is
+        mapped. The mapping is closed when the local copy of the file is deleted via
+        :meth:`deleteLocalFile` or when the job finishes, whichever happens first. Callers must
+        therefore release any memoryviews they derive from it before then, or the deletion or
+        the job fails. Slicing the mapping copies the data and is always safe.
+
+        :param toil.fileStore.FileID fileStoreID: job store id for the file
+        :return: A read-only mapping of the file's contents. An empty memoryview is returned for
+                 empty files since those can't be mapped.
+        :rtype: mmap.mmap|memoryview
+        """
+        localFilePath = self.readGlobalFile(fileStoreID, cache=True, mutable=False)
+        with open(localFilePath, 'rb') as fileHandle:
+            if os.fstat(fileHandle.fileno()).st_size == 0:
+                return memoryview(b'')
+            # The mapping holds its own reference to the file, so closing the handle is safe
+            mapping = mmap.mmap(fileHandle.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mappedFiles[fileStoreID].append(mapping)
+        return mapping
+
+    def _closeMappedFiles(self, fileStoreID=None):
+        """
+        Close the mappings created by readGlobalFileMapped for the given file, or for all files
+        if no file is given.
+
+        :param str fileStoreID: job store id for the file, or None for all mapped files
+
+        :raise RuntimeError: if a mapping can't be closed because memoryviews of it still exist.
+               All other mappings are closed regardless.
+        """
+        fileStoreIDs = list(self._mappedFiles.keys()) if fileStoreID is None else [fileStoreID]
+        inUse = set()
+        for mappedFileID in fileStoreIDs:
+            for mapping in self._mappedFiles.pop(mappedFileID, []):
+                try:
+                    mapping.close()
+                except BufferError:
+                    # Keep it around to be closed once it's no longer in use
+                    self._mappedFiles[mappedFileID].append(mapping)
+                    inUse.add(mappedFileID)
+        if inUse:
+            raise RuntimeError('The mapped files %s are still in use. Release all memoryviews of '
+                               'them before deleting them or returning from the job.'
+                               % ', '.join(sorted(inUse)))
+
     @abstractmethod
     def readGlobalFileStream(self, fileStoreID):
         """
@@ -526,6 +582,14 @@ class CachingFileStore(FileStore):
                                  level=logging.WARNING)
             os.chdir(startingDir)
             self.cleanupInProgress = True
+            # Drop any mappings of cached files so that they no longer pin the cache, but only
+            # complain about the ones still in use once the job has been cleaned up
+            try:
+                self._closeMappedFiles()
+            except RuntimeError as e:
+                mappingError = e
+            else:
+                mappingError = None
             # Delete all the job specific files and return sizes to jobReqs
             self.returnJobReqs(jobReqs)
             with self._CacheState.open(self) as cacheInfo:
@@ -536,6 +600,8 @@ class CachingFileStore(FileStore):
                     self.logToMaster('Deferred function "%s" failed.' % failure, logging.WARN)
                 # Finally delete the job from the cache state file
                 cacheInfo.jobState.pop(self.jobID)
+            if mappingError is not None:
+                raise mappingError
 
     # Functions related to reading, writing and removing files to/from the job store
     def writeGlobalFile(self, localFileName, cleanup=False):
@@ -762,6 +828,7 @@ class CachingFileStore(FileStore):
         # if a file was cached or not based on the value held in the third tuple value for the
         # dict item having key = fileStoreID. If it was cached, it holds the value True else
         # False.
+        self._closeMappedFiles(fileStoreID)
         with self._CacheState.open(self) as cacheInfo:
             jobState = self._JobState(cacheInfo.jobState[self.jobID])
             if fileStoreID not in list(jobState.jobSpecificFiles.keys()):
@@ -927,8 +994,12 @@ class CachingFileStore(FileStore):
         # The nlink threshold is setup along with the first instance of the cache class on the
         # node.
         self.setNlinkThreshold()
-        # Get the free space on the device
+        # Get the free space on the device, less the space set aside for the workers' copies of
+        # pickled jobs
         freeSpace, _ = getFileSystemSize(tempCacheDir)
+        if self.jobStore.config.cacheJobBodies:
+            from toil.job import Job
+            freeSpace -= Job.maxJobBodyCacheSize
         # Create the cache lock file.
         open(os.path.join(tempCacheDir, os.path.basename(self.cacheLockFile)), 'w').close()
         # Setup the cache state file
@@ -1647,6 +1718,12 @@ class NonCachingFileStore(FileStore):
                                  "script to avoid the chance of failure due to incorrectly "
                                  "requested resources. " + logString, level=logging.WARNING)
             os.chdir(startingDir)
+            try:
+                self._closeMappedFiles()
+            except RuntimeError as e:
+                mappingError = e
+            else:
+                mappingError = None
             jobState = self._readJobState(self.jobStateFile)
             deferredFunctions = jobState['deferredFunctions']
             failures = self._runDeferredFunctions(deferredFunctions)
@@ -1654,6 +1731,8 @@ class NonCachingFileStore(FileStore):
                 self.logToMaster('Deferred function "%s" failed.' % failure, logging.WARN)
             # Finally delete the job from the worker
             os.remove(self.jobStateFile)
+            if mappingError is not None:
+                raise mappingError
 
     def writeGlobalFile(self, localFileName, cleanup=False):
         absLocalFileName = self._resolveAbsoluteLocalPath(localFileName)
@@ -1683,6 +1762,7 @@ class NonCachingFileStore(FileStore):
         self.jobStore.exportFile(jobStoreFileID, dstUrl)
 
     def deleteLocalFile(self, fileStoreID):
+        self._closeMappedFiles(fileStoreID)
         try:
             localFilePaths = self.localFileMap.pop(fileStoreID)
         except KeyError:
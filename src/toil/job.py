@@ -22,10 +22,14 @@ from builtins import str
 from builtins import object
 from builtins import super
 import collections
+import errno
 import importlib
 import inspect
 import logging
 import os
+import re
+import shutil
+import threading
 import time
 import dill
 import tempfile
@@ -38,6 +42,7 @@ except ImportError:
 from abc import ABCMeta, abstractmethod
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 from contextlib import contextmanager
+from hashlib import sha1
 from io import BytesIO
 
 # Python 3 compatibility imports
@@ -45,6 +50,7 @@ from six import iteritems, string_types
 
 from toil.lib.expando import Expando
 from toil.lib.humanize import human2bytes
+from toil.lib.threading import concurrently
 
 from toil.common import Toil, addOptions, safeUnpickleFromStream
 from toil.fileStore import DeferredFunction
@@ -69,6 +75,9 @@ class BaseJob(object):
         memory = requirements.get('memory')
         disk = requirements.get('disk')
         preemptable = requirements.get('preemptable')
+        priority = requirements.get('priority')
+        tags = requirements.get('tags')
+        consumables = requirements.get('consumables')
         if unitName:
             assert isinstance(unitName, (str, bytes))
         if jobName:
@@ -80,8 +89,25 @@ class BaseJob(object):
         self._memory = self._parseResource('memory', memory)
         self._disk = self._parseResource('disk', disk)
         self._preemptable = preemptable
+        if priority is not None and not isinstance(priority, int):
+            raise TypeError("The 'priority' requirement does not accept values that are of %s"
+                            % type(priority))
+        self._priority = priority
+        if tags is not None and (isinstance(tags, string_types) or
+                                 not all(isinstance(tag, string_types) for tag in tags)):
+            raise TypeError("The 'tags' requirement must be a list of strings")
+        self.tags = tuple(tags) if tags else ()
+        self._consumables = self._parseConsumables(consumables)
         self._config = None
 
+    # The values of the attributes that instances pickled by Toil versions before job priorities,
+    # tags and consumables lack
+    _addedAttributeDefaults = dict(_priority=None, tags=(), _consumables=())
+
+    def __setstate__(self, state):
+        self.__dict__.update(self._addedAttributeDefaults)
+        self.__dict__.update(state)
+
     @property
     def disk(self):
         """
@@ -130,6 +156,23 @@ class BaseJob(object):
         else:
             raise AttributeError("Default value for 'preemptable' cannot be determined")
 
+    @property
+    def priority(self):
+        """
+        The priority of the job relative to other jobs that are ready to run. Jobs with a higher
+        priority are issued, and run by batch systems that support it, before jobs with a lower
+        one. Defaults to 0.
+        """
+        return 0 if self._priority is None else self._priority
+
+    @property
+    def consumables(self):
+        """
+        A dictionary mapping the names of the custom consumable resources the job requires, e.g.
+        license seats, to the amount of each.
+        """
+        return dict(self._consumables)
+
     @property
     def _requirements(self):
         """
@@ -138,7 +181,10 @@ class BaseJob(object):
         return {'memory': getattr(self, 'memory', None),
                 'cores': getattr(self, 'cores', None),
                 'disk': getattr(self, 'disk', None),
-                'preemptable': getattr(self, 'preemptable', None)}
+                'preemptable': getattr(self, 'preemptable', None),
+                'priority': self._priority,
+                'tags': self.tags,
+                'consumables': self.consumables}
 
     @staticmethod
     def _parseResource(name, value):
@@ -182,6 +228,35 @@ class BaseJob(object):
             raise TypeError("The '%s' requirement does not accept values that are of %s"
                             % (name, type(value)))
 
+    @staticmethod
+    def _parseConsumables(consumables):
+        """
+        Check a Toil job's custom consumable resource requirements and convert them into the
+        immutable form they are stored in, a tuple of name and amount pairs ordered by name.
+        Consumables required in an amount of zero are dropped.
+
+        :param dict[str,int]|None consumables: Maps the consumable resources to the amounts
+        :rtype: tuple
+
+        >>> Job._parseConsumables(None)
+        ()
+        >>> Job._parseConsumables({'ssd': 1, 'license': 2, 'gpu': 0})
+        (('license', 2), ('ssd', 1))
+        >>> Job._parseConsumables({'ssd': 1.5}) # doctest: +IGNORE_EXCEPTION_DETAIL
+        Traceback (most recent call last):
+        ...
+        TypeError: The amount of consumable 'ssd' must be a non-negative integer
+        """
+        if not consumables:
+            return ()
+        for name, amount in iteritems(consumables):
+            if not isinstance(name, string_types):
+                raise TypeError('The names of consumables must be strings, not %s' % type(name))
+            if not isinstance(amount, int) or isinstance(amount, bool) or amount < 0:
+                raise TypeError("The amount of consumable '%s' must be a non-negative integer"
+                                % name)
+        return tuple(sorted((name, amount) for name, amount in iteritems(consumables) if amount))
+
     def __str__(self):
         printedName = "'" + self.jobName + "'"
         if self.unitName:
@@ -196,11 +271,17 @@ class JobNode(BaseJob):
     This object bridges the job graph, job, and batchsystem classes
     """
     def __init__(self, requirements, jobName, unitName, jobStoreID,
-                 command, displayName=None, predecessorNumber=1):
+                 command, displayName=None, predecessorNumber=1, criticalPath=1):
         super().__init__(requirements=requirements, displayName=displayName, unitName=unitName, jobName=jobName)
         self.jobStoreID = jobStoreID
         self.predecessorNumber = predecessorNumber
         self.command = command
+        # The number of jobs on the longest chain of successors starting with this job, as far as
+        # it was known when the job was added to the workflow. Used by the leader to break ties
+        # between jobs of equal priority in favour of those with more work left downstream.
+        self.criticalPath = criticalPath
+
+    _addedAttributeDefaults = dict(BaseJob._addedAttributeDefaults, criticalPath=1)
 
     def __str__(self):
         return super().__str__() + ' ' + self.jobStoreID
@@ -235,7 +316,8 @@ class JobNode(BaseJob):
                    jobName=jobGraph.jobName,
                    unitName=jobGraph.unitName,
                    displayName=jobGraph.displayName,
-                   predecessorNumber=jobGraph.predecessorNumber)
+                   predecessorNumber=jobGraph.predecessorNumber,
+                   criticalPath=jobGraph.criticalPath)
 
     @classmethod
     def fromJob(cls, job, command, predecessorNumber):
@@ -261,7 +343,8 @@ class Job(BaseJob):
     Class represents a unit of work in toil.
     """
     def __init__(self, memory=None, cores=None, disk=None, preemptable=None,
-                       unitName=None, checkpoint=False, displayName=None):
+                       unitName=None, checkpoint=False, displayName=None, priority=None,
+                       tags=None, consumables=None):
         """
         This method must be called by any overriding constructor.
 
@@ -269,6 +352,13 @@ class Job(BaseJob):
         :param cores: the number of CPU cores required.
         :param disk: the amount of local disk space required by the job, expressed in bytes.
         :param preemptable: if the job can be run on a preemptable node.
+        :param priority: jobs with a higher priority are issued before ready jobs with a lower \
+            one, see :attr:`toil.job.BaseJob.priority`.
+        :param tags: user-defined names, e.g. ``license:gatk``, which the leader limits the \
+            number of concurrently issued jobs by, just like job names. See the ``--jobQuota`` \
+            option.
+        :param consumables: the amount of each custom consumable resource, e.g. local SSD slots \
+            or license seats, that the job requires. See the ``--consumable`` option.
         :param checkpoint: if any of this job's successor jobs completely fails,
             exhausting all their retries, remove any successor jobs and rerun this job to restart the
             subtree. Job must be a leaf vertex in the job graph when initially defined, see
@@ -276,11 +366,15 @@ class Job(BaseJob):
         :type cores: int or string convertable by toil.lib.humanize.human2bytes to an int
         :type disk: int or string convertable by toil.lib.humanize.human2bytes to an int
         :type preemptable: bool
+        :type priority: int
+        :type tags: list[str]
+        :type consumables: dict[str,int]
         :type cache: int or string convertable by toil.lib.humanize.human2bytes to an int
         :type memory: int or string convertable by toil.lib.humanize.human2bytes to an int
         """
         requirements = {'memory': memory, 'cores': cores, 'disk': disk,
-                        'preemptable': preemptable}
+                        'preemptable': preemptable, 'priority': priority, 'tags': tags,
+                        'consumables': consumables}
         super().__init__(requirements=requirements, unitName=unitName, displayName=displayName)
         self.checkpoint = checkpoint
         self.displayName = displayName if displayName is not None else self.__class__.__name__
@@ -885,8 +979,18 @@ class Job(BaseJob):
         """
         return userModule.load()
 
+    # Matches references to a pickled job in a bundle of pickles, i.e. <fileStoreID>@<offset>:<length>
+    _bundleSliceRegex = re.compile(r'^(.+)@(\d+):(\d+)$')
+
+    #: Pickled jobs up to this size are read into memory, larger ones are spooled to disk
+    maxInMemoryPickleSize = 1024 * 1024
+
+    #: The most space the copies of pickled jobs in a node-local cache directory take up, see
+    #: _loadJob. The least recently used copies are evicted beyond it.
+    maxJobBodyCacheSize = 64 * 1024 * 1024
+
     @classmethod
-    def _loadJob(cls, command, jobStore):
+    def _loadJob(cls, command, jobStore, cacheDir=None):
         """
         Unpickles a :class:`toil.job.Job` instance by decoding command.
 
@@ -899,6 +1003,10 @@ class Job(BaseJob):
 
         :param string command: encoding of the job in the job store.
         :param toil.jobStores.abstractJobStore.AbstractJobStore jobStore: The job store.
+        :param str cacheDir: A node-local directory in which to keep a copy of the pickled job. \
+               Pickled jobs are never modified, so a copy found there is used instead of \
+               reading the pickle from the job store again. The copies in the directory are \
+               limited to maxJobBodyCacheSize in total.
         :returns: The job referenced by the command.
         :rtype: toil.job.Job
         """
@@ -908,14 +1016,93 @@ class Job(BaseJob):
         logger.debug('Loading user module %s.', userModule)
         userModule = cls._loadUserModule(userModule)
         pickleFile = commandTokens[1]
-        with tempfile.NamedTemporaryFile() as f:
-            filename = f.name
-            if pickleFile == "firstJob":
-                jobStore.readSharedFile(pickleFile, filename)
+        # Resolve the promises held by the job with this job store
+        Promise._useJobStore(jobStore)
+        if pickleFile == "firstJob":
+            # The only pickle in a shared file, which may be rewritten, so it isn't cached
+            cacheDir = None
+        cachePath = None
+        if cacheDir is not None:
+            cachePath = os.path.join(cacheDir, sha1(pickleFile.encode('utf-8')).hexdigest())
+            try:
+                with open(cachePath, 'rb') as fileHandle:
+                    # Mark the copy as recently used, see _evictPickledJobs
+                    os.utime(cachePath, None)
+                    return cls._unpickle(userModule, fileHandle, jobStore.config)
+            except (IOError, OSError) as e:
+                # The copy may not exist yet or have been evicted in the meantime
+                if e.errno != errno.ENOENT:
+                    raise
+        with tempfile.SpooledTemporaryFile(max_size=cls.maxInMemoryPickleSize) as spool:
+            bundleSlice = cls._bundleSliceRegex.match(pickleFile)
+            if bundleSlice is not None:
+                # The pickle is part of a bundle, see _uploadPickledJobs
+                fileStoreID, offset, length = bundleSlice.groups()
+                spool.write(jobStore.readFileRange(fileStoreID, int(offset), int(length)))
+            else:
+                if pickleFile == "firstJob":
+                    readFileStream = jobStore.readSharedFileStream
+                else:
+                    readFileStream = jobStore.readFileStream
+                with readFileStream(pickleFile) as readable:
+                    shutil.copyfileobj(readable, spool)
+            if cachePath is not None and spool.tell() <= cls.maxJobBodyCacheSize:
+                spool.seek(0)
+                cls._cachePickledJob(spool, cachePath)
+            spool.seek(0)
+            return cls._unpickle(userModule, spool, jobStore.config)
+
+    @classmethod
+    def _cachePickledJob(cls, readable, cachePath):
+        """
+        Atomically publishes a copy of a pickled job at the given path, then evicts copies of
+        other pickled jobs as needed to stay within maxJobBodyCacheSize.
+        """
+        cacheDir = os.path.dirname(cachePath)
+        try:
+            os.makedirs(cacheDir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        fd, tempPath = tempfile.mkstemp(dir=cacheDir, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as fileHandle:
+                shutil.copyfileobj(readable, fileHandle)
+            os.rename(tempPath, cachePath)
+        except:
+            os.unlink(tempPath)
+            raise
+        cls._evictPickledJobs(cacheDir)
+
+    @classmethod
+    def _evictPickledJobs(cls, cacheDir):
+        """
+        Deletes the least recently used copies of pickled jobs in the given cache directory until
+        the remaining ones take up no more than maxJobBodyCacheSize. Copies that other workers
+        are reading remain readable to them.
+        """
+        copies = []
+        for name in os.listdir(cacheDir):
+            if name.startswith('.tmp-'):
+                continue
+            try:
+                stats = os.stat(os.path.join(cacheDir, name))
+            except OSError as e:
+                # Evicted by another worker
+                if e.errno != errno.ENOENT:
+                    raise
             else:
-                jobStore.readFile(pickleFile, filename)
-            with open(filename, 'rb') as fileHandle:
-                return cls._unpickle(userModule, fileHandle, jobStore.config)
+                copies.append((stats.st_mtime, stats.st_size, name))
+        cacheSize = sum(size for _, size, _ in copies)
+        for _, size, name in sorted(copies):
+            if cacheSize <= cls.maxJobBodyCacheSize:
+                break
+            try:
+                os.unlink(os.path.join(cacheDir, name))
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            cacheSize -= size
 
     @classmethod
     def _unpickle(cls, userModule, fileHandle, config):
@@ -941,22 +1128,30 @@ class Job(BaseJob):
                     logger.debug('Failed getting %s from module %s.', class_name, module_name)
                 raise
 
-        try:
-            unpickler = pickle.Unpickler(fileHandle)
-            # In Python 2 with cPickle we set "find_global"
-            unpickler.find_global = filter_main
-        except AttributeError:
-            # In Python 3 find_global isn't real and we are supposed to
-            # subclass unpickler and override find_class. We can't just replace
-            # it. But with cPickle in Pyhton 2 we can't subclass Unpickler.
-            
-            class FilteredUnpickler(pickle.Unpickler):
-                def find_class(self, module, name):
-                    return filter_main(module, name)
-                    
-            unpickler = FilteredUnpickler(fileHandle)
-            
-        runnable = unpickler.load()
+        def newUnpickler():
+            try:
+                unpickler = pickle.Unpickler(fileHandle)
+                # In Python 2 with cPickle we set "find_global"
+                unpickler.find_global = filter_main
+            except AttributeError:
+                # In Python 3 find_global isn't real and we are supposed to
+                # subclass unpickler and override find_class. We can't just replace
+                # it. But with cPickle in Pyhton 2 we can't subclass Unpickler.
+
+                class FilteredUnpickler(pickle.Unpickler):
+                    def find_class(self, module, name):
+                        return filter_main(module, name)
+
+                unpickler = FilteredUnpickler(fileHandle)
+            return unpickler
+
+        runnable = newUnpickler().load()
+        if isinstance(runnable, list):
+            # The pickled job is preceded by the IDs of the promise files it references, see
+            # _serialiseJob, so that they can be read all at once before they are resolved. The
+            # job is a separate pickle and needs an unpickler with a memo of its own.
+            with Promise._prefetching(runnable):
+                runnable = newUnpickler().load()
         assert isinstance(runnable, BaseJob)
         runnable._config = config
         return runnable
@@ -968,6 +1163,8 @@ class Job(BaseJob):
         """
         Sets the values for promises using the return values from this job's run() function.
         """
+        from toil.jobStores.abstractJobStore import NoSuchFileException
+        promiseFiles = []
         for path, promiseFileStoreIDs in iteritems(self._rvs):
             if not path:
                 # Note that its possible for returnValues to be a promise, not an actual return
@@ -985,12 +1182,33 @@ class Job(BaseJob):
                     promisedValue = returnValues
                     for index in path:
                         promisedValue = promisedValue[index]
+            pickledValue = None
             for promiseFileStoreID in promiseFileStoreIDs:
-                # File may be gone if the job is a service being re-run and the accessing job is
-                # already complete.
-                if jobStore.fileExists(promiseFileStoreID):
+                if pickledValue is None:
+                    with Promise._registering() as registered:
+                        pickledValue = pickle.dumps(promisedValue, pickle.HIGHEST_PROTOCOL)
+                promiseFiles.append((promiseFileStoreID, pickledValue))
+                Promise._cacheFulfilled(jobStore, promiseFileStoreID, pickledValue)
+                if registered:
+                    # The value references promises, which have to be registered separately for
+                    # every file it is written to. Otherwise the same pickle is written to all.
+                    pickledValue = None
+
+        def write(promiseFile):
+            promiseFileStoreID, pickledValue = promiseFile
+            # File may be gone if the job is a service being re-run and the accessing job is
+            # already complete. Not every job store raises NoSuchFileException when a missing
+            # file is updated, some recreate it instead.
+            if jobStore.fileExists(promiseFileStoreID):
+                try:
                     with jobStore.updateFileStream(promiseFileStoreID) as fileHandle:
-                        pickle.dump(promisedValue, fileHandle, pickle.HIGHEST_PROTOCOL)
+                        fileHandle.write(pickledValue)
+                    return
+                except NoSuchFileException:
+                    # Deleted after we checked
+                    pass
+            Promise._uncacheFulfilled(jobStore, promiseFileStoreID)
+        concurrently(write, promiseFiles, Promise.maxConcurrentTransfers)
 
     # Functions associated with Job.checkJobGraphAcyclic to establish that the job graph does not
     # contain any cycles of dependencies:
@@ -1066,6 +1284,7 @@ class Job(BaseJob):
         for successors in (self._followOns, self._children):
             jobs = [successor._makeJobGraphs2(jobStore, jobsToJobGraphs) for successor in successors]
             jobGraph.stack.append(jobs)
+        self._updateCriticalPath(jobGraph)
         return jobsToJobGraphs
 
     def _makeJobGraphs2(self, jobStore, jobsToJobGraphs):
@@ -1077,6 +1296,7 @@ class Job(BaseJob):
             for successors in (self._followOns, self._children):
                 jobs = [successor._makeJobGraphs2(jobStore, jobsToJobGraphs) for successor in successors]
                 jobGraph.stack.append(jobs)
+            self._updateCriticalPath(jobGraph)
         else:
             jobGraph = jobsToJobGraphs[self]
         #The return is a tuple stored within a job.stack
@@ -1086,6 +1306,15 @@ class Job(BaseJob):
         #per predecessor
         return JobNode.fromJobGraph(jobGraph)
 
+    @staticmethod
+    def _updateCriticalPath(jobGraph):
+        """
+        Sets the critical path of a job graph whose successors have been made, and therefore
+        already know their own critical path.
+        """
+        jobGraph.criticalPath = 1 + max([jobNode.criticalPath
+                                         for jobs in jobGraph.stack for jobNode in jobs] or [0])
+
     def getTopologicalOrderingOfJobs(self):
         """
         :returns: a list of jobs such that for all pairs of indices i, j for which i < j, \
@@ -1107,9 +1336,10 @@ class Job(BaseJob):
         getRunOrder(self)
         return ordering
 
-    def _serialiseJob(self, jobStore, jobsToJobGraphs, rootJobGraph):
+    def _serialiseJob(self, jobStore, jobsToJobGraphs, rootJobGraph, pickledJobs):
         """
-        Pickle a job and its jobGraph to disk.
+        Pickle a job. The pickle is not written to the job store here but appended to \
+        pickledJobs, see :func:`toil.job.Job._uploadPickledJobs`.
         """
         # Pickle the job so that its run method can be run at a later time.
         # Drop out the children/followOns/predecessors/services - which are
@@ -1119,9 +1349,13 @@ class Job(BaseJob):
         self._directPredecessors, self._promiseJobStore = set(), None
         # The pickled job is "run" as the command of the job, see worker
         # for the mechanism which unpickles the job and executes the Job.run
-        # method.
-        with jobStore.writeFileStream(rootJobGraph.jobStoreID) as (fileHandle, fileStoreID):
-            pickle.dump(self, fileHandle, pickle.HIGHEST_PROTOCOL)
+        # method. Pickling registers promises with the job store so it must
+        # happen in order, uploading the pickle can be deferred.
+        with Promise._registering() as promiseFileIDs:
+            pickledJob = pickle.dumps(self, pickle.HIGHEST_PROTOCOL)
+        if promiseFileIDs:
+            # Prepend the IDs of the promise files the job references, see _unpickle
+            pickledJob = pickle.dumps(promiseFileIDs, pickle.HIGHEST_PROTOCOL) + pickledJob
         # Note that getUserScript() may have been overridden. This is intended. If we used
         # self.userModule directly, we'd be getting a reference to job.py if the job was
         # specified as a function (as opposed to a class) since that is where FunctionWrappingJob
@@ -1129,13 +1363,71 @@ class Job(BaseJob):
         # and FunctionWrappingJob overrides getUserScript() to give us just that. Only then can
         # filter_main() in _unpickle( ) do its job of resolving any user-defined type or function.
         userScript = self.getUserScript().globalize()
-        jobsToJobGraphs[self].command = ' '.join(('_toil', fileStoreID) + userScript.toCommand())
-        #Update the status of the jobGraph on disk
-        jobStore.update(jobsToJobGraphs[self])
+        pickledJobs.append((jobsToJobGraphs[self], pickledJob, userScript))
+
+    #: The maximum number of threads used to upload pickled jobs, see _uploadPickledJobs
+    maxConcurrentPickleUploads = 16
 
-    def _serialiseServices(self, jobStore, jobGraph, rootJobGraph):
+    #: Pickled jobs no larger than this are packed into bundles, see _uploadPickledJobs
+    maxBundledPickleSize = 64 * 1024
+
+    #: The size at which a bundle of pickled jobs is closed and a new one started
+    maxPickleBundleSize = 16 * 1024 * 1024
+
+    @classmethod
+    def _uploadPickledJobs(cls, jobStore, pickledJobs, rootJobGraph):
         """
-        Serialises the services for a job.
+        Writes the pickled jobs collected by :func:`toil.job.Job._serialiseJob` to the job \
+        store concurrently, sets the command of each job graph to reference its pickle and \
+        updates the job graphs. Within :meth:`AbstractJobStore.batch` the updates are deferred \
+        until the batch is released.
+
+        Small pickles are packed into bundle files instead of each being written to a file of \
+        its own. The command of a job whose pickle is bundled references the slice of the \
+        bundle holding the pickle, see :func:`toil.job.Job._loadJob`, so the commands form \
+        the index of the bundle. Like all other pickles, bundles are owned by rootJobGraph. \
+        Every job referencing a bundle is a successor of rootJobGraph and rootJobGraph is only \
+        deleted once all of its successors are, so a bundle can't be deleted while it is in use.
+
+        :param toil.jobStores.abstractJobStore.AbstractJobStore jobStore: The job store.
+        :param list pickledJobs: tuples of (jobGraph, pickled job, user script descriptor)
+        :param toil.jobGraph.JobGraph rootJobGraph: The job graph the pickles are owned by.
+        """
+        # Group the pickles into files, each one a list of pickled jobs
+        files, bundle, bundleSize = [], [], 0
+        for pickledJob in pickledJobs:
+            size = len(pickledJob[1])
+            if size > cls.maxBundledPickleSize:
+                files.append([pickledJob])
+            else:
+                if bundleSize + size > cls.maxPickleBundleSize:
+                    files.append(bundle)
+                    bundle, bundleSize = [], 0
+                bundle.append(pickledJob)
+                bundleSize += size
+        if bundle:
+            files.append(bundle)
+
+        def upload(pickledJobsInFile):
+            with jobStore.writeFileStream(rootJobGraph.jobStoreID) as (fileHandle, fileStoreID):
+                offset = 0
+                for jobGraph, pickledJob, userScript in pickledJobsInFile:
+                    fileHandle.write(pickledJob)
+                    if len(pickledJobsInFile) == 1:
+                        pickleFile = fileStoreID
+                    else:
+                        pickleFile = '%s@%i:%i' % (fileStoreID, offset, len(pickledJob))
+                    offset += len(pickledJob)
+                    jobGraph.command = ' '.join(('_toil', pickleFile) + userScript.toCommand())
+
+        concurrently(upload, files, cls.maxConcurrentPickleUploads)
+        # Update the status of the jobGraphs on disk
+        for jobGraph, _, _ in pickledJobs:
+            jobStore.update(jobGraph)
+
+    def _serialiseServices(self, jobStore, jobGraph, rootJobGraph, pickledJobs):
+        """
+        Serialises the services for a job, see :func:`toil.job.Job._serialiseJob`.
         """
         def processService(serviceJob, depth):
             # Extend the depth of the services if necessary
@@ -1182,7 +1474,8 @@ class Job(BaseJob):
             serviceJob.service = None
 
             # Serialise the service job and job wrapper
-            serviceJob._serialiseJob(jobStore, { serviceJob:serviceJobGraph }, rootJobGraph)
+            serviceJob._serialiseJob(jobStore, { serviceJob:serviceJobGraph }, rootJobGraph,
+                                     pickledJobs)
 
             # Restore values
             #serviceJob.service = service
@@ -1203,15 +1496,15 @@ class Job(BaseJob):
         #any cycles of dependencies or has multiple roots
         self.checkJobGraphForDeadlocks()
 
-        #Create the jobGraphs for followOns/children
+        # All job graphs are written once, with their final command, when the batch is released
         with jobStore.batch():
+            #Create the jobGraphs for followOns/children
             jobsToJobGraphs = self._makeJobGraphs(jobGraph, jobStore)
-        #Get an ordering on the jobs which we use for pickling the jobs in the
-        #correct order to ensure the promises are properly established
-        ordering = self.getTopologicalOrderingOfJobs()
-        assert len(ordering) == len(jobsToJobGraphs)
+            #Get an ordering on the jobs which we use for pickling the jobs in the
+            #correct order to ensure the promises are properly established
+            ordering = self.getTopologicalOrderingOfJobs()
+            assert len(ordering) == len(jobsToJobGraphs)
 
-        with jobStore.batch():
             # Temporarily set the jobStore locators for the promise call back functions
             for job in ordering:
                 job.prepareForPromiseRegistration(jobStore)
@@ -1224,13 +1517,14 @@ class Job(BaseJob):
 
             ordering.reverse()
             assert self == ordering[-1]
+            pickledJobs = []
             if firstJob:
                 #If the first job we serialise all the jobs, including the root job
                 for job in ordering:
                     # Pickle the services for the job
-                    job._serialiseServices(jobStore, jobsToJobGraphs[job], jobGraph)
+                    job._serialiseServices(jobStore, jobsToJobGraphs[job], jobGraph, pickledJobs)
                     # Now pickle the job
-                    job._serialiseJob(jobStore, jobsToJobGraphs, jobGraph)
+                    job._serialiseJob(jobStore, jobsToJobGraphs, jobGraph, pickledJobs)
             else:
                 #We store the return values at this point, because if a return value
                 #is a promise from another job, we need to register the promise
@@ -1239,11 +1533,13 @@ class Job(BaseJob):
                 #Pickle the non-root jobs
                 for job in ordering[:-1]:
                     # Pickle the services for the job
-                    job._serialiseServices(jobStore, jobsToJobGraphs[job], jobGraph)
+                    job._serialiseServices(jobStore, jobsToJobGraphs[job], jobGraph, pickledJobs)
                     # Pickle the job itself
-                    job._serialiseJob(jobStore, jobsToJobGraphs, jobGraph)
+                    job._serialiseJob(jobStore, jobsToJobGraphs, jobGraph, pickledJobs)
                 # Pickle any services for the job
-                self._serialiseServices(jobStore, jobGraph, jobGraph)
+                self._serialiseServices(jobStore, jobGraph, jobGraph, pickledJobs)
+            # Write the pickles and, in the same batch, the job graphs referencing them
+            self._uploadPickledJobs(jobStore, pickledJobs, jobGraph)
 
     def _serialiseFirstJob(self, jobStore):
         """
@@ -1328,10 +1624,15 @@ class Job(BaseJob):
             totalCpuTime, totalMemoryUsage = getTotalCpuTimeAndMemoryUsage()
             stats.jobs.append(
                 Expando(
+                    start=str(startTime),
                     time=str(time.time() - startTime),
                     clock=str(totalCpuTime - startClock),
                     class_name=self._jobName(),
-                    memory=str(totalMemoryUsage)
+                    memory=str(totalMemoryUsage),
+                    requestedCores=str(jobGraph.cores),
+                    requestedMemory=str(jobGraph.memory),
+                    requestedDisk=str(jobGraph.disk),
+                    preemptable=str(jobGraph.preemptable)
                 )
             )
 
@@ -1385,11 +1686,12 @@ class FunctionWrappingJob(Job):
         :param callable userFunction: The function to wrap. It will be called with ``*args`` and
                ``**kwargs`` as arguments.
 
-        The keywords ``memory``, ``cores``, ``disk``, ``preemptable`` and ``checkpoint`` are
-        reserved keyword arguments that if specified will be used to determine the resources
-        required for the job, as :func:`toil.job.Job.__init__`. If they are keyword arguments to
-        the function they will be extracted from the function definition, but may be overridden
-        by the user (as you would expect).
+        The keywords ``memory``, ``cores``, ``disk``, ``preemptable``, ``priority``, ``tags``,
+        ``consumables`` and ``checkpoint`` are reserved keyword arguments that if specified will
+        be used to determine the resources required for the job, as
+        :func:`toil.job.Job.__init__`. If they are keyword arguments to the function they will be
+        extracted from the function definition, but may be overridden by the user (as you would
+        expect).
         """
         # Use the user-specified requirements, if specified, else grab the default argument
         # from the function, if specified, else default to None
@@ -1420,6 +1722,9 @@ class FunctionWrappingJob(Job):
                      cores=resolve('cores', dehumanize=True),
                      disk=resolve('disk', dehumanize=True),
                      preemptable=resolve('preemptable'),
+                     priority=resolve('priority'),
+                     tags=resolve('tags'),
+                     consumables=resolve('consumables'),
                      checkpoint=resolve('checkpoint', default=False),
                      unitName=resolve('name', default=None))
 
@@ -1728,6 +2033,37 @@ class Promise(object):
     """
     A set of IDs of files containing promised values when we know we won't need them anymore
     """
+
+    maxConcurrentTransfers = 16
+    """
+    The maximum number of threads used to read or write promise files at once
+    """
+
+    maxCachedValueSize = 64 * 1024
+    """
+    Pickled promised values up to this size fulfilled in the current process are kept in memory
+    """
+
+    maxCachedValues = 1024
+    """
+    The maximum number of promised values fulfilled in the current process kept in memory
+    """
+
+    _fulfilled = {}
+    """
+    The pickled values of small promises fulfilled in the current process, by the locator of the
+    job store and the ID of the file holding the value, so that successors run in this process,
+    e.g. by chaining, can resolve the promises without reading the files. Guarded by _lock.
+    """
+
+    _lock = threading.Lock()
+
+    _local = threading.local()
+    """
+    The promise files registered while pickling in the current thread, see :meth:`_registering`,
+    and those read for the job being unpickled in it, see :meth:`_prefetching`
+    """
+
     def __init__(self, job, path):
         """
         :param Job job: the job whose return value this promise references
@@ -1748,6 +2084,9 @@ class Promise(object):
         # empty file in the job store if the promise is actually being pickled. This is done so
         # that we do not allocate files for promises that are never used.
         jobStoreLocator, jobStoreFileID = self.job.registerPromise(self.path)
+        registered = getattr(Promise._local, 'registered', None)
+        if registered is not None:
+            registered.append(jobStoreFileID)
         # Returning a class object here causes the pickling machinery to attempt to instantiate
         # the class. We will catch that with __new__ and return an the actual return value instead.
         return self.__class__, (jobStoreLocator, jobStoreFileID)
@@ -1764,17 +2103,103 @@ class Promise(object):
 
     @classmethod
     def _resolve(cls, jobStoreLocator, jobStoreFileID):
+        cls.filesToDelete.add(jobStoreFileID)
+        pickledValue = getattr(cls._local, 'prefetched', {}).get(jobStoreFileID)
+        if pickledValue is None:
+            with cls._lock:
+                pickledValue = cls._fulfilled.get(jobStoreLocator, {}).get(jobStoreFileID)
+        if pickledValue is not None:
+            return pickle.loads(pickledValue)
         # Initialize the cached job store if it was never initialized in the current process or
         # if it belongs to a different workflow that was run earlier in the current process.
         if cls._jobstore is None or cls._jobstore.config.jobStore != jobStoreLocator:
             cls._jobstore = Toil.resumeJobStore(jobStoreLocator)
-        cls.filesToDelete.add(jobStoreFileID)
         with cls._jobstore.readFileStream(jobStoreFileID) as fileHandle:
             # If this doesn't work then the file containing the promise may not exist or be
             # corrupted
             value = safeUnpickleFromStream(fileHandle)
             return value
 
+    @classmethod
+    def _useJobStore(cls, jobStore):
+        """
+        Makes promises resolved in the current process use the given job store instead of
+        resuming a job store of their own.
+        """
+        cls._jobstore = jobStore
+
+    @classmethod
+    def _forgetJobStore(cls, jobStore):
+        """
+        Drops the values of the promises fulfilled in the current process that are kept in
+        memory for the given job store, and stops resolving promises with it. Called once a
+        worker is done with the job store, so that a later worker run in the same process
+        starts afresh.
+        """
+        with cls._lock:
+            cls._fulfilled.pop(jobStore.config.jobStore, None)
+        if cls._jobstore is jobStore:
+            cls._jobstore = None
+
+    @classmethod
+    def _cacheFulfilled(cls, jobStore, jobStoreFileID, pickledValue):
+        """
+        Keeps the pickled value of a promise fulfilled in the current process in memory, if it
+        is small enough and there is room for it.
+        """
+        if len(pickledValue) <= cls.maxCachedValueSize:
+            with cls._lock:
+                fulfilled = cls._fulfilled.setdefault(jobStore.config.jobStore, {})
+                if len(fulfilled) < cls.maxCachedValues:
+                    fulfilled[jobStoreFileID] = pickledValue
+
+    @classmethod
+    def _uncacheFulfilled(cls, jobStore, jobStoreFileID):
+        """
+        Drops the pickled value of a promise kept in memory by :meth:`_cacheFulfilled`.
+        """
+        with cls._lock:
+            cls._fulfilled.get(jobStore.config.jobStore, {}).pop(jobStoreFileID, None)
+
+    @classmethod
+    @contextmanager
+    def _registering(cls):
+        """
+        Yields a list that the IDs of the files registered by promises pickled in the current
+        thread are added to while the context is active.
+        """
+        cls._local.registered = []
+        try:
+            yield cls._local.registered
+        finally:
+            cls._local.registered = None
+
+    @classmethod
+    @contextmanager
+    def _prefetching(cls, jobStoreFileIDs):
+        """
+        Concurrently reads the given promise files from the job store set by \
+        :meth:`_useJobStore` so that promises referencing them resolve without further reads
+        in the current thread while the context is active.
+        """
+        jobStore = cls._jobstore
+        pickledValues = {}
+        if jobStore is not None:
+            with cls._lock:
+                fulfilled = cls._fulfilled.get(jobStore.config.jobStore, {})
+                jobStoreFileIDs = [jobStoreFileID for jobStoreFileID in jobStoreFileIDs
+                                   if jobStoreFileID not in fulfilled]
+            def read(jobStoreFileID):
+                with jobStore.readFileStream(jobStoreFileID) as fileHandle:
+                    return fileHandle.read()
+            pickledValues = dict(zip(jobStoreFileIDs, concurrently(read, jobStoreFileIDs,
+                                                                   cls.maxConcurrentTransfers)))
+        cls._local.prefetched = pickledValues
+        try:
+            yield
+        finally:
+            cls._local.prefetched = {}
+
 
 class PromisedRequirement(object):
     def __init__(self, valueOrCallable, *args):
@@ -13,11 +13,35 @@
 # limitations under the License.
 from __future__ import absolute_import
 import logging
+from operator import attrgetter
 
-from toil.job import JobNode
+from toil import pickle
+from toil.job import JobNode, ServiceJobNode
 
 logger = logging.getLogger(__name__)
 
+# The persisted state of the job nodes on a job graph's stack and service lists, in the order in
+# which it is laid out by JobGraph.toBinary().
+_jobNodeFields = ('command', 'jobStoreID', 'jobName', 'unitName', 'displayName',
+                  'predecessorNumber', '_memory', '_cores', '_disk', '_preemptable',
+                  '_priority', 'criticalPath', 'tags', '_consumables')
+_serviceJobNodeExtraFields = ('startJobStoreID', 'terminateJobStoreID', 'errorJobStoreID')
+_serviceJobNodeFields = _jobNodeFields + _serviceJobNodeExtraFields
+# The persisted state of a job graph that is not also part of its job node state
+_jobGraphFields = ('remainingRetryCount', 'filesToDelete', 'predecessorsFinished',
+                   'logJobStoreFileID', 'terminateJobStoreID', 'startJobStoreID',
+                   'errorJobStoreID', 'checkpoint', 'checkpointFilesToDelete', 'chainedJobs')
+
+_getJobNodeFields = attrgetter(*_jobNodeFields)
+_getServiceJobNodeFields = attrgetter(*_serviceJobNodeFields)
+_getJobGraphFields = attrgetter(*(_jobNodeFields + _jobGraphFields))
+
+# The complete set of instance attributes expected on each of the above
+_jobNodeAttributes = frozenset(_jobNodeFields + ('_config',))
+_serviceJobNodeAttributes = frozenset(_serviceJobNodeFields + ('_config',))
+_jobGraphAttributes = frozenset(_jobNodeFields + _jobGraphFields +
+                                ('stack', 'services', '_config'))
+
 
 class JobGraph(JobNode):
     """
@@ -40,14 +64,20 @@ class JobGraph(JobNode):
                  logJobStoreFileID=None,
                  checkpoint=None,
                  checkpointFilesToDelete=None,
-                 chainedJobs=None):
+                 chainedJobs=None,
+                 priority=None,
+                 criticalPath=1,
+                 tags=None,
+                 consumables=None):
         requirements = {'memory': memory, 'cores': cores, 'disk': disk,
-                        'preemptable': preemptable}
+                        'preemptable': preemptable, 'priority': priority, 'tags': tags,
+                        'consumables': consumables}
         super(JobGraph, self).__init__(command=command,
                                        requirements=requirements,
                                        unitName=unitName, jobName=jobName,
                                        jobStoreID=jobStoreID,
-                                       predecessorNumber=predecessorNumber)
+                                       predecessorNumber=predecessorNumber,
+                                       criticalPath=criticalPath)
 
         # The number of times the job should be retried if it fails This number is reduced by
         # retries until it is zero and then no further retries are made
@@ -103,6 +133,28 @@ class JobGraph(JobNode):
     def __hash__(self):
         return hash(self.jobStoreID)
 
+    def snapshot(self):
+        """
+        Returns a copy of this job graph that can be modified independently of the original,
+        e.g. while the original is being written to the job store asynchronously.
+
+        Unlike a deep copy, the snapshot shares the job nodes with the original, as well as the
+        lists of job nodes that make up the individual levels of the stack. Taking a snapshot
+        therefore takes time proportional to the number of levels, not the number of jobs on the
+        stack. In exchange, a level must never be modified in place once it is on a stack, it
+        must be replaced instead, e.g. ``jobGraph.stack[-1] = jobGraph.stack[-1][:-1]``. The
+        service lists are copied since they are built up in place.
+
+        :rtype: JobGraph
+        """
+        jobGraph = self.__class__.__new__(self.__class__)
+        jobGraph.__dict__.update(self.__dict__)
+        jobGraph.stack = list(self.stack)
+        jobGraph.services = [list(jobs) for jobs in self.services]
+        jobGraph.filesToDelete = list(self.filesToDelete)
+        jobGraph.predecessorsFinished = set(self.predecessorsFinished)
+        return jobGraph
+
     def setupJobAfterFailure(self, config):
         """
         Reduce the remainingRetryCount if greater than zero and set the memory
@@ -192,8 +244,107 @@ class JobGraph(JobNode):
                    remainingRetryCount=tryCount,
                    predecessorNumber=jobNode.predecessorNumber,
                    unitName=jobNode.unitName, jobName=jobNode.jobName,
+                   criticalPath=jobNode.criticalPath,
                    **jobNode._requirements)
 
+    # Prefixes the compact encoding produced by toBinary(). Pickles never start with a null byte,
+    # which is how fromBinary() recognizes pickled job graphs written by older versions of Toil.
+    _binaryMagic = b'\x00TJG'
+    # The version of the encoding. Increment it whenever any of the field tuples at the top of
+    # this module change and keep the ability to read older versions in fromBinary().
+    _binaryVersion = 1
+    # The pickle protocol of the encoding, which both Python 2 and 3 can read
+    _binaryProtocol = 2
+
+    def toBinary(self):
+        """
+        Serialize this job graph for persistence in a job store.
+
+        Instead of pickling the job graph, its fields and those of the job nodes on its stack
+        are laid out in a fixed order as plain tuples, which are then pickled. This omits the
+        attribute names and class references a pickle of the job graph would repeat for every
+        job node, making the result considerably smaller and faster to load. The tuples are
+        preceded by a version number, so that the layout can evolve. Job graphs that hold state
+        the fixed layout doesn't cover, e.g. extra attributes, are pickled as a whole instead.
+
+        :rtype: bytes
+        """
+        try:
+            return (self._binaryMagic + bytes(bytearray([self._binaryVersion])) +
+                    pickle.dumps(self._toTuple(), protocol=self._binaryProtocol))
+        except ValueError:
+            logger.debug('Falling back to pickling job graph %s.', self.jobStoreID)
+            return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def fromBinary(cls, binary):
+        """
+        Deserialize a job graph that was serialized by :meth:`toBinary` or pickled by an older
+        version of Toil.
+
+        :param bytes binary: the serialized job graph
+        :return: An instance of this class, unless the job graph was pickled, in which case the
+                 pickled class is used.
+        :rtype: toil.jobGraph.JobGraph
+        """
+        header = len(cls._binaryMagic)
+        if binary[:header] != cls._binaryMagic:
+            return pickle.loads(binary)
+        version = bytearray(binary[header:header + 1])[0]
+        if version != cls._binaryVersion:
+            raise RuntimeError('Unsupported job graph encoding version %i. The job store was '
+                               'likely written by a newer version of Toil.' % version)
+        return cls._fromTuple(pickle.loads(binary[header + 1:]))
+
+    def _toTuple(self):
+        if self.__dict__.keys() != _jobGraphAttributes or self._config is not None:
+            raise ValueError('Job graph has state not covered by the fixed field layout.')
+
+        def jobNodeToTuple(jobNode):
+            if type(jobNode) is JobNode:
+                attributes, getFields = _jobNodeAttributes, _getJobNodeFields
+            elif type(jobNode) is ServiceJobNode:
+                attributes, getFields = _serviceJobNodeAttributes, _getServiceJobNodeFields
+            else:
+                raise ValueError('Unexpected job node type %s.' % type(jobNode))
+            if jobNode.__dict__.keys() != attributes or jobNode._config is not None:
+                raise ValueError('Job node has state not covered by the fixed field layout.')
+            return getFields(jobNode)
+
+        def jobNodeListsToTuple(jobNodeLists):
+            return tuple(tuple(jobNodeToTuple(jobNode) for jobNode in jobNodes)
+                         for jobNodes in jobNodeLists)
+
+        return (_getJobGraphFields(self),
+                jobNodeListsToTuple(self.stack),
+                jobNodeListsToTuple(self.services))
+
+    @classmethod
+    def _fromTuple(cls, state):
+        values, stack, services = state
+        numJobNodeFields = len(_jobNodeFields)
+
+        def jobNodeFromTuple(nodeValues):
+            # Only service job nodes carry additional fields
+            if len(nodeValues) == numJobNodeFields:
+                nodeCls, nodeFields = JobNode, _jobNodeFields
+            else:
+                nodeCls, nodeFields = ServiceJobNode, _serviceJobNodeFields
+            jobNode = nodeCls.__new__(nodeCls)
+            jobNode.__dict__ = dict(zip(nodeFields, nodeValues), _config=None)
+            return jobNode
+
+        def jobNodeListsFromTuple(jobNodeLists):
+            return [[jobNodeFromTuple(nodeValues) for nodeValues in jobNodes]
+                    for jobNodes in jobNodeLists]
+
+        jobGraph = cls.__new__(cls)
+        jobGraph.__dict__ = dict(zip(_jobNodeFields + _jobGraphFields, values),
+                                 stack=jobNodeListsFromTuple(stack),
+                                 services=jobNodeListsFromTuple(services),
+                                 _config=None)
+        return jobGraph
+
     def __eq__(self, other):
         return (
             isinstance(other, self.__class__)
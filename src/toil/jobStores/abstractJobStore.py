@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from __future__ import absolute_import
+from __future__ import division
 
 from future import standard_library
 standard_library.install_aliases()
@@ -21,8 +22,13 @@ from builtins import object
 from builtins import super
 import shutil
 
+import json
+import os
 import re
+import threading
+import time
 from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
 from contextlib import contextmanager, closing
 from datetime import timedelta
 from uuid import uuid4
@@ -37,8 +43,10 @@ from toil.lib.retry import retry_http
 from toil.common import safeUnpickleFromStream
 from toil.fileStore import FileID
 from toil.job import JobException
+from toil.lib.humanize import bytes2human
 from toil.lib.memoize import memoize
 from toil.lib.objects import abstractclassmethod
+from toil.lib.threading import concurrently
 from future.utils import with_metaclass
 
 try:
@@ -51,6 +59,59 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+class _TransferJournal(object):
+    """
+    A local file recording the completed transfers of a bulk import or export from or to a
+    particular job store, keyed by the source URL of an import or the destination URL of an
+    export. Each line of the file holds a JSON object, the first one identifying the job store by
+    its locator. A journal of a different job store is started afresh.
+    """
+
+    def __init__(self, path, jobStoreLocator):
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.file = None
+        if path is None:
+            return
+        header = dict(jobStore=jobStoreLocator)
+        if os.path.exists(path):
+            with open(path) as f:
+                lines = iter(f)
+                if json.loads(next(lines, 'null')) == header:
+                    for line in lines:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            # The last line may be incomplete if the transfer was interrupted
+                            logger.debug("Ignoring corrupt line '%s' in journal %s.", line, path)
+                        else:
+                            self.entries[entry['key']] = entry['value']
+                    logger.info('Resuming from journal %s with %i completed transfers.',
+                                path, len(self.entries))
+                    self.file = open(path, 'a')
+                    return
+            logger.warning('Discarding journal %s of another job store.', path)
+        self.file = open(path, 'w')
+        self._write(header)
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def record(self, key, value):
+        if self.file is not None:
+            with self.lock:
+                self._write(dict(key=key, value=value))
+
+    def _write(self, entry):
+        self.file.write(json.dumps(entry) + '\n')
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
 class InvalidImportExportUrlException(Exception):
     def __init__(self, url):
         """
@@ -119,6 +180,8 @@ class AbstractJobStore(with_metaclass(ABCMeta, object)):
         methods.
         """
         self.__config = None
+        # The batch of job graphs opened by each thread, see _batchJobGraphs()
+        self.__batches = threading.local()
 
     def initialize(self, config):
         """
@@ -296,7 +359,13 @@ class AbstractJobStore(with_metaclass(ABCMeta, object)):
         # subclasses of AbstractJobStore.
         srcUrl = urlparse.urlparse(srcUrl)
         otherCls = self._findJobStoreForUrl(srcUrl)
-        return self._importFile(otherCls, srcUrl, sharedFileName=sharedFileName, hardlink=hardlink)
+        start = time.time()
+        fileID = self._importFile(otherCls, srcUrl, sharedFileName=sharedFileName,
+                                  hardlink=hardlink)
+        if logger.isEnabledFor(logging.DEBUG):
+            self._logThroughput('Imported', srcUrl, None if fileID is None else fileID.size,
+                                time.time() - start)
+        return fileID
 
     def _importFile(self, otherCls, url, sharedFileName=None, hardlink=False):
         """
@@ -305,6 +374,11 @@ class AbstractJobStore(with_metaclass(ABCMeta, object)):
         asks the other job store class for a stream and writes that stream as either a regular or
         a shared file.
 
+        Subclasses override this method to copy files without streaming them through this
+        process when the given class stores them in a compatible way, e.g. with a server-side
+        copy between buckets of the same cloud provider or a clone on the same file system, and
+        defer to this implementation otherwise. The same goes for :meth:`._exportFile`.
+
         :param AbstractJobStore otherCls: The concrete subclass of AbstractJobStore that supports
                reading from the given URL and getting the file size from the URL.
 
@@ -341,7 +415,25 @@ class AbstractJobStore(with_metaclass(ABCMeta, object)):
         """
         dstUrl = urlparse.urlparse(dstUrl)
         otherCls = self._findJobStoreForUrl(dstUrl, export=True)
+        start = time.time()
         self._exportFile(otherCls, jobStoreFileID, dstUrl)
+        if logger.isEnabledFor(logging.DEBUG):
+            # Only the size of a FileID is known without asking the destination, which could
+            # fail an export that succeeded
+            size = jobStoreFileID.size if isinstance(jobStoreFileID, FileID) else None
+            self._logThroughput('Exported', dstUrl, size, time.time() - start)
+
+    @staticmethod
+    def _logThroughput(verb, url, size, seconds):
+        """
+        Logs the time taken to transfer a file and, if its size is known, the throughput.
+        """
+        if size is None:
+            logger.debug('%s %s in %.2f seconds.', verb, url.geturl(), seconds)
+        else:
+            logger.debug('%s %s (%s) in %.2f seconds (%s/s).', verb, url.geturl(),
+                         bytes2human(size), seconds,
+                         bytes2human(size / seconds) if seconds else 'inf')
 
     def _exportFile(self, otherCls, jobStoreFileID, url):
         """
@@ -359,6 +451,103 @@ class AbstractJobStore(with_metaclass(ABCMeta, object)):
         with self.readFileStream(jobStoreFileID) as readable:
             otherCls._writeToUrl(readable, url)
 
+    # The number of files transferred concurrently by importFiles and exportFiles by default
+    maxTransferThreads = 16
+
+    # The minimum number of seconds between progress reports of importFiles and exportFiles
+    transferProgressPeriod = 30
+
+    def importFiles(self, srcUrls, hardlink=False, maxThreads=None, journalPath=None):
+        """
+        Imports the files at the given URLs into the job store, several at a time. Each file is
+        imported as by :meth:`.importFile`, so files that are already stored in the same kind of
+        storage as the job store, e.g. in S3 for an AWS job store, are copied without passing
+        through this machine.
+
+        If a journal is given, every imported file is recorded in it. Repeating an interrupted
+        import into the same job store with the same journal only imports the remaining files,
+        provided they are still in the job store. A journal of a different job store is
+        discarded. To resume an import that was interrupted by the death of the process running
+        it, reopen the job store it left behind with --restart, which is allowed for workflows
+        that were never started, and repeat the import before starting the workflow.
+
+        :param list[str] srcUrls: the URLs of the files to import
+
+        :param int maxThreads: the maximum number of files to import at the same time, by default
+               :attr:`maxTransferThreads`
+
+        :param str journalPath: optional path of a local file to record the imported files in
+
+        :return: the IDs of the imported files, in the order of the URLs
+        :rtype: list[toil.fileStore.FileID]
+        """
+        journal = _TransferJournal(journalPath, self.config.jobStore)
+
+        def importOne(srcUrl):
+            entry = journal.get(srcUrl)
+            if entry is not None:
+                jobStoreFileID, size = entry
+                if self.fileExists(jobStoreFileID):
+                    return FileID(jobStoreFileID, size)
+            fileID = self.importFile(srcUrl, hardlink=hardlink)
+            journal.record(srcUrl, (str(fileID), fileID.size))
+            return fileID
+
+        with closing(journal):
+            return self._transferAll(importOne, srcUrls, 'Imported', maxThreads)
+
+    def exportFiles(self, exports, maxThreads=None, journalPath=None):
+        """
+        Exports files from the job store to the given URLs, several at a time, as by
+        :meth:`.exportFile`.
+
+        If a journal is given, every exported file is recorded in it. Repeating an interrupted
+        export from the same job store with the same journal only exports the remaining files. A
+        journal of a different job store is discarded. To resume an export that was interrupted
+        by the death of the process running it, restart the completed workflow, which returns the
+        return value of its root job again, and repeat the export.
+
+        :param dict[str,str] exports: maps each destination URL to the ID of the file in the job
+               store to export to it
+
+        :param int maxThreads: the maximum number of files to export at the same time, by default
+               :attr:`maxTransferThreads`
+
+        :param str journalPath: optional path of a local file to record the exported files in
+        """
+        journal = _TransferJournal(journalPath, self.config.jobStore)
+
+        def exportOne(export):
+            dstUrl, jobStoreFileID = export
+            if journal.get(dstUrl) != str(jobStoreFileID):
+                self.exportFile(jobStoreFileID, dstUrl)
+                journal.record(dstUrl, str(jobStoreFileID))
+
+        with closing(journal):
+            self._transferAll(exportOne, sorted(exports.items()), 'Exported', maxThreads)
+
+    def _transferAll(self, transfer, items, verb, maxThreads):
+        """
+        Applies the given transfer function to all of the given items concurrently, logging the
+        progress periodically, and returns the results in the order of the items.
+        """
+        items = list(items)
+        lock = threading.Lock()
+        # The number of items transferred and the time of the last progress report
+        progress = [0, time.time()]
+
+        def transferOne(item):
+            result = transfer(item)
+            with lock:
+                progress[0] += 1
+                now = time.time()
+                if progress[0] == len(items) or now - progress[1] >= self.transferProgressPeriod:
+                    progress[1] = now
+                    logger.info('%s %i of %i files.', verb, progress[0], len(items))
+            return result
+
+        return concurrently(transferOne, items, maxThreads or self.maxTransferThreads)
+
     @abstractclassmethod
     def getSize(cls, url):
         """
@@ -659,13 +848,74 @@ class AbstractJobStore(with_metaclass(ABCMeta, object)):
     @contextmanager
     def batch(self):
         """
-        All calls to create() with this context manager active will be performed in a batch
-        after the context manager is released.
+        All calls to create() and update() with this context manager active will be performed
+        in a batch after the context manager is released. A job graph that is created and then
+        updated, or updated several times, within the batch is written only once, in the state
+        it is in when the batch is released. Job stores that do not support batching write
+        job graphs immediately.
+
+        A batch only defers the job graphs written by the thread that opened it. If the body of
+        the context manager raises, the job graphs of the batch are discarded.
 
         :rtype: None
         """
         yield
 
+    @property
+    def _batchedJobGraphs(self):
+        """
+        The job graphs created or updated in the batch opened by the current thread, or None if
+        the current thread has no batch open.
+
+        :rtype: list[(toil.jobGraph.JobGraph, bool)]|None
+        """
+        return getattr(self.__batches, 'jobGraphs', None)
+
+    def _deferToBatch(self, jobGraph, created=False):
+        """
+        Adds the given job graph to the batch opened by the current thread, if any.
+
+        :param toil.jobGraph.JobGraph jobGraph: the job graph to write when the batch is released
+        :param bool created: whether the job graph was created rather than updated
+        :return: True if the job graph was deferred, False if it must be written right away
+        :rtype: bool
+        """
+        batchedJobGraphs = self._batchedJobGraphs
+        if batchedJobGraphs is None:
+            return False
+        batchedJobGraphs.append((jobGraph, created))
+        return True
+
+    @contextmanager
+    def _batchJobGraphs(self):
+        """
+        Helps job stores implement :meth:`.batch`. Job graphs passed to :meth:`._deferToBatch` by
+        the current thread while the context manager is active are collected in the yielded
+        list. Once the body completes, the list holds a (jobGraph, created) pair for the last
+        state of each collected job graph, created being True if the job graph was created in
+        the batch. If the body raises, the batch is discarded. A nested batch is written with
+        the batch enclosing it, so its list remains empty.
+
+        :rtype: list[(toil.jobGraph.JobGraph, bool)]
+        """
+        batch = []
+        if self._batchedJobGraphs is not None:
+            yield batch
+            return
+        self.__batches.jobGraphs = []
+        try:
+            yield batch
+            jobGraphs = OrderedDict()
+            created = set()
+            for jobGraph, isCreated in self.__batches.jobGraphs:
+                jobGraphs[jobGraph.jobStoreID] = jobGraph
+                if isCreated:
+                    created.add(jobGraph.jobStoreID)
+            batch.extend((jobGraph, jobStoreID in created)
+                         for jobStoreID, jobGraph in jobGraphs.items())
+        finally:
+            self.__batches.jobGraphs = None
+
     @abstractmethod
     def create(self, jobNode):
         """
@@ -867,6 +1117,25 @@ class AbstractJobStore(with_metaclass(ABCMeta, object)):
         """
         raise NotImplementedError()
 
+    def readFileRange(self, jobStoreFileID, offset, length):
+        """
+        Returns the given range of bytes of the file with the given ID. Job stores that can read
+        part of a file without reading what precedes it should override this method, the default
+        implementation reads the file from its beginning.
+
+        :param str jobStoreFileID: ID of the file to read from
+        :param int offset: the position of the first byte to read
+        :param int length: the number of bytes to read
+        :rtype: bytes
+        """
+        with self.readFileStream(jobStoreFileID) as readable:
+            while offset > 0:
+                skipped = len(readable.read(min(offset, 1 << 20)))
+                if not skipped:
+                    break
+                offset -= skipped
+            return readable.read(length)
+
     @abstractmethod
     def deleteFile(self, jobStoreFileID):
         """
@@ -20,12 +20,6 @@ from builtins import str
 from builtins import range
 from contextlib import contextmanager, closing
 import logging
-
-try:
-    import cPickle as pickle
-except ImportError:
-    import pickle
-
 import re
 import uuid
 import base64
@@ -62,7 +56,7 @@ from toil.jobStores.aws.utils import (SDBHelper,
                                       bucket_location_to_region,
                                       region_to_bucket_location, copyKeyMultipart,
                                       uploadFromPath, chunkedFileUpload, fileSizeAndTime)
-from toil.jobStores.utils import WritablePipe, ReadablePipe
+from toil.jobStores.utils import WritablePipe, ReadablePipe, ParallelWritablePipe
 from toil.jobGraph import JobGraph
 import toil.lib.encryption as encryption
 
@@ -73,7 +67,7 @@ class AWSJobStore(AbstractJobStore):
     """
     A job store that uses Amazon's S3 for file storage and SimpleDB for storing job info and
     enforcing strong consistency on the S3 file storage. There will be SDB domains for jobs and
-    files and a versioned S3 bucket for file contents. Job objects are pickled, compressed,
+    files and a versioned S3 bucket for file contents. Job objects are serialized, compressed,
     partitioned into chunks of 1024 bytes and each chunk is stored as a an attribute of the SDB
     item representing the job. UUIDs are used to identify jobs and files.
     """
@@ -91,13 +85,16 @@ class AWSJobStore(AbstractJobStore):
     maxNameLen = 10
     nameSeparator = '--'
 
-    def __init__(self, locator, partSize=50 << 20):
+    def __init__(self, locator, partSize=50 << 20, uploadConcurrency=4):
         """
         Create a new job store in AWS or load an existing one from there.
 
         :param int partSize: The size of each individual part used for multipart operations like
                upload and copy, must be >= 5 MiB but large enough to not exceed 10k parts for the
                whole file
+
+        :param int uploadConcurrency: The number of parts of a streamed multipart upload that are
+               uploaded concurrently. Up to this many parts plus one are buffered in memory.
         """
         super(AWSJobStore, self).__init__()
         region, namePrefix = locator.split(':')
@@ -118,6 +115,7 @@ class AWSJobStore(AbstractJobStore):
         self.region = region
         self.namePrefix = namePrefix
         self.partSize = partSize
+        self.uploadConcurrency = uploadConcurrency
         self.jobsDomain = None
         self.filesDomain = None
         self.filesBucket = None
@@ -250,11 +248,11 @@ class AWSJobStore(AbstractJobStore):
         else:
             binary,_ = SDBHelper.attributesToBinary(item)
             assert binary is not None
-        job = pickle.loads(binary)
+        job = JobGraph.fromBinary(binary)
         return job
 
     def _awsJobToItem(self, job):
-        binary = pickle.dumps(job, protocol=pickle.HIGHEST_PROTOCOL)
+        binary = job.toBinary()
         if len(binary) > SDBHelper.maxBinarySize(extraReservedChunks=1):
             #Store as an overlarge job in S3
             with self.writeFileStream() as (writable, fileID):
@@ -270,16 +268,16 @@ class AWSJobStore(AbstractJobStore):
 
     @contextmanager
     def batch(self):
-        self._batchedJobGraphs = []
-        yield
-        batches = [self._batchedJobGraphs[i:i + self.jobsPerBatchInsert] for i in range(0, len(self._batchedJobGraphs), self.jobsPerBatchInsert)]
+        with self._batchJobGraphs() as batchedJobGraphs:
+            yield
+        batchedJobGraphs = [jobGraph for jobGraph, _ in batchedJobGraphs]
+        batches = [batchedJobGraphs[i:i + self.jobsPerBatchInsert] for i in range(0, len(batchedJobGraphs), self.jobsPerBatchInsert)]
 
         for batch in batches:
             items = {jobGraph.jobStoreID:self._awsJobToItem(jobGraph) for jobGraph in batch}
             for attempt in retry_sdb():
                 with attempt:
                     assert self.jobsDomain.batch_put_attributes(items)
-        self._batchedJobGraphs = None
             
 
     def create(self, jobNode):
@@ -288,9 +286,7 @@ class AWSJobStore(AbstractJobStore):
                   jobStoreID, '<no command>' if jobNode.command is None else jobNode.command)
         job = JobGraph.fromJobNode(jobNode, jobStoreID=jobStoreID, tryCount=self._defaultTryCount())
 
-        if hasattr(self, "_batchedJobGraphs") and self._batchedJobGraphs is not None:
-            self._batchedJobGraphs.append(job)
-        else:
+        if not self._deferToBatch(job, created=True):
             item = self._awsJobToItem(job)
             for attempt in retry_sdb():
                 with attempt:
@@ -330,6 +326,8 @@ class AWSJobStore(AbstractJobStore):
         return job
 
     def update(self, job):
+        if self._deferToBatch(job):
+            return
         log.debug("Updating job %s", job.jobStoreID)
         item = self._awsJobToItem(job)        
         for attempt in retry_sdb():
@@ -569,6 +567,11 @@ class AWSJobStore(AbstractJobStore):
         with info.downloadStream() as readable:
             yield readable
 
+    def readFileRange(self, jobStoreFileID, offset, length):
+        info = self.FileInfo.loadOrFail(jobStoreFileID)
+        log.debug("Reading %i bytes at %i from %r.", length, offset, info)
+        return info.downloadRange(offset, length)
+
     @contextmanager
     def readSharedFileStream(self, sharedFileName):
         assert self._validateSharedFileName(sharedFileName)
@@ -1035,41 +1038,44 @@ class AWSJobStore(AbstractJobStore):
             info = self
             store = self.outer
 
-            class MultiPartPipe(WritablePipe):
+            class MultiPartPipe(ParallelWritablePipe):
                 def readFrom(self, readable):
                     buf = readable.read(store.partSize)
                     if allowInlining and len(buf) <= info._maxInlinedSize():
                         info.content = buf
                     else:
-                        headers = info._s3EncryptionHeaders()
+                        self.headers = info._s3EncryptionHeaders()
                         for attempt in retry_s3():
                             with attempt:
-                                upload = store.filesBucket.initiate_multipart_upload(
+                                self.upload = store.filesBucket.initiate_multipart_upload(
                                     key_name=bytes(info.fileID),
-                                    headers=headers)
+                                    headers=self.headers)
+                        super(MultiPartPipe, self).readFrom(readable, firstPart=buf)
+
+                def uploadPart(self, partNumber, buf):
+                    for attempt in retry_s3():
+                        with attempt:
+                            self.upload.upload_part_from_file(fp=StringIO(buf),
+                                                              # part numbers are 1-based
+                                                              part_num=partNumber + 1,
+                                                              headers=self.headers)
+
+                def commit(self, parts):
+                    if not parts:
+                        # There must be at least one part, even if the file is empty.
                         try:
-                            for part_num in itertools.count():
-                                # There must be at least one part, even if the file is empty.
-                                if len(buf) == 0 and part_num > 0:
-                                    break
-                                for attempt in retry_s3():
-                                    with attempt:
-                                        upload.upload_part_from_file(fp=StringIO(buf),
-                                                                     # part numbers are 1-based
-                                                                     part_num=part_num + 1,
-                                                                     headers=headers)
-                                if len(buf) == 0:
-                                    break
-                                buf = readable.read(info.outer.partSize)
+                            self.uploadPart(0, b'')
                         except:
                             with panic(log=log):
-                                for attempt in retry_s3():
-                                    with attempt:
-                                        upload.cancel_upload()
-                        else:
-                            for attempt in retry_s3():
-                                with attempt:
-                                    info.version = upload.complete_upload().version_id
+                                self.abort()
+                    for attempt in retry_s3():
+                        with attempt:
+                            info.version = self.upload.complete_upload().version_id
+
+                def abort(self):
+                    for attempt in retry_s3():
+                        with attempt:
+                            self.upload.cancel_upload()
 
             class SinglePartPipe(WritablePipe):
                 def readFrom(self, readable):
@@ -1086,7 +1092,8 @@ class AWSJobStore(AbstractJobStore):
                                                                              headers=headers)
                         info.version = key.version_id
 
-            with MultiPartPipe() if multipart else SinglePartPipe() as writable:
+            with (MultiPartPipe(partSize=store.partSize, concurrency=store.uploadConcurrency)
+                  if multipart else SinglePartPipe()) as writable:
                 yield writable
 
             assert bool(self.version) == (self.content is None)
@@ -1175,6 +1182,20 @@ class AWSJobStore(AbstractJobStore):
             with DownloadPipe() as readable:
                 yield readable
 
+        def downloadRange(self, offset, length):
+            if self.content is not None:
+                return self.content[offset:offset + length]
+            elif self.version:
+                headers = self._s3EncryptionHeaders()
+                headers['Range'] = 'bytes=%i-%i' % (offset, offset + length - 1)
+                key = self.outer.filesBucket.get_key(bytes(self.fileID), validate=False)
+                for attempt in retry_s3():
+                    with attempt:
+                        return key.get_contents_as_string(headers=headers,
+                                                          version_id=self.version)
+            else:
+                assert False
+
         def delete(self):
             store = self.outer
             if self.previousVersion is not None:
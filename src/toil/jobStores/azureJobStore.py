@@ -24,16 +24,12 @@ import logging
 import os
 import re
 import socket
+import time
 import uuid
 from collections import namedtuple
 from contextlib import contextmanager
 from datetime import datetime, timedelta
 
-try:
-    import cPickle as pickle
-except ImportError:
-    import pickle
-
 # Python 3 compatibility imports
 from six.moves.http_client import HTTPException
 from six.moves.configparser import RawConfigParser, NoOptionError
@@ -52,7 +48,8 @@ from toil.lib.memoize import strict_bool, memoize
 from toil.lib.exceptions import panic
 from toil.lib.retry import retry
 
-from toil.jobStores.utils import WritablePipe, ReadablePipe
+from toil.jobStores.utils import ReadablePipe, ParallelWritablePipe
+from toil.fileStore import FileID
 from toil.jobGraph import JobGraph
 from toil.jobStores.abstractJobStore import (AbstractJobStore,
                                              NoSuchJobException,
@@ -326,6 +323,60 @@ class AzureJobStore(AbstractJobStore):
     def _supportsUrl(cls, url, export=False):
         return url.scheme.lower() in ('wasb', 'wasbs')
 
+    # How long the source of a server-side copy is readable by the destination account
+    copySourceExpiration = timedelta(days=1)
+
+    def _importFile(self, otherCls, url, sharedFileName=None, hardlink=False):
+        # Blobs encrypted by the job store can't simply be copied
+        if issubclass(otherCls, AzureJobStore) and self.keyPath is None:
+            srcBlob = self._parseWasbUrl(url)
+            if sharedFileName is None:
+                jobStoreFileID = self._newFileID()
+            else:
+                assert self._validateSharedFileName(sharedFileName)
+                jobStoreFileID = self._newFileID(sharedFileName)
+            startTime = datetime.utcnow() - timedelta(minutes=5)
+            sasToken = srcBlob.service.generate_blob_shared_access_signature(
+                srcBlob.container, srcBlob.name, permission=BlobPermissions.READ,
+                start=startTime, expiry=startTime + self.copySourceExpiration)
+            srcUrl = srcBlob.service.make_blob_url(srcBlob.container, srcBlob.name,
+                                                   sas_token=sasToken)
+            self._copyBlob(srcUrl, self.files.blobService, self.files.containerName,
+                           jobStoreFileID, metadata=dict(encrypted=str(False)))
+            return FileID(jobStoreFileID, self.getSize(url)) if sharedFileName is None else None
+        else:
+            return super(AzureJobStore, self)._importFile(otherCls, url,
+                                                          sharedFileName=sharedFileName)
+
+    def _exportFile(self, otherCls, jobStoreFileID, url):
+        if issubclass(otherCls, AzureJobStore) and self.keyPath is None:
+            if not self.fileExists(jobStoreFileID):
+                raise NoSuchFileException(jobStoreFileID)
+            dstBlob = self._parseWasbUrl(url)
+            self._copyBlob(self.getPublicUrl(jobStoreFileID), dstBlob.service, dstBlob.container,
+                           dstBlob.name)
+        else:
+            super(AzureJobStore, self)._exportFile(otherCls, jobStoreFileID, url)
+
+    @staticmethod
+    def _copyBlob(srcUrl, dstService, dstContainer, dstName, metadata=None):
+        """
+        Copies the blob at the given URL to the given container without passing the data through
+        this process.
+        """
+        for attempt in retry_azure():
+            with attempt:
+                copy = dstService.copy_blob(dstContainer, dstName, srcUrl, metadata=metadata)
+        # Copies between storage accounts complete asynchronously
+        while copy.status == 'pending':
+            time.sleep(1)
+            for attempt in retry_azure():
+                with attempt:
+                    copy = dstService.get_blob_properties(dstContainer, dstName).properties.copy
+        if copy.status != 'success':
+            raise RuntimeError("Copying blob '%s' to '%s' in container '%s' failed with status "
+                               "'%s'." % (srcUrl.split('?')[0], dstName, dstContainer, copy.status))
+
     def writeFile(self, localFilePath, jobStoreID=None):
         jobStoreFileID = self._newFileID()
         self.updateFile(jobStoreFileID, localFilePath)
@@ -539,6 +590,9 @@ class AzureJobStore(AbstractJobStore):
     # https://github.com/Azure/azure-storage-python/blob/4c7666e05a9556c10154508335738ee44d7cb104/azure/storage/blob/blobservice.py#L106
     _maxAzureBlockBytes = 4 * 1024 * 1024
 
+    # The number of blocks of a streamed upload that are uploaded concurrently
+    _uploadConcurrency = 4
+
     @contextmanager
     def _uploadStream(self, jobStoreFileID, container, checkForModification=False, encrypted=None):
         """
@@ -564,29 +618,24 @@ class AzureJobStore(AbstractJobStore):
 
         store = self
 
-        class UploadPipe(WritablePipe):
+        class UploadPipe(ParallelWritablePipe):
 
-            def readFrom(self, readable):
-                blocks = []
-                try:
-                    while True:
-                        buf = readable.read(maxBlockSize)
-                        if len(buf) == 0:
-                            # We're safe to break here even if we never read anything, since
-                            # putting an empty block list creates an empty blob.
-                            break
-                        if encrypted:
-                            buf = encryption.encrypt(buf, store.keyPath)
-                        blockID = store._newFileID()
-                        container.put_block(blob_name=str(jobStoreFileID),
-                                            block=buf,
-                                            block_id=blockID)
-                        blocks.append(BlobBlock(blockID))
-                except:
-                    with panic(log=logger):
-                        # This is guaranteed to delete any uncommitted blocks.
-                        container.delete_blob(blob_name=str(jobStoreFileID))
+            def uploadPart(self, partNumber, buf):
+                if encrypted:
+                    buf = encryption.encrypt(buf, store.keyPath)
+                blockID = store._newFileID()
+                container.put_block(blob_name=str(jobStoreFileID),
+                                    block=buf,
+                                    block_id=blockID)
+                return BlobBlock(blockID)
+
+            def abort(self):
+                # This is guaranteed to delete any uncommitted blocks.
+                container.delete_blob(blob_name=str(jobStoreFileID))
 
+            def commit(self, blocks):
+                # We're safe to commit even if we never read anything, since putting an empty
+                # block list creates an empty blob.
                 if checkForModification and expectedVersion is not None:
                     # Acquire a (60-second) write lock,
                     leaseID = container.acquire_blob_lease(blob_name=str(jobStoreFileID),
@@ -610,7 +659,7 @@ class AzureJobStore(AbstractJobStore):
                                              block_list=blocks,
                                              metadata=dict(encrypted=str(encrypted)))
 
-        with UploadPipe() as writable:
+        with UploadPipe(partSize=maxBlockSize, concurrency=self._uploadConcurrency) as writable:
             yield writable
 
     @contextmanager
@@ -745,7 +794,7 @@ class AzureJob(JobGraph):
             wholeJobString = chunkedJob[0][1].value
         else:
             wholeJobString = ''.join(item[1].value for item in chunkedJob)
-        return pickle.loads(bz2.decompress(wholeJobString))
+        return cls.fromBinary(bz2.decompress(wholeJobString))
 
     def toEntity(self, chunkSize=maxAzureTablePropertySize):
         """
@@ -755,7 +804,7 @@ class AzureJob(JobGraph):
         """
         assert chunkSize <= maxAzureTablePropertySize
         item = {}
-        serializedAndEncodedJob = bz2.compress(pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL))
+        serializedAndEncodedJob = bz2.compress(self.toBinary())
         jobChunks = [serializedAndEncodedJob[i:i + chunkSize]
                      for i in range(0, len(serializedAndEncodedJob), chunkSize)]
         for attributeOrder, chunk in enumerate(jobChunks):
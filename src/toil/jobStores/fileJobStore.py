@@ -26,12 +26,9 @@ import re
 import tempfile
 import stat
 import errno
+import sys
 import time
 import traceback
-try:
-    import cPickle as pickle
-except ImportError:
-    import pickle
 
 # toil dependencies
 from toil.fileStore import FileID
@@ -133,19 +130,16 @@ class FileJobStore(AbstractJobStore):
         # Make the job
         job = JobGraph.fromJobNode(jobNode, jobStoreID=self._getRelativePath(absJobDir),
                                    tryCount=self._defaultTryCount())
-        if hasattr(self, "_batchedJobGraphs") and self._batchedJobGraphs is not None:
-            self._batchedJobGraphs.append(job)
-        else:
+        if not self._deferToBatch(job, created=True):
             self.update(job)
         return job
 
     @contextmanager
     def batch(self):
-        self._batchedJobGraphs = []
-        yield
-        for jobGraph in self._batchedJobGraphs:
+        with self._batchJobGraphs() as batchedJobGraphs:
+            yield
+        for jobGraph, _ in batchedJobGraphs:
             self.update(jobGraph)
-        self._batchedJobGraphs = None
 
     def waitForExists(self, jobStoreID, maxTries=35, sleepTime=1):
         """Spin-wait and block for a file to appear before returning False if it does not.
@@ -195,7 +189,7 @@ class FileJobStore(AbstractJobStore):
         # Load a valid version of the job
         jobFile = self._getJobFileName(jobStoreID)
         with open(jobFile, 'rb') as fileHandle:
-            job = pickle.load(fileHandle)
+            job = JobGraph.fromBinary(fileHandle.read())
         # The following cleans up any issues resulting from the failure of the
         # job during writing by the batch system.
         if os.path.isfile(jobFile + ".new"):
@@ -205,12 +199,14 @@ class FileJobStore(AbstractJobStore):
         return job
 
     def update(self, job):
+        if self._deferToBatch(job):
+            return
         # The job is serialised to a file suffixed by ".new"
         # The file is then moved to its correct path.
         # Atomicity guarantees use the fact the underlying file systems "move"
         # function is atomic.
         with open(self._getJobFileName(job.jobStoreID) + ".new", 'wb') as f:
-            pickle.dump(job, f)
+            f.write(job.toBinary())
         # This should be atomic for the file system
         os.rename(self._getJobFileName(job.jobStoreID) + ".new", self._getJobFileName(job.jobStoreID))
 
@@ -250,7 +246,30 @@ class FileJobStore(AbstractJobStore):
         if self.linkImports:
             os.symlink(os.path.realpath(srcPath), destPath)
         else:
-            shutil.copyfile(srcPath, destPath)
+            self._copyFile(srcPath, destPath)
+
+    # The FICLONE ioctl from linux/fs.h
+    FICLONE = 0x40049409
+
+    @classmethod
+    def _copyFile(cls, srcPath, destPath):
+        """
+        Copies a file, sharing its blocks with the copy instead of duplicating them if both
+        files are on a file system that supports it, like Btrfs or XFS.
+
+        :param str srcPath: the path of the file to copy
+        :param str destPath: the path to copy it to
+        """
+        if sys.platform.startswith('linux'):
+            import fcntl
+            try:
+                with open(srcPath, 'rb') as src, open(destPath, 'wb') as dest:
+                    fcntl.ioctl(dest.fileno(), cls.FICLONE, src.fileno())
+                return
+            except (IOError, OSError):
+                # Not supported by the file system or the files are on different file systems
+                pass
+        shutil.copyfile(srcPath, destPath)
 
     def _importFile(self, otherCls, url, sharedFileName=None, hardlink=False):
         if issubclass(otherCls, FileJobStore):
@@ -273,7 +292,7 @@ class FileJobStore(AbstractJobStore):
 
     def _exportFile(self, otherCls, jobStoreFileID, url):
         if issubclass(otherCls, FileJobStore):
-            shutil.copyfile(self._getAbsPath(jobStoreFileID), self._extractPathFromUrl(url))
+            self._copyFile(self._getAbsPath(jobStoreFileID), self._extractPathFromUrl(url))
         else:
             super(FileJobStore, self)._exportFile(otherCls, jobStoreFileID, url)
 
@@ -433,6 +452,12 @@ class FileJobStore(AbstractJobStore):
         with open(self._getAbsPath(jobStoreFileID), 'rb') as f:
             yield f
 
+    def readFileRange(self, jobStoreFileID, offset, length):
+        self._checkJobStoreFileID(jobStoreFileID)
+        with open(self._getAbsPath(jobStoreFileID), 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
     ##########################################
     # The following methods deal with shared files, i.e. files not associated
     # with specific jobs.
@@ -24,7 +24,6 @@ import uuid
 import logging
 import time
 import os
-from toil import pickle
 from toil.lib.retry import retry
 from google.cloud import storage, exceptions
 from google.api_core.exceptions import GoogleAPICallError, InternalServerError, ServiceUnavailable
@@ -37,7 +36,8 @@ from toil.jobStores.abstractJobStore import (AbstractJobStore, NoSuchJobExceptio
                                              NoSuchFileException, NoSuchJobStoreException,
                                              JobStoreExistsException,
                                              ConcurrentFileModificationException)
-from toil.jobStores.utils import WritablePipe, ReadablePipe
+from toil.jobStores.utils import ReadablePipe, ParallelWritablePipe
+from toil.fileStore import FileID
 from toil.jobGraph import JobGraph
 log = logging.getLogger(__name__)
 
@@ -86,6 +86,15 @@ def googleRetry(f):
 class GoogleJobStore(AbstractJobStore):
 
     nodeServiceAccountJson = '/root/service_account.json'
+
+    # The size of the parts that streamed uploads are split into, and the number of parts that
+    # are uploaded concurrently
+    _partSize = 32 << 20
+    _uploadConcurrency = 4
+
+    # The maximum number of source objects in a single compose request
+    _maxComposeSources = 32
+
     def __init__(self, locator):
         super(GoogleJobStore, self).__init__()
 
@@ -177,12 +186,17 @@ class GoogleJobStore(AbstractJobStore):
         log.debug("Creating job %s for '%s'",
                   jobStoreID, '<no command>' if jobNode.command is None else jobNode.command)
         job = JobGraph.fromJobNode(jobNode, jobStoreID=jobStoreID, tryCount=self._defaultTryCount())
-        if hasattr(self, "_batchedJobGraphs") and self._batchedJobGraphs is not None:
-            self._batchedJobGraphs.append(job)
-        else:
-            self._writeString(jobStoreID, pickle.dumps(job, protocol=pickle.HIGHEST_PROTOCOL))  # UPDATE: bz2.compress(
+        if not self._deferToBatch(job, created=True):
+            self._writeString(jobStoreID, job.toBinary())  # UPDATE: bz2.compress(
         return job
 
+    @contextmanager
+    def batch(self):
+        with self._batchJobGraphs() as batchedJobGraphs:
+            yield
+        for jobGraph, created in batchedJobGraphs:
+            self._writeString(jobGraph.jobStoreID, jobGraph.toBinary(), update=not created)
+
     def _newJobID(self):
         return "job"+str(uuid.uuid4())
 
@@ -205,10 +219,12 @@ class GoogleJobStore(AbstractJobStore):
             jobString = self._readContents(jobStoreID)
         except NoSuchFileException:
             raise NoSuchJobException(jobStoreID)
-        return pickle.loads(jobString)  # UPDATE bz2.decompress(
+        return JobGraph.fromBinary(jobString)  # UPDATE bz2.decompress(
 
     def update(self, job):
-        self._writeString(job.jobStoreID, pickle.dumps(job, protocol=pickle.HIGHEST_PROTOCOL), update=True)
+        if self._deferToBatch(job):
+            return
+        self._writeString(job.jobStoreID, job.toBinary(), update=True)
 
     @googleRetry
     def delete(self, jobStoreID):
@@ -350,6 +366,41 @@ class GoogleJobStore(AbstractJobStore):
         blob = cls._getBlobFromURL(url)
         blob.upload_from_file(readable)
 
+    def _importFile(self, otherCls, url, sharedFileName=None, hardlink=False):
+        if issubclass(otherCls, GoogleJobStore):
+            srcBlob = self._getBlobFromURL(url, exists=True)
+            if sharedFileName is None:
+                fileID = self._newID(isFile=True)
+            else:
+                self._requireValidSharedFileName(sharedFileName)
+                fileID = sharedFileName
+            self._copyBlob(srcBlob, self.bucket.blob(bytes(fileID), encryption_key=self.sseKey))
+            return FileID(fileID, srcBlob.size) if sharedFileName is None else None
+        else:
+            return super(GoogleJobStore, self)._importFile(otherCls, url,
+                                                           sharedFileName=sharedFileName)
+
+    def _exportFile(self, otherCls, jobStoreFileID, url):
+        if issubclass(otherCls, GoogleJobStore):
+            srcBlob = self.bucket.get_blob(bytes(jobStoreFileID), encryption_key=self.sseKey)
+            if srcBlob is None:
+                raise NoSuchFileException(jobStoreFileID)
+            self._copyBlob(srcBlob, self._getBlobFromURL(url))
+        else:
+            super(GoogleJobStore, self)._exportFile(otherCls, jobStoreFileID, url)
+
+    @staticmethod
+    @googleRetry
+    def _copyBlob(srcBlob, dstBlob):
+        """
+        Copies a blob within Google Cloud Storage, re-encrypting it with the encryption key of
+        the destination blob, if any, without passing the data through this process.
+        """
+        # Large blobs and those copied between locations or storage classes take several calls
+        token, _, _ = dstBlob.rewrite(srcBlob)
+        while token is not None:
+            token, _, _ = dstBlob.rewrite(srcBlob, token=token)
+
     def writeStatsAndLogging(self, statsAndLoggingString):
         statsID = self.statsBaseID + str(uuid.uuid4())
         log.debug("Writing stats file: %s", statsID)
@@ -452,6 +503,9 @@ class GoogleJobStore(AbstractJobStore):
         Yields a context manager that can be used to write to the bucket
         with a stream. See :class:`~toil.jobStores.utils.WritablePipe` for an example.
 
+        Streams larger than a single part are uploaded as separate part objects in
+        parallel, which are then composed into the final object.
+
         Will throw assertion error if the file shouldn't be updated
         and yet exists.
 
@@ -464,17 +518,68 @@ class GoogleJobStore(AbstractJobStore):
         :return: an instance of WritablePipe.
         :rtype: :class:`~toil.jobStores.utils.writablePipe`
         """
-        blob = self.bucket.blob(bytes(fileName), encryption_key=self.sseKey if encrypt else None)
+        encryptionKey = self.sseKey if encrypt else None
+        blob = self.bucket.blob(bytes(fileName), encryption_key=encryptionKey)
+        bucket = self.bucket
+
+        class UploadPipe(ParallelWritablePipe):
+            def __init__(self, *args, **kwargs):
+                super(UploadPipe, self).__init__(*args, **kwargs)
+                self.partBlobs = []
+                # Concurrent writers of the same file must not overwrite each other's parts
+                self.partPrefix = '%s.part-%s' % (fileName, uuid.uuid4())
 
-        class UploadPipe(WritablePipe):
             def readFrom(self, readable):
                 if not update:
                     assert not blob.exists()
-                blob.upload_from_file(readable)
-
-        with UploadPipe() as writable:
+                buf = readable.read(self.partSize)
+                if len(buf) < self.partSize:
+                    # The whole stream fits into one part so there is nothing to parallelize
+                    blob.upload_from_string(buf)
+                else:
+                    try:
+                        super(UploadPipe, self).readFrom(readable, firstPart=buf)
+                    finally:
+                        # The parts are of no use once they have been composed, or failed to be
+                        for partBlob in self.partBlobs:
+                            try:
+                                partBlob.delete()
+                            except exceptions.NotFound:
+                                pass
+
+            @googleRetry
+            def uploadPart(self, partNumber, buf):
+                partBlob = bucket.blob(bytes('%s-%i' % (self.partPrefix, partNumber)),
+                                       encryption_key=encryptionKey)
+                self.partBlobs.append(partBlob)
+                partBlob.upload_from_string(buf)
+                return partBlob
+
+            def commit(self, partBlobs):
+                # A single compose request takes at most 32 source objects, so longer
+                # streams are appended to the final object incrementally.
+                maxSources = GoogleJobStore._maxComposeSources
+                blob.content_type = 'application/octet-stream'
+                GoogleJobStore._composeBlob(blob, partBlobs[:maxSources])
+                for i in range(maxSources, len(partBlobs), maxSources - 1):
+                    GoogleJobStore._composeBlob(blob, [blob] + partBlobs[i:i + maxSources - 1])
+
+        with UploadPipe(partSize=self._partSize, concurrency=self._uploadConcurrency) as writable:
             yield writable
 
+    @staticmethod
+    @googleRetry
+    def _composeBlob(blob, sources):
+        """
+        Concatenates the given source blobs into the given blob, retrying transient failures.
+        The request is encrypted with the customer-supplied encryption key of the blob, if any,
+        which must be the key of the sources as well.
+
+        :param storage.Blob blob: the blob to write
+        :param list[storage.Blob] sources: the blobs to concatenate
+        """
+        blob.compose(sources)
+
     @contextmanager
     @googleRetry
     def _downloadStream(self, fileName, encrypt=True):
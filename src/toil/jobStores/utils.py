@@ -3,11 +3,16 @@ import codecs
 import logging
 import os
 import errno
+import sys
 from abc import ABCMeta
 from abc import abstractmethod
+from threading import Event, Semaphore
 
+from six.moves.queue import Queue
+
+from toil.lib.exceptions import panic
 from toil.lib.threading import ExceptionalThread
-from future.utils import with_metaclass
+from future.utils import with_metaclass, raise_
 
 log = logging.getLogger(__name__)
 
@@ -125,6 +130,169 @@ class WritablePipe(with_metaclass(ABCMeta, object)):
                 os.close(readable_fh)
 
 
+class ParallelWritablePipe(WritablePipe):
+    """
+    A :class:`.WritablePipe` that cuts the data written to it into parts of a fixed size and
+    uploads up to a given number of those parts concurrently. Clients should subclass it,
+    implement :meth:`.uploadPart` to store a single part and :meth:`.commit` to assemble the
+    uploaded parts into the final object, then instantiate the class as a context manager to get
+    the writable end.
+
+    >>> import sys
+    >>> class MyPipe(ParallelWritablePipe):
+    ...     def uploadPart(self, partNumber, buf):
+    ...         return buf
+    ...     def commit(self, parts):
+    ...         sys.stdout.write(b''.join(parts).decode('utf-8'))
+    >>> with MyPipe(partSize=4, concurrency=3) as writable:
+    ...     _ = writable.write('Hello, world!\\n'.encode('utf-8'))
+    Hello, world!
+
+    Parts are read into a bounded ring of buffers, so at most `concurrency + 1` parts are held in
+    memory at any time: one being filled from the pipe while the others are being uploaded. A
+    producer that outpaces the uploaders is blocked until a buffer becomes free.
+
+    If a part fails to upload, :meth:`.abort` is invoked and the exception is reraised in the
+    main thread:
+
+    >>> class MyPipe(ParallelWritablePipe):
+    ...     aborted = False
+    ...     def uploadPart(self, partNumber, buf):
+    ...         if partNumber == 2:
+    ...             raise RuntimeError('Hello, world!')
+    ...     def commit(self, parts):
+    ...         assert False
+    ...     def abort(self):
+    ...         self.aborted = True
+    >>> pipe = MyPipe(partSize=4)
+    >>> with pipe as writable:
+    ...     _ = writable.write('Hello, world!'.encode('utf-8'))
+    Traceback (most recent call last):
+    ...
+    RuntimeError: Hello, world!
+    >>> pipe.aborted
+    True
+
+    Empty streams result in no parts being uploaded:
+
+    >>> class MyPipe(ParallelWritablePipe):
+    ...     def uploadPart(self, partNumber, buf):
+    ...         assert False
+    ...     def commit(self, parts):
+    ...         print(parts)
+    >>> with MyPipe(partSize=4) as writable:
+    ...     pass
+    []
+    """
+
+    def __init__(self, partSize, concurrency=4):
+        """
+        :param int partSize: the size of each part in bytes. Every part but the last is exactly
+               this large.
+
+        :param int concurrency: the maximum number of parts to upload concurrently
+        """
+        super(ParallelWritablePipe, self).__init__()
+        assert partSize > 0 and concurrency > 0
+        self.partSize = partSize
+        self.concurrency = concurrency
+
+    @abstractmethod
+    def uploadPart(self, partNumber, buf):
+        """
+        Implement this method to upload a single part. It will be invoked concurrently from
+        multiple threads.
+
+        :param int partNumber: the zero-based index of the part within the stream
+        :param bytes buf: the contents of the part
+        :return: a value identifying the uploaded part, which is passed on to :meth:`.commit`
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def commit(self, parts):
+        """
+        Implement this method to assemble the uploaded parts into the final object.
+
+        :param list parts: the values returned by :meth:`.uploadPart`, ordered by part number.
+               The list is empty if no data was written to the pipe.
+        """
+        raise NotImplementedError()
+
+    def abort(self):
+        """
+        Override this method to clean up after a failed upload, e.g. to delete the parts that
+        were uploaded already. It is invoked with the causing exception being handled.
+        """
+        pass
+
+    def readFrom(self, readable, firstPart=None):
+        """
+        :param file readable: see :meth:`.WritablePipe.readFrom`
+
+        :param bytes firstPart: the first part if it has already been read from the pipe by the
+               caller, e.g. to decide whether the upload should be parallelized in the first place
+        """
+        # Buffers can only be reused once the part they hold has been uploaded
+        freeBuffers = Semaphore(self.concurrency + 1)
+        parts = Queue()
+        results = {}
+        failed = Event()
+
+        def uploader():
+            while True:
+                item = parts.get()
+                if item is None:
+                    break
+                partNumber, buf = item
+                try:
+                    # Once one part failed there is no point in uploading the others, but we
+                    # still need to drain the queue so the reading thread isn't blocked.
+                    if not failed.is_set():
+                        results[partNumber] = self.uploadPart(partNumber, buf)
+                except:
+                    failed.set()
+                    raise
+                finally:
+                    freeBuffers.release()
+
+        threads = [ExceptionalThread(target=uploader) for _ in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        excInfo = None
+        numParts = 0
+        try:
+            while not failed.is_set():
+                freeBuffers.acquire()
+                if firstPart is not None:
+                    buf, firstPart = firstPart, None
+                else:
+                    buf = readable.read(self.partSize)
+                if not buf:
+                    freeBuffers.release()
+                    break
+                parts.put((numParts, buf))
+                numParts += 1
+        except:
+            excInfo = sys.exc_info()
+        finally:
+            for _ in threads:
+                parts.put(None)
+            for thread in threads:
+                try:
+                    thread.join()
+                except:
+                    if excInfo is None:
+                        excInfo = sys.exc_info()
+        if excInfo is not None:
+            try:
+                raise_(*excInfo)
+            except:
+                with panic(log=log):
+                    self.abort()
+        self.commit([results[partNumber] for partNumber in range(numParts)])
+
+
 class ReadablePipe(with_metaclass(ABCMeta, object)):
     """
     An object-oriented wrapper for os.pipe. Clients should subclass it, implement
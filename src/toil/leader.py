@@ -26,6 +26,10 @@ from builtins import super
 import logging
 import time
 import os
+from collections import Counter, OrderedDict, defaultdict, deque
+from heapq import heappush, heappop
+from itertools import count, takewhile
+from six import iteritems
 
 from toil.lib.humanize import bytes2human
 from toil import resolveEntryPoint
@@ -41,7 +45,7 @@ from toil.serviceManager import ServiceManager
 from toil.statsAndLogging import StatsAndLogging
 from toil.job import JobNode, ServiceJobNode
 from toil.toilState import ToilState
-from toil.common import ToilMetrics
+from toil.common import ToilMetrics, getJobQuotas
 
 logger = logging.getLogger( __name__ )
 
@@ -134,6 +138,17 @@ class Leader(object):
         # Map of batch system IDs to IssuedJob tuples
         self.jobBatchSystemIDToIssuedJob = {}
 
+        # The jobs that are ready to be issued, see queueJob(). Maps the set of quotas and
+        # rates that apply to the jobs to a heap of such jobs.
+        self.readyJobs = {}
+        # Breaks ties between ready jobs of equal importance in favour of those queued first
+        self.readyJobSequenceNumbers = count()
+        # The number of issued jobs counted against each of the configured job quotas
+        self.quotaUsage = Counter()
+        # The times at which the jobs counted against each of the configured job rates were
+        # issued, oldest first. Times older than a minute are dropped as the rate is checked.
+        self.rateUsage = defaultdict(deque)
+
         # Number of preemptible jobs currently being run by batch system
         self.preemptableJobsIssued = 0
 
@@ -152,6 +167,15 @@ class Leader(object):
         # used to decide if to reissue an apparently missing job
         self.reissueMissingJobs_missingHash = {}
 
+        # The times at which the currently issued jobs were issued, oldest first, used to find
+        # the jobs that might have been running for too long without asking about all of them
+        self.jobIssueTimes = OrderedDict()
+
+        # Maps the jobStoreIDs of queued jobs that were created with children to those children,
+        # which will be ready to run once the job completed. Used to provision nodes ahead of
+        # demand.
+        self.queuedJobSuccessors = {}
+
         # Class used to create/destroy nodes in the cluster, may be None if
         # using a statically defined cluster
         self.provisioner = provisioner
@@ -160,6 +184,8 @@ class Leader(object):
         self.clusterScaler = None
         if self.provisioner is not None and len(self.provisioner.nodeTypes) > 0:
             self.clusterScaler = ScalerThread(self.provisioner, self, self.config)
+            # Pick up what was learned about the runtimes of jobs before a restart
+            self.clusterScaler.scaler.runtimeEstimator.load(self.jobStore)
 
         # A service manager thread to start and terminate services
         self.serviceManager = ServiceManager(jobStore, self.toilState)
@@ -215,6 +241,7 @@ class Leader(object):
                         startTime = time.time()
                         self.clusterScaler.shutdown()
                         logger.debug('Worker shutdown complete in %s seconds.', time.time() - startTime)
+                        self.clusterScaler.scaler.runtimeEstimator.save(self.jobStore)
 
             finally:
                 # Ensure service manager thread is properly shutdown
@@ -342,7 +369,7 @@ class Leader(object):
         for jobNode in jobGraph.stack[-1]:
             if self._makeJobSuccessorReadyToRun(jobGraph, jobNode):
                 successors.append(jobNode)
-        self.issueJobs(successors)
+        self.queueJobs(successors)
 
     def _processFailedSuccessors(self, jobGraph):
         """Some of the jobs successors failed then either fail the job
@@ -370,7 +397,7 @@ class Leader(object):
             # unless it has more than 1 try.
             logger.warn('Job: %s is being restarted as a checkpoint after the total '
                         'failure of jobs in its subtree.', jobGraph.jobStoreID)
-            self.issueJob(JobNode.fromJobGraph(jobGraph))
+            self.queueJob(JobNode.fromJobGraph(jobGraph))
         else:
             # Mark it totally failed
             logger.debug("Job %s is being processed as completely failed", jobGraph.jobStoreID)
@@ -404,7 +431,9 @@ class Leader(object):
                             jobGraph, jobGraph.jobStoreID)
             else:
                 # Otherwise try the job again
-                self.issueJob(JobNode.fromJobGraph(jobGraph))
+                if jobGraph.stack and jobGraph.stack[-1]:
+                    self.queuedJobSuccessors[jobGraph.jobStoreID] = jobGraph.stack[-1]
+                self.queueJob(JobNode.fromJobGraph(jobGraph))
         elif len(jobGraph.services) > 0:
             # the job has services to run, which have not been started, start them
             # Build a map from the service jobs to the job and a map
@@ -439,7 +468,7 @@ class Leader(object):
             #process that deletes jobs and then feeds them back into the set
             #of jobs to be processed
             if jobGraph.remainingRetryCount > 0:
-                self.issueJob(JobNode.fromJobGraph(jobGraph))
+                self.queueJob(JobNode.fromJobGraph(jobGraph))
                 logger.debug("Job: %s is empty, we are scheduling to clean it up", jobGraph.jobStoreID)
             else:
                 self.processTotallyFailedJob(jobGraph)
@@ -456,6 +485,9 @@ class Leader(object):
         for jobGraph, resultStatus in updatedJobs:
             self._processReadyJob(jobGraph, resultStatus)
 
+        # Now that all jobs that became ready in this round are known, issue them in order
+        self.issueReadyJobs()
+
     def _startServiceJobs(self):
         """Start any service jobs available from the service manager"""
         self.issueQueingServiceJobs()
@@ -526,6 +558,7 @@ class Leader(object):
         self.timeSinceJobsLastRescued = time.time()
 
         while self.toilState.updatedJobs or \
+              self.readyJobs or \
               self.getNumberOfJobsIssued() or \
               self.serviceManager.jobsIssuedToServiceManager:
 
@@ -543,6 +576,10 @@ class Leader(object):
             else:
                 self._processLostJobs()
 
+            # Issue the ready jobs held back by the limits on issued jobs as capacity frees up
+            if self.readyJobs:
+                self.issueReadyJobs()
+
             # Check on the associated threads and exit if a failure is detected
             self.statsAndLogging.check()
             self.serviceManager.check()
@@ -604,6 +641,11 @@ class Leader(object):
         # jobBatchSystemID is an int that is an incremented counter for each job
         jobBatchSystemID = self.batchSystem.issueBatchJob(jobNode)
         self.jobBatchSystemIDToIssuedJob[jobBatchSystemID] = jobNode
+        self.jobIssueTimes[jobBatchSystemID] = time.time()
+        for quota in self._getQuotas(jobNode):
+            self.quotaUsage[quota] += 1
+        for rate in getJobQuotas(jobNode, self.config.jobRates):
+            self.rateUsage[rate].append(time.time())
         if jobNode.preemptable:
             # len(jobBatchSystemIDToIssuedJob) should always be greater than or equal to preemptableJobsIssued,
             # so increment this value after the job is added to the issuedJob dict
@@ -622,6 +664,92 @@ class Leader(object):
         for job in jobs:
             self.issueJob(job)
 
+    def queueJob(self, jobNode):
+        """
+        Add a job to the jobs that are ready to be issued. Ready jobs are issued by
+        issueReadyJobs() in order of decreasing priority and, among jobs of equal priority, in
+        order of decreasing critical path length, so that the jobs with the most work left
+        below them are started first.
+        """
+        heappush(self.readyJobs.setdefault(self._getLimits(jobNode), []),
+                 (-jobNode.priority, -jobNode.criticalPath,
+                  next(self.readyJobSequenceNumbers), jobNode))
+
+    def queueJobs(self, jobs):
+        """Add a list of jobs, each represented as a jobNode object, to the ready jobs."""
+        for job in jobs:
+            self.queueJob(job)
+
+    def issueReadyJobs(self):
+        """
+        Issue the jobs added by queueJob(s), most important first, for as long as neither the
+        maximum number of issued jobs nor any of the quotas or rates on the issued jobs with a
+        particular name or tag is exceeded. The remaining jobs are held until capacity frees up.
+        Since they aren't issued, the cluster scaler doesn't provision nodes for them either.
+        """
+        while self.readyJobs and self.getNumberOfJobsIssued() < self.config.maxJobs:
+            # Jobs subject to the same quotas and rates are kept together so that all jobs held
+            # back by an exhausted quota or rate can be skipped at once
+            heaps = [heap for limits, heap in iteritems(self.readyJobs)
+                     if self._isWithinLimits(limits)]
+            if not heaps:
+                break
+            heap = min(heaps, key=lambda heap: heap[0])
+            _, _, _, jobNode = heappop(heap)
+            if not heap:
+                del self.readyJobs[self._getLimits(jobNode)]
+            self.issueJob(jobNode)
+
+    def getNumberOfJobsReady(self):
+        """
+        Gets the number of jobs that are ready to run but have not yet been issued, e.g. because
+        of the limits on the number of issued jobs.
+        """
+        return sum(len(heap) for heap in self.readyJobs.values())
+
+    def _getQuotas(self, jobNode):
+        """
+        Returns the configured job quotas that apply to the given job, i.e. those for its job
+        name and its tags.
+
+        :rtype: frozenset[str]
+        """
+        return getJobQuotas(jobNode, self.config.jobQuotas)
+
+    def _getLimits(self, jobNode):
+        """
+        Returns the configured job quotas and job rates that apply to the given job.
+
+        :rtype: frozenset[str]
+        """
+        return self._getQuotas(jobNode) | getJobQuotas(jobNode, self.config.jobRates)
+
+    def _isWithinLimits(self, limits):
+        """
+        Returns whether another job subject to the given job quotas and job rates can be issued
+        without exceeding any of them.
+        """
+        now = time.time()
+        for limit in limits:
+            if limit in self.config.jobQuotas:
+                if self.quotaUsage[limit] >= self.config.jobQuotas[limit]:
+                    return False
+            if limit in self.config.jobRates:
+                issueTimes = self.rateUsage[limit]
+                while issueTimes and issueTimes[0] <= now - 60:
+                    issueTimes.popleft()
+                if len(issueTimes) >= self.config.jobRates[limit]:
+                    return False
+        return True
+
+    def _canIssue(self, jobNode):
+        """
+        Returns whether the given job can be issued without exceeding the maximum number of
+        issued jobs or any of the job quotas and job rates that apply to it.
+        """
+        return (self.getNumberOfJobsIssued() < self.config.maxJobs
+                and self._isWithinLimits(self._getLimits(jobNode)))
+
     def issueServiceJob(self, jobNode):
         """
         Issue a service job, putting it on a queue if the maximum number of service
@@ -634,11 +762,16 @@ class Leader(object):
         self.issueQueingServiceJobs()
 
     def issueQueingServiceJobs(self):
-        """Issues any queuing service jobs up to the limit of the maximum allowed."""
-        while len(self.serviceJobsToBeIssued) > 0 and self.serviceJobsIssued < self.config.maxServiceJobs:
+        """
+        Issues any queuing service jobs up to the limit of the maximum allowed, as long as they
+        don't exceed the maximum number of issued jobs or their job quotas and rates either.
+        """
+        while len(self.serviceJobsToBeIssued) > 0 and self.serviceJobsIssued < self.config.maxServiceJobs \
+                and self._canIssue(self.serviceJobsToBeIssued[-1]):
             self.issueJob(self.serviceJobsToBeIssued.pop())
             self.serviceJobsIssued += 1
-        while len(self.preemptableServiceJobsToBeIssued) > 0 and self.preemptableServiceJobsIssued < self.config.maxPreemptableServiceJobs:
+        while len(self.preemptableServiceJobsToBeIssued) > 0 and self.preemptableServiceJobsIssued < self.config.maxPreemptableServiceJobs \
+                and self._canIssue(self.preemptableServiceJobsToBeIssued[-1]):
             self.issueJob(self.preemptableServiceJobsToBeIssued.pop())
             self.preemptableServiceJobsIssued += 1
 
@@ -670,6 +803,11 @@ class Leader(object):
             assert self.preemptableJobsIssued > 0
             self.preemptableJobsIssued -= 1
         del self.jobBatchSystemIDToIssuedJob[jobBatchSystemID]
+        self.jobIssueTimes.pop(jobBatchSystemID, None)
+        self.queuedJobSuccessors.pop(jobNode.jobStoreID, None)
+        self.reissueMissingJobs_missingHash.pop(jobBatchSystemID, None)
+        for quota in self._getQuotas(jobNode):
+            self.quotaUsage[quota] -= 1
         # If service job
         if jobNode.jobStoreID in self.toilState.serviceJobStoreIDToPredecessorJob:
             # Decrement the number of services
@@ -681,11 +819,45 @@ class Leader(object):
         return jobNode
 
     def getJobs(self, preemptable=None):
+        """
+        Gets the jobs that have been issued to the batch system. This excludes ready jobs held
+        back by the limits on the number of issued jobs, so that the cluster scaler, which sizes
+        the cluster according to these jobs, doesn't provision nodes for them.
+
+        :param None or boolean preemptable: If none, return all types of jobs. Otherwise only
+          return either preemptable or non-preemptable jobs.
+        """
         jobs = self.jobBatchSystemIDToIssuedJob.values()
         if preemptable is not None:
             jobs = [job for job in jobs if job.preemptable == preemptable]
         return jobs
 
+    def getImminentJobs(self):
+        """
+        Gets the jobs that will be ready to run as soon as an issued job completes: the children
+        the issued job was created with and, if the issued job is the last outstanding successor
+        of its predecessor, the follow-ons of the predecessor. Successors that wait on other
+        predecessors, and those that jobs create while running, are unknown until then.
+
+        :return: a list of tuples of the batch system ID of an issued job, the issued job and
+                 the jobs it releases
+        :rtype: list[(int,JobNode,list[JobNode])]
+        """
+        imminentJobs = []
+        # The scaler thread calls this while the leader thread modifies the issued jobs
+        for jobBatchSystemID, jobNode in list(self.jobBatchSystemIDToIssuedJob.items()):
+            successors = list(self.queuedJobSuccessors.get(jobNode.jobStoreID, ()))
+            for predecessor in self.toilState.successorJobStoreIDToPredecessorJobs.get(
+                    jobNode.jobStoreID, ()):
+                if (self.toilState.successorCounts.get(predecessor.jobStoreID) == 1
+                        and len(predecessor.stack) > 1):
+                    successors.extend(predecessor.stack[-2])
+            successors = [successor for successor in successors
+                          if successor.predecessorNumber <= 1]
+            if successors:
+                imminentJobs.append((jobBatchSystemID, jobNode, successors))
+        return imminentJobs
+
     def killJobs(self, jobsToKill):
         """
         Kills the given set of jobs and then sends them for processing
@@ -702,17 +874,28 @@ class Leader(object):
         Check each issued job - if it is running for longer than desirable
         issue a kill instruction.
         Wait for the job to die then we pass the job to processFinishedJob.
+
+        A job can't have been running for longer than it has been issued, so only the jobs
+        issued more than the maximum job duration ago are checked, and the batch system is only
+        asked for the running times of its jobs if there are any such jobs.
         """
         maxJobDuration = self.config.maxJobDuration
         jobsToKill = []
         if maxJobDuration < 10000000:  # We won't bother doing anything if rescue time > 16 weeks.
+            cutoff = time.time() - maxJobDuration
+            # Jobs are issued in order, so the candidates are at the front
+            candidates = [jobBatchSystemID for jobBatchSystemID, issueTime in
+                          takewhile(lambda item: item[1] < cutoff, iteritems(self.jobIssueTimes))]
+            if not candidates:
+                return
             runningJobs = self.batchSystem.getRunningBatchJobIDs()
-            for jobBatchSystemID in list(runningJobs.keys()):
-                if runningJobs[jobBatchSystemID] > maxJobDuration:
+            for jobBatchSystemID in candidates:
+                runningTime = runningJobs.get(jobBatchSystemID)
+                if runningTime is not None and runningTime > maxJobDuration:
                     logger.warn("The job: %s has been running for: %s seconds, more than the "
                                 "max job duration: %s, we'll kill it",
                                 str(self.jobBatchSystemIDToIssuedJob[jobBatchSystemID].jobStoreID),
-                                str(runningJobs[jobBatchSystemID]),
+                                str(runningTime),
                                 str(maxJobDuration))
                     jobsToKill.append(jobBatchSystemID)
             self.killJobs(jobsToKill)
@@ -723,18 +906,27 @@ class Leader(object):
         If a job is missing, we mark it as so, if it is missing for a number of runs of
         this function (say 10).. then we try deleting the job (though its probably lost), we wait
         then we pass the job to processFinishedJob.
+
+        The batch system only ever knows about jobs issued by the leader, so as long as it
+        counts as many jobs as the leader issued, no job is missing and the job IDs aren't
+        compared.
         """
+        if self.batchSystem.getNumberOfIssuedBatchJobs() == len(self.jobBatchSystemIDToIssuedJob):
+            for jobBatchSystemID in self.reissueMissingJobs_missingHash:
+                logger.warn("Batch system id: %s is no longer missing", str(jobBatchSystemID))
+            self.reissueMissingJobs_missingHash.clear()
+            return True
         runningJobs = set(self.batchSystem.getIssuedBatchJobIDs())
-        jobBatchSystemIDsSet = set(list(self.jobBatchSystemIDToIssuedJob.keys()))
-        #Clean up the reissueMissingJobs_missingHash hash, getting rid of jobs that have turned up
-        missingJobIDsSet = set(list(self.reissueMissingJobs_missingHash.keys()))
-        for jobBatchSystemID in missingJobIDsSet.difference(jobBatchSystemIDsSet):
+        jobBatchSystemIDsSet = set(self.jobBatchSystemIDToIssuedJob)
+        # Clean up the reissueMissingJobs_missingHash hash, getting rid of jobs that have turned
+        # up. Jobs removed by the leader were already dropped from it by removeJob().
+        for jobBatchSystemID in runningJobs.intersection(self.reissueMissingJobs_missingHash):
             self.reissueMissingJobs_missingHash.pop(jobBatchSystemID)
             logger.warn("Batch system id: %s is no longer missing", str(jobBatchSystemID))
         assert runningJobs.issubset(jobBatchSystemIDsSet) #Assert checks we have
         #no unexpected jobs running
         jobsToKill = []
-        for jobBatchSystemID in set(jobBatchSystemIDsSet.difference(runningJobs)):
+        for jobBatchSystemID in jobBatchSystemIDsSet.difference(runningJobs):
             jobStoreID = self.jobBatchSystemIDToIssuedJob[jobBatchSystemID].jobStoreID
             if jobBatchSystemID in self.reissueMissingJobs_missingHash:
                 self.reissueMissingJobs_missingHash[jobBatchSystemID] += 1
@@ -19,6 +19,7 @@ from future.utils import raise_
 from builtins import range
 import sys
 import threading
+from six.moves.queue import Queue
 if sys.version_info >= (3, 0):
     from threading import BoundedSemaphore
 else:
@@ -86,6 +87,58 @@ class ExceptionalThread(threading.Thread):
             raise_(type, value, traceback)
 
 
+def concurrently(function, items, maxThreads):
+    """
+    Applies the given function to each of the given items using up to the given number of
+    threads and returns the results in the order of the items. If the function raises an
+    exception for an item, the remaining items are skipped and the exception is re-raised.
+
+    >>> concurrently(lambda x: x * 2, range(5), 3)
+    [0, 2, 4, 6, 8]
+    >>> def f(x):
+    ...     assert x != 3
+    >>> concurrently(f, range(5), 3)
+    Traceback (most recent call last):
+    ...
+    AssertionError
+    >>> concurrently(f, [], 3)
+    []
+    """
+    items = list(items)
+    results = [None] * len(items)
+    numThreads = min(maxThreads, len(items))
+    if numThreads <= 1:
+        for i, item in enumerate(items):
+            results[i] = function(item)
+        return results
+    queue = Queue()
+    failed = threading.Event()
+
+    def worker():
+        while True:
+            task = queue.get()
+            if task is None:
+                break
+            # Once one item failed there is no point in doing the others
+            if not failed.is_set():
+                i, item = task
+                try:
+                    results[i] = function(item)
+                except:
+                    failed.set()
+                    raise
+
+    for task in enumerate(items):
+        queue.put(task)
+    threads = [ExceptionalThread(target=worker) for _ in range(numThreads)]
+    for thread in threads:
+        queue.put(None)
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
 # noinspection PyPep8Naming
 class defaultlocal(threading.local):
     """
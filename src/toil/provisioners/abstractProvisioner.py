@@ -17,10 +17,12 @@ from builtins import object
 from functools import total_ordering
 import logging
 import os.path
+import threading
 
 from toil import subprocess
 from toil import applianceSelf
 from toil.lib.retry import never
+from toil.lib.threading import concurrently
 
 a_short_time = 5
 log = logging.getLogger(__name__)
@@ -37,20 +39,25 @@ class Shape(object):
 
     The memory and disk attributes store the number of bytes required by a job (or provided by a
     node) in RAM or on disk (SSD or HDD), respectively.
+
+    The consumables attribute maps the names of custom consumable resources, e.g. license seats,
+    to the amount of each required by a job (or provided by a node).
     """
-    def __init__(self, wallTime, memory, cores, disk, preemptable):
+    def __init__(self, wallTime, memory, cores, disk, preemptable, consumables=None):
         self.wallTime = wallTime
         self.memory = memory
         self.cores = cores
         self.disk = disk
         self.preemptable = preemptable
+        self.consumables = consumables or {}
 
     def __eq__(self, other):
         return (self.wallTime == other.wallTime and
                 self.memory == other.memory and
                 self.cores == other.cores and
                 self.disk == other.disk and
-                self.preemptable == other.preemptable)
+                self.preemptable == other.preemptable and
+                self.consumables == other.consumables)
 
     def greater_than(self, other):
         if self.preemptable < other.preemptable:
@@ -80,12 +87,13 @@ class Shape(object):
         return self.greater_than(other)
 
     def __repr__(self):
-        return "Shape(wallTime=%s, memory=%s, cores=%s, disk=%s, preemptable=%s)" % \
+        return "Shape(wallTime=%s, memory=%s, cores=%s, disk=%s, preemptable=%s%s)" % \
                (self.wallTime,
                 self.memory,
                 self.cores,
                 self.disk,
-                self.preemptable)
+                self.preemptable,
+                ", consumables=%r" % self.consumables if self.consumables else "")
 
     def __str__(self):
         return self.__repr__()
@@ -97,7 +105,8 @@ class Shape(object):
              self.memory,
              self.cores,
              self.disk,
-             self.preemptable))
+             self.preemptable,
+             frozenset(self.consumables.items())))
 
 
 class AbstractProvisioner(with_metaclass(ABCMeta, object)):
@@ -107,6 +116,13 @@ class AbstractProvisioner(with_metaclass(ABCMeta, object)):
     """
     LEADER_HOME_DIR = '/root/'  # home directory in the Toil appliance on an instance
 
+    #: The maximum number of newly launched nodes that are waited for and set up at once
+    maxConcurrentNodeSetups = 50
+
+    #: Whether the methods of this provisioner may be called from several threads at once. The
+    #: cluster scaler only resizes node types concurrently if they may.
+    threadSafe = False
+
     def __init__(self, clusterName=None, zone=None, nodeStorage=50):
         """
         Initialize provisioner.
@@ -233,6 +249,49 @@ class AbstractProvisioner(with_metaclass(ABCMeta, object)):
         """
         raise NotImplementedError
 
+    def _setUpNodes(self, setUp, nodes):
+        """
+        Calls the given function on each of the given newly launched nodes concurrently, e.g. to
+        wait for them to boot and to copy credentials to them.
+
+        :param setUp: a function taking a node
+        :param list nodes: the nodes, in whatever form setUp expects them
+        :return: the nodes that setUp raised an exception for
+        :rtype: list
+        """
+        def trySetUp(node):
+            try:
+                setUp(node)
+            except Exception:
+                log.exception('Failed to set up node %s.', node)
+                return node
+
+        results = concurrently(trySetUp, nodes, self.maxConcurrentNodeSetups)
+        return [node for node in results if node is not None]
+
+    def _setUpNodesInBackground(self, setUp, nodes, onFailure):
+        """
+        Like _setUpNodes() but returns right away, so that the cluster scaler can carry on while
+        the nodes boot. Only use this for set up that nodes wait for before they accept jobs.
+
+        :param onFailure: a function that is passed the list of nodes that failed to be set up,
+               e.g. to terminate them
+        :rtype: threading.Thread
+        """
+        def run():
+            try:
+                failedNodes = self._setUpNodes(setUp, nodes)
+                if failedNodes:
+                    log.error('Failed to set up %i of %i node(s).', len(failedNodes), len(nodes))
+                    onFailure(failedNodes)
+            except Exception:
+                log.exception('Failed to set up nodes.')
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return thread
+
     def _setSSH(self):
         """
         Generate a key pair, save it in /root/.ssh/id_rsa.pub, and return the public key.
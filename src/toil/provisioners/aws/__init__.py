@@ -19,8 +19,6 @@ import datetime
 from toil.lib.misc import std_dev, mean
 from six import string_types
 
-from toil.test import runningOnEC2
-
 logger = logging.getLogger(__name__)
 
 ZoneTuple = namedtuple('ZoneTuple', ['name', 'price_deviation'])
@@ -48,6 +46,8 @@ def _getCurrentAWSZone(spotBid=None, nodeType=None, ctx=None):
     except ImportError:
         pass
     else:
+        # Importing toil.test pulls in pytest, so defer it until it is actually needed
+        from toil.test import runningOnEC2
         zone = os.environ.get('TOIL_AWS_ZONE', None)
         if not zone and runningOnEC2():
             try:
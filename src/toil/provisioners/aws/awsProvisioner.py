@@ -17,6 +17,7 @@ from builtins import str
 from builtins import range
 import time
 import string
+import threading
 
 # Python 3 compatibility imports
 from _ssl import SSLError
@@ -92,11 +93,14 @@ class AWSProvisioner(AbstractProvisioner):
     """
     Implements an AWS provisioner using the boto libraries.
     """
+    # Every thread talks to AWS through a context of its own, see _ctx
+    threadSafe = True
 
     def __init__(self, clusterName, zone, nodeStorage, sseKey):
         super(AWSProvisioner, self).__init__(clusterName, zone, nodeStorage)
         self.cloud = 'aws'
         self._sseKey = sseKey
+        self._threadContexts = threading.local()
         if not zone:
             self._zone = getCurrentAWSZone()
         if clusterName:
@@ -288,22 +292,31 @@ class AWSProvisioner(AbstractProvisioner):
                     # flatten the list
                     instancesLaunched = [item for sublist in instancesLaunched for item in sublist]
 
-        for attempt in retry(predicate=awsRetryPredicate):
-            with attempt:
-                wait_instances_running(self._ctx.ec2, instancesLaunched)
-
-        AWSProvisioner._addTags(instancesLaunched, self._tags)
+        # Tag all instances at once rather than making a request per instance and tag
+        if instancesLaunched and self._tags:
+            self._addTagsToIDs([i.id for i in instancesLaunched], self._tags)
         if self._sseKey:
-            for i in instancesLaunched:
-                self._waitForIP(i)
-                node = Node(publicIP=i.ip_address, privateIP=i.private_ip_address, name=i.id,
-                            launchTime=i.launch_time, nodeType=i.instance_type, preemptable=preemptable,
-                            tags=i.tags)
-                node.waitForNode('toil_worker')
-                node.coreRsync([self._sseKey, ':' + self._sseKey], applianceName='toil_worker')
+            # The Mesos agent of a new instance only starts once the key is on it (see
+            # waitForKey.sh), so the instances can be counted while the key is copied to them in
+            # the background. Instances the key can't be copied to are terminated and drop out
+            # of the count on the next scaling tick.
+            self._setUpNodesInBackground(setUp=lambda i: self._copySSEKey(i, preemptable),
+                                         nodes=instancesLaunched,
+                                         onFailure=lambda failed: self._terminateIDs(
+                                             [i.id for i in failed]))
         logger.debug('Launched %s new instance(s)', numNodes)
         return len(instancesLaunched)
 
+    def _copySSEKey(self, instance, preemptable):
+        # Poll the instance through this thread's own connection
+        instance.connection = self._ctx.ec2
+        self._waitForIP(instance)
+        node = Node(publicIP=instance.ip_address, privateIP=instance.private_ip_address,
+                    name=instance.id, launchTime=instance.launch_time,
+                    nodeType=instance.instance_type, preemptable=preemptable, tags=instance.tags)
+        node.waitForNode('toil_worker')
+        node.coreRsync([self._sseKey, ':' + self._sseKey], applianceName='toil_worker')
+
     def getProvisionedWorkers(self, nodeType, preemptable):
         assert self._leaderPrivateIP
         entireCluster = self._getNodesInCluster(both=True, nodeType=nodeType)
@@ -328,7 +341,24 @@ class AWSProvisioner(AbstractProvisioner):
                     'is set, ec2_region_name is set in the .boto file, or that '
                     'you are running on EC2.')
         logger.debug("Building AWS context in zone %s for cluster %s" % (self._zone, self.clusterName))
-        self._ctx = Context(availability_zone=self._zone, namespace=self._toNameSpace())
+        self._threadContexts.ctx = Context(availability_zone=self._zone,
+                                           namespace=self._toNameSpace())
+
+    @property
+    def _ctx(self):
+        """
+        The AWS context of the calling thread. The cluster scaler resizes node types from
+        concurrent threads, and boto 2 connections must not be shared between threads, so every
+        thread gets a context of its own.
+
+        :rtype: Context
+        """
+        try:
+            return self._threadContexts.ctx
+        except AttributeError:
+            self._threadContexts.ctx = Context(availability_zone=self._zone,
+                                               namespace=self._toNameSpace())
+            return self._threadContexts.ctx
 
     @memoize
     def _discoverAMI(self):
@@ -384,6 +414,10 @@ class AWSProvisioner(AbstractProvisioner):
     def _addTag(cls, instance, key, value):
         instance.add_tag(key, value)
 
+    @awsRetry
+    def _addTagsToIDs(self, resourceIDs, tags):
+        self._ctx.ec2.create_tags(resourceIDs, tags)
+
     @classmethod
     def _addTags(cls, instances, tags):
         for instance in instances:
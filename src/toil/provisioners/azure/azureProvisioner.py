@@ -254,21 +254,22 @@ class AzureProvisioner(AnsibleDriver):
         # Wait for nodes - needed if transferring credential files
         allWorkers = self.getProvisionedWorkers(None)
         nodesIndex = dict((x.name, x) for x in allWorkers)
-        numLaunched = 0
+        nodes = []
         for vmName in instances:
             if vmName in nodesIndex:
-                try:
-                    self._addToHosts(nodesIndex[vmName], nodesIndex[vmName].publicIP)
-                    if self._onLeader:
-                        self._addToHosts(nodesIndex[vmName]) # add to leader, too
-                    nodesIndex[vmName].waitForNode('toil_worker')
-                    numLaunched += 1
-                except RuntimeError as e:
-                    print(e)
-                # TODO: add code to transfer sse key here
+                nodes.append(nodesIndex[vmName])
             else:
                 logger.debug("Instance %s failed to launch", vmName)
-        return numLaunched
+
+        def setUp(node):
+            self._addToHosts(node, node.publicIP)
+            if self._onLeader:
+                self._addToHosts(node) # add to leader, too
+            node.waitForNode('toil_worker')
+            # TODO: add code to transfer sse key here
+
+        # Wait for all nodes at once rather than for each of them in turn
+        return len(nodes) - len(self._setUpNodes(setUp, nodes))
 
     def getNodeShape(self, nodeType=None, preemptable=False):
         # FIXME: this should only needs to be called once, but failed
@@ -20,19 +20,22 @@ standard_library.install_aliases()
 from builtins import str
 from builtins import map
 from builtins import object
+import itertools
 import json
 import logging
 import os
 import time
-from collections import defaultdict
+from collections import Counter, defaultdict
+from six import iteritems
 
 from toil.lib.retry import retry
-from toil.lib.threading import ExceptionalThread
+from toil.lib.threading import ExceptionalThread, concurrently
 from toil.lib.throttle import throttle
 from itertools import islice
 
 from toil.batchSystems.abstractBatchSystem import AbstractScalableBatchSystem, NodeInfo
 from toil.provisioners.abstractProvisioner import Shape
+from toil.provisioners.runtimeEstimator import RuntimeEstimator
 from toil.job import ServiceJobNode
 from toil.common import defaultTargetTime
 
@@ -61,24 +64,35 @@ class BinPackedFit(object):
         self.nodeShapes = sorted(nodeShapes)
         self.targetTime = targetTime
         self.nodeReservations = {nodeShape:[] for nodeShape in nodeShapes}
+        # Where the packed jobs of each shape went, as (node shape, node reservation, job ID)
+        # tuples, so that they can be taken out again by removeJobShape()
+        self._placements = defaultdict(list)
+        # The number of jobs packed into each node reservation
+        self._jobsPerReservation = Counter()
+        self._jobIDs = itertools.count()
 
     def binPack(self, jobShapes):
-        """Pack a list of jobShapes into the fewest nodes reasonable. Can be run multiple times."""
+        """
+        Pack jobShapes into the fewest nodes reasonable. Can be run multiple times.
+
+        :param jobShapes: a list of job shapes or a dict mapping job shapes to the number of
+               jobs of that shape
+        """
         # TODO: Check for redundancy with batchsystems.mesos.JobQueue() sorting
-        logger.debug('Running bin packing for node shapes %s and %s job(s).',
-                     self.nodeShapes, len(jobShapes))
+        jobShapeCounts = Counter(jobShapes)
+        logger.debug('Running bin packing for node shapes %s and %s job(s) of %s shape(s).',
+                     self.nodeShapes, sum(jobShapeCounts.values()), len(jobShapeCounts))
         # Sort in descending order from largest to smallest. The FFD like-strategy will pack the
-        # jobs in order from longest to shortest.
-        jobShapes.sort()
-        jobShapes.reverse()
-        assert len(jobShapes) == 0 or jobShapes[0] >= jobShapes[-1]
-        for jS in jobShapes:
-            self.addJobShape(jS)
+        # jobs in order from longest to shortest. Jobs of identical shape are packed together.
+        for jobShape in sorted(jobShapeCounts, reverse=True):
+            self.addJobShape(jobShape, jobShapeCounts[jobShape])
 
-    def addJobShape(self, jobShape):
+    def addJobShape(self, jobShape, count=1):
         """
         Function adds the job to the first node reservation in which it will fit (this is the
         bin-packing aspect).
+
+        :param int count: the number of identical jobs to add
         """
         chosenNodeShape = None
         for nodeShape in self.nodeShapes:
@@ -88,28 +102,104 @@ class BinPackedFit(object):
                 break
 
         if chosenNodeShape is None:
-            logger.warning("Couldn't fit job with requirements %r into any nodes in the nodeTypes "
-                           "list." % jobShape)
+            logger.warning("Couldn't fit %i job(s) with requirements %r into any nodes in the "
+                           "nodeTypes list." % (count, jobShape))
             return
 
         # grab current list of job objects appended to this nodeType
         nodeReservations = self.nodeReservations[chosenNodeShape]
-        for nodeReservation in nodeReservations:
-            if nodeReservation.attemptToAddJob(jobShape, chosenNodeShape, self.targetTime):
-                # We succeeded adding the job to this node reservation. Now we're done.
-                return
+        # Resources are only ever taken away from a reservation while jobs are added, so a
+        # reservation that turned down a job will turn down an identical one as well. Each job
+        # therefore only tries the reservations that did not turn down the job before it.
+        index = 0
+        while count and index < len(nodeReservations):
+            job = next(self._jobIDs)
+            if nodeReservations[index].attemptToAddJob(jobShape, chosenNodeShape,
+                                                       self.targetTime, job):
+                # We succeeded adding the job to this node reservation.
+                self._placeJob(jobShape, chosenNodeShape, nodeReservations[index], job)
+                count -= 1
+            else:
+                index += 1
+        if count:
+            # The remaining jobs go on new nodes. Each of them would be filled with the same jobs
+            # in the same way, so only the first node is packed job by job and the other full
+            # nodes are copies of it. The reservations are chains of time slices that get split
+            # as jobs are added, so they aren't kept in capacity arrays.
+            reservation, jobs = self._fillNode(chosenNodeShape, jobShape, count)
+            self._addNode(chosenNodeShape, jobShape, reservation, jobs)
+            count -= len(jobs)
+            for _ in range(count // len(jobs)):
+                copiedJobs = [next(self._jobIDs) for _ in jobs]
+                self._addNode(chosenNodeShape, jobShape,
+                              reservation.copy(dict(zip(jobs, copiedJobs))), copiedJobs)
+            count %= len(jobs)
+            if count:
+                self._addNode(chosenNodeShape, jobShape,
+                              *self._fillNode(chosenNodeShape, jobShape, count))
+
+    def removeJobShape(self, jobShape, count=1):
+        """
+        Takes packed jobs of the given shape back out of the node reservations they went into,
+        dropping the reservations that are left without jobs. The other jobs stay where they are.
 
+        :param int count: the number of identical jobs to remove
+        """
+        placements = self._placements[jobShape]
+        for _ in range(min(count, len(placements))):
+            nodeShape, reservation, job = placements.pop()
+            reservation.release(jobShape, job)
+            self._jobsPerReservation[reservation] -= 1
+            if self._jobsPerReservation[reservation] == 0:
+                del self._jobsPerReservation[reservation]
+                self.nodeReservations[nodeShape].remove(reservation)
+
+    def _fillNode(self, nodeShape, jobShape, count):
+        """
+        Returns a reservation for a new node of the given shape running as many of count jobs of
+        the given shape as fit on it, and the IDs of those jobs.
+        """
+        jobs = [next(self._jobIDs)]
+        reservation = self._reserveNode(nodeShape, jobShape, jobs[0])
+        while len(jobs) < count:
+            job = next(self._jobIDs)
+            if not reservation.attemptToAddJob(jobShape, nodeShape, self.targetTime, job):
+                break
+            jobs.append(job)
+        return reservation, jobs
+
+    def _addNode(self, nodeShape, jobShape, reservation, jobs):
+        """
+        Adds a reservation for a new node running the given jobs of the given shape.
+        """
+        self.nodeReservations[nodeShape].append(reservation)
+        for job in jobs:
+            self._placeJob(jobShape, nodeShape, reservation, job)
+
+    def _placeJob(self, jobShape, nodeShape, reservation, job):
+        """
+        Records that the given job went into the given node reservation.
+        """
+        self._placements[jobShape].append((nodeShape, reservation, job))
+        self._jobsPerReservation[reservation] += 1
+
+    @staticmethod
+    def _reserveNode(chosenNodeShape, jobShape, job=None):
+        """
+        Returns a reservation for a new node of the given shape running the given job.
+        """
         reservation = NodeReservation(chosenNodeShape)
         currentTimeAllocated = chosenNodeShape.wallTime
-        adjustEndingReservationForJob(reservation, jobShape, 0)
-        self.nodeReservations[chosenNodeShape].append(reservation)
+        adjustEndingReservationForJob(reservation, jobShape, 0, job)
+        firstReservation = reservation
 
         # Extend the reservation if necessary to cover the job's entire runtime.
         while currentTimeAllocated < jobShape.wallTime:
-            extendThisReservation = NodeReservation(reservation.shape)
+            extendThisReservation = NodeReservation(reservation.shape, reservation.jobs)
             currentTimeAllocated += chosenNodeShape.wallTime
             reservation.nReservation = extendThisReservation
             reservation = extendThisReservation
+        return firstReservation
 
     def getRequiredNodes(self):
         """
@@ -125,11 +215,13 @@ class NodeReservation(object):
     reservation as a linked list of NodeReservations, each giving the
     resources free within a single timeslice.
     """
-    def __init__(self, shape):
+    def __init__(self, shape, jobs=()):
         # The wall-time of this slice and resources available in this timeslice
         self.shape = shape
         # The next portion of the reservation (None if this is the end)
         self.nReservation = None
+        # The IDs of the packed jobs whose resources were taken from this timeslice
+        self.jobs = list(jobs)
 
     def __str__(self):
         return "-------------------\n" \
@@ -166,7 +258,9 @@ class NodeReservation(object):
         return jobShape.memory <= self.shape.memory and \
                jobShape.cores <= self.shape.cores and \
                jobShape.disk <= self.shape.disk and \
-               (jobShape.preemptable or not self.shape.preemptable)
+               (jobShape.preemptable or not self.shape.preemptable) and \
+               all(amount <= self.shape.consumables.get(name, 0)
+                   for name, amount in iteritems(jobShape.consumables))
 
     def shapes(self):
         """Get all time-slice shapes, in order, from this reservation on."""
@@ -177,7 +271,7 @@ class NodeReservation(object):
             curRes = curRes.nReservation
         return shapes
 
-    def subtract(self, jobShape):
+    def subtract(self, jobShape, job=None):
         """
         Subtracts the resources necessary to run a jobShape from the reservation.
         """
@@ -185,14 +279,53 @@ class NodeReservation(object):
                            self.shape.memory - jobShape.memory,
                            self.shape.cores - jobShape.cores,
                            self.shape.disk - jobShape.disk,
-                           self.shape.preemptable)
+                           self.shape.preemptable,
+                           subtractConsumables(self.shape.consumables, jobShape.consumables))
+        if job is not None:
+            self.jobs.append(job)
+
+    def release(self, jobShape, job):
+        """
+        Gives the resources of the given packed job back to the timeslices of this reservation
+        and the ones after it that they were taken from.
+        """
+        reservation = self
+        while reservation is not None:
+            if job in reservation.jobs:
+                reservation.jobs.remove(job)
+                reservation.shape = Shape(reservation.shape.wallTime,
+                                          reservation.shape.memory + jobShape.memory,
+                                          reservation.shape.cores + jobShape.cores,
+                                          reservation.shape.disk + jobShape.disk,
+                                          reservation.shape.preemptable,
+                                          addConsumables(reservation.shape.consumables,
+                                                         jobShape.consumables))
+            reservation = reservation.nReservation
+
+    def copy(self, jobs):
+        """
+        Returns a copy of this reservation and the ones after it, with the IDs of the packed jobs
+        mapped through the given dict.
+        """
+        firstCopy = lastCopy = None
+        reservation = self
+        while reservation is not None:
+            copy = NodeReservation(reservation.shape, [jobs[job] for job in reservation.jobs])
+            if lastCopy is None:
+                firstCopy = copy
+            else:
+                lastCopy.nReservation = copy
+            lastCopy = copy
+            reservation = reservation.nReservation
+        return firstCopy
 
-    def attemptToAddJob(self, jobShape, nodeShape, targetTime):
+    def attemptToAddJob(self, jobShape, nodeShape, targetTime, job=None):
         """
         Attempt to pack a job into this reservation timeslice and/or the reservations after it.
 
         jobShape is the Shape of the job requirements, nodeShape is the Shape of the node this
         is a reservation for, and targetTime is the maximum time to wait before starting this job.
+        job is an ID under which the job is recorded in the timeslices, see release().
         """
         # starting slice of time that we can fit in so far
         startingReservation = self
@@ -213,12 +346,12 @@ class NodeReservation(object):
                     timeSlice = 0
                     while startingReservation != endingReservation:
                         # removes resources only (NO time) from startingReservation
-                        startingReservation.subtract(jobShape)
+                        startingReservation.subtract(jobShape, job)
                         # set aside the timeSlice
                         timeSlice += startingReservation.shape.wallTime
                         startingReservation = startingReservation.nReservation
                     assert jobShape.wallTime - timeSlice <= startingReservation.shape.wallTime
-                    adjustEndingReservationForJob(endingReservation, jobShape, timeSlice)
+                    adjustEndingReservationForJob(endingReservation, jobShape, timeSlice, job)
                     # Packed the job.
                     return True
 
@@ -244,7 +377,7 @@ class NodeReservation(object):
         # Couldn't pack the job.
         return False
 
-def adjustEndingReservationForJob(reservation, jobShape, wallTime):
+def adjustEndingReservationForJob(reservation, jobShape, wallTime, job=None):
     """
     Add a job to an ending reservation that ends at wallTime, splitting
     the reservation if the job doesn't fill the entire timeslice.
@@ -252,11 +385,14 @@ def adjustEndingReservationForJob(reservation, jobShape, wallTime):
     if jobShape.wallTime - wallTime < reservation.shape.wallTime:
         # This job only partially fills one of the slices. Create a new slice.
         reservation.shape, nS = split(reservation.shape, jobShape, jobShape.wallTime - wallTime)
+        nS.jobs = list(reservation.jobs)
         nS.nReservation = reservation.nReservation
         reservation.nReservation = nS
+        if job is not None:
+            reservation.jobs.append(job)
     else:
         # This job perfectly fits within the boundaries of the slices.
-        reservation.subtract(jobShape)
+        reservation.subtract(jobShape, job)
 
 def split(nodeShape, jobShape, wallTime):
     """
@@ -268,12 +404,28 @@ def split(nodeShape, jobShape, wallTime):
                   nodeShape.memory - jobShape.memory,
                   nodeShape.cores - jobShape.cores,
                   nodeShape.disk - jobShape.disk,
-                  nodeShape.preemptable),
+                  nodeShape.preemptable,
+                  subtractConsumables(nodeShape.consumables, jobShape.consumables)),
             NodeReservation(Shape(nodeShape.wallTime - wallTime,
                                   nodeShape.memory,
                                   nodeShape.cores,
                                   nodeShape.disk,
-                                  nodeShape.preemptable)))
+                                  nodeShape.preemptable,
+                                  nodeShape.consumables)))
+
+def subtractConsumables(available, required):
+    """
+    Returns the amounts of the available consumable resources that are left once the required
+    amounts are taken from them.
+    """
+    return {name: amount - required.get(name, 0) for name, amount in iteritems(available)}
+
+def addConsumables(available, released):
+    """
+    Returns the amounts of the available consumable resources once the released amounts are
+    given back to them.
+    """
+    return {name: amount + released.get(name, 0) for name, amount in iteritems(available)}
 
 def binPacking(nodeShapes, jobShapes, goalTime):
     bpf = BinPackedFit(nodeShapes, goalTime)
@@ -281,25 +433,25 @@ def binPacking(nodeShapes, jobShapes, goalTime):
     return bpf.getRequiredNodes()
 
 class ClusterScaler(object):
-    def __init__(self, provisioner, leader, config):
+    def __init__(self, provisioner, leader, config, runtimeEstimator=None):
         """
         Class manages automatically scaling the number of worker nodes.
 
         :param AbstractProvisioner provisioner: Provisioner instance to scale.
         :param toil.leader.Leader leader:
         :param Config config: Config object from which to draw parameters.
+        :param AbstractRuntimeEstimator runtimeEstimator: Predicts the wall time of queued jobs
+               for bin-packing. Defaults to a RuntimeEstimator using config.runtimeQuantile.
         """
         self.provisioner = provisioner
         self.leader = leader
         self.config = config
         self.static = {}
 
-        # Dictionary of job names to their average runtime, used to estimate wall time of queued
-        # jobs for bin-packing
-        self.jobNameToAvgRuntime = {}
-        self.jobNameToNumCompleted = {}
-        self.totalAvgRuntime = 0.0
-        self.totalJobsCompleted = 0
+        # Learns from completed jobs to estimate the wall time of queued jobs for bin-packing
+        if runtimeEstimator is None:
+            runtimeEstimator = RuntimeEstimator(quantile=config.runtimeQuantile)
+        self.runtimeEstimator = runtimeEstimator
 
         self.targetTime = config.targetTime
         if self.targetTime <= 0:
@@ -307,9 +459,19 @@ class ClusterScaler(object):
         self.betaInertia = config.betaInertia
         if not 0.0 <= self.betaInertia <= 0.9:
             raise RuntimeError('betaInertia (%f) must be between 0.0 and 0.9!' % self.betaInertia)
+        # How far ahead to provision nodes for jobs that will be released by issued jobs
+        self.prewarmHorizon = config.prewarmHorizon
 
         self.nodeTypes = provisioner.nodeTypes
-        self.nodeShapes = provisioner.nodeShapes
+        # Every worker node is assumed to provide the configured custom consumable resources.
+        # The shapes are copied since the provisioner's own shapes must be left alone.
+        self.nodeShapes = [Shape(wallTime=nodeShape.wallTime,
+                                 memory=nodeShape.memory,
+                                 cores=nodeShape.cores,
+                                 disk=nodeShape.disk,
+                                 preemptable=nodeShape.preemptable,
+                                 consumables=dict(config.consumables))
+                           for nodeShape in provisioner.nodeShapes]
 
         self.nodeShapeToType = dict(zip(self.nodeShapes, self.nodeTypes))
 
@@ -332,6 +494,14 @@ class ClusterScaler(object):
         # scaling up is smoothed as well.
         self.previousWeightedEstimate = {nodeShape:0.0 for nodeShape in self.nodeShapes}
 
+        # The number of queued jobs of each shape on the last call to getEstimatedNodeCounts()
+        # and their packing into nodes. Only the jobs that entered or left the queue since are
+        # added to or removed from the packing, until more jobs left the queue since it was last
+        # packed from scratch than are in it.
+        self.lastQueuedJobShapeCounts = Counter()
+        self.binPackedFit = BinPackedFit(self.nodeShapes, self.targetTime)
+        self.jobsRemovedSinceRepack = 0
+
         assert len(self.nodeShapes) > 0
 
         # Minimum/maximum number of either preemptable or non-preemptable nodes in the cluster
@@ -392,8 +562,13 @@ class ClusterScaler(object):
             # If we get here, something has gone wrong.
             raise RuntimeError("Could not round {}".format(number))
 
-    def getAverageRuntime(self, jobName, service=False):
-        if service:
+    def getEstimatedRuntime(self, jobNode):
+        """
+        Returns the number of seconds the given queued job is expected to run for.
+
+        :param toil.job.JobNode jobNode: the queued job
+        """
+        if isinstance(jobNode, ServiceJobNode):
             # We short-circuit service jobs and assume that they will
             # take a very long time, because if they are assumed to
             # take a short time, we may try to pack multiple services
@@ -402,17 +577,7 @@ class ClusterScaler(object):
             # and a deadlock, because often multiple services need to
             # be running at once for any actual work to get done.
             return self.targetTime * 24 + 3600
-        if jobName in self.jobNameToAvgRuntime:
-            #Have seen jobs of this type before, so estimate
-            #the runtime based on average of previous jobs of this type
-            return self.jobNameToAvgRuntime[jobName]
-        elif self.totalAvgRuntime > 0:
-            #Haven't seen this job yet, so estimate its runtime as
-            #the average runtime of all completed jobs
-            return self.totalAvgRuntime
-        else:
-            #Have no information whatsoever
-            return 1.0
+        return self.runtimeEstimator.estimateRuntime(jobNode)
 
     def addCompletedJob(self, job, wallTime):
         """
@@ -421,20 +586,7 @@ class ClusterScaler(object):
         :param toil.job.JobNode job: The memory, core and disk requirements of the completed job
         :param int wallTime: The wall-time taken to complete the job in seconds.
         """
-
-        #Adjust average runtimes to include this job.
-        if job.jobName in self.jobNameToAvgRuntime:
-            prevAvg = self.jobNameToAvgRuntime[job.jobName]
-            prevNum = self.jobNameToNumCompleted[job.jobName]
-            self.jobNameToAvgRuntime[job.jobName] = float(prevAvg*prevNum + wallTime)/(prevNum + 1)
-            self.jobNameToNumCompleted[job.jobName] += 1
-        else:
-            self.jobNameToAvgRuntime[job.jobName] = wallTime
-            self.jobNameToNumCompleted[job.jobName] = 1
-
-        self.totalJobsCompleted += 1
-        self.totalAvgRuntime = float(self.totalAvgRuntime * (self.totalJobsCompleted - 1) + \
-                                     wallTime)/self.totalJobsCompleted
+        self.runtimeEstimator.addCompletedJob(job, wallTime)
 
     def setStaticNodes(self, nodes, preemptable):
         """
@@ -475,9 +627,23 @@ class ClusterScaler(object):
         Given the resource requirements of queued jobs and the current size of the cluster, returns
         a dict mapping from nodeShape to the number of nodes we want in the cluster right now.
         """
-        nodesToRunQueuedJobs = binPacking(jobShapes=queuedJobShapes,
-                                          nodeShapes=self.nodeShapes,
-                                          goalTime=self.targetTime)
+        queuedJobShapeCounts = Counter(queuedJobShapes)
+        addedJobShapeCounts = queuedJobShapeCounts - self.lastQueuedJobShapeCounts
+        removedJobShapeCounts = self.lastQueuedJobShapeCounts - queuedJobShapeCounts
+        self.jobsRemovedSinceRepack += sum(removedJobShapeCounts.values())
+        if self.jobsRemovedSinceRepack > sum(queuedJobShapeCounts.values()):
+            # Removing jobs leaves gaps in the nodes they were packed into. Packing the queue from
+            # scratch once more jobs left it than are queued keeps the estimate close to a fresh
+            # packing, at a constant cost per removed job.
+            self.binPackedFit = BinPackedFit(self.nodeShapes, self.targetTime)
+            self.binPackedFit.binPack(queuedJobShapeCounts)
+            self.jobsRemovedSinceRepack = 0
+        else:
+            for jobShape, count in iteritems(removedJobShapeCounts):
+                self.binPackedFit.removeJobShape(jobShape, count)
+            self.binPackedFit.binPack(addedJobShapeCounts)
+        self.lastQueuedJobShapeCounts = queuedJobShapeCounts
+        nodesToRunQueuedJobs = self.binPackedFit.getRequiredNodes()
         estimatedNodeCounts = {}
         for nodeShape in self.nodeShapes:
             nodeType = self.nodeShapeToType[nodeShape]
@@ -532,6 +698,52 @@ class ClusterScaler(object):
             estimatedNodeCounts[nodeShape] = estimatedNodeCount
         return estimatedNodeCounts
 
+    def getImminentJobs(self):
+        """
+        Returns the jobs that will be released by issued jobs expected to complete within the
+        prewarm horizon, so that nodes can be provisioned for them before they are ready to run.
+
+        :rtype: list[toil.job.JobNode]
+        """
+        imminentJobs = self.leader.getImminentJobs()
+        if not imminentJobs:
+            return []
+        runningTimes = self.leader.batchSystem.getRunningBatchJobIDs()
+        jobs = []
+        for jobBatchSystemID, jobNode, successors in imminentJobs:
+            remainingTime = (self.getEstimatedRuntime(jobNode)
+                             - runningTimes.get(jobBatchSystemID, 0))
+            if remainingTime <= self.prewarmHorizon:
+                jobs.extend(successors)
+        logger.debug('Provisioning ahead of time for %i jobs that will be released within %s '
+                     'seconds.', len(jobs), self.prewarmHorizon)
+        return jobs
+
+    def scale(self):
+        """
+        Estimates the number of nodes needed to run the jobs issued by the leader and grows or
+        shrinks the cluster accordingly.
+        """
+        # Excludes the jobs held back by the leader's limits on issued jobs
+        queuedJobs = list(self.leader.getJobs())
+        if self.prewarmHorizon > 0:
+            queuedJobs.extend(self.getImminentJobs())
+        queuedJobShapes = [
+            Shape(wallTime=self.getEstimatedRuntime(job),
+                  memory=job.memory,
+                  cores=job.cores,
+                  disk=job.disk,
+                  preemptable=job.preemptable,
+                  consumables=job.consumables) for job in queuedJobs]
+        currentNodeCounts = {}
+        for nodeShape in self.nodeShapes:
+            nodeType = self.nodeShapeToType[nodeShape]
+            currentNodeCounts[nodeShape] = len(
+                self.leader.provisioner.getProvisionedWorkers(nodeType=nodeType,
+                                                              preemptable=nodeShape.preemptable))
+        estimatedNodeCounts = self.getEstimatedNodeCounts(queuedJobShapes, currentNodeCounts)
+        self.updateClusterSize(estimatedNodeCounts)
+
     def updateClusterSize(self, estimatedNodeCounts):
         """
         Given the desired and current size of the cluster, attempts to launch/remove instances to
@@ -541,10 +753,21 @@ class ClusterScaler(object):
         Returns the new size of the cluster.
         """
         newNodeCounts = defaultdict(int)
-        for nodeShape, estimatedNodeCount in estimatedNodeCounts.items():
+        estimatedNodeCounts = list(estimatedNodeCounts.items())
+
+        def setNodeCount(nodeShapeAndCount):
+            nodeShape, estimatedNodeCount = nodeShapeAndCount
+            return self.setNodeCount(nodeType=self.nodeShapeToType[nodeShape],
+                                     numNodes=estimatedNodeCount,
+                                     preemptable=nodeShape.preemptable)
+
+        # Launching and terminating nodes can take a while, so do it for all node types at once if
+        # the provisioner allows it
+        maxThreads = len(estimatedNodeCounts) if self.provisioner.threadSafe else 1
+        newNodeCountList = concurrently(setNodeCount, estimatedNodeCounts, maxThreads=maxThreads)
+        for (nodeShape, estimatedNodeCount), newNodeCount in zip(estimatedNodeCounts,
+                                                                 newNodeCountList):
             nodeType = self.nodeShapeToType[nodeShape]
-
-            newNodeCount = self.setNodeCount(nodeType=nodeType, numNodes=estimatedNodeCount, preemptable=nodeShape.preemptable)
             # If we were scaling up a preemptable node type and failed to meet
             # our target, we will attempt to compensate for the deficit while scaling
             # non-preemptable nodes of this type.
@@ -811,12 +1034,13 @@ class ScalerThread(ExceptionalThread):
     is made, else the size of the cluster is adapted. The beta factor is an inertia parameter
     that prevents continual fluctuations in the number of nodes.
     """
-    def __init__(self, provisioner, leader, config):
+    def __init__(self, provisioner, leader, config, runtimeEstimator=None):
         """
         :param ClusterScaler scaler: the parent class
+        :param AbstractRuntimeEstimator runtimeEstimator: see ClusterScaler
         """
         super(ScalerThread, self).__init__(name='scaler')
-        self.scaler = ClusterScaler(provisioner, leader, config)
+        self.scaler = ClusterScaler(provisioner, leader, config, runtimeEstimator)
 
         # Indicates that the scaling thread should shutdown
         self.stop = False
@@ -858,24 +1082,7 @@ class ScalerThread(ExceptionalThread):
         while not self.stop:
             with throttle(self.scaler.config.scaleInterval):
                 try:
-                    queuedJobs = self.scaler.leader.getJobs()
-                    queuedJobShapes = [
-                        Shape(wallTime=self.scaler.getAverageRuntime(
-                            jobName=job.jobName,
-                            service=isinstance(job, ServiceJobNode)),
-                            memory=job.memory,
-                            cores=job.cores,
-                            disk=job.disk,
-                            preemptable=job.preemptable) for job in queuedJobs]
-                    currentNodeCounts = {}
-                    for nodeShape in self.scaler.nodeShapes:
-                        nodeType = self.scaler.nodeShapeToType[nodeShape]
-                        currentNodeCounts[nodeShape] = len(
-                            self.scaler.leader.provisioner.getProvisionedWorkers(nodeType=nodeType,
-                                                                                 preemptable=nodeShape.preemptable))
-                    estimatedNodeCounts = self.scaler.getEstimatedNodeCounts(queuedJobShapes,
-                                                                             currentNodeCounts)
-                    self.scaler.updateClusterSize(estimatedNodeCounts)
+                    self.scaler.scale()
                     if self.stats:
                         self.stats.checkStats()
                 except:
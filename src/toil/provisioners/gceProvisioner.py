@@ -272,24 +272,27 @@ class GCEProvisioner(AbstractProvisioner):
                                     description=self._tags,
                                     ex_preemptible = preemptable
                                     )
-            failedWorkers = []
             for instance in instancesLaunched:
                 if isinstance(instance, GCEFailedNode):
                     logger.error("Worker failed to launch with code %s. Error message: %s"
                                  % (instance.code, instance.error))
-                    continue
+            instancesLaunched = [instance for instance in instancesLaunched
+                                 if not isinstance(instance, GCEFailedNode)]
 
+            def setUp(instance):
                 node = Node(publicIP=instance.public_ips[0], privateIP=instance.private_ips[0],
                             name=instance.name, launchTime=instance.created_at, nodeType=instance.size,
                             preemptable=False, tags=self._tags) #FIXME: what should tags be set to?
-                try:
-                    self._injectWorkerFiles(node, botoExists)
-                    logger.debug("Created worker %s" % node.publicIP)
-                    self._instanceGroup.add_instances([instance])
-                    workersCreated += 1
-                except Exception as e:
-                    logger.error("Failed to configure worker %s. Error message: %s" % (node.name, e))
-                    failedWorkers.append(instance)
+                self._injectWorkerFiles(node, botoExists)
+                logger.debug("Created worker %s" % node.publicIP)
+
+            # Configure all workers at once rather than waiting for each of them to boot in turn
+            failedWorkers = self._setUpNodes(setUp, instancesLaunched)
+            configuredWorkers = [instance for instance in instancesLaunched
+                                 if instance not in failedWorkers]
+            if configuredWorkers:
+                self._instanceGroup.add_instances(configuredWorkers)
+                workersCreated += len(configuredWorkers)
             if failedWorkers:
                 logger.error("Terminating %d failed workers" % len(failedWorkers))
                 self._terminateInstances(failedWorkers)
@@ -0,0 +1,219 @@
+# Copyright (C) 2015-2018 Regents of the University of California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import division
+
+from future.utils import with_metaclass
+from abc import ABCMeta, abstractmethod
+from builtins import object
+from collections import deque
+from threading import Lock
+import json
+import logging
+import math
+
+from toil.jobStores.abstractJobStore import NoSuchFileException
+
+logger = logging.getLogger(__name__)
+
+
+class AbstractRuntimeEstimator(with_metaclass(ABCMeta, object)):
+    """
+    Predicts how long queued jobs will run from the wall times of completed jobs so that the
+    cluster scaler can pack the queued jobs into nodes. Estimators are fed by the leader thread
+    and queried by the scaler thread, so implementations must be thread-safe.
+    """
+
+    #: The name of the shared file in the job store that estimates are persisted in
+    sharedFileName = 'runtimeEstimates.json'
+
+    @abstractmethod
+    def addCompletedJob(self, jobNode, wallTime):
+        """
+        Records the wall time of a completed job.
+
+        :param toil.job.JobNode jobNode: the completed job
+        :param float wallTime: the number of seconds the job ran for
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def estimateRuntime(self, jobNode):
+        """
+        Estimates the wall time of a queued job.
+
+        :param toil.job.JobNode jobNode: the queued job
+        :return: the estimated number of seconds the job will run for
+        :rtype: float
+        """
+        raise NotImplementedError()
+
+    def getState(self):
+        """
+        Returns what was learned from completed jobs so far, such that it can be serialized as
+        JSON and passed to setState() on a restart of the workflow. Estimators that don't want
+        to persist anything return None.
+        """
+        return None
+
+    def setState(self, state):
+        """
+        Restores what was learned in a previous run of the workflow, as returned by getState().
+        """
+        pass
+
+    def save(self, jobStore):
+        """
+        Persists the state of this estimator to the given job store.
+        """
+        state = self.getState()
+        if state is not None:
+            with jobStore.writeSharedFileStream(self.sharedFileName) as f:
+                f.write(json.dumps(state).encode('utf-8'))
+
+    def load(self, jobStore):
+        """
+        Restores the state of this estimator from the given job store, if it has been saved to it.
+        """
+        try:
+            with jobStore.readSharedFileStream(self.sharedFileName) as f:
+                state = json.loads(f.read().decode('utf-8'))
+        except NoSuchFileException:
+            logger.debug('No runtime estimates were saved to the job store.')
+        else:
+            self.setState(state)
+
+
+class RuntimeSamples(object):
+    """
+    The wall times of the most recent of a group of completed jobs, with more recent jobs
+    weighing exponentially more than older ones.
+    """
+    def __init__(self, maxSamples, decay, samples=()):
+        self.decay = decay
+        self.samples = deque(samples, maxlen=maxSamples)
+
+    def add(self, wallTime):
+        self.samples.append(wallTime)
+
+    def quantile(self, q):
+        """
+        Returns the smallest wall time such that the sample weight of the wall times no larger
+        than it is at least the fraction q of the total weight.
+
+        >>> RuntimeSamples(10, 1.0, [4, 1, 3, 2]).quantile(0.5)
+        2
+        >>> RuntimeSamples(10, 1.0, [4, 1, 3, 2]).quantile(1.0)
+        4
+        >>> RuntimeSamples(10, 0.5, [4, 1, 3, 2]).quantile(0.5)
+        2
+        >>> RuntimeSamples(10, 0.1, [4, 1, 2, 3]).quantile(0.5)
+        3
+        >>> RuntimeSamples(2, 1.0, [4, 1, 3, 2]).quantile(1.0)
+        3
+        """
+        # The most recent sample has a weight of 1, the one before it a weight of decay etc.
+        weighted = sorted((wallTime, self.decay ** age)
+                          for age, wallTime in enumerate(reversed(self.samples)))
+        threshold = q * sum(weight for _, weight in weighted)
+        total = 0.0
+        for wallTime, weight in weighted:
+            total += weight
+            if total >= threshold:
+                return wallTime
+        return weighted[-1][0]
+
+
+class RuntimeEstimator(AbstractRuntimeEstimator):
+    """
+    Estimates the runtime of a job as a quantile of the recent, exponentially decayed wall times
+    of completed jobs with the same name. Jobs whose name hasn't been seen yet are estimated from
+    completed jobs that requested the same number of cores and a similar amount of memory, since
+    their requirements correlate with their runtime, or failing that, from all completed jobs.
+    """
+    def __init__(self, quantile=0.5, decay=0.95, maxSamples=100):
+        """
+        :param float quantile: the quantile of past wall times to estimate runtimes as. Larger
+               values make the scaler provision for the slower jobs of a kind.
+
+        :param float decay: the weight of a completed job relative to the one completed after it
+
+        :param int maxSamples: the number of most recently completed jobs to remember per job
+               name or requirements
+        """
+        assert 0.0 < quantile <= 1.0
+        assert 0.0 < decay <= 1.0
+        self.quantile = quantile
+        self.decay = decay
+        self.maxSamples = maxSamples
+        self.lock = Lock()
+        # Maps job names, requirement keys and None, for all jobs, to their RuntimeSamples
+        self.samples = {}
+        # Caches the estimates derived from the samples until more samples are added
+        self.estimates = {}
+
+    @staticmethod
+    def _requirementsKey(jobNode):
+        """
+        Returns the key that completed jobs with requirements similar to the given job are
+        grouped by: the number of cores and the memory rounded up to a power of two.
+
+        >>> from collections import namedtuple
+        >>> job = namedtuple('Job', ('cores', 'memory'))
+        >>> RuntimeEstimator._requirementsKey(job(2, 3 * 2 ** 30))
+        'cores=2,memory=2^32'
+        >>> RuntimeEstimator._requirementsKey(job(2, 4 * 2 ** 30))
+        'cores=2,memory=2^32'
+        """
+        return 'cores=%s,memory=2^%i' % (jobNode.cores,
+                                         int(math.ceil(math.log(max(jobNode.memory, 1), 2))))
+
+    def addCompletedJob(self, jobNode, wallTime):
+        with self.lock:
+            for key in (jobNode.jobName, self._requirementsKey(jobNode), None):
+                try:
+                    samples = self.samples[key]
+                except KeyError:
+                    samples = self.samples[key] = RuntimeSamples(self.maxSamples, self.decay)
+                samples.add(wallTime)
+                self.estimates.pop(key, None)
+
+    def estimateRuntime(self, jobNode):
+        with self.lock:
+            for key in (jobNode.jobName, self._requirementsKey(jobNode), None):
+                try:
+                    return self.estimates[key]
+                except KeyError:
+                    samples = self.samples.get(key)
+                    if samples is not None:
+                        estimate = self.estimates[key] = samples.quantile(self.quantile)
+                        return estimate
+        # Have no information whatsoever
+        return 1.0
+
+    def getState(self):
+        with self.lock:
+            # JSON objects can't have a null key, so the samples of all jobs are kept apart
+            return dict(samples={key: list(samples.samples)
+                                 for key, samples in self.samples.items() if key is not None},
+                        allSamples=list(self.samples[None].samples) if None in self.samples else [])
+
+    def setState(self, state):
+        with self.lock:
+            self.samples = {key: RuntimeSamples(self.maxSamples, self.decay, samples)
+                            for key, samples in state['samples'].items()}
+            if state['allSamples']:
+                self.samples[None] = RuntimeSamples(self.maxSamples, self.decay,
+                                                    state['allSamples'])
+            self.estimates = {}
@@ -0,0 +1,492 @@
+# Copyright (C) 2015-2018 Regents of the University of California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Replays a recorded trace of jobs through the cluster scaler against a simulated cluster, so that
+scaling policies such as the target time, the inertia or the runtime estimator can be tuned
+without launching any instances.
+"""
+from __future__ import absolute_import
+from __future__ import division
+
+from builtins import object
+from collections import deque, defaultdict, namedtuple, OrderedDict
+from contextlib import contextmanager
+from itertools import count
+from operator import attrgetter
+import logging
+import time
+
+from toil.batchSystems.abstractBatchSystem import AbstractScalableBatchSystem, NodeInfo
+from toil.job import JobNode
+from toil.lib.generatedEC2Lists import E2Instances
+from toil.provisioners.abstractProvisioner import AbstractProvisioner, Shape
+from toil.provisioners.clusterScaler import ClusterScaler
+from toil.provisioners.node import Node
+
+logger = logging.getLogger(__name__)
+
+#: A job of a recorded trace. The submit time is relative to the start of the workflow and the
+#: wall time is how long the job actually ran for, both in seconds.
+TraceJob = namedtuple('TraceJob', ('jobName', 'submitTime', 'wallTime',
+                                   'memory', 'cores', 'disk', 'preemptable'))
+
+#: The outcome of a simulation. The makespan and the queueing delays are in seconds, the cost is
+#: in the currency of the node prices, and nodeHours maps node types to the hours nodes of that
+#: type were provisioned for.
+SimulationReport = namedtuple('SimulationReport', ('jobs', 'makespan', 'cost', 'nodeHours',
+                                                   'idleNodeHours', 'meanQueueingDelay',
+                                                   'maxQueueingDelay'))
+
+
+def traceFromStats(stats):
+    """
+    Derives a trace from the statistics of a workflow run with --stats, as returned by
+    :func:`toil.utils.toilStats.getStats`. Jobs aren't recorded when they were issued, so their
+    submit time is approximated by the time they started, relative to the first job.
+
+    :rtype: list[TraceJob]
+    """
+    jobs = [job for workerJobs in stats.get('jobs', []) if workerJobs for job in workerJobs]
+    # Jobs recorded by older versions of Toil lack their start time and requirements
+    jobs = [job for job in jobs if 'start' in job]
+    if not jobs:
+        return []
+    firstStart = min(float(job.start) for job in jobs)
+    trace = [TraceJob(jobName=job.class_name,
+                      submitTime=float(job.start) - firstStart,
+                      wallTime=float(job.time),
+                      memory=int(float(job.requestedMemory)),
+                      cores=float(job.requestedCores),
+                      disk=int(float(job.requestedDisk)),
+                      preemptable=job.preemptable == 'True') for job in jobs]
+    trace.sort(key=attrgetter('submitTime'))
+    return trace
+
+
+class FakeNode(Node):
+    """
+    A worker node of a simulated cluster. The launch time is in simulated seconds.
+    """
+    def __init__(self, clock, readyTime, **kwargs):
+        super(FakeNode, self).__init__(**kwargs)
+        self.clock = clock
+        self.readyTime = readyTime
+        self.terminationTime = None
+
+    def remainingBillingInterval(self):
+        return 1 - (self.clock() - self.launchTime) / 3600.0 % 1.0
+
+
+class FakeProvisioner(AbstractProvisioner):
+    """
+    A provisioner of nodes of EC2 instance types that come up after a fixed delay without
+    launching anything. Remembers every node it ever provisioned for accounting. Can also be
+    used to benchmark the cluster scaler against a cloud whose requests take a while.
+    """
+    threadSafe = True
+
+    def __init__(self, nodeTypes, clock, nodeLaunchTime=0, clusterName='simulated',
+                 nodeStorage=50, requestLatency=0):
+        """
+        :param list[str] nodeTypes: the node types to autoscale, as for --nodeTypes
+
+        :param clock: returns the current simulated time in seconds
+
+        :param float nodeLaunchTime: the number of seconds it takes a node to come up
+
+        :param float requestLatency: the number of seconds, in real time, that requests to add
+               or terminate nodes block for
+        """
+        super(FakeProvisioner, self).__init__(clusterName=clusterName, nodeStorage=nodeStorage)
+        self.clock = clock
+        self.nodeLaunchTime = nodeLaunchTime
+        self.requestLatency = requestLatency
+        self.nodes = []
+        self.nodeNumbers = count(1)
+        self.setAutoscaledNodeTypes(nodeTypes)
+
+    def launchCluster(self, leaderNodeType, leaderStorage, owner, **kwargs):
+        pass
+
+    def addNodes(self, nodeType, numNodes, preemptable, spotBid=None):
+        if self.requestLatency:
+            time.sleep(self.requestLatency)
+        now = self.clock()
+        for _ in range(numNodes):
+            number = next(self.nodeNumbers)
+            ip = '10.%i.%i.%i' % (number >> 16 & 255, number >> 8 & 255, number & 255)
+            self.nodes.append(FakeNode(clock=self.clock,
+                                       readyTime=now + self.nodeLaunchTime,
+                                       publicIP=ip, privateIP=ip,
+                                       name='node%i' % number,
+                                       launchTime=now,
+                                       nodeType=nodeType,
+                                       preemptable=preemptable))
+        return numNodes
+
+    def terminateNodes(self, nodes):
+        if self.requestLatency:
+            time.sleep(self.requestLatency)
+        now = self.clock()
+        for node in nodes:
+            if node.terminationTime is None:
+                node.terminationTime = now
+
+    def getLeader(self):
+        return None
+
+    def getProvisionedWorkers(self, nodeType=None, preemptable=None):
+        return [node for node in self.nodes
+                if node.terminationTime is None
+                and (nodeType is None or node.nodeType == nodeType)
+                and (preemptable is None or node.preemptable == preemptable)]
+
+    def getNodeShape(self, nodeType, preemptable=False):
+        instanceType = E2Instances[nodeType]
+        disk = instanceType.disks * instanceType.disk_capacity * 2 ** 30
+        if disk == 0:
+            disk = self._nodeStorage * 2 ** 30
+        # Like the AWS provisioner, underestimate the memory by 100M
+        return Shape(wallTime=60 * 60,
+                     memory=(instanceType.memory - 0.1) * 2 ** 30,
+                     cores=instanceType.cores,
+                     disk=disk,
+                     preemptable=preemptable)
+
+    def destroyCluster(self):
+        self.terminateNodes(self.nodes)
+
+
+class SimulatedJob(object):
+    def __init__(self, jobNode, wallTime, submitTime):
+        self.jobNode = jobNode
+        self.wallTime = wallTime
+        self.submitTime = submitTime
+        self.startTime = None
+        self.node = None
+
+    @property
+    def endTime(self):
+        return self.startTime + self.wallTime
+
+
+class SimulatedBatchSystem(AbstractScalableBatchSystem):
+    """
+    Runs issued jobs on the nodes of a fake provisioner in simulated time, first come first
+    served, on the first node with enough free resources. Non-preemptable jobs only run on
+    non-preemptable nodes.
+    """
+    def __init__(self, provisioner, clock, getWallTime):
+        """
+        :param FakeProvisioner provisioner: provides the nodes to run jobs on
+
+        :param clock: returns the current simulated time in seconds
+
+        :param getWallTime: returns the number of seconds a given JobNode runs for
+        """
+        self.provisioner = provisioner
+        self.clock = clock
+        self.getWallTime = getWallTime
+        self.jobIDs = count(1)
+        # Maps the IDs of queued and running jobs to their SimulatedJob
+        self.queuedJobs = OrderedDict()
+        self.runningJobs = {}
+        self.updatedJobs = deque()
+        self.ignoredNodes = set()
+        self.nodeFilter = None
+        # The jobs running on each node, the time since when a node was running any job and the
+        # number of seconds a node had been running jobs before that
+        self.jobsOnNode = defaultdict(set)
+        self.busySince = {}
+        self.busyTime = defaultdict(float)
+        self.queueingDelays = []
+
+    @classmethod
+    def supportsAutoDeployment(cls):
+        return False
+
+    @classmethod
+    def supportsWorkerCleanup(cls):
+        return False
+
+    def issueBatchJob(self, jobNode):
+        jobID = next(self.jobIDs)
+        self.queuedJobs[jobID] = SimulatedJob(jobNode, self.getWallTime(jobNode), self.clock())
+        return jobID
+
+    def killBatchJobs(self, jobIDs):
+        for jobID in jobIDs:
+            self.queuedJobs.pop(jobID, None)
+            job = self.runningJobs.pop(jobID, None)
+            if job is not None:
+                self._release(jobID, job)
+
+    def getIssuedBatchJobIDs(self):
+        return list(self.queuedJobs) + list(self.runningJobs)
+
+    def getNumberOfIssuedBatchJobs(self):
+        return len(self.queuedJobs) + len(self.runningJobs)
+
+    def getRunningBatchJobIDs(self):
+        now = self.clock()
+        return {jobID: now - job.startTime for jobID, job in self.runningJobs.items()}
+
+    def getUpdatedBatchJob(self, maxWait):
+        try:
+            return self.updatedJobs.popleft()
+        except IndexError:
+            return None
+
+    def shutdown(self):
+        pass
+
+    def getNodes(self, preemptable=None, timeout=600):
+        nodes = {}
+        for node in self._readyNodes(preemptable):
+            jobs = [self.runningJobs[jobID].jobNode for jobID in self.jobsOnNode[node]]
+            coresTotal, memoryTotal = self._nodeResources(node)[:2]
+            requestedCores = sum(job.cores for job in jobs)
+            requestedMemory = sum(job.memory for job in jobs)
+            nodes[node.privateIP] = NodeInfo(coresUsed=requestedCores / coresTotal,
+                                             memoryUsed=requestedMemory / memoryTotal,
+                                             coresTotal=coresTotal,
+                                             memoryTotal=memoryTotal,
+                                             requestedCores=requestedCores,
+                                             requestedMemory=requestedMemory,
+                                             workers=len(jobs))
+        return nodes
+
+    def nodeInUse(self, nodeIP):
+        return any(self.jobsOnNode[node] for node in self.provisioner.getProvisionedWorkers()
+                   if node.privateIP == nodeIP)
+
+    @contextmanager
+    def nodeFiltering(self, filter):
+        self.nodeFilter = filter
+        yield
+        self.nodeFilter = None
+
+    def ignoreNode(self, nodeAddress):
+        self.ignoredNodes.add(nodeAddress)
+
+    def unignoreNode(self, nodeAddress):
+        self.ignoredNodes.discard(nodeAddress)
+
+    def _readyNodes(self, preemptable=None):
+        now = self.clock()
+        return [node for node in self.provisioner.getProvisionedWorkers(preemptable=preemptable)
+                if node.readyTime <= now]
+
+    def _nodeResources(self, node):
+        shape = self.provisioner.getNodeShape(node.nodeType, node.preemptable)
+        return shape.cores, shape.memory, shape.disk
+
+    def _release(self, jobID, job):
+        jobsOnNode = self.jobsOnNode[job.node]
+        jobsOnNode.remove(jobID)
+        if not jobsOnNode:
+            self.busyTime[job.node] += self.clock() - self.busySince.pop(job.node)
+
+    def step(self):
+        """
+        Completes the jobs that have ended by now, requeues the jobs whose node went away and
+        starts as many queued jobs as fit on the nodes that are up.
+        """
+        now = self.clock()
+        provisioned = set(self.provisioner.getProvisionedWorkers())
+        for jobID, job in sorted(self.runningJobs.items(), key=lambda item: item[1].endTime):
+            if job.node not in provisioned:
+                logger.debug('Job %s was lost with node %s and is rerun.', jobID, job.node)
+                del self.runningJobs[jobID]
+                self._release(jobID, job)
+                job.startTime = job.node = None
+                self.queuedJobs[jobID] = job
+            elif job.endTime <= now:
+                del self.runningJobs[jobID]
+                self._release(jobID, job)
+                self.updatedJobs.append((jobID, 0, job.wallTime))
+
+        freeResources = OrderedDict()
+        for node in self._readyNodes():
+            if node.privateIP in self.ignoredNodes:
+                continue
+            if self.nodeFilter is not None and not self.nodeFilter(node):
+                continue
+            cores, memory, disk = self._nodeResources(node)
+            for jobID in self.jobsOnNode[node]:
+                jobNode = self.runningJobs[jobID].jobNode
+                cores -= jobNode.cores
+                memory -= jobNode.memory
+                disk -= jobNode.disk
+            freeResources[node] = [cores, memory, disk]
+        for jobID, job in list(self.queuedJobs.items()):
+            jobNode = job.jobNode
+            for node, free in freeResources.items():
+                if ((jobNode.preemptable or not node.preemptable)
+                        and jobNode.cores <= free[0] and jobNode.memory <= free[1]
+                        and jobNode.disk <= free[2]):
+                    free[0] -= jobNode.cores
+                    free[1] -= jobNode.memory
+                    free[2] -= jobNode.disk
+                    del self.queuedJobs[jobID]
+                    job.startTime = now
+                    job.node = node
+                    self.runningJobs[jobID] = job
+                    if not self.jobsOnNode[node]:
+                        self.busySince[node] = now
+                    self.jobsOnNode[node].add(jobID)
+                    self.queueingDelays.append(now - job.submitTime)
+                    break
+
+    def getNextEventTime(self):
+        """
+        Returns the earliest time after now at which a running job ends or a node comes up, or
+        None if there is no such time.
+        """
+        now = self.clock()
+        times = [job.endTime for job in self.runningJobs.values()]
+        times.extend(node.readyTime for node in self.provisioner.getProvisionedWorkers()
+                     if node.readyTime > now)
+        return min(times) if times else None
+
+    def getBusyTime(self, node):
+        """
+        Returns the number of seconds the given node has been running jobs for.
+        """
+        busyTime = self.busyTime[node]
+        if node in self.busySince:
+            busyTime += self.clock() - self.busySince[node]
+        return busyTime
+
+
+class ScalingSimulator(object):
+    """
+    Replays a trace of jobs through the cluster scaler in simulated time. Stands in for the
+    leader, issuing the jobs of the trace as they are submitted and feeding completed jobs back to
+    the scaler, which is run every config.scaleInterval seconds.
+    """
+    def __init__(self, config, trace, nodeLaunchTime=0, nodePrices=None, runtimeEstimator=None):
+        """
+        :param toil.common.Config config: the autoscaling options to simulate, most importantly
+               nodeTypes, minNodes, maxNodes, targetTime, betaInertia and scaleInterval
+
+        :param list[TraceJob] trace: the jobs to replay
+
+        :param float nodeLaunchTime: the number of seconds it takes a node to come up
+
+        :param dict[str,float] nodePrices: maps node types to their price per hour. Node types
+               without a price cost 1.0 per hour.
+
+        :param AbstractRuntimeEstimator runtimeEstimator: passed on to the ClusterScaler
+        """
+        self.config = config
+        self.trace = trace
+        self.nodePrices = nodePrices or {}
+        self.now = 0.0
+        self.toilMetrics = None
+        clock = lambda: self.now
+        self.provisioner = FakeProvisioner(config.nodeTypes, clock, nodeLaunchTime=nodeLaunchTime,
+                                           nodeStorage=config.nodeStorage)
+        self.wallTimes = {}
+        self.batchSystem = SimulatedBatchSystem(self.provisioner, clock,
+                                                lambda jobNode: self.wallTimes[jobNode.jobStoreID])
+        self.issuedJobs = {}
+        self.scaler = ClusterScaler(self.provisioner, self, config,
+                                    runtimeEstimator=runtimeEstimator)
+
+    def getJobs(self):
+        return self.issuedJobs.values()
+
+    def getImminentJobs(self):
+        # A trace doesn't record which jobs released which
+        return []
+
+    def _runnable(self, jobNode):
+        for nodeShape in self.scaler.nodeShapes:
+            if (self.scaler.maxNodes[nodeShape] > 0
+                    and (jobNode.preemptable or not nodeShape.preemptable)
+                    and jobNode.cores <= nodeShape.cores and jobNode.memory <= nodeShape.memory
+                    and jobNode.disk <= nodeShape.disk):
+                return True
+        return False
+
+    def _issue(self, jobStoreID, traceJob):
+        jobNode = JobNode(requirements=dict(memory=traceJob.memory,
+                                            cores=traceJob.cores,
+                                            disk=traceJob.disk,
+                                            preemptable=traceJob.preemptable),
+                          jobName=traceJob.jobName, unitName='', jobStoreID=jobStoreID,
+                          command=None)
+        if not self._runnable(jobNode):
+            logger.warning('Skipping job %s since it fits none of the node types.', jobNode)
+            return False
+        self.wallTimes[jobStoreID] = traceJob.wallTime
+        self.issuedJobs[self.batchSystem.issueBatchJob(jobNode)] = jobNode
+        return True
+
+    def _processUpdatedJobs(self):
+        while True:
+            updatedJob = self.batchSystem.getUpdatedBatchJob(maxWait=0)
+            if updatedJob is None:
+                break
+            jobID, _, wallTime = updatedJob
+            self.scaler.addCompletedJob(self.issuedJobs.pop(jobID), wallTime)
+
+    def run(self):
+        """
+        Replays the trace until every job completed, then shuts the cluster down.
+
+        :rtype: SimulationReport
+        """
+        submissions = deque(sorted(self.trace, key=attrgetter('submitTime')))
+        numJobs = 0
+        nextScaleTime = 0.0
+        jobStoreIDs = count()
+        while submissions or self.issuedJobs:
+            while submissions and submissions[0].submitTime <= self.now:
+                if self._issue('job%i' % next(jobStoreIDs), submissions.popleft()):
+                    numJobs += 1
+            self.batchSystem.step()
+            self._processUpdatedJobs()
+            if self.now >= nextScaleTime:
+                self.scaler.scale()
+                nextScaleTime = self.now + self.config.scaleInterval
+                self.batchSystem.step()
+            times = [nextScaleTime]
+            if submissions:
+                times.append(submissions[0].submitTime)
+            nextEventTime = self.batchSystem.getNextEventTime()
+            if nextEventTime is not None:
+                times.append(nextEventTime)
+            self.now = max(self.now, min(times))
+        self.provisioner.destroyCluster()
+        return self._report(numJobs)
+
+    def _report(self, numJobs):
+        nodeHours = defaultdict(float)
+        idleNodeHours = 0.0
+        for node in self.provisioner.nodes:
+            hours = (node.terminationTime - node.launchTime) / 3600
+            nodeHours[node.nodeType] += hours
+            idleNodeHours += hours - self.batchSystem.getBusyTime(node) / 3600
+        delays = self.batchSystem.queueingDelays
+        return SimulationReport(
+            jobs=numJobs,
+            makespan=self.now,
+            cost=sum(hours * self.nodePrices.get(nodeType, 1.0)
+                     for nodeType, hours in nodeHours.items()),
+            nodeHours=dict(nodeHours),
+            idleNodeHours=idleNodeHours,
+            meanQueueingDelay=sum(delays) / len(delays) if delays else 0.0,
+            maxQueueingDelay=max(delays) if delays else 0.0)
@@ -27,6 +27,7 @@ import shutil
 import sys
 from collections import namedtuple
 from contextlib import closing
+from fcntl import flock, LOCK_EX, LOCK_UN
 from io import BytesIO
 from pydoc import locate
 from tempfile import mkdtemp
@@ -165,20 +166,20 @@ class Resource(namedtuple('Resource', ('name', 'pathHash', 'url', 'contentHash')
         """
         dirPath = self.localDirPath
         if not os.path.exists(dirPath):
-            tempDirPath = mkdtemp(dir=os.path.dirname(dirPath), prefix=self.contentHash + "-")
-            self._save(tempDirPath)
-            if callback is not None:
-                callback(tempDirPath)
-            try:
-                os.rename(tempDirPath, dirPath)
-            except OSError as e:
-                # If dirPath already exists & is non-empty either ENOTEMPTY or EEXIST will be raised
-                if e.errno == errno.ENOTEMPTY or e.errno == errno.EEXIST:
-                    # Another process beat us to it.
-                    # TODO: This is correct but inefficient since multiple processes download the resource redundantly
-                    pass
-                else:
-                    raise
+            # Serialize downloads of this resource on this node such that only the first process
+            # to need it downloads it and the others wait for it to appear
+            with open(dirPath + '.lock', 'w') as lockFile:
+                flock(lockFile, LOCK_EX)
+                try:
+                    if not os.path.exists(dirPath):
+                        tempDirPath = mkdtemp(dir=os.path.dirname(dirPath),
+                                              prefix=self.contentHash + "-")
+                        self._save(tempDirPath)
+                        if callback is not None:
+                            callback(tempDirPath)
+                        os.rename(tempDirPath, dirPath)
+                finally:
+                    flock(lockFile, LOCK_UN)
 
     @property
     def localPath(self):
@@ -16,19 +16,166 @@ from __future__ import absolute_import
 
 from builtins import str
 from builtins import object
+from array import array
+from collections import OrderedDict
 import gzip
 import json
 import logging
 import os
+import sys
 import time
 from threading import Thread, Event
 
 from toil.lib.expando import Expando
 from toil.lib.bioio import getTotalCpuTime
+from toil.jobStores.abstractJobStore import NoSuchFileException
 
 logger = logging.getLogger( __name__ )
 
 
+class StatsTable(object):
+    """
+    A compact, columnar copy of the stats reported by the workers of a workflow, so that they can
+    be summarized without parsing the stats of every worker again. Each job and each worker is a
+    row of typed columns. The aggregator appends rows as the stats arrive and writes them to the
+    job store in chunks, each a shared file holding a JSON header line followed by the columns as
+    little-endian arrays. An index file lists the chunks and the totals of the leader.
+
+    The table is only complete if every run of the workflow shut down its aggregator. Otherwise
+    the index is marked incomplete and the table is no longer appended to.
+    """
+
+    #: The name of the shared file that indexes the chunks of the table
+    indexFileName = 'statsTable.json'
+
+    #: The name of the shared file holding the chunk with the given index
+    chunkFileName = 'statsTable-%i'
+
+    #: The number of job rows after which a chunk is written to the job store
+    chunkSize = 100000
+
+    #: The columns of the job rows and the array type codes of their values. The worker column
+    #: is the row of the worker that ran the job and the name column indexes the job names in the
+    #: header of the chunk.
+    jobColumns = (('worker', 'I'),
+                  ('start', 'd'),
+                  ('time', 'd'),
+                  ('clock', 'd'),
+                  ('memory', 'd'),
+                  ('requestedCores', 'd'),
+                  ('requestedMemory', 'd'),
+                  ('requestedDisk', 'd'),
+                  ('preemptable', 'B'),
+                  ('name', 'I'))
+
+    #: The columns of the worker rows
+    workerColumns = (('time', 'd'),
+                     ('clock', 'd'),
+                     ('memory', 'd'))
+
+    def __init__(self, jobStore, config):
+        self.jobStore = jobStore
+        try:
+            with jobStore.readSharedFileStream(self.indexFileName) as f:
+                self.index = json.loads(f.read().decode('utf-8'))
+        except NoSuchFileException:
+            # A restarted workflow without an index didn't record its earlier stats in a table
+            self.enabled = not config.workflowAttemptNumber
+            self.index = dict(chunks=0, workers=0, totalTime=0.0, totalClock=0.0, complete=True)
+        else:
+            self.enabled = self.index['complete']
+        if self.enabled:
+            self.index['complete'] = False
+            self._writeIndex()
+        else:
+            logger.debug('The stats of a previous run are missing from the stats table, which '
+                         'will not be updated.')
+        self._clear()
+
+    def _clear(self):
+        self.jobs = OrderedDict((name, array(typeCode)) for name, typeCode in self.jobColumns)
+        self.workers = OrderedDict((name, array(typeCode))
+                                   for name, typeCode in self.workerColumns)
+        self.jobNames = OrderedDict()
+
+    def add(self, stats):
+        """
+        Appends the stats reported by a worker, as parsed from the JSON written by the worker.
+
+        :param Expando stats: the stats of the worker and the jobs it ran
+        """
+        if not self.enabled:
+            return
+        worker = stats.get('workers', {})
+        if 'time' not in worker:
+            # Only logging was reported
+            return
+        workerRow = self.index['workers'] + len(self.workers['time'])
+        for name, _ in self.workerColumns:
+            self.workers[name].append(float(worker[name]))
+        for job in stats.get('jobs', []):
+            self.jobs['worker'].append(workerRow)
+            for name in ('start', 'time', 'clock', 'memory',
+                         'requestedCores', 'requestedMemory', 'requestedDisk'):
+                # Stats recorded by older versions of Toil lack some of the fields
+                self.jobs[name].append(float(job.get(name, 'nan')))
+            self.jobs['preemptable'].append(job.get('preemptable') == 'True')
+            self.jobs['name'].append(self.jobNames.setdefault(job.class_name,
+                                                              len(self.jobNames)))
+        if len(self.jobs['name']) >= self.chunkSize:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the rows appended since the last flush to a new chunk.
+        """
+        if not self.enabled or not self.workers['time']:
+            return
+        header = dict(jobs=len(self.jobs['name']),
+                      workers=len(self.workers['time']),
+                      jobNames=list(self.jobNames),
+                      jobColumns=[(name, self._dtype(column))
+                                  for name, column in self.jobs.items()],
+                      workerColumns=[(name, self._dtype(column))
+                                     for name, column in self.workers.items()])
+        with self.jobStore.writeSharedFileStream(self.chunkFileName % self.index['chunks']) as f:
+            f.write(json.dumps(header).encode('utf-8') + b'\n')
+            for column in list(self.jobs.values()) + list(self.workers.values()):
+                if sys.byteorder == 'big':
+                    column.byteswap()
+                f.write(column.tostring() if sys.version_info[0] == 2 else column.tobytes())
+        self.index['chunks'] += 1
+        self.index['workers'] += header['workers']
+        self._writeIndex()
+        self._clear()
+
+    def close(self, totalTime, totalClock):
+        """
+        Writes the remaining rows and marks the table complete.
+
+        :param float totalTime: the wall time of this run of the leader
+        :param float totalClock: the CPU time of this run of the leader
+        """
+        if not self.enabled:
+            return
+        self.flush()
+        self.index['totalTime'] += totalTime
+        self.index['totalClock'] += totalClock
+        self.index['complete'] = True
+        self._writeIndex()
+
+    def _writeIndex(self):
+        with self.jobStore.writeSharedFileStream(self.indexFileName) as f:
+            f.write(json.dumps(self.index).encode('utf-8'))
+
+    @staticmethod
+    def _dtype(column):
+        """
+        The NumPy type of the values in the given array, without the byte order.
+        """
+        return '%s%i' % ('f' if column.typecode in 'fd' else 'u', column.itemsize)
+
+
 class StatsAndLogging( object ):
     """
     Class manages a thread that aggregates statistics and logging information on a toil run.
@@ -107,9 +254,12 @@ class StatsAndLogging( object ):
         #  Overall timing
         startTime = time.time()
         startClock = getTotalCpuTime()
+        statsTable = StatsTable(jobStore, config) if config.stats else None
 
         def callback(fileHandle):
             stats = json.load(fileHandle, object_hook=Expando)
+            if statsTable is not None:
+                statsTable.add(stats)
             try:
                 logs = stats.workers.logsToMaster
             except AttributeError:
@@ -141,9 +291,13 @@ class StatsAndLogging( object ):
                 time.sleep(0.5)  # Avoid cycling too fast
 
         # Finish the stats file
-        text = json.dumps(dict(total_time=str(time.time() - startTime),
-                               total_clock=str(getTotalCpuTime() - startClock)), ensure_ascii=True)
+        totalTime = time.time() - startTime
+        totalClock = getTotalCpuTime() - startClock
+        text = json.dumps(dict(total_time=str(totalTime),
+                               total_clock=str(totalClock)), ensure_ascii=True)
         jobStore.writeStatsAndLogging(text)
+        if statsTable is not None:
+            statsTable.close(totalTime, totalClock)
 
     def check(self):
         """
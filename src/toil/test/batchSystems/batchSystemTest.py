@@ -359,6 +359,19 @@ class MesosBatchSystemTest(hidden.AbstractBatchSystemTest, MesosTestSupport):
         self.assertEqual(set(runningJobIDs), set({}))
 
 
+@slow
+@needs_mesos
+class MesosBundlingBatchSystemTest(MesosBatchSystemTest):
+    """
+    Tests against the Mesos batch system launching several jobs as one Mesos task
+    """
+
+    def createConfig(cls):
+        config = super(MesosBundlingBatchSystemTest, cls).createConfig()
+        config.mesosTaskBundleSize = 4
+        return config
+
+
 class SingleMachineBatchSystemTest(hidden.AbstractBatchSystemTest):
     """
     Tests against the single-machine batch system
@@ -371,6 +384,38 @@ class SingleMachineBatchSystemTest(hidden.AbstractBatchSystemTest):
         return SingleMachineBatchSystem(config=self.config,
                                         maxCores=numCores, maxMemory=1e9, maxDisk=2001)
 
+    def _createConfig(self):
+        config = super(SingleMachineBatchSystemTest, self)._createConfig()
+        config.consumables = {'license': 1}
+        return config
+
+    def testConsumables(self):
+        """
+        Jobs needing more of a consumable than configured are rejected and jobs sharing a
+        consumable don't run concurrently.
+        """
+        requirements = dict(defaultRequirements, consumables={'license': 2})
+        jobNode = JobNode(command='true', jobName='test', unitName=None, jobStoreID='1',
+                          requirements=requirements)
+        self.assertRaises(InsufficientSystemResources, self.batchSystem.issueBatchJob, jobNode)
+        requirements = dict(defaultRequirements, consumables={'dongle': 1})
+        jobNode = JobNode(command='true', jobName='test', unitName=None, jobStoreID='2',
+                          requirements=requirements)
+        self.assertRaises(InsufficientSystemResources, self.batchSystem.issueBatchJob, jobNode)
+
+        requirements = dict(defaultRequirements, consumables={'license': 1})
+        jobIDs = set()
+        for i in range(2):
+            jobNode = JobNode(command='sleep 1', jobName='test', unitName=None,
+                              jobStoreID=str(i + 3), requirements=requirements)
+            jobIDs.add(self.batchSystem.issueBatchJob(jobNode))
+        start = time.time()
+        while jobIDs:
+            jobID, exitStatus, _ = self.batchSystem.getUpdatedBatchJob(maxWait=100)
+            self.assertEqual(exitStatus, 0)
+            jobIDs.remove(jobID)
+        self.assertGreaterEqual(time.time() - start, 2)
+
 
 @slow
 class MaxCoresSingleMachineBatchSystemTest(ToilTest):
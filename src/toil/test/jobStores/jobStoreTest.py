@@ -47,7 +47,7 @@ from toil.lib.memoize import memoize
 from toil.lib.exceptions import panic
 # noinspection PyPackageRequirements
 # (installed by `make prepare`)
-from mock import patch
+from mock import patch, MagicMock
 
 from toil.common import Config, Toil
 from toil.fileStore import FileID
@@ -567,6 +567,45 @@ class AbstractJobStoreTest(object):
             for jobGraph in jobGraphs:
                 self.assertTrue(jobstore.exists(jobGraph.jobStoreID))
 
+        def testBatchUpdate(self):
+            """Test that updates within a batch are deferred and only the last one is kept."""
+            jobstore = self.jobstore_initialized
+            existingJob = jobstore.create(self.arbitraryJob)
+            with jobstore.batch():
+                newJob = jobstore.create(self.arbitraryJob)
+                for jobGraph in (existingJob, newJob):
+                    jobGraph.command = 'first'
+                    jobstore.update(jobGraph)
+                    jobGraph.command = 'second'
+                    jobstore.update(jobGraph)
+            for jobGraph in (existingJob, newJob):
+                self.assertEquals(jobstore.load(jobGraph.jobStoreID).command, 'second')
+
+        def testFailedBatch(self):
+            """Test that a batch whose body raises is discarded and no longer defers writes."""
+            jobstore = self.jobstore_initialized
+            job = jobstore.create(self.arbitraryJob)
+            with self.assertRaises(RuntimeError):
+                with jobstore.batch():
+                    job.command = 'batched'
+                    jobstore.update(job)
+                    raise RuntimeError()
+            self.assertEquals(jobstore.load(job.jobStoreID).command, self.arbitraryJob.command)
+            job.command = 'unbatched'
+            jobstore.update(job)
+            self.assertEquals(jobstore.load(job.jobStoreID).command, 'unbatched')
+
+        def testBatchIsPerThread(self):
+            """Test that a batch doesn't defer the updates of other threads."""
+            jobstore = self.jobstore_initialized
+            job = jobstore.create(self.arbitraryJob)
+            with jobstore.batch():
+                job.command = 'other thread'
+                thread = Thread(target=jobstore.update, args=(job,))
+                thread.start()
+                thread.join()
+                self.assertEquals(jobstore.load(job.jobStoreID).command, 'other thread')
+
         def testGrowingAndShrinkingJob(self):
             """Make sure jobs update correctly if they grow/shrink."""
             # Make some very large data, large enough to trigger
@@ -987,6 +1026,17 @@ class AbstractJobStoreTest(object):
                 self.assertEquals(f.read(1), a)
             # If it times out here, there's a deadlock
 
+        def testReadFileRange(self):
+            """Test reading parts of small and large files."""
+            job = self.jobstore_initialized.create(self.arbitraryJob)
+            for size in (100, 2 * 1024 * 1024):
+                data = os.urandom(size)
+                with self.jobstore_initialized.writeFileStream(job.jobStoreID) as (f, fileID):
+                    f.write(data)
+                for offset, length in ((0, 10), (10, 50), (size - 10, 10), (size - 10, 20)):
+                    self.assertEquals(self.jobstore_initialized.readFileRange(fileID, offset, length),
+                                      data[offset:offset + length])
+
         @abstractmethod
         def _corruptJobStore(self):
             """
@@ -1168,6 +1218,32 @@ class GoogleJobStoreTest(AbstractJobStoreTest.Test):
         contents = GoogleJobStore._getBlobFromURL(urlparse.urlparse(url)).download_as_string()
         return hashlib.md5(contents).hexdigest()
 
+    def testUploadPartsAreUniqueAndDeleted(self):
+        """
+        The parts of streamed uploads of the same file are named apart, and are deleted even if
+        composing them fails.
+        """
+        from toil.jobStores.googleJobStore import GoogleJobStore
+        jobStore = GoogleJobStore.__new__(GoogleJobStore)
+        jobStore.sseKey = None
+        jobStore._partSize = 4
+        blobs = {'file': MagicMock()}
+        blobs['file'].exists.return_value = False
+        blobs['file'].compose.side_effect = RuntimeError('compose failed')
+        jobStore.bucket = MagicMock()
+        jobStore.bucket.blob.side_effect = lambda name, encryption_key=None: \
+            blobs.setdefault(name, MagicMock())
+        for _ in range(2):
+            with self.assertRaises(RuntimeError):
+                with jobStore._uploadStream('file') as writable:
+                    writable.write(b'0123456789')
+        partNames = [name for name in blobs if name != 'file']
+        # Two uploads of three parts each
+        self.assertEqual(len(partNames), 6)
+        self.assertEqual(len(set(name.rsplit('-', 1)[0] for name in partNames)), 2)
+        for name in partNames:
+            blobs[name].delete.assert_called_once_with()
+
     @googleRetry
     def _createExternalStore(self):
         from google.cloud import storage
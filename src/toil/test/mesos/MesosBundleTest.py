@@ -0,0 +1,174 @@
+# Copyright (C) 2018 Regents of the University of California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from builtins import range
+import ast
+from uuid import uuid4
+
+from mock import MagicMock, patch
+
+from toil.common import Config
+from toil.job import JobNode
+from toil.test import ToilTest
+
+
+class MesosBundleTest(ToilTest):
+    """
+    Tests the scheduler side of launching several jobs as one Mesos task against a mock driver.
+    """
+    def setUp(self):
+        super(MesosBundleTest, self).setUp()
+        try:
+            import addict
+            from pymesos import encode_data, decode_data
+            from toil.batchSystems.mesos.batchSystem import MesosBatchSystem
+        except ImportError:
+            self.skipTest("Install Toil with the 'mesos' extra to include this test.")
+        self.addict, self.encodeData, self.decodeData = addict, encode_data, decode_data
+        config = Config()
+        config.workflowID = str(uuid4())
+        config.cleanWorkDir = 'always'
+        config.mesosTaskBundleSize = 2
+        with patch.object(MesosBatchSystem, '_startDriver'):
+            self.batchSystem = MesosBatchSystem(config, maxCores=4, maxMemory=10 ** 9,
+                                                maxDisk=10 ** 9)
+        self.driver = self.batchSystem.driver = MagicMock()
+        self.driver.join.return_value = None
+
+    def tearDown(self):
+        self.batchSystem.shutdown()
+        super(MesosBundleTest, self).tearDown()
+
+    def _issueJobs(self, numJobs):
+        return [self.batchSystem.issueBatchJob(JobNode(command='sleep 1000', jobName='test',
+                                                       unitName=None, jobStoreID=str(i),
+                                                       requirements=dict(cores=1, memory=10 ** 6,
+                                                                         disk=10 ** 6,
+                                                                         preemptable=False)))
+                for i in range(numJobs)]
+
+    def _offer(self):
+        offer = self.addict.Dict()
+        offer.id.value = 'offer'
+        offer.hostname = 'localhost'
+        offer.agent_id.value = 'agent'
+        offer.attributes = []
+        offer.resources = []
+        for name, amount in (('cpus', 4), ('mem', 1000), ('disk', 1000)):
+            resource = self.addict.Dict()
+            resource.name = name
+            resource.type = 'SCALAR'
+            resource.scalar.value = amount
+            offer.resources.append(resource)
+        return offer
+
+    def _launch(self, numJobs):
+        """
+        Issues the given number of jobs, launches them with a single offer and returns their IDs
+        and the launched tasks.
+        """
+        jobIDs = self._issueJobs(numJobs)
+        self.batchSystem.resourceOffers(self.driver, [self._offer()])
+        self.assertEqual(self.driver.launchTasks.call_count, 1)
+        offerID, tasks = self.driver.launchTasks.call_args[0]
+        return jobIDs, tasks
+
+    def _reportJobs(self, results):
+        message = dict(address='127.0.0.1', jobUpdates=results)
+        self.batchSystem.frameworkMessage(self.driver, self.addict.Dict(value='executor'),
+                                          self.addict.Dict(value='agent'),
+                                          self.encodeData(repr(message).encode('utf-8')))
+
+    def _updatedJobs(self):
+        updatedJobs = []
+        while True:
+            update = self.batchSystem.getUpdatedBatchJob(0)
+            if update is None:
+                return updatedJobs
+            updatedJobs.append(update[:2])
+
+    def testBundleLaunch(self):
+        jobIDs, tasks = self._launch(3)
+        # Two jobs are bundled into one task, the remaining one is launched by itself
+        self.assertEqual(sorted(task.task_id.value for task in tasks),
+                         sorted(['bundle-%i' % jobIDs[0], str(jobIDs[2])]))
+        self.assertEqual(self.batchSystem.jobBundles,
+                         {jobIDs[0]: 'bundle-%i' % jobIDs[0], jobIDs[1]: 'bundle-%i' % jobIDs[0]})
+        self.assertEqual(sorted(self.batchSystem.getRunningBatchJobIDs()), sorted(jobIDs))
+        bundle = [task for task in tasks if task.task_id.value.startswith('bundle-')][0]
+        # The bundle requires the resources of both of its jobs
+        self.assertEqual(dict((resource.name, resource.scalar.value)
+                              for resource in bundle.resources)['cpus'], 2)
+
+    def testBundledJobStatus(self):
+        jobIDs, tasks = self._launch(2)
+        bundleID = tasks[0].task_id.value
+        # Jobs of a bundle are reported individually as they end ...
+        self._reportJobs([(jobIDs[0], 0, 1.0)])
+        self.assertEqual(self._updatedJobs(), [(jobIDs[0], 0)])
+        self.assertEqual(list(self.batchSystem.getRunningBatchJobIDs()), [jobIDs[1]])
+        # ... and repeated in the final status update of the bundle, which is ignored for the
+        # jobs already reported
+        update = self.addict.Dict()
+        update.task_id.value = bundleID
+        update.state = 'TASK_FINISHED'
+        update.data = self.encodeData(repr([(jobIDs[0], 0, 1.0),
+                                            (jobIDs[1], 3, 2.0)]).encode('utf-8'))
+        self.batchSystem.statusUpdate(self.driver, update)
+        self.assertEqual(self._updatedJobs(), [(jobIDs[1], 3)])
+        self.assertEqual(self.batchSystem.getRunningBatchJobIDs(), {})
+        self.assertEqual(self.batchSystem.jobBundles, {})
+        self.assertEqual(self.batchSystem.bundles, {})
+
+    def testKillBundledJob(self):
+        jobIDs, tasks = self._launch(2)
+
+        def sendFrameworkMessage(executorId, agentId, data):
+            # The executor kills the job and reports it as killed by SIGKILL
+            message = ast.literal_eval(self.decodeData(data).decode('utf-8'))
+            self._reportJobs([(jobID, -9, 1.0) for jobID in message['killJobs']])
+
+        self.driver.sendFrameworkMessage.side_effect = sendFrameworkMessage
+        self.batchSystem.killBatchJobs([jobIDs[0]])
+        # Only the killed job was sent to the executor, the bundle's task was left running
+        self.assertEqual(self.driver.sendFrameworkMessage.call_count, 1)
+        self.assertFalse(self.driver.killTask.called)
+        self.assertEqual(list(self.batchSystem.getRunningBatchJobIDs()), [jobIDs[1]])
+        # Killed jobs aren't reported as updated
+        self.assertEqual(self._updatedJobs(), [])
+        self.assertEqual(self.batchSystem.jobBundles, {jobIDs[1]: tasks[0].task_id.value})
+
+    def testUnofferedConsumable(self):
+        requirements = dict(cores=1, memory=10 ** 6, disk=10 ** 6, preemptable=False,
+                            consumables={'ssd': 1})
+        self.batchSystem.issueBatchJob(JobNode(command='sleep 1000', jobName='test',
+                                               unitName=None, jobStoreID='1',
+                                               requirements=requirements))
+        with patch('toil.batchSystems.mesos.batchSystem.log') as log:
+            for _ in range(2):
+                self.batchSystem.resourceOffers(self.driver, [self._offer()])
+        # The job can't run and the missing consumable is only warned about once
+        self.assertFalse(self.driver.launchTasks.called)
+        self.assertEqual(log.warning.call_count, 1)
+        self.assertIn('ssd', log.warning.call_args[0])
+        # Once an agent offers the consumable, the job is launched
+        offer = self._offer()
+        resource = self.addict.Dict()
+        resource.name = 'ssd'
+        resource.type = 'SCALAR'
+        resource.scalar.value = 1
+        offer.resources.append(resource)
+        self.batchSystem.resourceOffers(self.driver, [offer])
+        self.assertEqual(self.driver.launchTasks.call_count, 1)
+        self.assertEqual(self.batchSystem.offeredConsumables, {'ssd'})
@@ -11,6 +11,7 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+from __future__ import division
 from builtins import str
 from builtins import range
 import uuid
@@ -79,3 +80,126 @@ class DataStructuresTest(ToilTest):
         self.assertEqual(len(jobQueue.jobIDs()), testJobs)
         # Ensure FIFO
         self.assertIs(testJob, tmpJob)
+
+    def testJobQueuePriority(self):
+        """
+        Jobs of a type are dequeued in order of decreasing priority, and types are offered in
+        order of the priority of their most important job.
+        """
+        from toil.batchSystems.mesos import JobQueue
+        jobQueue = JobQueue()
+        small, large = self._getJob(cores=1), self._getJob(cores=2)
+        jobs = [(self._getJob(cores=1), 0), (self._getJob(cores=1), 2),
+                (self._getJob(cores=1), 1), (self._getJob(cores=1), 2)]
+        for job, priority in jobs:
+            jobQueue.insertJob(job, small.resources, priority=priority)
+        jobQueue.insertJob(large, large.resources, priority=1)
+
+        # Without priorities the larger jobs would come first
+        self.assertEqual(jobQueue.sortedTypes, [large.resources, small.resources])
+        self.assertEqual(jobQueue.typesByPriority(), [small.resources, large.resources])
+
+        dequeued = []
+        while not jobQueue.typeEmpty(small.resources):
+            dequeued.append(jobQueue.nextJobOfType(small.resources))
+        self.assertEqual(dequeued, [jobs[1][0], jobs[3][0], jobs[2][0], jobs[0][0]])
+        self.assertEqual(jobQueue.typesByPriority(), [large.resources])
+        self.assertEqual(jobQueue.typeCountsByPriority(), [(large.resources, 1, 1)])
+
+    @staticmethod
+    def _getShape(cores, memory=1, disk=1, preemptable=False):
+        from toil.batchSystems.mesos import MesosShape
+        return MesosShape(wallTime=0, cores=cores, memory=memory, disk=disk,
+                          preemptable=preemptable)
+
+    @staticmethod
+    def _getOffer(cores, memory=100, disk=100, preemptable=False):
+        from toil.batchSystems.mesos import OfferResources
+        return OfferResources(cores=cores, memory=memory, disk=disk, preemptable=preemptable,
+                              consumables={})
+
+    def testPackOffers(self):
+        """
+        Important small jobs are packed tightly so that less important large jobs still fit, and
+        jobs only go to offers that can hold them.
+        """
+        from toil.batchSystems.mesos import packOffers
+        small, large = self._getShape(cores=2), self._getShape(cores=8)
+        spot = self._getShape(cores=1, preemptable=True)
+        offers = [self._getOffer(cores=8), self._getOffer(cores=2),
+                  self._getOffer(cores=4, preemptable=True)]
+        assignments = packOffers(offers, [(small, 1, 2), (spot, 1, 1), (large, 2, 0)])
+        self.assertEqual(assignments, [[large], [small], [spot]])
+
+        # Non-preemptable jobs never go to preemptable agents
+        self.assertEqual(packOffers(offers[2:], [(small, 1, 0)]), [[]])
+
+        # Custom consumable resources must be offered as well
+        gpu = self._getShape(cores=1)
+        gpu.consumables = {'gpu': 1}
+        offers = [self._getOffer(cores=8), offers[0]._replace(consumables={'gpu': 2})]
+        self.assertEqual(packOffers(offers, [(gpu, 3, 0)]), [[], [gpu, gpu]])
+
+    def testPackOffersFairly(self):
+        """
+        Types of equal priority share the offers instead of the first one taking all of them.
+        """
+        from toil.batchSystems.mesos import packOffers
+        first, second = self._getShape(cores=2), self._getShape(cores=1, memory=2)
+        assignments = packOffers([self._getOffer(cores=4)] * 2,
+                                 [(first, 10, 0), (second, 10, 0)])
+        placed = [jobType for offerJobTypes in assignments for jobType in offerJobTypes]
+        self.assertEqual(placed.count(first), 3)
+        self.assertEqual(placed.count(second), 2)
+
+    def testPackOffersTimeBudget(self):
+        """
+        Packing stops once the time budget is used up.
+        """
+        from toil.batchSystems.mesos import packOffers
+        jobTypes = [(self._getShape(cores=1), 10000, 0)]
+        offers = [self._getOffer(cores=100)] * 100
+        self.assertEqual(sum(map(len, packOffers(offers, jobTypes, timeBudget=0))), 1)
+        self.assertEqual(sum(map(len, packOffers(offers, jobTypes))), 10000)
+
+    def testPackOffersUtilization(self, numBatches=20, numOffers=50, numTypes=10):
+        """
+        Packing batches of synthetic offers together uses more of the offered cores than filling
+        the offers one after the other, the way the offers used to be handled.
+        """
+        from toil.batchSystems.mesos import packOffers
+        random.seed(1)
+
+        def usedCores(assignments):
+            return sum(jobType.cores for offerJobTypes in assignments for jobType in offerJobTypes)
+
+        def fillOneByOne(offers, jobTypes):
+            assignments = []
+            remaining = {jobType: numJobs for jobType, numJobs, _ in jobTypes}
+            for offer in offers:
+                cores, memory, offerJobTypes = offer.cores, offer.memory, []
+                for jobType, _, _ in jobTypes:
+                    while (remaining[jobType] and cores >= jobType.cores
+                           and memory >= jobType.memory):
+                        offerJobTypes.append(jobType)
+                        cores -= jobType.cores
+                        memory -= jobType.memory
+                        remaining[jobType] -= 1
+                assignments.append(offerJobTypes)
+            return assignments
+
+        packed, greedy = 0, 0
+        for _ in range(numBatches):
+            offers = [self._getOffer(cores=random.choice([2, 4, 8, 16]),
+                                     memory=random.choice([4, 8, 32]))
+                      for _ in range(numOffers)]
+            jobTypes = [(self._getShape(cores=random.randint(1, 16),
+                                        memory=random.randint(1, 16)),
+                         random.randint(1, 20), random.randint(0, 3)) for _ in range(numTypes)]
+            jobTypes.sort(key=lambda jobTypeCount: -jobTypeCount[2])
+            assignments = packOffers(offers, jobTypes)
+            for offer, offerJobTypes in zip(offers, assignments):
+                self.assertLessEqual(sum(jobType.cores for jobType in offerJobTypes), offer.cores)
+            packed += usedCores(assignments)
+            greedy += usedCores(fillOneByOne(offers, jobTypes))
+        self.assertGreater(packed, greedy)
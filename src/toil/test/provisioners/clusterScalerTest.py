@@ -21,13 +21,14 @@ from past.utils import old_div
 import time
 import datetime
 from contextlib import contextmanager
+from io import BytesIO
 from threading import Thread, Event
 import logging
 import random
 import types
 import uuid
 from collections import defaultdict
-from mock import MagicMock
+from mock import MagicMock, patch
 
 # Python 3 compatibility imports
 from six.moves.queue import Empty, Queue
@@ -45,6 +46,10 @@ from toil.provisioners.clusterScaler import (ClusterScaler,
                                              ScalerThread,
                                              BinPackedFit,
                                              NodeReservation)
+from toil.provisioners.runtimeEstimator import RuntimeEstimator
+from toil.provisioners.scalingSimulator import FakeProvisioner, SimulatedBatchSystem
+from toil.lib.expando import Expando
+from toil.jobStores.abstractJobStore import NoSuchFileException
 from toil.common import Config, defaultTargetTime
 
 logger = logging.getLogger(__name__)
@@ -263,6 +268,198 @@ class BinPackingTest(ToilTest):
         self.bpf.addJobShape(largerThanR3)
         # If we got here we didn't crash.
 
+    def testPackingIdenticalJobsInBulk(self):
+        """
+        Packing identical jobs together yields the same reservations as packing them one by one,
+        in order of decreasing size.
+        """
+        jobShapes = [Shape(wallTime=wallTime,
+                           cores=cores,
+                           memory=h2b('%iG' % memory),
+                           disk=h2b('2G'),
+                           preemptable=preemptable)
+                     for wallTime, cores, memory, preemptable in [(1000, 2, 1, True),
+                                                                  (5000, 1, 10, True),
+                                                                  (200, 4, 4, False),
+                                                                  (3600, 2, 1, True)]
+                     for _ in range(50)]
+        random.shuffle(jobShapes)
+        bulkBpf = BinPackedFit(self.nodeShapes)
+        bulkBpf.binPack(jobShapes)
+        for jobShape in sorted(jobShapes, reverse=True):
+            self.bpf.addJobShape(jobShape)
+        self.assertEqual(bulkBpf.getRequiredNodes(), self.bpf.getRequiredNodes())
+        for nodeShape in self.nodeShapes:
+            self.assertEqual([x.shapes() for x in bulkBpf.nodeReservations[nodeShape]],
+                             [x.shapes() for x in self.bpf.nodeReservations[nodeShape]])
+
+    def testPackingNodesInBulk(self):
+        """
+        Only the first new node for a run of identical jobs is packed job by job.
+        """
+        jobShape = Shape(wallTime=1000,
+                         cores=2,
+                         memory=h2b('1G'),
+                         disk=h2b('2G'),
+                         preemptable=True)
+        attemptToAddJob = NodeReservation.attemptToAddJob
+        with patch.object(NodeReservation, 'attemptToAddJob', autospec=True,
+                          side_effect=attemptToAddJob) as mockAttempt:
+            self.bpf.addJobShape(jobShape, 10000)
+        # 18 jobs run side by side on a node and two rounds of them start before the target time
+        self.assertEqual(self.bpf.getRequiredNodes(), {c4_8xlarge_preemptable: 278,
+                                                       r3_8xlarge: 0})
+        # The first node and the one running the 28 leftover jobs
+        self.assertLess(mockAttempt.call_count, 36 + 28 + 2)
+
+    def testRemovingJobs(self):
+        """
+        Removed jobs give their resources back, and nodes left without jobs are dropped.
+        """
+        jobShapes = [Shape(wallTime=1000,
+                           cores=2,
+                           memory=h2b('1G'),
+                           disk=h2b('2G'),
+                           preemptable=True),
+                     Shape(wallTime=5000,
+                           cores=1,
+                           memory=h2b('10G'),
+                           disk=h2b('2G'),
+                           preemptable=False)]
+        self.bpf.binPack({jobShapes[0]: 100, jobShapes[1]: 30})
+        self.bpf.removeJobShape(jobShapes[0], 64)
+        self.bpf.removeJobShape(jobShapes[1], 5)
+        freshBpf = BinPackedFit(self.nodeShapes)
+        freshBpf.binPack({jobShapes[0]: 36, jobShapes[1]: 25})
+        self.assertEqual(self.bpf.getRequiredNodes(), freshBpf.getRequiredNodes())
+        reservation = self.bpf.nodeReservations[r3_8xlarge][0]
+        # Removing more jobs than were packed removes all of them
+        for jobShape in jobShapes:
+            self.bpf.removeJobShape(jobShape, 100)
+        self.assertEqual(self.bpf.getRequiredNodes(), {c4_8xlarge_preemptable: 0, r3_8xlarge: 0})
+        # All resources of a node that kept jobs while others were removed are free again.
+        for shape in reservation.shapes():
+            self.assertEqual((shape.memory, shape.cores, shape.disk),
+                             (r3_8xlarge.memory, r3_8xlarge.cores, r3_8xlarge.disk))
+
+    @slow
+    def testBinPackingPerformance(self):
+        """
+        Packs a large queue of jobs of a few shapes, as the scaler does on every tick.
+        """
+        jobShapes = [Shape(wallTime=wallTime,
+                           cores=cores,
+                           memory=h2b('1G'),
+                           disk=h2b('2G'),
+                           preemptable=True)
+                     for wallTime, cores in [(60, 1), (600, 2), (3600, 4), (7200, 1)]
+                     for _ in range(50000)]
+        start = time.time()
+        self.bpf.binPack(jobShapes)
+        logger.info('Packing %i jobs into %s took %.2fs.', len(jobShapes),
+                    self.bpf.getRequiredNodes(), time.time() - start)
+
+    def testConsumables(self):
+        """
+        Jobs needing a consumable are packed onto nodes providing enough of it and don't fit
+        nodes that don't provide it.
+        """
+        licensedShape = Shape(wallTime=3600,
+                              memory=h2b('60G'),
+                              cores=36,
+                              disk=h2b('100G'),
+                              preemptable=False,
+                              consumables={'license': 2})
+        bpf = BinPackedFit([licensedShape])
+        for _ in range(3):
+            bpf.addJobShape(Shape(wallTime=3600,
+                                  cores=1,
+                                  memory=h2b('1G'),
+                                  disk=h2b('1G'),
+                                  preemptable=False,
+                                  consumables={'license': 1}))
+        self.assertEqual(bpf.getRequiredNodes(), {licensedShape: 2})
+
+        # A consumable no node provides fits nowhere
+        bpf = BinPackedFit([licensedShape])
+        bpf.addJobShape(Shape(wallTime=1000,
+                              cores=1,
+                              memory=h2b('1G'),
+                              disk=h2b('1G'),
+                              preemptable=False,
+                              consumables={'dongle': 1}))
+        self.assertEqual(bpf.getRequiredNodes(), {licensedShape: 0})
+
+class RuntimeEstimatorTest(ToilTest):
+    @staticmethod
+    def _makeJobNode(jobName, cores=1, memory=h2b('1G')):
+        return JobNode(requirements=dict(memory=memory, cores=cores, disk=1, preemptable=False),
+                       jobName=jobName, unitName='', jobStoreID='1', command=None)
+
+    def testEstimates(self):
+        """
+        Runtimes are estimated from completed jobs of the same name, then from completed jobs
+        with similar requirements, then from all completed jobs.
+        """
+        estimator = RuntimeEstimator(quantile=0.9, decay=1.0)
+        self.assertEqual(estimator.estimateRuntime(self._makeJobNode('align')), 1.0)
+        for wallTime in range(1, 11):
+            estimator.addCompletedJob(self._makeJobNode('align', cores=4), wallTime * 100)
+        estimator.addCompletedJob(self._makeJobNode('index'), 5)
+        self.assertEqual(estimator.estimateRuntime(self._makeJobNode('align', cores=4)), 900)
+        self.assertEqual(estimator.estimateRuntime(self._makeJobNode('index')), 5)
+        self.assertEqual(estimator.estimateRuntime(self._makeJobNode('call', cores=4,
+                                                                     memory=h2b('900M'))), 900)
+        self.assertEqual(estimator.estimateRuntime(self._makeJobNode('call', cores=2)), 900)
+
+    def testDecay(self):
+        """
+        Recently completed jobs outweigh the ones completed before them.
+        """
+        estimator = RuntimeEstimator(quantile=0.5, decay=0.8)
+        for wallTime in [10] * 20 + [100] * 5:
+            estimator.addCompletedJob(self._makeJobNode('align'), wallTime)
+        self.assertEqual(estimator.estimateRuntime(self._makeJobNode('align')), 100)
+        estimator = RuntimeEstimator(quantile=0.5, decay=1.0)
+        for wallTime in [10] * 20 + [100] * 5:
+            estimator.addCompletedJob(self._makeJobNode('align'), wallTime)
+        self.assertEqual(estimator.estimateRuntime(self._makeJobNode('align')), 10)
+
+    def testPersistence(self):
+        """
+        Estimates survive saving the estimator to a job store and loading it into a new one.
+        """
+        class SharedFileStore(object):
+            def __init__(self):
+                self.files = {}
+
+            @contextmanager
+            def writeSharedFileStream(self, sharedFileName):
+                f = BytesIO()
+                yield f
+                self.files[sharedFileName] = f.getvalue()
+
+            @contextmanager
+            def readSharedFileStream(self, sharedFileName):
+                try:
+                    yield BytesIO(self.files[sharedFileName])
+                except KeyError:
+                    raise NoSuchFileException(sharedFileName)
+
+        jobStore = SharedFileStore()
+        estimator = RuntimeEstimator()
+        estimator.load(jobStore)
+        estimator.addCompletedJob(self._makeJobNode('align', cores=4), 100)
+        estimator.addCompletedJob(self._makeJobNode('index'), 5)
+        estimator.save(jobStore)
+        restored = RuntimeEstimator()
+        restored.load(jobStore)
+        for jobNode in (self._makeJobNode('align', cores=4), self._makeJobNode('index'),
+                        self._makeJobNode('call', cores=4), self._makeJobNode('call', cores=8)):
+            self.assertEqual(restored.estimateRuntime(jobNode),
+                             estimator.estimateRuntime(jobNode))
+
+
 class ClusterScalerTest(ToilTest):
     def setUp(self):
         super(ClusterScalerTest, self).setUp()
@@ -281,6 +478,7 @@ class ClusterScalerTest(ToilTest):
                                                  c4_8xlarge_preemptable])
         setattr(self.provisioner, 'setStaticNodes', lambda _, __: None)
         setattr(self.provisioner, 'retryPredicate', lambda _: False)
+        setattr(self.provisioner, 'threadSafe', True)
 
         self.leader = MockBatchSystemAndProvisioner(self.config, 1)
         
@@ -339,6 +537,109 @@ class ClusterScalerTest(ToilTest):
         self.assertEqual(estimatedNodeCounts[r3_8xlarge], 2)
         self.assertEqual(estimatedNodeCounts[c4_8xlarge_preemptable], 3)
 
+    def testConsumablesLeaveProvisionerShapesAlone(self):
+        """
+        The configured consumables are added to the scaler's copies of the node shapes, not to
+        the shapes owned by the provisioner.
+        """
+        self.config.consumables = {'license': 2}
+        self.config.betaInertia = 0.0
+        self.config.maxNodes = [10, 10]
+        provisionerShapes = list(self.provisioner.nodeShapes)
+        scaler = ClusterScaler(self.provisioner, self.leader, self.config)
+        self.assertEqual(self.provisioner.nodeShapes, provisionerShapes)
+        for nodeShape in provisionerShapes:
+            self.assertEqual(nodeShape.consumables, {})
+        for nodeShape in scaler.nodeShapes:
+            self.assertEqual(nodeShape.consumables, {'license': 2})
+        # Jobs needing the consumable are packed onto the scaler's shapes
+        jobShapes = [Shape(wallTime=3600,
+                           cores=1,
+                           memory=h2b('1G'),
+                           disk=h2b('2G'),
+                           preemptable=False,
+                           consumables={'license': 1})] * 4
+        estimatedNodeCounts = scaler.getEstimatedNodeCounts(jobShapes, defaultdict(int))
+        self.assertEqual(sum(estimatedNodeCounts.values()), 2)
+
+    def testEstimateUpdatedIncrementally(self):
+        """
+        Only the jobs that entered or left the queue are packed or unpacked, until more jobs left
+        the queue than are in it.
+        """
+        self.config.betaInertia = 0.0
+        scaler = ClusterScaler(self.provisioner, self.leader, self.config)
+        jobShape = Shape(wallTime=3600,
+                         cores=2,
+                         memory=h2b('1G'),
+                         disk=h2b('2G'),
+                         preemptable=False)
+        estimatedNodeCounts = scaler.getEstimatedNodeCounts([jobShape] * 20, defaultdict(int))
+        self.assertEqual(estimatedNodeCounts[r3_8xlarge], 2)
+        packed = scaler.binPackedFit
+        with patch.object(packed, 'addJobShape', wraps=packed.addJobShape) as mockAdd:
+            scaler.getEstimatedNodeCounts([jobShape] * 20, defaultdict(int))
+            self.assertFalse(mockAdd.called)
+            estimatedNodeCounts = scaler.getEstimatedNodeCounts([jobShape] * 40, defaultdict(int))
+            mockAdd.assert_called_once_with(jobShape, 20)
+        self.assertIs(scaler.binPackedFit, packed)
+        self.assertEqual(estimatedNodeCounts[r3_8xlarge], 3)
+        estimatedNodeCounts = scaler.getEstimatedNodeCounts([jobShape] * 30, defaultdict(int))
+        self.assertIs(scaler.binPackedFit, packed)
+        self.assertEqual(estimatedNodeCounts[r3_8xlarge], 2)
+        # 10 + 20 jobs left the queue, more than the 10 that are in it
+        estimatedNodeCounts = scaler.getEstimatedNodeCounts([jobShape] * 10, defaultdict(int))
+        self.assertIsNot(scaler.binPackedFit, packed)
+        self.assertEqual(estimatedNodeCounts[r3_8xlarge], 1)
+
+    def testImminentJobs(self):
+        """
+        Jobs released by issued jobs are only provisioned for ahead of time if the issued jobs
+        are expected to complete within the prewarm horizon.
+        """
+        self.config.prewarmHorizon = 600
+        scaler = ClusterScaler(self.provisioner, self.leader, self.config)
+
+        def makeJobNode(jobName):
+            return JobNode(requirements=dict(memory=h2b('1G'), cores=1, disk=h2b('1G'),
+                                             preemptable=False),
+                           jobName=jobName, unitName='', jobStoreID=jobName, command=None)
+        gather, scatter = makeJobNode('gather'), makeJobNode('scatter')
+        scaler.addCompletedJob(gather, 1000)
+        children = [makeJobNode('child') for _ in range(10)]
+        imminentJobs = [(1, gather, children), (2, scatter, [makeJobNode('other')])]
+        self.leader.getImminentJobs = lambda: imminentJobs
+        # The gather job ran for long enough to complete within the horizon, whereas the
+        # scatter job isn't running yet and is estimated from the gather job
+        self.leader.getRunningBatchJobIDs = lambda: {1: 500}
+        self.assertEqual(scaler.getImminentJobs(), children)
+        scaler.prewarmHorizon = 400
+        self.assertEqual(scaler.getImminentJobs(), [])
+
+    def testNodeTypesScaledConcurrently(self):
+        """
+        Nodes of different types are launched and terminated at the same time rather than one
+        type after the other.
+        """
+        self.config.nodeTypes = ['t2.micro', 'c4.2xlarge', 'r3.8xlarge']
+        provisioner = FakeProvisioner(self.config.nodeTypes, clock=time.time, requestLatency=1)
+        leader = Expando(provisioner=provisioner, toilMetrics=None,
+                         batchSystem=SimulatedBatchSystem(provisioner, time.time, None))
+        scaler = ClusterScaler(provisioner, leader, self.config)
+        for numNodes in (2, 0):
+            start = time.time()
+            newNodeCounts = scaler.updateClusterSize({nodeShape: numNodes
+                                                      for nodeShape in scaler.nodeShapes})
+            self.assertLess(time.time() - start, 2.5)
+            self.assertEqual(dict(newNodeCounts), {nodeShape: numNodes
+                                                   for nodeShape in scaler.nodeShapes})
+            self.assertEqual(len(provisioner.getProvisionedWorkers()), 3 * numNodes)
+        # Provisioners that aren't thread-safe resize one node type after the other
+        provisioner.threadSafe = False
+        start = time.time()
+        scaler.updateClusterSize({nodeShape: 1 for nodeShape in scaler.nodeShapes})
+        self.assertGreaterEqual(time.time() - start, 3)
+
     def testMinNodes(self):
         """
         Without any jobs queued, the scaler should still estimate "minNodes" nodes.
@@ -718,11 +1019,12 @@ class MockBatchSystemAndProvisioner(AbstractScalableBatchSystem, AbstractProvisi
         :param preemptable: If True only return preemptable nodes else return non-preemptable nodes
         :return: list of Node
         """
-        nodesToWorker = self.nodesToWorker
+        # Node types are scaled concurrently, so take a snapshot of the nodes
+        nodes = list(self.nodesToWorker)
         if nodeType:
-            return [node for node in nodesToWorker if node.nodeType == nodeType]
+            return [node for node in nodes if node.nodeType == nodeType]
         else:
-            return list(nodesToWorker.keys())
+            return nodes
 
     def terminateNodes(self, nodes):
         self._removeNodes(nodes)
@@ -756,9 +1058,8 @@ class MockBatchSystemAndProvisioner(AbstractScalableBatchSystem, AbstractProvisi
     # AbstractScalableBatchSystem functionality
     def getNodes(self, preemptable=False, timeout=None):
         nodes = dict()
-        for node in self.nodesToWorker:
+        for node, worker in list(self.nodesToWorker.items()):
             if node.preemptable == preemptable:
-                worker = self.nodesToWorker[node]
                 nodes[node.privateIP] = NodeInfo(coresTotal=0, coresUsed=0, requestedCores=1,
                                                  memoryTotal=0, memoryUsed=0, requestedMemory=1,
                                                  workers=1 if worker.busyEvent.is_set() else 0)
@@ -0,0 +1,138 @@
+# Copyright (C) 2015-2018 Regents of the University of California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from builtins import range
+import time
+
+from toil.common import Config
+from toil.lib.expando import Expando
+from toil.lib.humanize import human2bytes as h2b
+from toil.provisioners.scalingSimulator import (FakeProvisioner, ScalingSimulator, TraceJob,
+                                                traceFromStats)
+from toil.test import ToilTest
+
+
+class ScalingSimulatorTest(ToilTest):
+    def setUp(self):
+        super(ScalingSimulatorTest, self).setUp()
+        self.config = Config()
+        self.config.nodeTypes = ['c4.2xlarge', 't2.micro']
+        self.config.maxNodes = [10, 10]
+
+    @staticmethod
+    def _makeTrace():
+        # A burst of long jobs followed by a few short, small ones
+        trace = [TraceJob('align', submitTime=i * 10, wallTime=600, memory=h2b('1G'), cores=2,
+                          disk=h2b('1G'), preemptable=False) for i in range(100)]
+        trace.extend(TraceJob('index', submitTime=3000, wallTime=60, memory=h2b('256M'),
+                              cores=1, disk=h2b('256M'), preemptable=False) for _ in range(20))
+        return trace
+
+    def testReplay(self):
+        """
+        Every job of the trace runs, and the cost and idle time follow from the nodes the scaler
+        provisioned.
+        """
+        trace = self._makeTrace()
+        simulator = ScalingSimulator(self.config, trace, nodeLaunchTime=120,
+                                     nodePrices={'c4.2xlarge': 0.398})
+        report = simulator.run()
+        self.assertEqual(report.jobs, len(trace))
+        self.assertEqual(len(simulator.batchSystem.queueingDelays), len(trace))
+        self.assertGreaterEqual(report.makespan, max(job.submitTime + job.wallTime
+                                                     for job in trace))
+        self.assertTrue(all(node.terminationTime is not None
+                            for node in simulator.provisioner.nodes))
+        self.assertEqual(set(report.nodeHours), {'c4.2xlarge', 't2.micro'})
+        self.assertAlmostEqual(report.cost, report.nodeHours['c4.2xlarge'] * 0.398
+                                            + report.nodeHours['t2.micro'])
+        # At most four of the jobs run on a node at once
+        busyHours = sum(job.wallTime for job in trace) / 3600
+        self.assertLess(report.idleNodeHours, sum(report.nodeHours.values()))
+        self.assertGreaterEqual(sum(report.nodeHours.values()) - report.idleNodeHours,
+                                busyHours / 4)
+        self.assertLessEqual(report.meanQueueingDelay, report.maxQueueingDelay)
+
+    def testNodeLaunchTime(self):
+        """
+        Nodes that take longer to come up delay the jobs waiting for them.
+        """
+        fast = ScalingSimulator(self.config, self._makeTrace(), nodeLaunchTime=0).run()
+        slow = ScalingSimulator(self.config, self._makeTrace(), nodeLaunchTime=1800).run()
+        self.assertGreater(slow.maxQueueingDelay, fast.maxQueueingDelay)
+        self.assertGreater(slow.makespan, fast.makespan)
+
+    def testUnrunnableJobsAreSkipped(self):
+        """
+        Jobs that fit on none of the node types, or only on preemptable ones when they aren't
+        preemptable themselves, are left out instead of waiting forever.
+        """
+        self.config.nodeTypes = ['t2.micro', 'c4.2xlarge:0.1']
+        trace = [TraceJob('big', 0, 60, h2b('100G'), 1, h2b('1G'), True),
+                 TraceJob('picky', 0, 60, h2b('2G'), 2, h2b('1G'), False),
+                 TraceJob('small', 0, 60, h2b('256M'), 1, h2b('1G'), False),
+                 TraceJob('spot', 0, 60, h2b('2G'), 2, h2b('1G'), True)]
+        report = ScalingSimulator(self.config, trace).run()
+        self.assertEqual(report.jobs, 2)
+
+    def testTraceFromStats(self):
+        def job(name, start, time, preemptable='True'):
+            return Expando(class_name=name, start=str(start), time=str(time), clock='0.1',
+                           memory='1024', requestedCores='2', requestedMemory='1073741824',
+                           requestedDisk='2147483648', preemptable=preemptable)
+        stats = Expando(jobs=[[job('b', 1000.5, 3), job('a', 1000.0, 1)],
+                              [],
+                              # Recorded by an older version of Toil
+                              [Expando(class_name='old', time='1', clock='1', memory='1')],
+                              [job('c', 1010.0, 2, preemptable='False')]])
+        self.assertEqual(traceFromStats(stats),
+                         [TraceJob('a', 0.0, 1.0, h2b('1G'), 2.0, h2b('2G'), True),
+                          TraceJob('b', 0.5, 3.0, h2b('1G'), 2.0, h2b('2G'), True),
+                          TraceJob('c', 10.0, 2.0, h2b('1G'), 2.0, h2b('2G'), False)])
+        self.assertEqual(traceFromStats(Expando()), [])
+
+
+class NodeSetupTest(ToilTest):
+    def setUp(self):
+        super(NodeSetupTest, self).setUp()
+        self.provisioner = FakeProvisioner(['t2.micro'], clock=time.time)
+
+    @staticmethod
+    def _setUp(node):
+        time.sleep(0.5)
+        if node % 3 == 0:
+            raise RuntimeError('Node %i failed to boot' % node)
+
+    def testSetUpNodes(self):
+        """
+        Newly launched nodes are set up concurrently and the ones that fail are reported.
+        """
+        start = time.time()
+        self.assertEqual(self.provisioner._setUpNodes(self._setUp, list(range(10))), [0, 3, 6, 9])
+        self.assertLess(time.time() - start, 2.5)
+
+    def testSetUpNodesInBackground(self):
+        """
+        Setting up nodes in the background returns right away and hands the nodes that failed
+        to the failure callback.
+        """
+        failedNodes = []
+        start = time.time()
+        thread = self.provisioner._setUpNodesInBackground(self._setUp, [1, 2, 3],
+                                                          onFailure=failedNodes.extend)
+        self.assertLess(time.time() - start, 0.5)
+        thread.join()
+        self.assertEqual(failedNodes, [3])
@@ -35,6 +35,7 @@ import inspect
 import os
 import random
 import signal
+import sys
 import time
 import pytest
 
@@ -424,6 +425,55 @@ class hidden(object):
             assert not os.path.exists(nonLocalFile1)
             assert not os.path.exists(nonLocalFile2)
 
+        def testReadGlobalFileMapped(self):
+            """
+            Write a file to the job store and read it back through a read-only memory map in a
+            successor job.
+            """
+            A = Job.wrapJobFn(self._writeFileToJobStoreWithContents)
+            B = Job.wrapJobFn(self._readMappedFile, fsIDAndContents=A.rv())
+            A.addChild(B)
+            Job.Runner.startToil(A, self.options)
+
+        @staticmethod
+        def _writeFileToJobStoreWithContents(job):
+            """
+            Write a small random local file to the job store and return its ID and contents.
+            """
+            fsID, testFile = hidden.AbstractFileStoreTest._writeFileToJobStore(job,
+                                                                              isLocalFile=True)
+            with open(testFile.name, 'rb') as f:
+                return fsID, f.read()
+
+        @staticmethod
+        def _readMappedFile(job, fsIDAndContents):
+            """
+            Map the given file, check its contents and ensure the mapping is closed once the
+            local copy is deleted.
+            """
+            fsID, contents = fsIDAndContents
+            mapping = job.fileStore.readGlobalFileMapped(fsID)
+            assert mapping[:] == contents
+            try:
+                mapping.write(b'x')
+            except TypeError:
+                pass
+            else:
+                assert False, 'The mapping should be read-only.'
+            if sys.version_info[0] >= 3:
+                # Python 2 doesn't track the memoryviews of mappings
+                view = memoryview(mapping)
+                try:
+                    job.fileStore.deleteLocalFile(fsID)
+                except RuntimeError:
+                    pass
+                else:
+                    assert False, 'The mapping should not be closed while in use.'
+                assert not mapping.closed
+                view.release()
+            job.fileStore.deleteLocalFile(fsID)
+            assert mapping.closed
+
         @staticmethod
         def _writeFileToJobStore(job, isLocalFile, nonLocalDir=None, fileMB=1):
             """
@@ -669,6 +719,29 @@ class hidden(object):
                 assert actual == 1, 'Should have one nlink. Got %i.' % actual
             return fsID
 
+        def testMappedFileIsNotEvicted(self):
+            """
+            Map a cached file and ensure the cache regards it as being in use, so that it can't be
+            evicted while mapped.
+            """
+            A = Job.wrapJobFn(self._writeFileToJobStoreWithAsserts, isLocalFile=True)
+            B = Job.wrapJobFn(self._mapCachedFile, fsID=A.rv())
+            A.addChild(B)
+            Job.Runner.startToil(A, self.options)
+
+        @staticmethod
+        def _mapCachedFile(job, fsID):
+            """
+            Map the given file and check that the cached copy is linked beyond the threshold at
+            which cleanCache considers it deletable.
+            """
+            job.fileStore.readGlobalFileMapped(fsID)
+            cachedFile = job.fileStore.encodedFileID(fsID)
+            actual = os.stat(cachedFile).st_nlink
+            assert actual > job.fileStore.nlinkThreshold, 'Expected more than %i nlinks. ' \
+                                                          'Got %i.' % (job.fileStore.nlinkThreshold,
+                                                                       actual)
+
         @staticmethod
         def _sleepy(job, timeToSleep):
             """
@@ -15,14 +15,21 @@
 from __future__ import absolute_import
 
 from builtins import str
+from builtins import range
+import logging
 import uuid
 import os
+import sys
 
-from toil.common import Toil
+from mock import patch
+
+from toil import subprocess
+from toil.common import Toil, ToilRestartException
 from toil.job import Job
 from toil.leader import FailedJobsException
 from toil.test import ToilTest, slow
 from toil.fileStore import FileID
+from toil.jobStores.fileJobStore import FileJobStore
 from toil.common import getDirSizeRecursively
 
 
@@ -93,6 +100,150 @@ class ImportExportFileTest(ToilTest):
             with toil._jobStore.readSharedFileStream(sharedFileName) as f:
                 self.assertEquals(f.read().decode('utf-8'), 'some data')
 
+    def _makeSrcFiles(self, numFiles):
+        srcFiles = []
+        for i in range(numFiles):
+            srcFile = '%s/%s%i' % (self._tempDir, 'in', i)
+            with open(srcFile, 'w') as f:
+                f.write('Hello %i' % i)
+            srcFiles.append(srcFile)
+        return srcFiles
+
+    def testImportExportFiles(self):
+        options = Job.Runner.getDefaultOptions(self._getTestJobStorePath())
+        srcFiles = self._makeSrcFiles(20)
+        with Toil(options) as toil:
+            fileIDs = toil.importFiles(['file://' + srcFile for srcFile in srcFiles],
+                                       maxThreads=4)
+            self.assertEqual([fileID.size for fileID in fileIDs],
+                             [os.stat(srcFile).st_size for srcFile in srcFiles])
+            toil.exportFiles({'file://%s/out%i' % (self._tempDir, i): fileID
+                              for i, fileID in enumerate(fileIDs)}, maxThreads=4)
+        for i in range(len(srcFiles)):
+            with open('%s/out%i' % (self._tempDir, i)) as f:
+                self.assertEqual(f.read(), 'Hello %i' % i)
+
+    def testResumeImportExportFiles(self):
+        """
+        Transfers recorded in the journal are skipped when repeated.
+        """
+        options = Job.Runner.getDefaultOptions(self._getTestJobStorePath())
+        srcUrls = ['file://' + srcFile for srcFile in self._makeSrcFiles(10)]
+        journalPath = os.path.join(self._tempDir, 'journal')
+        with Toil(options) as toil:
+            firstIDs = toil.importFiles(srcUrls[:5], journalPath=journalPath)
+            # The files imported before don't have to be read again
+            for srcUrl in srcUrls[:5]:
+                os.remove(srcUrl[len('file://'):])
+            fileIDs = toil.importFiles(srcUrls, journalPath=journalPath)
+            self.assertEqual(fileIDs[:5], firstIDs)
+            self.assertEqual([fileID.size for fileID in fileIDs[:5]],
+                             [fileID.size for fileID in firstIDs])
+
+            exportJournalPath = os.path.join(self._tempDir, 'exportJournal')
+            dstFile = os.path.join(self._tempDir, 'out')
+            toil.exportFiles({'file://' + dstFile: fileIDs[0]}, journalPath=exportJournalPath)
+            os.remove(dstFile)
+            toil.exportFiles({'file://' + dstFile: fileIDs[0]}, journalPath=exportJournalPath)
+            self.assertFalse(os.path.exists(dstFile))
+            # A different file exported to the same URL is not skipped
+            toil.exportFiles({'file://' + dstFile: fileIDs[9]}, journalPath=exportJournalPath)
+            with open(dstFile) as f:
+                self.assertEqual(f.read(), 'Hello 9')
+
+    def testResumeInterruptedImportExportFiles(self):
+        """
+        An import interrupted by the death of the process running it is resumed by a later
+        process that reopens the job store with --restart and then starts the workflow. An export
+        that failed is resumed from the job store left behind.
+        """
+        options = Job.Runner.getDefaultOptions(self._getTestJobStorePath())
+        srcFiles = self._makeSrcFiles(5)
+        missingFile = os.path.join(self._tempDir, 'missing')
+        srcUrls = ['file://' + srcFile for srcFile in srcFiles + [missingFile]]
+        journalPath = os.path.join(self._tempDir, 'journal')
+        exportJournalPath = os.path.join(self._tempDir, 'exportJournal')
+        # Sorts after the other destinations, so that it is exported last
+        missingDir = os.path.join(self._tempDir, 'zzz')
+        dstFiles = [os.path.join(self._tempDir, 'out%i' % i) for i in range(5)]
+        dstFiles.append(os.path.join(missingDir, 'out'))
+        self.assertEqual(subprocess.call([sys.executable, '-c',
+                                          'from toil.test.src.importExportFileTest import '
+                                          '_importAndDie; _importAndDie()',
+                                          options.jobStore, journalPath] + srcUrls), 1)
+        with open(missingFile, 'w') as f:
+            f.write('Hello 5')
+        # Only the file that failed is read again
+        for srcFile in srcFiles:
+            os.remove(srcFile)
+        options.restart = True
+        with self.assertRaises(IOError):
+            with Toil(options) as toil:
+                self.assertRaises(ToilRestartException, toil.restart)
+                fileIDs = toil.importFiles(srcUrls, maxThreads=1, journalPath=journalPath)
+                toil.exportFiles(dict(('file://' + dstFile, fileID)
+                                      for dstFile, fileID in zip(dstFiles, fileIDs)),
+                                 maxThreads=1, journalPath=exportJournalPath)
+        for dstFile in dstFiles[:5]:
+            os.remove(dstFile)
+        os.mkdir(missingDir)
+        with Toil(options) as toil:
+            toil.exportFiles(dict(('file://' + dstFile, fileID)
+                                  for dstFile, fileID in zip(dstFiles, fileIDs)),
+                             maxThreads=1, journalPath=exportJournalPath)
+            # The workflow was never started, so it can be started now
+            with patch.object(Toil, '_runMainLoop', return_value=5):
+                self.assertEqual(toil.start(Job()), 5)
+            self.assertEqual(toil.config.workflowAttemptNumber, 0)
+        self.assertFalse(any(os.path.exists(dstFile) for dstFile in dstFiles[:5]))
+        with open(dstFiles[5]) as f:
+            self.assertEqual(f.read(), 'Hello 5')
+
+    def testExportLogDoesNotQueryDestination(self):
+        """
+        Logging the throughput of an export doesn't fail it by asking the destination for the
+        size of the exported file.
+        """
+        options = Job.Runner.getDefaultOptions(self._getTestJobStorePath())
+        srcFile, = self._makeSrcFiles(1)
+        jobStoreLogger = logging.getLogger('toil.jobStores.abstractJobStore')
+        level = jobStoreLogger.level
+        jobStoreLogger.setLevel(logging.DEBUG)
+        try:
+            with Toil(options) as toil:
+                fileID = toil.importFile('file://' + srcFile)
+                with patch.object(FileJobStore, 'getSize', side_effect=IOError):
+                    toil.exportFile(fileID, 'file://' + self.dstFile)
+        finally:
+            jobStoreLogger.setLevel(level)
+        with open(self.dstFile) as f:
+            self.assertEqual(f.read(), 'Hello 0')
+
+    def testCopyFile(self):
+        """
+        Files copied within a file job store have the same content as the original, whether or
+        not the file system lets them share blocks, and replace any existing file.
+        """
+        srcFile, = self._makeSrcFiles(1)
+        with open(self.dstFile, 'w') as f:
+            f.write('a longer file than the source')
+        FileJobStore._copyFile(srcFile, self.dstFile)
+        with open(self.dstFile) as f:
+            self.assertEqual(f.read(), 'Hello 0')
+
+
+def _importAndDie():
+    """
+    Imports the files at the given URLs into a new job store with the given journal and dies
+    without cleaning up as soon as an import fails.
+    """
+    jobStore, journalPath = sys.argv[1:3]
+    with Toil(Job.Runner.getDefaultOptions(jobStore)) as toil:
+        try:
+            toil.importFiles(sys.argv[3:], maxThreads=1, journalPath=journalPath)
+        except IOError:
+            os._exit(1)
+
 
 class RestartingJob(Job):
     def __init__(self, inputFileID, failFileID):
@@ -13,13 +13,21 @@
 # limitations under the License.
 
 from __future__ import absolute_import
+import copy
+import logging
 import os
+import time
 from argparse import ArgumentParser
+from functools import partial
+from toil import pickle
 from toil.common import Toil
-from toil.job import Job
-from toil.test import ToilTest
+from toil.fileStore import FileID
+from toil.job import Job, JobNode, ServiceJobNode
+from toil.test import ToilTest, slow
 from toil.jobGraph import JobGraph
 
+logger = logging.getLogger(__name__)
+
 class JobGraphTest(ToilTest):
     
     def setUp(self):
@@ -80,3 +88,159 @@ class JobGraphTest(ToilTest):
         self.assertNotEquals(j, j2)
         
         ###TODO test other functionality
+
+    def testBinaryEncoding(self):
+        """
+        Tests that job graphs survive a round trip through their binary encoding, and that
+        pickled job graphs as written by older versions of Toil can still be loaded.
+        """
+        j = self._makeJobGraph('tmp/job0', numSuccessors=3)
+        j.services = [[ServiceJobNode(jobStoreID='tmp/service', memory=1, cores=1, disk=1,
+                                      preemptable=False, startJobStoreID='start',
+                                      terminateJobStoreID='terminate', errorJobStoreID='error',
+                                      unitName='service', jobName='serviceJob',
+                                      command='service command', predecessorNumber=1)]]
+        j.predecessorsFinished = {'tmp/job1', 'tmp/job2'}
+        j.filesToDelete = ['tmp/file']
+        binary = j.toBinary()
+        self.assertFalse(binary.startswith(pickle.PROTO))
+        j2 = JobGraph.fromBinary(binary)
+        self.assertEqual(j, j2)
+        self.assertEqual(j.__dict__, j2.__dict__)
+        self.assertEqual(type(j2.services[0][0]), ServiceJobNode)
+
+        # Old job stores hold pickled job graphs
+        self.assertEqual(j, JobGraph.fromBinary(pickle.dumps(j, protocol=pickle.HIGHEST_PROTOCOL)))
+
+        # State the fixed field layout doesn't know about causes the job graph to be pickled
+        j.someExtraAttribute = 'foo'
+        binary = j.toBinary()
+        self.assertTrue(binary.startswith(pickle.PROTO))
+        self.assertEqual(JobGraph.fromBinary(binary).someExtraAttribute, 'foo')
+
+        # Subclasses of str survive the encoding
+        j = self._makeJobGraph(FileID('tmp/job0', 0), numSuccessors=0)
+        self.assertEqual(type(JobGraph.fromBinary(j.toBinary()).jobStoreID), FileID)
+
+    def testUnpicklingOldJobGraphs(self):
+        """
+        Tests that job graphs pickled before job priorities, critical paths, tags and consumables
+        existed can be loaded and then be encoded compactly.
+        """
+        j = self._makeJobGraph('tmp/job0', numSuccessors=1)
+        for jobNode in [j, j.stack[0][0]]:
+            for attribute in ('_priority', 'criticalPath', 'tags', '_consumables'):
+                del jobNode.__dict__[attribute]
+        j2 = JobGraph.fromBinary(pickle.dumps(j, protocol=pickle.HIGHEST_PROTOCOL))
+        for jobNode in [j2, j2.stack[0][0]]:
+            self.assertEqual((jobNode.priority, jobNode.criticalPath, jobNode.tags,
+                              jobNode.consumables), (0, 1, (), {}))
+        self.assertFalse(j2.toBinary().startswith(pickle.PROTO))
+
+    def testBinaryEncodingFields(self):
+        """
+        Tests that job priorities, critical paths, tags and consumables survive the binary
+        encoding and that encodings of other versions are rejected.
+        """
+        j = self._makeJobGraph('tmp/job0', numSuccessors=2)
+        j.stack[0][0]._priority = 5
+        j.stack[0][0].criticalPath = 3
+        j.stack[0][0].tags = ('license:gatk',)
+        j.stack[0][0]._consumables = (('license', 1),)
+        j2 = JobGraph.fromBinary(j.toBinary())
+        self.assertEqual((j2.stack[0][0].priority, j2.stack[0][0].criticalPath), (5, 3))
+        self.assertEqual(j2.stack[0][0].tags, ('license:gatk',))
+        self.assertEqual(j2.stack[0][0].consumables, {'license': 1})
+        self.assertEqual((j2.priority, j2.criticalPath), (0, 1))
+        for version in (0, JobGraph._binaryVersion + 1):
+            with self.assertRaises(RuntimeError):
+                JobGraph.fromBinary(JobGraph._binaryMagic + bytes(bytearray([version])) +
+                                    pickle.dumps(None, protocol=2))
+
+    @slow
+    def testBinaryEncodingPerformance(self):
+        """
+        Compares size and speed of the binary encoding of job graphs to pickling them by round
+        tripping a large number of job graphs.
+        """
+        numJobs = 100000
+        jobs = [self._makeJobGraph('tmp/job%i' % i, numSuccessors=2) for i in range(numJobs)]
+        results = {}
+        for name, serialize, deserialize in [
+                ('pickle', partial(pickle.dumps, protocol=pickle.HIGHEST_PROTOCOL), pickle.loads),
+                ('binary', JobGraph.toBinary, JobGraph.fromBinary)]:
+            start = time.time()
+            binaries = [serialize(j) for j in jobs]
+            serialized = time.time()
+            loadedJobs = [deserialize(b) for b in binaries]
+            end = time.time()
+            self.assertEqual(jobs, loadedJobs)
+            results[name] = sum(len(b) for b in binaries)
+            logger.info('Round-tripping %i jobs with %s: %i bytes in total, %.2fs to serialize, '
+                        '%.2fs to deserialize.', numJobs, name, results[name],
+                        serialized - start, end - serialized)
+        self.assertLess(results['binary'], results['pickle'])
+
+    def testSnapshot(self):
+        """
+        Tests that a snapshot of a job graph is equal to it and isn't affected by the changes
+        the worker makes to the original when chaining.
+        """
+        j = self._makeJobGraph('tmp/job', numSuccessors=3)
+        j.services = [[]]
+        snapshot = j.snapshot()
+        self.assertEqual(j, snapshot)
+        self.assertEqual(j.toBinary(), snapshot.toBinary())
+        self.assertIs(j.stack[0], snapshot.stack[0])
+        j.stack.pop()
+        j.stack += self._makeJobGraph('tmp/successor', numSuccessors=1).stack
+        j.stack[0] = j.stack[0][:-1]
+        j.services[0].append(j.stack[0][0])
+        j.filesToDelete.append('tmp/file')
+        j.command = None
+        self.assertEqual(self._makeJobGraph('tmp/job', numSuccessors=3).stack, snapshot.stack)
+        self.assertEqual([[]], snapshot.services)
+        self.assertEqual([], snapshot.filesToDelete)
+        self.assertIsNotNone(snapshot.command)
+
+    @slow
+    def testSnapshotPerformance(self):
+        """
+        Compares snapshots to deep copies when chaining a long sequence of jobs below a job with
+        a large fan-out, as the worker does.
+        """
+        numChained = 100
+        results = {}
+        for name, clone in [('deepcopy', copy.deepcopy), ('snapshot', JobGraph.snapshot)]:
+            j = self._makeJobGraph('tmp/job', numSuccessors=2000)
+            j.stack.append([JobNode(requirements=dict(memory=1, cores=1, disk=1,
+                                                      preemptable=True),
+                                    jobName='chained', unitName='', jobStoreID='tmp/chained',
+                                    command='_toil tmp/chained /tmp/userModule False')])
+            start = time.time()
+            for i in range(numChained):
+                # Transplant the successor into a clone and clone that again, like the worker
+                j = clone(j)
+                successors = j.stack.pop()
+                j.stack += [successors]
+                j.command = successors[0].command
+                j = clone(j)
+            results[name] = time.time() - start
+            logger.info('Chaining %i jobs below a job with %i successors using %s took %.3fs.',
+                        numChained, len(j.stack[0]), name, results[name])
+        self.assertLess(results['snapshot'], results['deepcopy'])
+
+    @staticmethod
+    def _makeJobGraph(jobStoreID, numSuccessors):
+        j = JobGraph(command='_toil %s /tmp/userModule False' % jobStoreID,
+                     memory=2 << 30, cores=1, disk=2 << 30, preemptable=True,
+                     jobStoreID=jobStoreID, remainingRetryCount=1, predecessorNumber=1,
+                     jobName='JobFunctionWrappingJob', unitName='noName')
+        successors = [JobNode(requirements=dict(memory=1 << 30, cores=1.5, disk=1 << 30,
+                                                preemptable=False),
+                              jobName='JobFunctionWrappingJob', unitName='',
+                              jobStoreID='%s-%i' % (jobStoreID, i),
+                              command='_toil %s-%i /tmp/userModule False' % (jobStoreID, i))
+                      for i in range(numSuccessors)]
+        j.stack = [successors, []]
+        return j
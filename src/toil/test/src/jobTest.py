@@ -22,14 +22,21 @@ import unittest
 import logging
 import os
 import random
+import threading
+import time
+from hashlib import sha1
 
 # Python 3 compatibility imports
 from six.moves import xrange
+from mock import patch
 
 from toil.common import Toil
 from toil.leader import FailedJobsException
 from toil.lib.bioio import getTempFile
-from toil.job import Job, JobGraphDeadlockException, JobFunctionWrappingJob
+from toil.common import Config
+from toil.job import Job, JobGraphDeadlockException, JobFunctionWrappingJob, Promise
+from toil.jobStores.abstractJobStore import NoSuchFileException
+from toil.jobStores.fileJobStore import FileJobStore
 from toil.test import ToilTest, slow
 
 logger = logging.getLogger(__name__)
@@ -270,6 +277,208 @@ class JobTest(ToilTest):
                 and (fNode, tNode) not in childEdges and (fNode, tNode) not in followOnEdges):
                 checkFollowOnEdgeCycleDetection(fNode, tNode)
 
+    def testSerialiseJobGraph(self):
+        """
+        Serialise a job with many successors and check that every job graph is written once,
+        with a command referencing the pickled job, and that promises between the jobs are
+        registered. The pickles of all jobs fit into a single bundle.
+        """
+        pickleFiles = self._testSerialiseJobGraph()
+        self.assertEqual(len(set(pickleFile.split('@')[0] for pickleFile in pickleFiles)), 1)
+        self.assertTrue(all('@' in pickleFile for pickleFile in pickleFiles))
+
+    def testSerialiseJobGraphUnbundled(self):
+        """
+        Like testSerialiseJobGraph but with every job pickled to a file of its own.
+        """
+        with patch.object(Job, 'maxBundledPickleSize', 0):
+            pickleFiles = self._testSerialiseJobGraph()
+        self.assertEqual(len(set(pickleFiles)), len(pickleFiles))
+        self.assertFalse(any('@' in pickleFile for pickleFile in pickleFiles))
+
+    def testLoadJobFromCache(self):
+        """
+        Check that a job loaded with a cache directory is loaded from there the next time.
+        """
+        path = self._getTestJobStorePath()
+        jobStore = FileJobStore(path)
+        config = Config()
+        config.jobStore = 'file:%s' % path
+        jobStore.initialize(config)
+        cacheDir = os.path.join(self._createTempDir(), 'jobBodies')
+        rootJob = TrivialJob()
+        rootJob.addChild(TrivialJob('bundled'))
+        rootJob.addChild(TrivialJob('large' * Job.maxBundledPickleSize))
+        rootJobGraph = rootJob._serialiseFirstJob(jobStore)
+        commands = [jobStore.load(jobNode.jobStoreID).command for jobNode in rootJobGraph.stack[-1]]
+        values = sorted(Job._loadJob(command, jobStore, cacheDir=cacheDir).value
+                        for command in commands)
+        self.assertEqual(len(os.listdir(cacheDir)), 2)
+        for command in commands:
+            jobStore.deleteFile(command.split()[1].split('@')[0])
+        self.assertEqual(values, sorted(Job._loadJob(command, jobStore, cacheDir=cacheDir).value
+                                        for command in commands))
+        with self.assertRaises(NoSuchFileException):
+            Job._loadJob(commands[0], jobStore)
+
+    def testEvictJobsFromCache(self):
+        """
+        Check that the least recently used copies of pickled jobs are evicted from a cache
+        directory beyond its size limit, and that pickled jobs larger than it aren't cached.
+        """
+        path = self._getTestJobStorePath()
+        jobStore = FileJobStore(path)
+        config = Config()
+        config.jobStore = 'file:%s' % path
+        jobStore.initialize(config)
+        cacheDir = os.path.join(self._createTempDir(), 'jobBodies')
+        rootJob = TrivialJob()
+        for i in range(3):
+            rootJob.addChild(TrivialJob(str(i) * 1000))
+        rootJob.addChild(TrivialJob('large' * 10000))
+        rootJobGraph = rootJob._serialiseFirstJob(jobStore)
+        commands = {Job._loadJob(command, jobStore).value: command
+                    for command in (jobStore.load(jobNode.jobStoreID).command
+                                    for jobNode in rootJobGraph.stack[-1])}
+        Job._loadJob(commands['0' * 1000], jobStore, cacheDir=cacheDir)
+        copySize = os.path.getsize(os.path.join(cacheDir, os.listdir(cacheDir)[0]))
+        # Room for two copies but not for three or for the large one
+        with patch.object(Job, 'maxJobBodyCacheSize', copySize * 5 // 2):
+            time.sleep(0.01)
+            Job._loadJob(commands['1' * 1000], jobStore, cacheDir=cacheDir)
+            time.sleep(0.01)
+            # Using the first copy again makes the second the least recently used one
+            Job._loadJob(commands['0' * 1000], jobStore, cacheDir=cacheDir)
+            time.sleep(0.01)
+            Job._loadJob(commands['2' * 1000], jobStore, cacheDir=cacheDir)
+            cachedCopies = set(os.listdir(cacheDir))
+            self.assertEqual(len(cachedCopies), 2)
+            Job._loadJob(commands['large' * 10000], jobStore, cacheDir=cacheDir)
+            self.assertEqual(set(os.listdir(cacheDir)), cachedCopies)
+        for value in ('0' * 1000, '2' * 1000):
+            pickleFile = commands[value].split()[1]
+            self.assertIn(sha1(pickleFile.encode('utf-8')).hexdigest(), cachedCopies)
+
+    def testPromiseFulfilment(self):
+        """
+        Check that a job holding many promises gets their values, whether they were fulfilled
+        in the current process or have to be read from the job store.
+        """
+        path = self._getTestJobStorePath()
+        jobStore = FileJobStore(path)
+        config = Config()
+        config.jobStore = 'file:%s' % path
+        jobStore.initialize(config)
+        numChildren = 20
+        rootJob = TrivialJob()
+        children = [rootJob.addChild(TrivialJob()) for _ in range(numChildren)]
+        rootJob.addFollowOn(TrivialJob([child.rv() for child in children]))
+        rootJobGraph = rootJob._serialiseFirstJob(jobStore)
+        childCommands = [jobStore.load(jobNode.jobStoreID).command
+                         for jobNode in rootJobGraph.stack[-1]]
+        followOnCommand = jobStore.load(rootJobGraph.stack[0][0].jobStoreID).command
+        for i, command in enumerate(childCommands):
+            Job._loadJob(command, jobStore)._fulfillPromises(i, jobStore)
+        reads = []
+        readFileStream = jobStore.readFileStream
+        def countingReadFileStream(jobStoreFileID):
+            reads.append(jobStoreFileID)
+            return readFileStream(jobStoreFileID)
+        jobStore.readFileStream = countingReadFileStream
+        try:
+            # The promises were fulfilled in this process
+            followOn = Job._loadJob(followOnCommand, jobStore)
+            self.assertEqual(sorted(followOn.value), list(range(numChildren)))
+            self.assertEqual(reads, [])
+            # Once the worker is done with the job store they have to be read from it
+            Promise._forgetJobStore(jobStore)
+            self.assertNotIn(config.jobStore, Promise._fulfilled)
+            followOn = Job._loadJob(followOnCommand, jobStore)
+            self.assertEqual(sorted(followOn.value), list(range(numChildren)))
+            self.assertEqual(len(reads), numChildren)
+            self.assertEqual(Promise._local.prefetched, {})
+            # Unpickling in another thread doesn't see the promise files read in this one
+            loaded = []
+            with Promise._prefetching(reads):
+                thread = threading.Thread(target=lambda: loaded.append(
+                    getattr(Promise._local, 'prefetched', {})))
+                thread.start()
+                thread.join()
+                self.assertEqual(len(Promise._local.prefetched), numChildren)
+            self.assertEqual(loaded, [{}])
+        finally:
+            Promise._forgetJobStore(jobStore)
+            Promise.filesToDelete.clear()
+
+    def testJobPriorities(self):
+        """
+        Check that user-supplied priorities and tags, and the critical paths derived from the
+        job graph are persisted with the job graphs of the successors.
+        """
+        path = self._getTestJobStorePath()
+        jobStore = FileJobStore(path)
+        config = Config()
+        config.jobStore = 'file:%s' % path
+        jobStore.initialize(config)
+        rootJob = TrivialJob()
+        rootJob.addChild(TrivialJob()).addChild(TrivialJob()).addFollowOn(TrivialJob())
+        rootJob.addChild(TrivialJob(priority=5, tags=['license:gatk']))
+        with self.assertRaises(TypeError):
+            TrivialJob(priority='high')
+        with self.assertRaises(TypeError):
+            TrivialJob(tags='license:gatk')
+        rootJobGraph = rootJob._serialiseFirstJob(jobStore)
+        self.assertEqual(rootJobGraph.criticalPath, 4)
+        jobNodes = sorted(rootJobGraph.stack[-1], key=lambda jobNode: jobNode.priority)
+        for jobNode in jobNodes + [jobStore.load(jobNode.jobStoreID) for jobNode in jobNodes]:
+            self.assertIn((jobNode.priority, jobNode.criticalPath, jobNode.tags),
+                          [(0, 3, ()), (5, 1, ('license:gatk',))])
+        self.assertEqual([jobNode.priority for jobNode in jobNodes], [0, 5])
+
+    def _testSerialiseJobGraph(self):
+        """
+        :return: the references to the pickled jobs in the commands of the serialised jobs
+        :rtype: list[str]
+        """
+        path = self._getTestJobStorePath()
+        jobStore = FileJobStore(path)
+        config = Config()
+        config.jobStore = 'file:%s' % path
+        jobStore.initialize(config)
+        updates = []
+        update = jobStore.update
+        def countingUpdate(jobGraph):
+            if getattr(jobStore, '_batchedJobGraphs', None) is None:
+                updates.append(jobGraph.jobStoreID)
+            update(jobGraph)
+        jobStore.update = countingUpdate
+
+        numChildren = 50
+        rootJob = TrivialJob()
+        children = [rootJob.addChild(TrivialJob()) for _ in range(numChildren)]
+        followOn = rootJob.addFollowOn(TrivialJob(children[0].rv()))
+        rootJobGraph = rootJob._serialiseFirstJob(jobStore)
+
+        self.assertEqual(len(rootJobGraph.stack), 2)
+        jobStoreIDs = [jobNode.jobStoreID for jobNode in rootJobGraph.stack[1]]
+        jobStoreIDs += [jobNode.jobStoreID for jobNode in rootJobGraph.stack[0]]
+        self.assertEqual(len(jobStoreIDs), numChildren + 1)
+        # Each successor's job graph is written once. The root's is written when it is created,
+        # when its command is set and finally by _serialiseFirstJob.
+        self.assertEqual(sorted(updates),
+                         sorted(jobStoreIDs + [rootJobGraph.jobStoreID] * 3))
+        commands = [jobStore.load(jobStoreID).command
+                    for jobStoreID in jobStoreIDs + [rootJobGraph.jobStoreID]]
+        self.assertTrue(all(command.startswith('_toil ') for command in commands))
+        # The follow-on can only be unpickled once the promise it holds has been fulfilled
+        for command in commands[:numChildren] + commands[-1:]:
+            self.assertIsInstance(Job._loadJob(command, jobStore), TrivialJob)
+        promisingJob = Job._loadJob(commands[0], jobStore)
+        promiseFileIDs = [fileID for fileIDs in promisingJob._rvs.values() for fileID in fileIDs]
+        self.assertEqual(len(promiseFileIDs), 1)
+        self.assertTrue(jobStore.fileExists(promiseFileIDs[0]))
+        return [command.split()[1] for command in commands]
+
     @slow
     def testNewCheckpointIsLeafVertexNonRootCase(self):
         """
@@ -689,6 +898,15 @@ def errorChild(job):
     raise RuntimeError('Child failure')
 
 
+class TrivialJob(Job):
+    def __init__(self, value=None, **kwargs):
+        Job.__init__(self, **kwargs)
+        self.value = value
+
+    def run(self, fileStore):
+        return self.value
+
+
 class TrivialService(Job.Service):
     def __init__(self, message, *args, **kwargs):
         """ Service that does nothing, used to check for deadlocks
@@ -0,0 +1,281 @@
+# Copyright (C) 2015-2018 Regents of the University of California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from builtins import object
+import time
+from collections import Counter, OrderedDict, defaultdict, deque
+from itertools import count
+from mock import patch
+
+from toil.common import Config
+from toil.job import JobNode
+from toil.leader import Leader
+from toil.test import ToilTest
+
+
+class RecordingBatchSystem(object):
+    """
+    Stands in for a batch system, remembering the jobs issued to it and the questions asked
+    about them.
+    """
+    def __init__(self):
+        self.issued = []
+        # Maps the IDs of the jobs the batch system still knows about to their running times
+        self.runningTimes = {}
+        self.calls = Counter()
+
+    def issueBatchJob(self, jobNode):
+        self.issued.append(jobNode)
+        self.runningTimes[len(self.issued)] = 0
+        return len(self.issued)
+
+    def getIssuedBatchJobIDs(self):
+        self.calls['getIssuedBatchJobIDs'] += 1
+        return list(self.runningTimes)
+
+    def getNumberOfIssuedBatchJobs(self):
+        return len(self.runningTimes)
+
+    def getRunningBatchJobIDs(self):
+        self.calls['getRunningBatchJobIDs'] += 1
+        return dict(self.runningTimes)
+
+
+class EmptyToilState(object):
+    """
+    Stands in for the state of a workflow without any services.
+    """
+    def __init__(self):
+        self.serviceJobStoreIDToPredecessorJob = {}
+        self.successorJobStoreIDToPredecessorJobs = {}
+        self.successorCounts = {}
+
+
+class PredecessorJobGraph(object):
+    """
+    Stands in for the job graph of a job whose successors are running.
+    """
+    def __init__(self, jobStoreID, stack):
+        self.jobStoreID = jobStoreID
+        self.stack = stack
+
+
+class LeaderTest(ToilTest):
+
+    def _createLeader(self, maxJobs=None, jobQuotas=None, jobRates=None):
+        # Bypass the constructor, which requires a job store and starts threads
+        leader = Leader.__new__(Leader)
+        leader.config = Config()
+        if maxJobs is not None:
+            leader.config.maxJobs = maxJobs
+        if jobQuotas is not None:
+            leader.config.jobQuotas = jobQuotas
+        if jobRates is not None:
+            leader.config.jobRates = jobRates
+        leader.jobStoreLocator = 'file:/nonexistent'
+        leader.batchSystem = RecordingBatchSystem()
+        leader.jobBatchSystemIDToIssuedJob = {}
+        leader.jobIssueTimes = OrderedDict()
+        leader.queuedJobSuccessors = {}
+        leader.reissueMissingJobs_missingHash = {}
+        leader.preemptableJobsIssued = 0
+        leader.toilMetrics = None
+        leader.readyJobs = {}
+        leader.readyJobSequenceNumbers = count()
+        leader.quotaUsage = Counter()
+        leader.rateUsage = defaultdict(deque)
+        leader.serviceJobsToBeIssued = []
+        leader.serviceJobsIssued = 0
+        leader.preemptableServiceJobsToBeIssued = []
+        leader.preemptableServiceJobsIssued = 0
+        leader.toilState = EmptyToilState()
+        # Record the jobs killed instead of processing them, which requires a job store
+        leader.killedJobs = []
+        leader.killJobs = leader.killedJobs.extend
+        return leader
+
+    @staticmethod
+    def _makeJobNode(jobStoreID, priority=None, criticalPath=1, jobName='job', tags=None,
+                     predecessorNumber=1):
+        return JobNode(requirements=dict(memory=1, cores=1, disk=1, preemptable=False,
+                                         priority=priority, tags=tags),
+                       jobName=jobName, unitName='', jobStoreID=jobStoreID, command=None,
+                       criticalPath=criticalPath, predecessorNumber=predecessorNumber)
+
+    @staticmethod
+    def _issuedJobStoreIDs(leader):
+        return [jobNode.jobStoreID for jobNode in leader.batchSystem.issued]
+
+    def testIssueReadyJobsInPriorityOrder(self):
+        """
+        Ready jobs are issued by decreasing priority, then by decreasing critical path length,
+        then in the order they became ready.
+        """
+        leader = self._createLeader()
+        leader.queueJobs([self._makeJobNode('first'),
+                          self._makeJobNode('long', criticalPath=10),
+                          self._makeJobNode('urgent', priority=3),
+                          self._makeJobNode('second'),
+                          self._makeJobNode('background', priority=-1, criticalPath=100)])
+        self.assertEqual(leader.batchSystem.issued, [])
+        leader.issueReadyJobs()
+        self.assertEqual(self._issuedJobStoreIDs(leader),
+                         ['urgent', 'long', 'first', 'second', 'background'])
+        self.assertEqual(leader.readyJobs, {})
+        self.assertEqual(len(leader.jobBatchSystemIDToIssuedJob), 5)
+
+    def testIssueReadyJobsWithinLimits(self):
+        """
+        Ready jobs in excess of the maximum number of issued jobs or of a quota on a job name or
+        tag are held until issued jobs are removed. Jobs not subject to an exhausted quota are
+        issued in the meantime.
+        """
+        leader = self._createLeader(maxJobs=4, jobQuotas={'db': 1, 'license:gatk': 2})
+        leader.queueJobs([self._makeJobNode('db1', jobName='db', priority=1),
+                          self._makeJobNode('db2', jobName='db', priority=1),
+                          self._makeJobNode('gatk1', tags=['license:gatk']),
+                          self._makeJobNode('gatk2', tags=['license:gatk'], priority=1),
+                          self._makeJobNode('gatk3', tags=['license:gatk'], priority=1),
+                          self._makeJobNode('other1'),
+                          self._makeJobNode('other2')])
+        leader.issueReadyJobs()
+        self.assertEqual(self._issuedJobStoreIDs(leader), ['db1', 'gatk2', 'gatk3', 'other1'])
+        self.assertEqual(leader.getNumberOfJobsReady(), 3)
+
+        # Removing a job subject to the tag quota frees up capacity for the next one of them
+        leader.removeJob(2)
+        leader.issueReadyJobs()
+        self.assertEqual(self._issuedJobStoreIDs(leader)[4:], ['gatk1'])
+        self.assertEqual(dict(leader.quotaUsage), {'db': 1, 'license:gatk': 2})
+
+        # Removing a job subject to no quota only frees up overall capacity
+        leader.removeJob(4)
+        leader.issueReadyJobs()
+        self.assertEqual(self._issuedJobStoreIDs(leader)[5:], ['other2'])
+        self.assertEqual(leader.getNumberOfJobsReady(), 1)
+        self.assertEqual(set(leader.getJobs()) & {jobNode for heap in leader.readyJobs.values()
+                                                    for _, _, _, jobNode in heap}, set())
+
+    def testIssueReadyJobsWithinRates(self):
+        """
+        Ready jobs in excess of the rate on a job name or tag are held until the jobs issued
+        more than a minute ago no longer count against it.
+        """
+        leader = self._createLeader(jobRates={'db': 2})
+        leader.queueJobs([self._makeJobNode('db%i' % i, tags=['db']) for i in range(3)] +
+                         [self._makeJobNode('other')])
+        with patch.object(time, 'time', return_value=1000):
+            leader.issueReadyJobs()
+            self.assertEqual(self._issuedJobStoreIDs(leader), ['db0', 'db1', 'other'])
+            # Unlike with quotas, finishing jobs doesn't free up capacity
+            leader.removeJob(1)
+            leader.issueReadyJobs()
+            self.assertEqual(leader.getNumberOfJobsReady(), 1)
+        with patch.object(time, 'time', return_value=1060):
+            leader.issueReadyJobs()
+        self.assertEqual(self._issuedJobStoreIDs(leader)[3:], ['db2'])
+
+    def testIssueServiceJobsWithinLimits(self):
+        """
+        Service jobs count against the maximum number of issued jobs and the job quotas, and are
+        held like other jobs when they would exceed them.
+        """
+        leader = self._createLeader(maxJobs=2, jobQuotas={'db': 1})
+        leader.issueServiceJob(self._makeJobNode('db1', jobName='db'))
+        leader.issueServiceJob(self._makeJobNode('db2', jobName='db'))
+        self.assertEqual(self._issuedJobStoreIDs(leader), ['db1'])
+        leader.queueJob(self._makeJobNode('other1'))
+        leader.issueReadyJobs()
+        leader.issueServiceJob(self._makeJobNode('service'))
+        self.assertEqual(self._issuedJobStoreIDs(leader), ['db1', 'other1'])
+        leader.removeJob(2)
+        leader.issueQueingServiceJobs()
+        self.assertEqual(self._issuedJobStoreIDs(leader)[2:], ['service'])
+        leader.removeJob(1)
+        leader.issueQueingServiceJobs()
+        self.assertEqual(self._issuedJobStoreIDs(leader)[3:], ['db2'])
+
+    def testReissueOverLongJobs(self):
+        """
+        Only jobs issued longer ago than the maximum job duration are checked for running too
+        long, and the batch system isn't asked about running jobs unless there are such jobs.
+        """
+        leader = self._createLeader()
+        leader.config.maxJobDuration = 100
+        leader.issueJobs([self._makeJobNode('job%i' % i) for i in range(4)])
+        leader.batchSystem.runningTimes.update({1: 200, 2: 50, 3: 200})
+        leader.reissueOverLongJobs()
+        self.assertEqual(leader.batchSystem.calls['getRunningBatchJobIDs'], 0)
+        self.assertEqual(leader.killedJobs, [])
+
+        # Pretend the first two jobs were issued long ago. The third job has supposedly been
+        # running for longer than it was issued, so it must not be checked.
+        for jobBatchSystemID in (1, 2):
+            leader.jobIssueTimes[jobBatchSystemID] = time.time() - 1000
+        leader.reissueOverLongJobs()
+        self.assertEqual(leader.batchSystem.calls['getRunningBatchJobIDs'], 1)
+        self.assertEqual(leader.killedJobs, [1])
+
+    def testReissueMissingJobs(self):
+        """
+        Job IDs are only compared if the batch system knows about fewer jobs than were issued,
+        and jobs missing repeatedly are killed.
+        """
+        leader = self._createLeader()
+        leader.issueJobs([self._makeJobNode('job%i' % i) for i in range(3)])
+        self.assertTrue(leader.reissueMissingJobs())
+        self.assertEqual(leader.batchSystem.calls['getIssuedBatchJobIDs'], 0)
+
+        # A job that goes missing and turns up again is forgotten
+        runningTime = leader.batchSystem.runningTimes.pop(2)
+        self.assertFalse(leader.reissueMissingJobs())
+        self.assertEqual(leader.reissueMissingJobs_missingHash, {2: 1})
+        leader.batchSystem.runningTimes[2] = runningTime
+        self.assertTrue(leader.reissueMissingJobs())
+        self.assertEqual(leader.reissueMissingJobs_missingHash, {})
+
+        # A job that stays missing is eventually killed
+        del leader.batchSystem.runningTimes[3]
+        for _ in range(3):
+            self.assertEqual(leader.killedJobs, [])
+            leader.reissueMissingJobs(killAfterNTimesMissing=3)
+        self.assertEqual(leader.killedJobs, [3])
+        self.assertEqual(leader.batchSystem.calls['getIssuedBatchJobIDs'], 4)
+
+    def testGetImminentJobs(self):
+        """
+        The children of issued jobs are imminent, as are the follow-ons of a predecessor whose
+        only outstanding successor is issued, unless they wait for other predecessors too.
+        """
+        leader = self._createLeader()
+        children = [self._makeJobNode('child%i' % i) for i in range(3)]
+        joined = self._makeJobNode('joined', predecessorNumber=2)
+        leader.queuedJobSuccessors['gather'] = children + [joined]
+        followOn = self._makeJobNode('followOn')
+        leader.toilState.successorJobStoreIDToPredecessorJobs.update({
+            'last': [PredecessorJobGraph('parent1', [[followOn], [self._makeJobNode('last')]])],
+            'notLast': [PredecessorJobGraph('parent2', [[self._makeJobNode('unreleased')], []])]})
+        leader.toilState.successorCounts.update({'parent1': 1, 'parent2': 2})
+        leader.issueJobs([self._makeJobNode(jobStoreID)
+                          for jobStoreID in ('gather', 'last', 'notLast', 'leaf')])
+        self.assertEqual(sorted((jobBatchSystemID, jobNode.jobStoreID,
+                                 [successor.jobStoreID for successor in successors])
+                                for jobBatchSystemID, jobNode, successors
+                                in leader.getImminentJobs()),
+                         [(1, 'gather', ['child0', 'child1', 'child2']),
+                          (2, 'last', ['followOn'])])
+
+        # The children of a completed job are no longer imminent
+        leader.removeJob(1)
+        self.assertNotIn('gather', leader.queuedJobSuccessors)
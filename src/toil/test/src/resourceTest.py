@@ -14,6 +14,7 @@
 
 from __future__ import absolute_import
 
+import hashlib
 import importlib
 import os
 import sys
@@ -27,7 +28,8 @@ from mock import MagicMock, patch
 
 from toil import subprocess
 from toil import inVirtualEnv
-from toil.resource import ModuleDescriptor, Resource, ResourceException
+from toil.lib.threading import ExceptionalThread
+from toil.resource import DirectoryResource, ModuleDescriptor, Resource, ResourceException
 from toil.test import ToilTest, tempFileContaining, travis_test
 
 
@@ -187,6 +189,39 @@ class ResourceTest(ToilTest):
         finally:
             Resource.cleanSystem()
 
+    def testConcurrentDownload(self):
+        """
+        Asserts that workers concurrently localizing a resource on the same node only download
+        it once.
+        """
+        zipBuffer = BytesIO()
+        with ZipFile(zipBuffer, 'w') as zipFile:
+            zipFile.writestr('foo.py', 'x = 1\n')
+        zipFile = zipBuffer.getvalue()
+        resource = DirectoryResource(name='foo', pathHash=hashlib.md5(b'foo').hexdigest(),
+                                     url='file:///foo.zip',
+                                     contentHash=hashlib.md5(zipFile).hexdigest())
+        downloads = []
+
+        def read():
+            downloads.append(1)
+            return zipFile
+
+        mock_urlopen = MagicMock()
+        mock_urlopen.return_value.read.side_effect = read
+        Resource.prepareSystem()
+        try:
+            with patch('toil.resource.urlopen', mock_urlopen):
+                threads = [ExceptionalThread(target=resource.download) for _ in range(8)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            self.assertEqual(len(downloads), 1)
+            self.assertTrue(os.path.isfile(os.path.join(resource.localDirPath, 'foo.py')))
+        finally:
+            Resource.cleanSystem()
+
     @travis_test
     def testNonPyStandAlone(self):
         """
@@ -11,14 +11,29 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import hashlib
+import json
+import logging
+import os
 import pickle
+import signal
+import subprocess
+import sys
+import time
 
+import toil
 from toil.common import Config
 from toil.job import Job
 from toil.jobGraph import JobGraph
 from toil.jobStores.fileJobStore import FileJobStore
-from toil.test import ToilTest
-from toil.worker import nextChainableJobGraph
+from toil.test import ToilTest, slow
+from toil.lib.expando import MagicExpando
+from toil.worker import (loadEnvironment, nextChainableJobGraph, nextParallelJobGraphs,
+                         runJobGraphsInWorker)
+from toil.workerZygote import (runInZygote, zygoteAddress, zygoteKey, zygoteKeyEnvVar,
+                               zygoteSupported)
+
+logger = logging.getLogger(__name__)
 
 class WorkerTests(ToilTest):
     """Test miscellaneous units of the worker."""
@@ -28,28 +43,13 @@ class WorkerTests(ToilTest):
         self.jobStore = FileJobStore(path)
         self.config = Config()
         self.config.jobStore = 'file:%s' % path
+        self.config.workDir = self._createTempDir(purpose='workDir')
         self.jobStore.initialize(self.config)
         self.jobGraphNumber = 0
 
     def testNextChainableJobGraph(self):
         """Make sure chainable/non-chainable jobs are identified correctly."""
-        def createJobGraph(memory, cores, disk, preemptable, checkpoint):
-            """Create a fake-ish Job and JobGraph pair, and return the
-            jobGraph."""
-            name = 'jobGraph%d' % self.jobGraphNumber
-            self.jobGraphNumber += 1
-
-            job = Job()
-            job.checkpoint = checkpoint
-            with self.jobStore.writeFileStream() as (f, fileStoreID):
-                pickle.dump(job, f, pickle.HIGHEST_PROTOCOL)
-            command = '_toil %s fooCommand toil True' % fileStoreID
-            jobGraph = JobGraph(command=command, memory=memory, cores=cores,
-                                disk=disk, unitName=name,
-                                jobName=name, preemptable=preemptable,
-                                jobStoreID=name, remainingRetryCount=1,
-                                predecessorNumber=1)
-            return self.jobStore.create(jobGraph)
+        createJobGraph = self._createJobGraph
 
         # Identical non-checkpoint jobs should be chainable.
         jobGraph1 = createJobGraph(1, 2, 3, True, False)
@@ -89,3 +89,336 @@ class WorkerTests(ToilTest):
         jobGraph2 = createJobGraph(1, 2, 3, False, True)
         jobGraph1.stack = [[jobGraph2]]
         self.assertEquals(None, nextChainableJobGraph(jobGraph1, self.jobStore))
+
+    def testJobQuotasHoldWhenChaining(self):
+        """A worker must not run successors subject to job quotas its own job isn't subject to."""
+        createJobGraph = self._createJobGraph
+        jobQuotas = {'license:gatk': 1}
+
+        # The successor would take up a slot of the quota that the leader didn't account for
+        jobGraph1 = createJobGraph(1, 2, 3, True, False)
+        jobGraph2 = createJobGraph(1, 2, 3, True, False, tags=['license:gatk'])
+        jobGraph1.stack = [[jobGraph2]]
+        self.assertEquals(None, nextChainableJobGraph(jobGraph1, self.jobStore,
+                                                      jobQuotas=jobQuotas))
+        # Without the quota it is chainable
+        self.assertEquals(jobGraph2, nextChainableJobGraph(jobGraph1, self.jobStore))
+
+        # The successor runs in the slot its predecessor was issued in
+        jobGraph1 = createJobGraph(1, 2, 3, True, False, tags=['license:gatk'])
+        jobGraph1.stack = [[jobGraph2]]
+        self.assertEquals(jobGraph2, nextChainableJobGraph(jobGraph1, self.jobStore,
+                                                           jobQuotas=jobQuotas))
+
+        # Quotas on job names apply as well
+        jobGraph1 = createJobGraph(1, 2, 3, True, False)
+        jobGraph2 = createJobGraph(1, 2, 3, True, False)
+        jobGraph1.stack = [[jobGraph2]]
+        self.assertEquals(None, nextChainableJobGraph(jobGraph1, self.jobStore,
+                                                      jobQuotas={jobGraph2.jobName: 1}))
+
+        # Successors run alongside each other would exceed the quota, even that of the parent
+        parent = createJobGraph(2, 2, 2, True, False, tags=['license:gatk'])
+        children = [createJobGraph(1, 1, 1, True, False, tags=['license:gatk'])
+                    for _ in range(2)]
+        free = [createJobGraph(1, 1, 1, True, False) for _ in range(2)]
+        parent.stack = [children + free]
+        self.assertEqual(set(jobGraph.jobStoreID for jobGraph in free),
+                         set(jobGraph.jobStoreID
+                             for jobGraph in nextParallelJobGraphs(parent, self.jobStore, 10,
+                                                                   jobQuotas)))
+
+        # The leader has to count every job subject to a rate, even if its predecessor is too
+        jobRates = {'db': 2}
+        jobGraph1 = createJobGraph(1, 2, 3, True, False, tags=['db'])
+        jobGraph2 = createJobGraph(1, 2, 3, True, False, tags=['db'])
+        jobGraph1.stack = [[jobGraph2]]
+        self.assertEquals(None, nextChainableJobGraph(jobGraph1, self.jobStore,
+                                                      jobRates=jobRates))
+        parent.stack = [children + free]
+        self.assertEqual(set(jobGraph.jobStoreID for jobGraph in free),
+                         set(jobGraph.jobStoreID
+                             for jobGraph in nextParallelJobGraphs(parent, self.jobStore, 10,
+                                                                   jobRates={'license:gatk': 1})))
+
+    def testConsumablesHoldWhenChaining(self):
+        """A worker must only run successors whose consumable resources its job holds."""
+        createJobGraph = self._createJobGraph
+
+        # The successor needs a consumable its predecessor wasn't allocated
+        jobGraph1 = createJobGraph(1, 2, 3, True, False)
+        jobGraph2 = createJobGraph(1, 2, 3, True, False, consumables={'ssd': 1})
+        jobGraph1.stack = [[jobGraph2]]
+        self.assertEquals(None, nextChainableJobGraph(jobGraph1, self.jobStore))
+
+        # ... or more of it
+        jobGraph1 = createJobGraph(1, 2, 3, True, False, consumables={'ssd': 1, 'gpu': 1})
+        jobGraph2 = createJobGraph(1, 2, 3, True, False, consumables={'ssd': 2})
+        jobGraph1.stack = [[jobGraph2]]
+        self.assertEquals(None, nextChainableJobGraph(jobGraph1, self.jobStore))
+
+        jobGraph2 = createJobGraph(1, 2, 3, True, False, consumables={'ssd': 1})
+        jobGraph1.stack = [[jobGraph2]]
+        self.assertEquals(jobGraph2, nextChainableJobGraph(jobGraph1, self.jobStore))
+
+        # Successors run alongside each other share the consumables of their predecessor
+        parent = createJobGraph(2, 2, 2, True, False, consumables={'ssd': 1})
+        children = [createJobGraph(1, 1, 1, True, False, consumables={'ssd': 1})
+                    for _ in range(2)]
+        tooMany = createJobGraph(1, 1, 1, True, False, consumables={'ssd': 2})
+        for jobGraph in children:
+            jobGraph.stack = [[], []]
+            self.jobStore.update(jobGraph)
+        parent.stack = [children + [tooMany]]
+        successors = nextParallelJobGraphs(parent, self.jobStore, 10)
+        self.assertEqual(set(jobGraph.jobStoreID for jobGraph in children),
+                         set(jobGraph.jobStoreID for jobGraph in successors))
+        statsDict = MagicExpando()
+        statsDict.jobs = []
+        statsDict.workers.logsToMaster = []
+        finished = runJobGraphsInWorker(successors, parent, self.config,
+                                        self._createTempDir(purpose='worker'), statsDict)
+        self.assertEqual(2, len(finished))
+
+    def _createJobGraph(self, memory, cores, disk, preemptable, checkpoint, tags=None,
+                        consumables=None):
+        """Create a fake-ish Job and JobGraph pair, and return the
+        jobGraph."""
+        name = 'jobGraph%d' % self.jobGraphNumber
+        self.jobGraphNumber += 1
+
+        job = Job()
+        job.checkpoint = checkpoint
+        with self.jobStore.writeFileStream() as (f, fileStoreID):
+            pickle.dump(job, f, pickle.HIGHEST_PROTOCOL)
+        command = '_toil %s fooCommand toil True' % fileStoreID
+        jobGraph = JobGraph(command=command, memory=memory, cores=cores,
+                            disk=disk, unitName=name,
+                            jobName=name, preemptable=preemptable,
+                            jobStoreID=name, remainingRetryCount=1,
+                            predecessorNumber=1, tags=tags, consumables=consumables)
+        return self.jobStore.create(jobGraph)
+
+    def testRunJobGraphsInWorker(self):
+        """Make sure a worker runs the successors that fit within it and reports which finished."""
+        ids = lambda jobGraphs: set(jobGraph.jobStoreID for jobGraph in jobGraphs)
+        parent = self._createJobGraph(2, 2, 2, True, False)
+        children = [self._createJobGraph(1, 1, 1, True, False) for _ in range(3)]
+        checkpoint = self._createJobGraph(1, 1, 1, True, True)
+        tooBig = self._createJobGraph(1, 3, 1, True, False)
+        notPreemptable = self._createJobGraph(1, 1, 1, False, False)
+        for jobGraph in children + [checkpoint]:
+            # Like the job graphs made by Job._makeJobGraphs, which have a level for follow-ons
+            # and one for children
+            jobGraph.stack = [[], []]
+            self.jobStore.update(jobGraph)
+        parent.stack = [children + [checkpoint, tooBig, notPreemptable]]
+        # A single successor is left to chaining
+        self.assertEqual([], nextParallelJobGraphs(self._createJobGraph(2, 2, 2, True, False),
+                                                   self.jobStore, 10))
+        # Checkpoints are only recognized once their job has been loaded
+        successors = nextParallelJobGraphs(parent, self.jobStore, 10)
+        self.assertEqual(ids(children + [checkpoint]), ids(successors))
+
+        statsDict = MagicExpando()
+        statsDict.jobs = []
+        statsDict.workers.logsToMaster = []
+        finished = runJobGraphsInWorker(successors, parent, self.config,
+                                        self._createTempDir(purpose='worker'), statsDict)
+        self.assertEqual(ids(children), ids(finished))
+        for child in children:
+            self.assertIsNone(self.jobStore.load(child.jobStoreID).command)
+        self.assertIsNotNone(self.jobStore.load(checkpoint.jobStoreID).command)
+
+    def testWideScatterIsIssued(self):
+        """A worker runs at most the configured number of successors, leaving the rest of a wide
+        scatter to be issued to the batch system."""
+        parent = self._createJobGraph(2, 2, 2, True, False)
+        children = [self._createJobGraph(1, 1, 1, True, False) for _ in range(20)]
+        for jobGraph in children:
+            jobGraph.stack = [[], []]
+            self.jobStore.update(jobGraph)
+        parent.stack = [list(children)]
+        successors = nextParallelJobGraphs(parent, self.jobStore, 3)
+        self.assertEqual(3, len(successors))
+
+        statsDict = MagicExpando()
+        statsDict.jobs = []
+        statsDict.workers.logsToMaster = []
+        finished = runJobGraphsInWorker(successors, parent, self.config,
+                                        self._createTempDir(purpose='worker'), statsDict)
+        finishedIDs = set(jobGraph.jobStoreID for jobGraph in finished)
+        self.assertEqual(set(jobGraph.jobStoreID for jobGraph in successors), finishedIDs)
+        # The other successors are still runnable, so the leader will issue them
+        remaining = [child for child in children if child.jobStoreID not in finishedIDs]
+        self.assertEqual(17, len(remaining))
+        for child in remaining:
+            self.assertIsNotNone(self.jobStore.load(child.jobStoreID).command)
+        # Absorbing successors is opt-in
+        self.assertEqual(0, Config().maxWorkerSuccessors)
+
+    def testEnvironmentCache(self):
+        """Workers should read the environment from a validated node-local copy if there is one."""
+        name = 'TOIL_TEST_ENVIRONMENT_CACHE'
+        cacheDir = self._createTempDir(purpose='cache')
+
+        def writeEnvironment(value):
+            data = pickle.dumps({name: value}, pickle.HIGHEST_PROTOCOL)
+            with self.jobStore.writeSharedFileStream('environment.pickle') as f:
+                f.write(data)
+            return hashlib.md5(data).hexdigest()
+
+        try:
+            environmentHash = writeEnvironment('a')
+            loadEnvironment(self.jobStore, cacheDir, environmentHash)
+            self.assertEqual(os.environ[name], 'a')
+            self.assertEqual(os.listdir(cacheDir), ['environment-%s.pickle' % environmentHash])
+            # Subsequent workers use the cached copy rather than the one in the job store ...
+            writeEnvironment('b')
+            loadEnvironment(self.jobStore, cacheDir, environmentHash)
+            self.assertEqual(os.environ[name], 'a')
+            # ... unless it is corrupt ...
+            with open(os.path.join(cacheDir, 'environment-%s.pickle' % environmentHash), 'wb') as f:
+                f.write(b'garbage')
+            loadEnvironment(self.jobStore, cacheDir, environmentHash)
+            self.assertEqual(os.environ[name], 'b')
+            # ... or doesn't match the environment in the job store
+            newHash = writeEnvironment('c')
+            loadEnvironment(self.jobStore, cacheDir, newHash)
+            self.assertEqual(os.environ[name], 'c')
+        finally:
+            os.environ.pop(name, None)
+
+    def testWorkerImportIsLazy(self):
+        """Importing the worker entry point must not import Toil's job machinery or backends."""
+        modules = json.loads(self._python('import json, sys, toil.worker; '
+                                          'print(json.dumps(list(sys.modules)))'))
+        for module in ('toil.common', 'toil.job', 'toil.fileStore', 'toil.test', 'boto',
+                       'toil.jobStores.fileJobStore', 'toil.jobStores.aws.jobStore',
+                       'toil.jobStores.azureJobStore', 'toil.jobStores.googleJobStore'):
+            self.assertNotIn(module, modules)
+
+    @slow
+    def testWorkerStartupLatency(self):
+        """Benchmark the import time of the worker and its per-job startup latency."""
+        numRuns = 10
+        importTimes = []
+        for _ in range(numRuns):
+            start = time.time()
+            self._python('import toil.worker')
+            importTimes.append(time.time() - start)
+        logger.info('Importing toil.worker took %.3fs on average (best %.3fs)',
+                    sum(importTimes) / numRuns, min(importTimes))
+
+        with self.jobStore.writeSharedFileStream('environment.pickle') as f:
+            pickle.dump(dict(os.environ), f, pickle.HIGHEST_PROTOCOL)
+        # Warm up the file system caches
+        self._runEmptyJobs(1)
+        coldTime = self._runEmptyJobs(numRuns)
+        logger.info('Running an empty job took %.3fs per job', coldTime / numRuns)
+        if not zygoteSupported():
+            return
+        key = zygoteKey(self.config.jobStore)
+        zygote = subprocess.Popen([sys.executable, '-m', 'toil.workerZygote',
+                                   key, self.config.jobStore], env=self._env())
+        try:
+            address = zygoteAddress(key)
+            while not os.path.exists(address):
+                self.assertIsNone(zygote.poll())
+                time.sleep(0.1)
+            zygoteTime = self._runEmptyJobs(numRuns, zygoteKey=key)
+            logger.info('Running an empty job in a zygote took %.3fs per job',
+                        zygoteTime / numRuns)
+        finally:
+            zygote.terminate()
+            zygote.wait()
+            for path in (address, address + '.lock'):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+    def testZygoteRelaysKill(self):
+        """A worker forked by the zygote must die along with the process that handed it off."""
+        if not zygoteSupported():
+            self.skipTest('Worker zygotes are not supported on this platform')
+        marker = os.path.join(self._createTempDir(purpose='marker'), 'started')
+        with self.jobStore.writeSharedFileStream('environment.pickle') as f:
+            pickle.dump(dict(os.environ), f, pickle.HIGHEST_PROTOCOL)
+        key = zygoteKey(self.config.jobStore)
+        # Replace the worker with one that signals it started and then hangs
+        zygote = subprocess.Popen([sys.executable, '-c',
+                                   'import os, sys, time, toil.worker, toil.workerZygote; '
+                                   'toil.worker._runWorker = lambda argv: '
+                                   '(open(os.environ["TOIL_TEST_MARKER"], "w").close(), '
+                                   'time.sleep(600)); '
+                                   'toil.workerZygote.main()',
+                                   key, self.config.jobStore], env=self._env())
+        address = zygoteAddress(key)
+        try:
+            while not os.path.exists(address):
+                self.assertIsNone(zygote.poll())
+                time.sleep(0.1)
+            # Without the key from the leader, workers don't hand off their jobs
+            os.environ.pop(zygoteKeyEnvVar, None)
+            self.assertIsNone(runInZygote(['_toil_worker', 'hang', self.config.jobStore, 'unused']))
+            env = self._env(zygoteKey=key)
+            env['TOIL_TEST_MARKER'] = marker
+            worker = subprocess.Popen([sys.executable, '-c', 'from toil.worker import main; main()',
+                                       'hang', self.config.jobStore, 'unused'], env=env)
+            while not os.path.exists(marker):
+                self.assertIsNone(worker.poll())
+                time.sleep(0.1)
+            worker.terminate()
+            # The forked worker died of the relayed SIGTERM
+            self.assertEqual(worker.wait(), 128 + signal.SIGTERM)
+            self.assertIsNone(zygote.poll())
+        finally:
+            zygote.terminate()
+            zygote.wait()
+            for path in (address, address + '.lock'):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+    def testZygoteKey(self):
+        """The zygote key changes along with the user module, but not otherwise."""
+        userModule = os.path.join(self._createTempDir(purpose='userModule'), 'foo.py')
+        with open(userModule, 'w') as f:
+            f.write('x = 1\n')
+        key = zygoteKey(self.config.jobStore, userModule)
+        self.assertEqual(zygoteKey(self.config.jobStore, userModule), key)
+        self.assertNotEqual(zygoteKey('file:/other', userModule), key)
+        with open(userModule, 'w') as f:
+            f.write('x = 2\n')
+        self.assertNotEqual(zygoteKey(self.config.jobStore, userModule), key)
+
+    def _runEmptyJobs(self, numJobs, zygoteKey=None):
+        """
+        Run the given number of workers on job graphs without a command and return the time it
+        took. The workers hand off to the zygote with the given key, if any.
+        """
+        jobGraphs = [self.jobStore.create(JobGraph(command=None, memory=1, cores=1, disk=1,
+                                                   unitName='empty', jobName='empty',
+                                                   preemptable=True, jobStoreID=None,
+                                                   remainingRetryCount=1, predecessorNumber=1))
+                     for _ in range(numJobs)]
+        start = time.time()
+        for jobGraph in jobGraphs:
+            self._python('from toil.worker import main; main()',
+                         'empty', self.config.jobStore, jobGraph.jobStoreID, zygoteKey=zygoteKey)
+        elapsed = time.time() - start
+        # The worker deletes a job graph once there is nothing left to do for it
+        for jobGraph in jobGraphs:
+            self.assertFalse(self.jobStore.exists(jobGraph.jobStoreID))
+        return elapsed
+
+    def _python(self, code, *args, **kwargs):
+        return subprocess.check_output((sys.executable, '-c', code) + args,
+                                       env=self._env(kwargs.get('zygoteKey')))
+
+    @staticmethod
+    def _env(zygoteKey=None):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.path.dirname(os.path.dirname(os.path.abspath(toil.__file__)))
+        env.pop(zygoteKeyEnvVar, None)
+        if zygoteKey is not None:
+            env[zygoteKeyEnvVar] = zygoteKey
+        return env
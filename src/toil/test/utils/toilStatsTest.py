@@ -0,0 +1,95 @@
+# Copyright (C) 2018 Regents of the University of California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import division
+from builtins import range
+import json
+import random
+
+from toil.common import Config
+from toil.jobStores.fileJobStore import FileJobStore
+from toil.lib.expando import Expando
+from toil.statsAndLogging import StatsTable
+from toil.test import ToilTest
+from toil.utils.toilStats import getStats, getStatsTable, processData, processStatsTable
+
+
+class StatsTableTest(ToilTest):
+    """
+    Tests that the stats table written by the leader is summarized like the stats of the workers.
+    """
+    def setUp(self):
+        super(StatsTableTest, self).setUp()
+        path = self._getTestJobStorePath()
+        self.jobStore = FileJobStore(path)
+        self.config = Config()
+        self.config.jobStore = 'file:%s' % path
+        self.config.workflowAttemptNumber = 0
+        self.jobStore.initialize(self.config)
+
+    def _writeStats(self, statsTable, numWorkers):
+        random.seed(0)
+        for worker in range(numWorkers):
+            stats = dict(workers=dict(time=str(random.randint(10, 20)), clock='5.5',
+                                      memory=str(random.randint(1000, 2000)), logsToMaster=[]),
+                         jobs=[dict(start=str(1000.0 + worker), time=str(random.randint(1, 10)),
+                                    clock=str(random.randint(0, 8) / 8),
+                                    memory=str(random.randint(1, 999)),
+                                    class_name=random.choice(['align', 'index', 'call']),
+                                    requestedCores='1', requestedMemory='2147483648',
+                                    requestedDisk='2147483648', preemptable='False')
+                               for _ in range(random.randint(0, 4))])
+            self.jobStore.writeStatsAndLogging(json.dumps(stats))
+            statsTable.add(json.loads(json.dumps(stats), object_hook=Expando))
+        # Workers that only report log messages are left out
+        statsTable.add(Expando(workers=Expando(logsToMaster=[]), jobs=[]))
+        self.jobStore.writeStatsAndLogging(json.dumps(dict(total_time='60.5',
+                                                           total_clock='2.5')))
+
+    def testStatsTable(self):
+        statsTable = StatsTable(self.jobStore, self.config)
+        statsTable.chunkSize = 7
+        self._writeStats(statsTable, 25)
+        statsTable.close(60.5, 2.5)
+        self.assertGreater(statsTable.index['chunks'], 1)
+        table = getStatsTable(self.jobStore)
+        self.assertEqual(len(table.workers.time), 25)
+        for jobNames in None, ['a*', 'call']:
+            self.assertEqual(processStatsTable(self.config, table, jobNames),
+                             processData(self.config, getStats(self.jobStore), jobNames))
+        collatedStats = processStatsTable(self.config, table, ['a*'])
+        self.assertEqual(list(collatedStats.job_types), ['align'])
+        self.assertEqual(collatedStats.jobs.total_number,
+                         collatedStats.job_types.align.total_number)
+
+    def testIncompleteStatsTable(self):
+        """
+        Once a run of the workflow didn't complete the stats table, it is no longer used.
+        """
+        StatsTable(self.jobStore, self.config).add(Expando())
+        self.assertIsNone(getStatsTable(self.jobStore))
+        statsTable = StatsTable(self.jobStore, self.config)
+        self._writeStats(statsTable, 1)
+        statsTable.close(60.5, 2.5)
+        self.assertIsNone(getStatsTable(self.jobStore))
+
+    def testRestartWithoutStatsTable(self):
+        """
+        A restarted workflow doesn't start a stats table that would lack the earlier runs.
+        """
+        self.config.workflowAttemptNumber = 1
+        statsTable = StatsTable(self.jobStore, self.config)
+        self._writeStats(statsTable, 1)
+        statsTable.close(60.5, 2.5)
+        self.assertIsNone(getStatsTable(self.jobStore))
@@ -0,0 +1,83 @@
+# Copyright (C) 2015-2018 Regents of the University of California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Replays a workflow run with --stats through the autoscaler on a simulated cluster.
+"""
+
+from __future__ import absolute_import, print_function
+import logging
+import sys
+
+from toil.common import Toil, Config
+from toil.job import Job
+from toil.lib.bioio import setLoggingFromOptions
+from toil.provisioners.scalingSimulator import ScalingSimulator, traceFromStats
+from toil.utils.toilStats import getStats
+
+logger = logging.getLogger(__name__)
+
+
+def parseNodePrice(nodePrice):
+    """
+    >>> parseNodePrice('c4.8xlarge=1.591')
+    ('c4.8xlarge', 1.591)
+    """
+    nodeType, _, price = nodePrice.partition('=')
+    return nodeType, float(price)
+
+
+def printReport(report):
+    print('Jobs:                  %i' % report.jobs)
+    print('Makespan:              %.1f s' % report.makespan)
+    print('Cost:                  %.2f' % report.cost)
+    for nodeType, hours in sorted(report.nodeHours.items()):
+        print('Node hours (%s): %.2f' % (nodeType, hours))
+    print('Idle node hours:       %.2f' % report.idleNodeHours)
+    print('Mean queueing delay:   %.1f s' % report.meanQueueingDelay)
+    print('Max queueing delay:    %.1f s' % report.maxQueueingDelay)
+
+
+def main():
+    """
+    Replays the jobs of a workflow run with --stats through the cluster scaler configured with
+    the given autoscaling options, and reports the cost, makespan, idle node hours and queueing
+    delays the workflow would have had.
+    """
+    parser = Job.Runner.getDefaultArgumentParser()
+    parser.add_argument("--nodeLaunchTime", dest="nodeLaunchTime", default=300, type=float,
+                        help="The number of seconds it takes a worker node to come up in the "
+                             "simulated cluster. default=%(default)s")
+    parser.add_argument("--nodePrice", dest="nodePrices", default=[], action="append",
+                        type=parseNodePrice, metavar="TYPE=PRICE",
+                        help="The price per hour of a node type, e.g. c4.8xlarge=1.591. May be "
+                             "given once for each node type. Node types without a price cost "
+                             "1.0 per hour.")
+    options = parser.parse_args()
+    setLoggingFromOptions(options)
+    config = Config()
+    config.setOptions(options)
+    if not config.nodeTypes:
+        parser.error('Specify the node types to simulate with --nodeTypes.')
+
+    jobStore = Toil.resumeJobStore(config.jobStore)
+    trace = traceFromStats(getStats(jobStore))
+    if not trace:
+        logger.error('The job store contains no statistics to replay. Was the workflow run '
+                     'with --stats and a recent version of Toil?')
+        sys.exit(1)
+    simulator = ScalingSimulator(config, trace,
+                                 nodeLaunchTime=options.nodeLaunchTime,
+                                 nodePrices=dict(options.nodePrices))
+    printReport(simulator.run())
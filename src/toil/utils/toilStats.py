@@ -23,13 +23,17 @@ from builtins import range
 from past.utils import old_div
 from builtins import object
 from functools import partial
+from fnmatch import fnmatch
 import logging
 import json
+import numpy as np
 from toil.lib.bioio import getBasicOptionParser
 from toil.lib.bioio import parseBasicOptions
 from toil.common import Toil, jobStoreLocatorHelp, Config
 from toil.version import version
 from toil.lib.expando import Expando
+from toil.jobStores.abstractJobStore import NoSuchFileException
+from toil.statsAndLogging import StatsTable
 
 logger = logging.getLogger( __name__ )
 
@@ -87,6 +91,11 @@ def initializeOptions(parser):
     parser.add_argument("--sortReverse", "--reverseSort", default=False,
                       action="store_true",
                       help="reverse sort order.")
+    parser.add_argument("--jobNames",
+                      help=("comma separated list of the names of the jobs "
+                            "to report on, which may contain shell-style "
+                            "wildcards. Other jobs are left out of the job "
+                            "summaries."))
     parser.add_argument("--version", action='version', version=version)
 
 def checkOptions(options, parser):
@@ -116,6 +125,8 @@ def checkOptions(options, parser):
         if (options.sortField not in sortFields):
             parser.error("Unknown --sortField %s. Must be from %s"
                          % (options.sortField, str(sortFields)))
+    if options.jobNames is not None:
+        options.jobNames = options.jobNames.split(",")
 
 def printJson(elem):
     """ Return a JSON formatted string
@@ -442,72 +453,50 @@ def updateColumnWidths(tag, cw, options):
 def buildElement(element, items, itemName):
     """ Create an element for output.
     """
-    def assertNonnegative(i,name):
-        if i < 0:
-            raise RuntimeError("Negative value %s reported for %s" %(i,name) )
-        else:
-            return float(i)
-
-    itemTimes = []
-    itemClocks = []
-    itemMemory = []
-    for item in items:
-        itemTimes.append(assertNonnegative(float(item["time"]), "time"))
-        itemClocks.append(assertNonnegative(float(item["clock"]), "clock"))
-        itemMemory.append(assertNonnegative(float(item["memory"]), "memory"))
-    assert len(itemClocks) == len(itemTimes) == len(itemMemory)
-
-    itemWaits=[]
-    for index in range(0,len(itemTimes)):
-        itemWaits.append(itemTimes[index] - itemClocks[index])
-
-    itemWaits.sort()
-    itemTimes.sort()
-    itemClocks.sort()
-    itemMemory.sort()
-
-    if len(itemTimes) == 0:
-        itemTimes.append(0)
-        itemClocks.append(0)
-        itemWaits.append(0)
-        itemMemory.append(0)
-
-    element[itemName]=Expando(
-        total_number=float(len(items)),
-        total_time=float(sum(itemTimes)),
-        median_time=float(itemTimes[old_div(len(itemTimes),2)]),
-        average_time=float(old_div(sum(itemTimes),len(itemTimes))),
-        min_time=float(min(itemTimes)),
-        max_time=float(max(itemTimes)),
-        total_clock=float(sum(itemClocks)),
-        median_clock=float(itemClocks[old_div(len(itemClocks),2)]),
-        average_clock=float(old_div(sum(itemClocks),len(itemClocks))),
-        min_clock=float(min(itemClocks)),
-        max_clock=float(max(itemClocks)),
-        total_wait=float(sum(itemWaits)),
-        median_wait=float(itemWaits[old_div(len(itemWaits),2)]),
-        average_wait=float(old_div(sum(itemWaits),len(itemWaits))),
-        min_wait=float(min(itemWaits)),
-        max_wait=float(max(itemWaits)),
-        total_memory=float(sum(itemMemory)),
-        median_memory=float(itemMemory[old_div(len(itemMemory),2)]),
-        average_memory=float(old_div(sum(itemMemory),len(itemMemory))),
-        min_memory=float(min(itemMemory)),
-        max_memory=float(max(itemMemory)),
-        name=itemName
-    )
-    return element[itemName]
+    return buildColumnsElement(element,
+                               np.array([float(item["time"]) for item in items]),
+                               np.array([float(item["clock"]) for item in items]),
+                               np.array([float(item["memory"]) for item in items]),
+                               itemName)
+
+def buildColumnsElement(element, times, clocks, memory, itemName):
+    """ Create an element for output from arrays of the times, clocks and
+    memory of the items.
+    """
+    for values, name in [(times, "time"), (clocks, "clock"), (memory, "memory")]:
+        if (values < 0).any():
+            raise RuntimeError("Negative value %s reported for %s"
+                               % (values[values < 0][0], name))
+    summary = Expando(total_number=float(len(times)), name=itemName)
+    for values, name in [(times, "time"), (clocks, "clock"),
+                         (times - clocks, "wait"), (memory, "memory")]:
+        if len(values) == 0:
+            values = np.zeros(1)
+        middle = len(values) // 2
+        summary["total_" + name] = float(values.sum())
+        summary["median_" + name] = float(np.partition(values, middle)[middle])
+        summary["average_" + name] = float(values.mean())
+        summary["min_" + name] = float(values.min())
+        summary["max_" + name] = float(values.max())
+    element[itemName] = summary
+    return summary
 
 def createSummary(element, containingItems, containingItemName, getFn):
-    itemCounts = [len(getFn(containingItem)) for
-                  containingItem in containingItems]
-    itemCounts.sort()
+    createCountsSummary(element,
+                        np.array([len(getFn(containingItem))
+                                  for containingItem in containingItems], dtype=int),
+                        containingItemName)
+
+def createCountsSummary(element, itemCounts, containingItemName):
+    """ Summarize the number of items in each containing item.
+    """
     if len(itemCounts) == 0:
-        itemCounts.append(0)
-    element["median_number_per_%s" % containingItemName] = itemCounts[old_div(len(itemCounts), 2)]
-    element["average_number_per_%s" % containingItemName] = old_div(float(sum(itemCounts)), len(itemCounts))
-    element["min_number_per_%s" % containingItemName] = min(itemCounts)
-    element["max_number_per_%s" % containingItemName] = max(itemCounts)
+        itemCounts = np.zeros(1, dtype=int)
+    middle = len(itemCounts) // 2
+    element["median_number_per_%s" % containingItemName] = int(np.partition(itemCounts, middle)[middle])
+    element["average_number_per_%s" % containingItemName] = float(itemCounts.mean())
+    element["min_number_per_%s" % containingItemName] = int(itemCounts.min())
+    element["max_number_per_%s" % containingItemName] = int(itemCounts.max())
 
 
 def getStats(jobStore):
@@ -531,7 +520,66 @@ def getStats(jobStore):
     return aggregateObject
 
 
-def processData(config, stats):
+def getStatsTable(jobStore):
+    """ Load the columns of the stats table written as the workflow ran.
+    Return None if the workflow didn't write a complete table.
+    """
+    try:
+        with jobStore.readSharedFileStream(StatsTable.indexFileName) as f:
+            index = json.loads(f.read().decode('utf-8'))
+    except NoSuchFileException:
+        return None
+    if not index["complete"]:
+        return None
+    jobs = dict((name, []) for name, _ in StatsTable.jobColumns)
+    workers = dict((name, []) for name, _ in StatsTable.workerColumns)
+    jobNameCodes = {}
+    for chunk in range(index["chunks"]):
+        with jobStore.readSharedFileStream(StatsTable.chunkFileName % chunk) as f:
+            data = f.read()
+        offset = data.index(b"\n") + 1
+        header = json.loads(data[:offset].decode("utf-8"))
+        for columns, rows, table in [(header["jobColumns"], header["jobs"], jobs),
+                                     (header["workerColumns"], header["workers"], workers)]:
+            for name, dtype in columns:
+                dtype = np.dtype("<" + dtype)
+                table[name].append(np.frombuffer(data, dtype, rows, offset))
+                offset += rows * dtype.itemsize
+        # Translate the job names of the chunk to the ones of the whole table
+        codes = np.array([jobNameCodes.setdefault(name, len(jobNameCodes))
+                          for name in header["jobNames"]], dtype=np.uint32)
+        jobs["name"][-1] = codes[jobs["name"][-1]]
+
+    def concatenate(table, columns):
+        return Expando((name, np.concatenate(table[name]) if table[name]
+                              else np.zeros(0, dtype=typeCode))
+                       for name, typeCode in columns)
+
+    return Expando(jobs=concatenate(jobs, StatsTable.jobColumns),
+                   workers=concatenate(workers, StatsTable.workerColumns),
+                   job_names=sorted(jobNameCodes, key=jobNameCodes.get),
+                   total_time=index["totalTime"],
+                   total_clock=index["totalClock"])
+
+
+def selectJobName(jobName, jobNames):
+    """ Return True if the job name matches one of the given names or
+    wildcard patterns, or if no names are given.
+    """
+    return jobNames is None or any(fnmatch(jobName, pattern) for pattern in jobNames)
+
+
+def createCollatedStatsTag(config, totalRunTime, totalClock):
+    return Expando(total_run_time=totalRunTime,
+                   total_clock=totalClock,
+                   batch_system=config.batchSystem,
+                   default_memory=str(config.defaultMemory),
+                   default_cores=str(config.defaultCores),
+                   max_cores=str(config.maxCores)
+                   )
+
+
+def processData(config, stats, jobNames=None):
     ##########################################
     # Collate the stats and report
     ##########################################
@@ -541,37 +589,55 @@ def processData(config, stats):
         stats.total_time = sum([float(number) for number in stats.total_time])
         stats.total_clock = sum([float(number) for number in stats.total_clock])
 
-    collatedStatsTag = Expando(total_run_time=stats.total_time,
-                               total_clock=stats.total_clock,
-                               batch_system=config.batchSystem,
-                               default_memory=str(config.defaultMemory),
-                               default_cores=str(config.defaultCores),
-                               max_cores=str(config.maxCores)
-                               )
+    collatedStatsTag = createCollatedStatsTag(config, stats.total_time, stats.total_clock)
 
     # Add worker info
     worker = [_f for _f in stats.workers if _f]
-    jobs = [_f for _f in stats.jobs if _f]
-    jobs = [item for sublist in jobs for item in sublist]
-
-    def fn4(job):
-        try:
-            return list(jobs)
-        except TypeError:
-            return []
+    workerJobs = [[job for job in jobs or [] if selectJobName(job.class_name, jobNames)]
+                  for jobs in stats.jobs]
+    jobs = [item for sublist in workerJobs for item in sublist]
 
     buildElement(collatedStatsTag, worker, "worker")
     createSummary(buildElement(collatedStatsTag, jobs, "jobs"),
-                  stats.workers, "worker", fn4)
+                  workerJobs, "worker", lambda jobs: jobs)
     # Get info for each job
-    jobNames = set()
+    jobTypes = {}
     for job in jobs:
-        jobNames.add(job.class_name)
+        jobTypes.setdefault(job.class_name, []).append(job)
+    jobTypesTag = Expando()
+    collatedStatsTag.job_types = jobTypesTag
+    for jobName, jobsOfType in jobTypes.items():
+        buildElement(jobTypesTag, jobsOfType, jobName)
+    collatedStatsTag.name = "collatedStatsTag"
+    return collatedStatsTag
+
+def processStatsTable(config, table, jobNames=None):
+    """ Collate the columns returned by getStatsTable() like processData().
+    """
+    collatedStatsTag = createCollatedStatsTag(config, table.total_time, table.total_clock)
+    workers = table.workers
+    buildColumnsElement(collatedStatsTag, workers.time, workers.clock, workers.memory, "worker")
+
+    selected = np.array([selectJobName(jobName, jobNames) for jobName in table.job_names],
+                        dtype=bool)
+    jobs = Expando((name, column[selected[table.jobs.name]])
+                   for name, column in table.jobs.items())
+    createCountsSummary(buildColumnsElement(collatedStatsTag, jobs.time, jobs.clock,
+                                            jobs.memory, "jobs"),
+                        np.bincount(jobs.worker, minlength=len(workers.time)), "worker")
+    # Get info for each job, sorting the jobs by name to make the jobs of
+    # each name contiguous
     jobTypesTag = Expando()
     collatedStatsTag.job_types = jobTypesTag
-    for jobName in jobNames:
-        jobTypes = [ job for job in jobs if job.class_name == jobName ]
-        buildElement(jobTypesTag, jobTypes, jobName)
+    order = np.argsort(jobs.name, kind="mergesort")
+    ends = np.cumsum(np.bincount(jobs.name, minlength=len(table.job_names)))
+    start = 0
+    for jobName, end in zip(table.job_names, ends):
+        if end > start:
+            rows = order[start:end]
+            buildColumnsElement(jobTypesTag, jobs.time[rows], jobs.clock[rows],
+                                jobs.memory[rows], jobName)
+        start = end
     collatedStatsTag.name = "collatedStatsTag"
     return collatedStatsTag
 
@@ -599,6 +665,11 @@ def main():
     config = Config()
     config.setOptions(options)
     jobStore = Toil.resumeJobStore(config.jobStore)
-    stats = getStats(jobStore)
-    collatedStatsTag = processData(jobStore.config, stats)
+    statsTable = getStatsTable(jobStore)
+    if statsTable is None:
+        # Workflows run with older versions of Toil or that didn't shut down
+        stats = getStats(jobStore)
+        collatedStatsTag = processData(jobStore.config, stats, options.jobNames)
+    else:
+        collatedStatsTag = processStatsTable(jobStore.config, statsTable, options.jobNames)
     reportData(collatedStatsTag, options)
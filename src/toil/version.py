@@ -0,0 +1,13 @@
+baseVersion = '3.19.0a1'
+cgcloudVersion = '1.6.0a1.dev393'
+dockerRegistry = 'quay.io/ucsc_cgl'
+dockerName = 'toil'
+version = '3.19.0a1-f84815cfedbf71d9a661ca5bf6f2cf4fbd573320'
+shortVersion = '3.19.0a1-f84815c'
+distVersion = '3.19.0a1'
+dockerTag = '3.19.0a1-f84815cfedbf71d9a661ca5bf6f2cf4fbd573320'
+dockerShortTag = '3.19.0a1-f84815c'
+dockerMinimalTag = '3.19.0a1'
+buildNumber = None
+currentCommit = 'f84815cfedbf71d9a661ca5bf6f2cf4fbd573320'
+dirty = False
@@ -19,7 +19,8 @@ from builtins import map
 from builtins import filter
 import os
 import sys
-import copy
+import errno
+import hashlib
 import random
 import json
 import tempfile
@@ -31,22 +32,99 @@ import shutil
 from threading import Thread
 
 from toil.lib.expando import MagicExpando
-from toil.common import Toil, safeUnpickleFromStream
-from toil.fileStore import FileStore
 from toil import logProcessContext
-from toil.job import Job
+from toil import pickle
 from toil.lib.bioio import setLogLevel
 from toil.lib.bioio import getTotalCpuTime
 from toil.lib.bioio import getTotalCpuTimeAndMemoryUsage
 import signal
 
+# toil.common, toil.job and toil.fileStore (and through them the job store and provisioner
+# backends) are imported where they are used rather than here. This keeps `_toil_worker` cheap to
+# start, which matters most when it merely hands the job off to a worker zygote.
+
 logging.basicConfig()
 logger = logging.getLogger(__name__)
 
-def nextChainableJobGraph(jobGraph, jobStore):
+
+def loadEnvironment(jobStore, cacheDir=None, environmentHash=None):
+    """
+    Apply the leader's environment, as saved in the given job store, to this process.
+
+    :param toil.jobStores.abstractJobStore.AbstractJobStore jobStore: The job store.
+    :param str cacheDir: A node-local directory shared by the workers of the workflow. If given
+           along with environmentHash, the environment is read from a copy in that directory,
+           which is created by the first worker on the node that needs it.
+    :param str environmentHash: The MD5 of the environment file, used to validate the cached copy.
+    """
+    environment = None
+    cachePath = None
+    if cacheDir is not None and environmentHash is not None:
+        cachePath = os.path.join(cacheDir, 'environment-%s.pickle' % environmentHash)
+        try:
+            with open(cachePath, 'rb') as fileHandle:
+                data = fileHandle.read()
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        else:
+            if hashlib.md5(data).hexdigest() == environmentHash:
+                environment = pickle.loads(data)
+            else:
+                logger.warning("Ignoring corrupt cached environment at %s", cachePath)
+    if environment is None:
+        with jobStore.readSharedFileStream("environment.pickle") as fileHandle:
+            data = fileHandle.read()
+        environment = pickle.loads(data)
+        # Only cache the version the config refers to, a restarted leader may be rewriting it
+        if cachePath is not None and hashlib.md5(data).hexdigest() == environmentHash:
+            fd, tempPath = tempfile.mkstemp(dir=cacheDir, prefix='environment-')
+            with os.fdopen(fd, 'wb') as fileHandle:
+                fileHandle.write(data)
+            # Atomically publish the copy to the other workers on this node
+            os.rename(tempPath, cachePath)
+    for i in environment:
+        if i not in ("TMPDIR", "TMP", "HOSTNAME", "HOSTTYPE"):
+            os.environ[i] = environment[i]
+    # sys.path is used by __import__ to find modules
+    if "PYTHONPATH" in environment:
+        for e in environment["PYTHONPATH"].split(':'):
+            if e != '' and e not in sys.path:
+                sys.path.append(e)
+
+def jobBodyCacheDir(config):
+    """
+    Returns the node-local directory the workers of the workflow keep copies of the pickled
+    jobs they read in, or None if they don't, see :func:`toil.job.Job._loadJob`.
+
+    :param toil.common.Config config: The workflow's configuration.
+    :rtype: str|None
+    """
+    if not config.cacheJobBodies:
+        return None
+    from toil.common import Toil
+    return os.path.join(Toil.getWorkflowDir(config.workflowID, config.workDir), 'jobBodies')
+
+def _fitsConsumables(jobNode, available):
+    """Returns True if the given job needs no more of any custom consumable resource than the
+    given amounts.
+
+    :param dict[str,int] available: Maps consumable resources to the available amounts.
+    """
+    return all(amount <= available.get(name, 0) for name, amount in jobNode.consumables.items())
+
+def nextChainableJobGraph(jobGraph, jobStore, cacheDir=None, jobQuotas=None, jobRates=None):
     """Returns the next chainable jobGraph after this jobGraph if one
     exists, or None if the chain must terminate.
+
+    :param str cacheDir: See :func:`toil.job.Job._loadJob`.
+    :param dict[str,int] jobQuotas: The configured job quotas. A successor is only chained if
+           the jobGraph is subject to all of its quotas, since it is run in the jobGraph's stead.
+    :param dict[str,int] jobRates: The configured job rates. A successor subject to any of them
+           is never chained, since the leader has to count it when it is started.
     """
+    from toil.common import getJobQuotas
+    from toil.job import Job
     #If no more jobs to run or services not finished, quit
     if len(jobGraph.stack) == 0 or len(jobGraph.services) > 0 or jobGraph.checkpoint != None:
         logger.debug("Stopping running chain of jobs: length of stack: %s, services: %s, checkpoint: %s",
@@ -81,6 +159,15 @@ def nextChainableJobGraph(jobGraph, jobStore):
     if successorJobNode.predecessorNumber > 1:
         logger.debug("The jobGraph has multiple predecessors, we must return to the leader.")
         return None
+    if not _fitsConsumables(successorJobNode, jobGraph.consumables):
+        logger.debug("We need more consumable resources for the next job, so finishing")
+        return None
+    if getJobQuotas(successorJobNode, jobQuotas) - getJobQuotas(jobGraph, jobQuotas):
+        logger.debug("The next job is subject to other job quotas, returning to the leader")
+        return None
+    if getJobQuotas(successorJobNode, jobRates):
+        logger.debug("The next job is subject to job rates, returning to the leader")
+        return None
 
     # Load the successor jobGraph
     successorJobGraph = jobStore.load(successorJobNode.jobStoreID)
@@ -89,7 +176,7 @@ def nextChainableJobGraph(jobGraph, jobStore):
     # so
     if successorJobGraph.command.startswith("_toil "):
         #Load the job
-        successorJob = Job._loadJob(successorJobGraph.command, jobStore)
+        successorJob = Job._loadJob(successorJobGraph.command, jobStore, cacheDir=cacheDir)
 
         # Check it is not a checkpoint
         if successorJob.checkpoint:
@@ -99,6 +186,179 @@ def nextChainableJobGraph(jobGraph, jobStore):
     # Made it through! This job is chainable.
     return successorJobGraph
 
+def nextParallelJobGraphs(jobGraph, jobStore, maxJobs, jobQuotas=None, jobRates=None):
+    """Returns the job graphs of the successors of this jobGraph that this worker can run
+    itself, in parallel if its resources allow. These are at most maxJobs of the jobs in the top
+    level of the jobGraph's stack that individually fit within the jobGraph's requirements and
+    that are neither checkpoints nor joins nor in need of services nor subject to any of the
+    given job quotas or job rates. The remaining jobs are left to the leader to issue to the batch system.
+    Returns an empty list if there are fewer than two successors in that level, which is the
+    domain of :func:`nextChainableJobGraph`.
+    """
+    from toil.common import getJobQuotas
+    if len(jobGraph.stack) == 0 or len(jobGraph.services) > 0 or jobGraph.checkpoint != None:
+        return []
+    jobs = jobGraph.stack[-1]
+    if len(jobs) < 2:
+        return []
+    candidates = [successorJobNode for successorJobNode in jobs
+                  if successorJobNode.memory <= jobGraph.memory
+                  and successorJobNode.cores <= jobGraph.cores
+                  and successorJobNode.disk <= jobGraph.disk
+                  and successorJobNode.preemptable == jobGraph.preemptable
+                  and _fitsConsumables(successorJobNode, jobGraph.consumables)
+                  and successorJobNode.predecessorNumber <= 1
+                  and not getJobQuotas(successorJobNode, jobQuotas)
+                  and not getJobQuotas(successorJobNode, jobRates)][:maxJobs]
+    # Load the candidates concurrently, since each load is a round trip to the job store
+    loaded = [None] * len(candidates)
+
+    def load(i):
+        try:
+            loaded[i] = jobStore.load(candidates[i].jobStoreID)
+        except Exception as e:
+            loaded[i] = e
+
+    threads = [Thread(target=load, args=(i,)) for i in range(len(candidates))]
+    for t in threads:
+        t.start()
+    # The caller forks once these threads are gone
+    for t in threads:
+        t.join()
+    for successorJobGraph in loaded:
+        if isinstance(successorJobGraph, Exception):
+            raise successorJobGraph
+    successorJobGraphs = []
+    for successorJobGraph in loaded:
+        if (successorJobGraph.command is None
+                or not successorJobGraph.command.startswith("_toil ")
+                or len(successorJobGraph.services) > 0
+                or successorJobGraph.checkpoint != None):
+            continue
+        successorJobGraphs.append(successorJobGraph)
+    logger.debug("%i of the %i successors of the jobGraph can be run by this worker",
+                 len(successorJobGraphs), len(jobs))
+    return successorJobGraphs
+
+def runJobGraphsInWorker(jobGraphs, jobGraph, config, localWorkerTempDir, statsDict):
+    """
+    Runs the given successor job graphs of the jobGraph in processes forked from this worker,
+    running as many of them at once as fit within the jobGraph's cores, memory, disk and
+    consumable resources. The
+    forked processes report their stats and log messages back to this worker via statsDict.
+
+    Successors that fail or turn out to be checkpoints are left alone for the leader to issue
+    as usual. The caller must ensure that there are no pending asynchronous updates, since
+    forking while they are in progress isn't safe.
+
+    :return: The successors that completed and have no successors of their own. They can be
+             removed from the jobGraph's stack and deleted.
+    :rtype: list[toil.jobGraph.JobGraph]
+    """
+    pending = list(jobGraphs)
+    running = {}
+    finished = []
+    freeCores, freeMemory, freeDisk = jobGraph.cores, jobGraph.memory, jobGraph.disk
+    freeConsumables = jobGraph.consumables
+    while pending or running:
+        # Start as many successors as fit in the resources not used by the running ones
+        for successorJobGraph in list(pending):
+            if (successorJobGraph.cores <= freeCores
+                    and successorJobGraph.memory <= freeMemory
+                    and successorJobGraph.disk <= freeDisk
+                    and _fitsConsumables(successorJobGraph, freeConsumables)):
+                pending.remove(successorJobGraph)
+                freeCores -= successorJobGraph.cores
+                freeMemory -= successorJobGraph.memory
+                freeDisk -= successorJobGraph.disk
+                for name, amount in successorJobGraph.consumables.items():
+                    freeConsumables[name] -= amount
+                resultFd, resultPath = tempfile.mkstemp(dir=localWorkerTempDir, suffix='.json')
+                os.close(resultFd)
+                sys.stdout.flush()
+                sys.stderr.flush()
+                pid = os.fork()
+                if pid == 0:
+                    _runForkedJobGraph(successorJobGraph, config, localWorkerTempDir, resultPath)
+                logger.debug("Running %s in process %i", successorJobGraph, pid)
+                running[pid] = successorJobGraph, resultPath
+        # Wait for any of them to finish
+        pid, status = os.waitpid(-1, 0)
+        successorJobGraph, resultPath = running.pop(pid)
+        freeCores += successorJobGraph.cores
+        freeMemory += successorJobGraph.memory
+        freeDisk += successorJobGraph.disk
+        for name, amount in successorJobGraph.consumables.items():
+            freeConsumables[name] += amount
+        try:
+            if os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0:
+                with open(resultPath) as f:
+                    result = json.load(f)
+            else:
+                result = None
+        finally:
+            os.unlink(resultPath)
+        if result is None:
+            logger.warning("Failed to run %s in this worker, leaving it to the leader",
+                           successorJobGraph)
+        elif result['ran']:
+            statsDict.jobs.extend(result['jobs'])
+            statsDict.workers.logsToMaster += result['logsToMaster']
+            if result['done']:
+                finished.append(successorJobGraph)
+    return finished
+
+def _runForkedJobGraph(jobGraph, config, localWorkerTempDir, resultPath):
+    """
+    Runs the given job graph in a process forked by :func:`runJobGraphsInWorker` and writes
+    the outcome to the given path as JSON. Never returns.
+    """
+    from toil.common import Toil
+    from toil.fileStore import FileStore
+    from toil.job import Job
+    exitStatus = 1
+    try:
+        # Don't share the job store's connections with the parent process or our siblings
+        jobStore = Toil.resumeJobStore(config.jobStore)
+        job = Job._loadJob(jobGraph.command, jobStore, cacheDir=jobBodyCacheDir(config))
+        if job.checkpoint:
+            logger.debug("Successor %s is a checkpoint, leaving it to the leader", jobGraph)
+            result = dict(ran=False)
+        else:
+            logger.info("Running %s in this worker", jobGraph)
+            stats = MagicExpando()
+            stats.jobs = []
+            fileStore = FileStore.createFileStore(jobStore, jobGraph,
+                                                  tempfile.mkdtemp(dir=localWorkerTempDir),
+                                                  lambda: True,
+                                                  caching=not config.disableCaching)
+            with job._executor(jobGraph=jobGraph,
+                               stats=stats if config.stats else None,
+                               fileStore=fileStore):
+                with fileStore.open(job):
+                    job._runner(jobGraph=jobGraph, jobStore=jobStore, fileStore=fileStore)
+            # Wait for the update of the job graph
+            fileStore._blockFn()
+            if FileStore._terminateEvent.isSet():
+                raise RuntimeError("The termination flag is set")
+            result = dict(ran=True,
+                          done=(jobGraph.command is None
+                                and not any(jobGraph.stack)
+                                and not jobGraph.services),
+                          jobs=stats.jobs,
+                          logsToMaster=fileStore.loggingMessages)
+        with open(resultPath, 'w') as f:
+            json.dump(result, f)
+        exitStatus = 0
+    except:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(exitStatus)
+
 def workerScript(jobStore, config, jobName, jobStoreID, redirectOutputToLogFile=True):
     """
     Worker process script, runs a job. 
@@ -108,6 +368,9 @@ def workerScript(jobStore, config, jobName, jobStoreID, redirectOutputToLogFile=
     :param str jobStoreID: The job store ID of the job to be run
     :param bool redirectOutputToLogFile: Redirect standard out and standard error to a log file
     """
+    from toil.common import Toil
+    from toil.fileStore import FileStore
+    from toil.job import Job, Promise
     logging.basicConfig()
     setLogLevel(config.logLevel)
 
@@ -138,20 +401,11 @@ def workerScript(jobStore, config, jobName, jobStoreID, redirectOutputToLogFile=
     #Load the environment for the jobGraph
     ##########################################
     
-    #First load the environment for the jobGraph.
-    with jobStore.readSharedFileStream("environment.pickle") as fileHandle:
-        environment = safeUnpickleFromStream(fileHandle)
-    for i in environment:
-        if i not in ("TMPDIR", "TMP", "HOSTNAME", "HOSTTYPE"):
-            os.environ[i] = environment[i]
-    # sys.path is used by __import__ to find modules
-    if "PYTHONPATH" in environment:
-        for e in environment["PYTHONPATH"].split(':'):
-            if e != '':
-                sys.path.append(e)
-
     toilWorkflowDir = Toil.getWorkflowDir(config.workflowID, config.workDir)
 
+    #First load the environment for the jobGraph, preferably from this node's copy of it.
+    loadEnvironment(jobStore, cacheDir=toilWorkflowDir, environmentHash=config.environmentHash)
+
     ##########################################
     #Setup the temporary directories.
     ##########################################
@@ -160,6 +414,9 @@ def workerScript(jobStore, config, jobName, jobStoreID, redirectOutputToLogFile=
     localWorkerTempDir = tempfile.mkdtemp(dir=toilWorkflowDir)
     os.chmod(localWorkerTempDir, 0o755)
 
+    # Dir to keep this node's copies of the pickled jobs in, if any
+    cacheDir = jobBodyCacheDir(config)
+
     ##########################################
     #Setup the logging
     ##########################################
@@ -226,6 +483,11 @@ def workerScript(jobStore, config, jobName, jobStoreID, redirectOutputToLogFile=
         jobGraph = jobStore.load(jobStoreID)
         listOfJobs[0] = str(jobGraph)
         logger.debug("Parsed job wrapper")
+
+        # Start a zygote for this node if requested, so that later workers can be forked from it
+        if config.workerZygote and jobGraph.command is not None:
+            from toil.workerZygote import ensureZygote
+            ensureZygote(config.jobStore, jobGraph.command)
         
         ##########################################
         #Cleanup from any earlier invocation of the jobGraph
@@ -288,7 +550,7 @@ def workerScript(jobStore, config, jobName, jobStoreID, redirectOutputToLogFile=
                 assert jobGraph.command.startswith("_toil ")
                 logger.debug("Got a command to run: %s" % jobGraph.command)
                 #Load the job
-                job = Job._loadJob(jobGraph.command, jobStore)
+                job = Job._loadJob(jobGraph.command, jobStore, cacheDir=cacheDir)
                 # If it is a checkpoint job, save the command
                 if job.checkpoint:
                     jobGraph.checkpoint = jobGraph.command
@@ -318,10 +580,44 @@ def workerScript(jobStore, config, jobName, jobStoreID, redirectOutputToLogFile=
             if FileStore._terminateEvent.isSet():
                 raise RuntimeError("The termination flag is set")
 
+            ##########################################
+            #Run any successors that fit within this worker ourselves
+            ##########################################
+            # Successors run alongside each other would exceed a limit on the number of jobs
+            if (config.maxWorkerSuccessors and not config.disableChaining
+                    and config.maxJobs == sys.maxsize):
+                successorJobGraphs = nextParallelJobGraphs(jobGraph, jobStore,
+                                                           config.maxWorkerSuccessors,
+                                                           config.jobQuotas, config.jobRates)
+                if successorJobGraphs:
+                    # Forking is only safe once the update of the jobGraph has been written
+                    blockFn()
+                    listOfJobs.extend(str(s) for s in successorJobGraphs)
+                    finishedJobGraphs = runJobGraphsInWorker(successorJobGraphs, jobGraph, config,
+                                                             localWorkerTempDir, statsDict)
+                    if finishedJobGraphs:
+                        finishedIDs = set(s.jobStoreID for s in finishedJobGraphs)
+                        logger.debug("Ran %i successors in this worker", len(finishedIDs))
+                        #Remove the finished successors, they are wholly done
+                        jobGraph = jobGraph.snapshot()
+                        jobGraph.stack[-1] = [s for s in jobGraph.stack[-1]
+                                              if s.jobStoreID not in finishedIDs]
+                        if len(jobGraph.stack[-1]) == 0:
+                            jobGraph.stack.pop()
+                        fileStore = FileStore.createFileStore(jobStore, jobGraph,
+                                                              localWorkerTempDir, blockFn,
+                                                              caching=not config.disableCaching)
+                        blockFn = fileStore._blockFn
+                        fileStore.jobsToDelete.update(finishedIDs)
+                        fileStore._updateJobWhenDone()
+                        jobGraph = jobGraph.snapshot()
+
             ##########################################
             #Establish if we can run another jobGraph within the worker
             ##########################################
-            successorJobGraph = nextChainableJobGraph(jobGraph, jobStore)
+            successorJobGraph = nextChainableJobGraph(jobGraph, jobStore, cacheDir=cacheDir,
+                                                      jobQuotas=config.jobQuotas,
+                                                      jobRates=config.jobRates)
             if successorJobGraph is None or config.disableChaining:
                 # Can't chain any more jobs.
                 break
@@ -339,7 +635,7 @@ def workerScript(jobStore, config, jobName, jobStoreID, redirectOutputToLogFile=
             listOfJobs.append(str(successorJobGraph))
 
             #Clone the jobGraph and its stack
-            jobGraph = copy.deepcopy(jobGraph)
+            jobGraph = jobGraph.snapshot()
             
             #Remove the successor jobGraph
             jobGraph.stack.pop()
@@ -369,7 +665,7 @@ def workerScript(jobStore, config, jobName, jobStoreID, redirectOutputToLogFile=
             
             #Clone the jobGraph and its stack again, so that updates to it do
             #not interfere with this update
-            jobGraph = copy.deepcopy(jobGraph)
+            jobGraph = jobGraph.snapshot()
             
             logger.debug("Starting the next job")
         
@@ -418,6 +714,9 @@ def workerScript(jobStore, config, jobName, jobStoreID, redirectOutputToLogFile=
     #Cleanup
     ##########################################
 
+    # Don't keep promised values of this workflow around for later workers run in this process
+    Promise._forgetJobStore(jobStore)
+
     # Close the worker logging
     # Flush at the Python level
     sys.stdout.flush()
@@ -486,6 +785,20 @@ def main(argv=None):
     if argv is None:
         argv = sys.argv
 
+    # If this node runs a worker zygote, let it fork a pre-initialized worker for the job
+    from toil.workerZygote import runInZygote
+    exitStatus = runInZygote(argv)
+    if exitStatus is not None:
+        sys.exit(exitStatus)
+
+    _runWorker(argv)
+
+def _runWorker(argv):
+    """
+    Run the worker for the job named by the given command line in the current process.
+    """
+    from toil.common import Toil
+
     # Parse input args
     jobName = argv[1]
     jobStoreLocator = argv[2]
@@ -495,15 +808,17 @@ def main(argv=None):
     #Load the jobStore/config file
     ##########################################
 
-    # Try to monkey-patch boto early so that credentials are cached.
-    try:
-        import boto
-    except ImportError:
-        pass
-    else:
-        # boto is installed, monkey patch it now
-        from toil.lib.ec2Credentials import enable_metadata_credential_caching
-        enable_metadata_credential_caching()
+    # Try to monkey-patch boto early so that credentials are cached. Only do so for AWS job
+    # stores, since importing boto dominates the startup time of workers using other job stores.
+    if Toil.parseLocator(jobStoreLocator)[0] == 'aws':
+        try:
+            import boto
+        except ImportError:
+            pass
+        else:
+            # boto is installed, monkey patch it now
+            from toil.lib.ec2Credentials import enable_metadata_credential_caching
+            enable_metadata_credential_caching()
 
     jobStore = Toil.resumeJobStore(jobStoreLocator)
     config = jobStore.config
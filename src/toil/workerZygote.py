@@ -0,0 +1,522 @@
+# Copyright (C) 2015-2018 Regents of the University of California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+A per-node worker zygote.
+
+Starting a worker is dominated by importing Toil, the job store backend and the user module. A
+zygote is a long-running process that does all of that once and then forks a fresh worker for
+every job handed to it by `_toil_worker`. The worker process started by the batch system merely
+forwards its command line, environment and standard streams to the zygote over a Unix domain
+socket and waits for the forked worker's exit status, relaying any request to terminate to it.
+
+Workers only hand off to a zygote if the leader passed them a zygote key in the environment,
+which it only does with --workerZygote and for batch systems that don't confine the processes
+of each job, see :meth:`toil.batchSystems.abstractBatchSystem.AbstractBatchSystem.supportsWorkerZygote`.
+The key identifies the job store and the contents of the user module, so a restarted workflow
+whose user module changed doesn't run its jobs in a zygote that imported the old one. The
+zygote runs in a session of its own, so that it and its workers survive the worker that
+started it.
+
+This module is imported by every worker and must therefore only import from the standard library
+at module level.
+"""
+from __future__ import absolute_import
+from builtins import object
+import errno
+import hashlib
+import json
+import logging
+import os
+import random
+import select
+import signal
+import socket
+import struct
+import sys
+import tempfile
+import time
+import traceback
+from array import array
+from contextlib import closing
+
+logger = logging.getLogger(__name__)
+
+# How long an idle zygote waits for another worker before it exits
+defaultIdleTimeout = 300
+
+# The environment variable in which the leader passes the zygote key to the workers
+zygoteKeyEnvVar = 'TOIL_WORKER_ZYGOTE'
+
+_lengthFormat = '!I'
+_statusFormat = '!i'
+_standardStreams = (0, 1, 2)
+# The signals relayed from the process that handed off a worker to the worker
+_relayedSignals = (signal.SIGTERM, signal.SIGINT, signal.SIGHUP)
+
+
+def zygoteSupported():
+    """
+    Whether this platform supports handing workers off to a zygote. Passing file descriptors
+    between processes requires Unix domain sockets and `socket.sendmsg`.
+    """
+    return hasattr(socket, 'AF_UNIX') and hasattr(socket.socket, 'sendmsg')
+
+
+def zygoteKey(jobStoreLocator, userModulePath=None):
+    """
+    The key identifying the zygote for the given job store and user module.
+
+    :param str jobStoreLocator: The locator of the job store the zygote's workers will use.
+    :param str userModulePath: The path to the source file of the user module, if any. The key
+           changes along with the contents of that file.
+    :rtype: str
+    """
+    digest = hashlib.sha1(jobStoreLocator.encode('utf-8'))
+    if userModulePath is not None:
+        try:
+            with open(userModulePath, 'rb') as f:
+                digest.update(f.read())
+        except IOError:
+            logger.debug('Failed to read user module %s', userModulePath, exc_info=True)
+    return digest.hexdigest()[:16]
+
+
+def zygoteAddress(key):
+    """
+    The path of the Unix domain socket at which the zygote with the given key listens.
+    """
+    return os.path.join(tempfile.gettempdir(), 'toil-zygote-%i-%s' % (os.getuid(), key))
+
+
+def _lockPath(address):
+    return address + '.lock'
+
+
+def _isRunning(address):
+    """
+    Whether a zygote is serving the given address. A live zygote holds an exclusive lock on a
+    file next to its socket for as long as it runs.
+    """
+    import fcntl
+    try:
+        fd = os.open(_lockPath(address), os.O_RDONLY)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return False
+        raise
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+    except (IOError, OSError) as e:
+        if e.errno in (errno.EAGAIN, errno.EACCES):
+            return True
+        raise
+    else:
+        return False
+    finally:
+        os.close(fd)
+
+
+def _recvAll(sock, size):
+    data = b''
+    while len(data) < size:
+        try:
+            chunk = sock.recv(size - len(data))
+        except socket.error as e:
+            # Python 2 doesn't retry calls interrupted by signal handlers
+            if e.errno == errno.EINTR:
+                continue
+            raise
+        if not chunk:
+            raise EOFError('Connection closed after %i of %i bytes' % (len(data), size))
+        data += chunk
+    return data
+
+
+def ensureZygote(jobStoreLocator, command=None):
+    """
+    Start a zygote for the given job store on this node unless one is already running or the
+    leader didn't pass a zygote key to this worker.
+
+    :param str jobStoreLocator: The locator of the job store the zygote's workers will use.
+    :param str command: The command of a job graph (of the form `_toil <pickle> <module>`). If
+           given, the zygote also pre-imports the user module referenced by it.
+    """
+    key = os.environ.get(zygoteKeyEnvVar)
+    if not key or not zygoteSupported() or _isRunning(zygoteAddress(key)):
+        return
+    args = [sys.executable, '-m', 'toil.workerZygote', key, jobStoreLocator]
+    if command is not None:
+        args.extend(command.split()[2:])
+    logger.debug('Starting worker zygote %s for %s', key, jobStoreLocator)
+    from toil import subprocess
+    with open(os.devnull, 'r+') as devnull:
+        # Detach the zygote from this worker, so that it isn't killed along with it
+        subprocess.Popen(args, stdin=devnull, stdout=devnull, stderr=devnull, close_fds=True,
+                         preexec_fn=os.setsid)
+
+
+def runInZygote(argv):
+    """
+    Hand the worker with the given command line off to the zygote for its job store, if the
+    leader passed a zygote key to this worker and a zygote is running on this node.
+
+    :param list argv: The worker command line, i.e. the program name, job name, job store locator
+           and job store ID of the job graph to run.
+    :return: The exit status of the worker forked by the zygote, or None if no zygote could be
+             reached, in which case the caller should run the worker itself.
+    :rtype: int|None
+    """
+    key = os.environ.get(zygoteKeyEnvVar)
+    if not key or not zygoteSupported():
+        return None
+    address = zygoteAddress(key)
+    if not os.path.exists(address):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with closing(sock):
+        try:
+            sock.connect(address)
+        except socket.error:
+            return None
+        request = json.dumps(dict(argv=list(argv[:4]),
+                                  cwd=os.getcwd(),
+                                  environ=dict(os.environ))).encode('utf-8')
+        request = struct.pack(_lengthFormat, len(request)) + request
+        fds = array('i', _standardStreams)
+        try:
+            sent = sock.sendmsg([request], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds.tobytes())])
+            sock.sendall(request[sent:])
+        except socket.error:
+            # The zygote went away before it could have started the worker
+            return None
+        statusSize = struct.calcsize(_statusFormat)
+        try:
+            pid, = struct.unpack(_statusFormat, _recvAll(sock, statusSize))
+        except (EOFError, socket.error):
+            # The zygote failed to start the worker
+            return None
+
+        def relaySignal(signum, frame):
+            # The worker isn't part of our process group, so pass on signals sent to us
+            try:
+                os.kill(pid, signum)
+            except OSError:
+                pass
+
+        handlers = [(signum, signal.signal(signum, relaySignal)) for signum in _relayedSignals]
+        try:
+            exitStatus, = struct.unpack(_statusFormat, _recvAll(sock, statusSize))
+        except (EOFError, socket.error):
+            # The zygote died while the worker was running. Report the worker as failed so that
+            # the leader retries the job.
+            logger.error('Lost connection to the worker zygote at %s', address)
+            return 1
+        finally:
+            for signum, handler in handlers:
+                signal.signal(signum, handler)
+        return exitStatus
+
+
+class WorkerZygote(object):
+    """
+    Listens for worker hand-offs on the socket for a job store and forks a worker for each.
+
+    The zygote is single-threaded so that the workers it forks don't inherit locks held by other
+    threads, e.g. those of the logging module. It waits for hand-offs, for the processes that
+    handed off workers to hang up and for workers to exit in a single loop.
+    """
+
+    def __init__(self, key, jobStoreLocator, idleTimeout=defaultIdleTimeout):
+        """
+        :param str key: The zygote key passed to the workers by the leader, see :func:`zygoteKey`.
+        :param str jobStoreLocator: The locator of the job store the workers will use.
+        :param float idleTimeout: The number of seconds the zygote waits for new workers when none
+               are running before it exits.
+        """
+        self.jobStoreLocator = jobStoreLocator
+        self.idleTimeout = idleTimeout
+        self.address = zygoteAddress(key)
+        self._lockFd = None
+        self._listener = None
+        # Maps the process IDs of running workers to the connections to the processes that
+        # handed them off, or None once those hung up
+        self._workers = {}
+        # A pipe that SIGCHLD is written to, waking up the zygote when a worker exits
+        self._wakeupFds = None
+
+    def preload(self, userModule=None):
+        """
+        Import everything a worker for the job store needs, so that forked workers don't have to.
+
+        :param list userModule: The module descriptor of the user module, as encoded in job
+               commands, or None.
+        """
+        # noinspection PyUnresolvedReferences
+        import toil.fileStore
+        from toil.common import Toil
+        from toil.job import Job
+        from toil.resource import ModuleDescriptor
+        from toil.worker import loadEnvironment
+        jobStore = Toil.resumeJobStore(self.jobStoreLocator)
+        loadEnvironment(jobStore)
+        if userModule:
+            try:
+                Job._loadUserModule(ModuleDescriptor.fromCommand(userModule))
+            except Exception:
+                # Workers will import the module themselves
+                logger.warning('Failed to pre-import user module %s', userModule, exc_info=True)
+        import threading
+        if threading.active_count() > 1:
+            # Forked workers would inherit locks held by the other threads
+            logger.warning('Preloading the worker zygote started %i threads',
+                           threading.active_count() - 1)
+
+    def bind(self):
+        """
+        Take ownership of the zygote address for the job store.
+
+        :return: False if another zygote already owns it.
+        :rtype: bool
+        """
+        import fcntl
+        self._lockFd = os.open(_lockPath(self.address), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(self._lockFd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError) as e:
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                os.close(self._lockFd)
+                self._lockFd = None
+                return False
+            raise
+        # Any socket left behind by a zygote that died is stale now that we hold the lock
+        try:
+            os.unlink(self.address)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(self.address)
+        self._listener.listen(64)
+        return True
+
+    def serveForever(self):
+        """
+        Fork workers for incoming hand-offs until the zygote has been idle for idleTimeout seconds.
+        """
+        import fcntl
+        self._wakeupFds = os.pipe()
+        for fd in self._wakeupFds:
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        signal.set_wakeup_fd(self._wakeupFds[1])
+        # The wakeup file descriptor is only written to if the signal has a handler
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        idleSince = time.time()
+        try:
+            while True:
+                self._reapWorkers()
+                if self._workers:
+                    idleSince = time.time()
+                    timeout = None
+                else:
+                    timeout = idleSince + self.idleTimeout - time.time()
+                    if timeout <= 0:
+                        logger.debug('Worker zygote idle for %s seconds, exiting',
+                                     self.idleTimeout)
+                        return
+                waitFor = [self._listener, self._wakeupFds[0]]
+                waitFor.extend(conn for conn in self._workers.values() if conn is not None)
+                try:
+                    readable, _, _ = select.select(waitFor, [], [], timeout)
+                except (select.error, OSError) as e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                for ready in readable:
+                    if ready is self._listener:
+                        self._accept()
+                    elif ready is self._wakeupFds[0]:
+                        while True:
+                            try:
+                                os.read(ready, 512)
+                            except OSError as e:
+                                if e.errno == errno.EAGAIN:
+                                    break
+                                raise
+                    else:
+                        self._abandon(ready)
+        finally:
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            signal.set_wakeup_fd(-1)
+            for fd in self._wakeupFds:
+                os.close(fd)
+            self._wakeupFds = None
+            self.close()
+
+    def close(self):
+        if self._listener is not None:
+            try:
+                os.unlink(self.address)
+            except OSError:
+                pass
+            self._listener.close()
+            self._listener = None
+        if self._lockFd is not None:
+            os.close(self._lockFd)
+            self._lockFd = None
+
+    def _accept(self):
+        conn, _ = self._listener.accept()
+        try:
+            self._handle(conn)
+        except Exception:
+            logger.exception('Failed to start worker')
+            conn.close()
+
+    def _handle(self, conn):
+        conn.settimeout(60)
+        fds = array('i')
+        headerSize = struct.calcsize(_lengthFormat)
+        data, ancdata, _, _ = conn.recvmsg(4096, socket.CMSG_SPACE(len(_standardStreams) *
+                                                                    fds.itemsize))
+        for level, kind, payload in ancdata:
+            if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                fds.frombytes(payload[:len(payload) - len(payload) % fds.itemsize])
+        try:
+            if len(fds) != len(_standardStreams):
+                raise RuntimeError('Expected %i file descriptors, got %i' % (len(_standardStreams),
+                                                                            len(fds)))
+            if len(data) < headerSize:
+                data += _recvAll(conn, headerSize - len(data))
+            length, = struct.unpack(_lengthFormat, data[:headerSize])
+            data = data[headerSize:]
+            if len(data) < length:
+                data += _recvAll(conn, length - len(data))
+            request = json.loads(data.decode('utf-8'))
+            conn.settimeout(None)
+            sys.stdout.flush()
+            sys.stderr.flush()
+            pid = os.fork()
+            if pid == 0:
+                self._runWorker(conn, fds, request)
+        finally:
+            for fd in fds:
+                os.close(fd)
+        self._workers[pid] = conn
+        try:
+            # Let the process that handed off the worker relay signals to it
+            conn.sendall(struct.pack(_statusFormat, pid))
+        except socket.error:
+            self._abandon(conn)
+
+    def _runWorker(self, conn, fds, request):
+        """
+        Run the requested worker in a freshly forked child of the zygote. Never returns.
+        """
+        exitStatus = 1
+        try:
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            signal.set_wakeup_fd(-1)
+            for fd in self._wakeupFds:
+                os.close(fd)
+            for otherConn in self._workers.values():
+                if otherConn is not None:
+                    otherConn.close()
+            conn.close()
+            self._listener.close()
+            os.close(self._lockFd)
+            for stream, fd in zip(_standardStreams, fds):
+                os.dup2(fd, stream)
+            os.chdir(request['cwd'])
+            os.environ.clear()
+            os.environ.update(request['environ'])
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            # Don't let all forked workers share the zygote's random state
+            random.seed()
+            from toil.worker import _runWorker
+            _runWorker(request['argv'])
+            exitStatus = 0
+        except SystemExit as e:
+            exitStatus = e.code if isinstance(e.code, int) else 1
+        except:
+            traceback.print_exc()
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(exitStatus)
+
+    def _abandon(self, conn):
+        """
+        Kill the worker handed off over the given connection, since the process that handed it
+        off went away, e.g. because the batch system killed it.
+        """
+        for pid, workerConn in self._workers.items():
+            if workerConn is conn:
+                logger.warning('Worker %i was abandoned, killing it', pid)
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except OSError:
+                    pass
+                self._workers[pid] = None
+                break
+        conn.close()
+
+    def _reapWorkers(self):
+        """
+        Report the exit status of every worker that exited to the process that handed it off.
+        """
+        while self._workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            if pid == 0:
+                return
+            conn = self._workers.pop(pid, None)
+            if conn is None:
+                continue
+            if os.WIFSIGNALED(status):
+                exitStatus = 128 + os.WTERMSIG(status)
+            else:
+                exitStatus = os.WEXITSTATUS(status)
+            try:
+                conn.sendall(struct.pack(_statusFormat, exitStatus))
+                conn.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            conn.close()
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    logging.basicConfig()
+    zygote = WorkerZygote(argv[1], argv[2])
+    if not zygote.bind():
+        # Another worker started a zygote for this job store first
+        return
+    try:
+        zygote.preload(argv[3:] or None)
+    except:
+        zygote.close()
+        raise
+    zygote.serveForever()
+
+
+if __name__ == '__main__':
+    main()